@@ -1,15 +1,86 @@
-from fastapi import FastAPI, UploadFile, File, Form
+import os
+import json
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 from pydantic import BaseModel
 from typing import Optional, Any, Dict, List
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+from api.services.doc_service import (
+    save_current_dicom,
+    save_current_dicom_and_extract_frames,
+    list_current_files,
+    delete_current_file,
+)
+from api.services.rag_service import (
+    answer_question_async,
+    analyze_current_case,
+    iter_current_case_events,
+    stream_answer_events,
+)
+from api.services.job_service import get_job_pool, shutdown_job_pool, submit_analyze_case, get_job
+from api.services.metrics_service import MetricsMiddleware, render_metrics
+from api.services.trace_service import RequestTracingMiddleware
+
+from scripts.index_Qdrant import (
+    reset_collections,
+    get_vectorstore,
+    refresh_index,
+    get_query_cache,
+    get_embedding_batcher,
+    get_embedder,
+)
+from scripts.frame_extraction_pool import get_frame_extraction_pool
+from scripts.multimodal_rag_openai import get_image_cache, get_result_cache
+from scripts.llm_provider import get_llm_provider
+from scripts.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from scripts.tracing import get_trace_exporter
+
+# Warmup all'avvio: indicizzazione + caricamento modello in background, cosi'
+# l'import resta leggero e il server accetta richieste subito (0 = tutto al primo utilizzo)
+RAG_WARMUP = os.getenv("RAG_WARMUP", "1") != "0"
+# Thread intra-op di torch (0 = default di torch). Il pool e' globale al processo:
+# si fissa solo qui, nel processo dedicato all'API, e non negli script offline
+API_TORCH_THREADS = int(os.getenv("API_TORCH_THREADS", "0"))
+
 
-from api.services.doc_service import save_current_dicom_and_extract_frames, list_current_files, delete_current_file
-from api.services.rag_service import answer_question, analyze_current_case
+def _set_torch_threads(n: int):
+    try:
+        import torch
+        torch.set_num_threads(n)
+        print(f"[API] torch intra-op threads set to {n}.")
+    except Exception as e:
+        print(f"[API] WARNING: could not set torch threads: {e}")
+
+
+def _warmup():
+    try:
+        get_vectorstore()
+        get_embedder()
+        print("[API] RAG warmup completed.")
+    except Exception as e:
+        print(f"[API] WARNING: RAG warmup failed, components will initialize on first use: {e}")
 
-from scripts.index_Qdrant import reset_collections
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if API_TORCH_THREADS:
+        _set_torch_threads(API_TORCH_THREADS)
+    if RAG_WARMUP:
+        threading.Thread(target=_warmup, name="rag-warmup", daemon=True).start()
+    # worker dei job: riprendono anche i job rimasti in coda/orfani prima del riavvio
+    get_job_pool()
+    yield
+    shutdown_job_pool()
+    # tracce ancora in coda per il writer
+    get_trace_exporter().flush()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  
@@ -17,6 +88,9 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+# piu' esterno: request ID e traccia coprono anche gli altri middleware
+app.add_middleware(RequestTracingMiddleware)
 
 class ChatRequest(BaseModel):
     question: str
@@ -30,17 +104,21 @@ class ChatResponse(BaseModel):
     sources: Optional[List[Dict[str, Any]]] = None
     session_id: Optional[str] = None
     evaluation: Optional[Any] = None
+    timed_out: Optional[List[str]] = None
+    failed: Optional[List[str]] = None
 
 
 @app.post("/chat", response_model=ChatResponse)
-def chat(req: ChatRequest):
+async def chat(req: ChatRequest):
     """
     POST /chat
     Accepts a clinical question and RAG parameters. Returns an answer generated by the model, relevant sources, session info, and optional evaluation metrics.
+    Retrieval on cases and guidelines runs concurrently; a collection that times out is listed in timed_out,
+    one whose search fails is listed in failed, and in both cases its sources are omitted.
     Request body: question, model, rag_type, evaluate (optional), session_id (optional)
-    Response: answer, sources, session_id, evaluation (optional)
+    Response: answer, sources, session_id, evaluation (optional), timed_out (optional), failed (optional)
     """
-    out = answer_question(
+    out = await answer_question_async(
         question=req.question,
         model=req.model,
         rag_type=req.rag_type,
@@ -50,6 +128,41 @@ def chat(req: ChatRequest):
     return ChatResponse(**out)
 
 
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def _sse_response(events) -> StreamingResponse:
+    # no-cache / X-Accel-Buffering: i proxy non devono bufferizzare gli eventi
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest):
+    """
+    POST /chat/stream
+    Streaming /chat as Server-Sent Events: `sources` (retrieved sources, timed_out and failed) as soon as
+    retrieval finishes, then `token` events with answer text, then `done` with the full answer,
+    session_id, evaluation and timings.
+    Request body: same as /chat.
+    """
+    async def events():
+        async for event, data in stream_answer_events(
+            question=req.question,
+            model=req.model,
+            rag_type=req.rag_type,
+            session_id=req.session_id,
+            evaluate=req.evaluate,
+        ):
+            yield _sse(event, data)
+
+    return _sse_response(events())
+
+
 @app.post("/upload-doc")
 async def upload_doc(
     file: UploadFile = File(...),
@@ -57,8 +170,11 @@ async def upload_doc(
     """
     POST /upload-doc
     Uploads a DICOM file, extracts frames, and stores the document for further analysis.
+    The upload is streamed to disk in chunks (constant memory) and hashed on the fly;
+    frames are extracted in a separate process (FRAME_EXTRACT_TIMEOUT_S), off the event loop.
     Request: multipart form with a DICOM file.
-    Response: ok, plus metadata about the uploaded file and extracted frames.
+    Response: ok, plus metadata about the uploaded file (size_bytes, sha256) and extracted frames.
+    Errors: 413 if the file exceeds MAX_UPLOAD_MB.
     """
     result = await save_current_dicom_and_extract_frames(file)
     return {"ok": True, **result}
@@ -68,20 +184,95 @@ async def upload_doc(
 @app.post("/analyze-case")
 async def analyze_case(
     file: UploadFile = File(...),
-    report_text: Optional[str] = Form(None)
+    report_text: Optional[str] = Form(None),
+    no_cache: bool = Form(False),
 ):
     """
     POST /analyze-case
     Uploads a DICOM file and optional report text, extracts frames, and runs a multimodal RAG analysis to generate a clinical answer.
-    Request: multipart form with a DICOM file and optional report_text.
+    Request: multipart form with a DICOM file, optional report_text and no_cache (skip the analysis result cache).
+    Identical analyses (same report, frames and index version) are answered from the result cache.
     Response: ok, metadata about the file and frames, and analysis result.
+    Errors: 413 if the file exceeds MAX_UPLOAD_MB.
     """
     result = await save_current_dicom_and_extract_frames(file)
-    analysis = analyze_current_case(report_text=report_text, frames_dir=result.get("frames_dir"))
+    analysis = await asyncio.to_thread(
+        analyze_current_case,
+        report_text=report_text,
+        frames_dir=result.get("frames_dir"),
+        frame_paths=result.get("frames"),
+        bypass_cache=no_cache,
+    )
     return {"ok": True, **result, "analysis": analysis}
 
 
 
+@app.post("/analyze-case/stream")
+async def analyze_case_stream(
+    file: UploadFile = File(...),
+    report_text: Optional[str] = Form(None),
+    no_cache: bool = Form(False),
+):
+    """
+    POST /analyze-case/stream
+    Streaming /analyze-case as Server-Sent Events: `upload` (file and frames metadata), `sources`
+    (retrieved cases and guidelines), `token` events as the model writes the answer, then `done`
+    with the full answer, cached flag and timings (retrieval_s, first_token_s, total_s).
+    A failure after the stream has started is reported as an `error` event.
+    Request: same multipart form as /analyze-case.
+    Errors: 413 if the file exceeds MAX_UPLOAD_MB.
+    """
+    result = await save_current_dicom_and_extract_frames(file)
+
+    def events():
+        # generatore sincrono: Starlette lo itera nel threadpool (retrieval e OpenAI sono bloccanti)
+        yield _sse("upload", result)
+        for event, data in iter_current_case_events(
+            report_text=report_text,
+            frames_dir=result.get("frames_dir"),
+            frame_paths=result.get("frames"),
+            bypass_cache=no_cache,
+        ):
+            yield _sse(event, data)
+
+    return _sse_response(events())
+
+
+
+@app.post("/analyze-case/jobs", status_code=202)
+async def analyze_case_job(
+    file: UploadFile = File(...),
+    report_text: Optional[str] = Form(None),
+    no_cache: bool = Form(False),
+):
+    """
+    POST /analyze-case/jobs
+    Asynchronous /analyze-case: stores the DICOM upload and enqueues frame extraction and the
+    multimodal RAG analysis on the background worker pool. Returns immediately.
+    Request: multipart form with a DICOM file, optional report_text and no_cache.
+    Response (202): ok, job_id, status and file_id. Poll GET /jobs/{job_id} for the result.
+    """
+    upload = await save_current_dicom(file)
+    job_id = submit_analyze_case(upload, report_text, no_cache=no_cache)
+    return {"ok": True, "job_id": job_id, "status": "queued", "file_id": upload["file_id"]}
+
+
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    """
+    GET /jobs/{job_id}
+    Returns the state of a background job: status (queued, running, succeeded, failed),
+    attempts, queue wait and per-stage timings, plus result or error once finished.
+    Errors: 404 if the job does not exist.
+    """
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+
 @app.get("/list-docs")
 def list_docs(rag_type: str):
     """
@@ -120,3 +311,50 @@ def flush_rag():
         return {"ok": True, "message": "RAG collections reset."}
     except Exception as e:
         return {"ok": False, "error": str(e)}, 500
+
+
+
+@app.post("/reindex")
+def reindex():
+    """
+    POST /reindex
+    Incrementally re-indexes the RAG collections from documents.jsonl and the guideline files:
+    only new or changed documents are embedded, removed documents are deleted.
+    Response: ok, per-collection sync summary or error.
+    """
+    try:
+        get_vectorstore()
+        return {"ok": True, "collections": refresh_index()}
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"ok": False, "error": str(e)})
+
+
+
+@app.get("/stats")
+def stats():
+    """
+    GET /stats
+    Returns runtime statistics for tuning: query cache hits/misses, micro-batching queue
+    depth / batch sizes, frame extraction pool activity (active, timeouts, cancellations)
+    the vision image payload cache (hits, bytes, compression ratio), the analysis result cache
+    and the LLM provider in use (calls, failures).
+    """
+    return {
+        "query_cache": get_query_cache().stats(),
+        "embedding_batcher": get_embedding_batcher().stats(),
+        "frame_extraction": get_frame_extraction_pool().stats(),
+        "image_cache": get_image_cache().stats(),
+        "result_cache": get_result_cache().stats(),
+        "llm": get_llm_provider().stats(),
+    }
+
+
+@app.get("/metrics")
+def metrics():
+    """
+    GET /metrics
+    Prometheus text exposition: per-stage latency histograms (embedding, search per collection,
+    frame extraction, image encoding, prompt build, LLM call and first token), HTTP requests by
+    route, cache hits/misses, cache sizes, queue depths, index size and LLM calls by outcome.
+    """
+    return PlainTextResponse(render_metrics(), media_type=METRICS_CONTENT_TYPE)
@@ -1,20 +1,184 @@
 import os
+import time
 import uuid
+import json
+import asyncio
+import hashlib
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-from fastapi import UploadFile
+from typing import Dict, Optional, Tuple
+from fastapi import HTTPException, UploadFile
 import sys
 
 # Ensure project root is on path to import scripts
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+import pydicom
 from scripts.dicom_to_frames_current import extract_frames
+from scripts.frame_extraction_pool import FrameExtractionCancelled, get_frame_extraction_pool
+from scripts.tracing import span
+
+try:
+    import fcntl
+except ImportError:  # Windows: lock solo tra i thread del processo
+    fcntl = None
 
 DATA_DIR = Path("data")
 CURRENT_DICOM_DIR = DATA_DIR / "current" / "dicom"
 CURRENT_FRAMES_DIR = DATA_DIR / "current" / "frames"
+# upload in corso (stesso filesystem di current/dicom, per os.replace atomico)
+UPLOAD_STAGING_DIR = DATA_DIR / "current" / "incoming"
+# indice content-addressed: sha256 -> file_id, frame, metadata header, refcount
+UPLOAD_INDEX_PATH = DATA_DIR / "current" / "upload_index.json"
+
+# Upload in streaming: memoria per upload = un chunk, indipendentemente dalla dimensione
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "1024")) * 1024 * 1024
+
+# Estrazione in corso dello stesso contenuto in un altro worker: oltre questa eta' il claim
+# e' considerato abbandonato (worker morto) e l'upload successivo estrae da se'
+UPLOAD_CLAIM_STALE_S = float(os.getenv("UPLOAD_CLAIM_STALE_S", "600"))
+UPLOAD_CLAIM_POLL_S = float(os.getenv("UPLOAD_CLAIM_POLL_S", "0.5"))
+
+_index_thread_lock = threading.Lock()
+# estrazioni in corso in questo processo per sha256 (single-flight, come la result cache)
+_inflight: Dict[str, threading.Event] = {}
+
+
+@contextmanager
+def _index_lock():
+    """
+    Serializza il read-modify-write dell'indice: tra i thread del processo e,
+    con flock su un file .lock accanto all'indice, tra i worker uvicorn.
+    """
+    with _index_thread_lock:
+        if fcntl is None:
+            yield
+            return
+        UPLOAD_INDEX_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with open(UPLOAD_INDEX_PATH.with_name(UPLOAD_INDEX_PATH.name + ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
 
 def _ensure_dirs():
     CURRENT_DICOM_DIR.mkdir(parents=True, exist_ok=True)
     CURRENT_FRAMES_DIR.mkdir(parents=True, exist_ok=True)
+    UPLOAD_STAGING_DIR.mkdir(parents=True, exist_ok=True)
+
+
+def _load_upload_index() -> Dict[str, Dict]:
+    try:
+        with open(UPLOAD_INDEX_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_upload_index(index: Dict[str, Dict]):
+    tmp = UPLOAD_INDEX_PATH.with_name(UPLOAD_INDEX_PATH.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, UPLOAD_INDEX_PATH)
+
+
+def _entry_is_complete(entry: Dict) -> bool:
+    """DICOM e tutti i frame ancora su disco (un'estrazione fallita non viene riusata)."""
+    return (
+        bool(entry.get("frames"))
+        and Path(entry["dicom_path"]).exists()
+        and all(Path(p).exists() for p in entry["frames"])
+    )
+
+
+def _acquire_existing(sha256: str) -> Optional[Dict]:
+    """Se il contenuto e' gia' stato caricato ed estratto: refcount + 1 e ritorna l'entry."""
+    with _index_lock():
+        index = _load_upload_index()
+        entry = index.get(sha256)
+        if entry is None or not _entry_is_complete(entry):
+            return None
+        entry["refcount"] = entry.get("refcount", 1) + 1
+        _save_upload_index(index)
+        return dict(entry)
+
+
+def _register_upload(sha256: str, entry: Dict) -> Dict:
+    with _index_lock():
+        index = _load_upload_index()
+        # riestrazione di un'entry incompleta: i riferimenti esistenti restano, uno in piu'
+        refcount = index.get(sha256, {}).get("refcount", 0) + 1
+        # l'entry registrata sostituisce anche il claim di estrazione
+        index[sha256] = {**entry, "refcount": refcount}
+        _save_upload_index(index)
+        return dict(index[sha256])
+
+
+def _claim_extraction(sha256: str, cancel_event: Optional[threading.Event] = None) -> Tuple[Optional[Dict], Optional[str]]:
+    """
+    Single-flight dell'estrazione per contenuto, anche tra worker.
+    Ritorna (entry, None) se un upload concorrente ha gia' estratto gli stessi
+    byte (refcount + 1), altrimenti (None, token) e l'estrazione tocca al
+    chiamante, che poi registra l'upload e chiama _release_claim(sha256, token).
+    """
+    while True:
+        with _index_lock():
+            index = _load_upload_index()
+            entry = index.get(sha256)
+            if entry is not None and _entry_is_complete(entry):
+                entry["refcount"] = entry.get("refcount", 1) + 1
+                _save_upload_index(index)
+                return dict(entry), None
+            claim = (entry or {}).get("extracting")
+            if claim is None or time.time() - claim["since"] > UPLOAD_CLAIM_STALE_S:
+                token = uuid.uuid4().hex
+                index[sha256] = {
+                    **(entry or {"refcount": 0}),
+                    "extracting": {"token": token, "pid": os.getpid(), "since": time.time()},
+                }
+                _save_upload_index(index)
+                _inflight[sha256] = threading.Event()
+                return None, token
+            event = _inflight.get(sha256)
+        # stesso contenuto in estrazione (qui o in un altro worker): attende e ricontrolla
+        if cancel_event is not None and cancel_event.is_set():
+            raise FrameExtractionCancelled(f"Upload {sha256[:12]} cancelled while waiting for extraction")
+        if event is not None:
+            event.wait(UPLOAD_CLAIM_POLL_S)
+        else:
+            time.sleep(UPLOAD_CLAIM_POLL_S)
+
+
+def _release_claim(sha256: str, token: str):
+    """Rimuove il claim se l'upload non e' stato registrato (estrazione annullata) e sveglia chi attende."""
+    with _index_lock():
+        index = _load_upload_index()
+        entry = index.get(sha256)
+        if entry is not None and (entry.get("extracting") or {}).get("token") == token:
+            entry.pop("extracting")
+            if not entry.get("refcount") and not entry.get("frames"):
+                del index[sha256]
+            _save_upload_index(index)
+        event = _inflight.pop(sha256, None)
+    if event is not None:
+        event.set()
+
+
+def _read_header_meta(dicom_path: str) -> Dict:
+    """Metadata tecnici dell'header (nessun dato paziente), senza leggere i pixel."""
+    ds = pydicom.dcmread(dicom_path, stop_before_pixels=True)
+    fps = getattr(ds, "CineRate", getattr(ds, "RecommendedDisplayFrameRate", None))
+    return {
+        "modality": getattr(ds, "Modality", None),
+        "num_frames": int(getattr(ds, "NumberOfFrames", 1) or 1),
+        "rows": int(getattr(ds, "Rows", 0) or 0),
+        "columns": int(getattr(ds, "Columns", 0) or 0),
+        "view": getattr(ds, "ViewName", None),
+        "stage": getattr(ds, "StageName", None),
+        "fps": float(fps) if fps is not None else None,
+    }
 
 # Nuova funzione: importa tutti i DICOM da raw_data a current/dicom
 import shutil
@@ -33,35 +197,172 @@ def import_all_rawdata_dicoms():
             count += 1
     return {"imported": count, "from": str(rawdata_root), "to": str(CURRENT_DICOM_DIR)}
 
-async def save_current_dicom_and_extract_frames(file: UploadFile):
+def _write_chunk(f, hasher, chunk: bytes):
+    # sha256 e write rilasciano il GIL: eseguiti in un thread, fuori dall'event loop
+    hasher.update(chunk)
+    f.write(chunk)
+
+
+def _close_file(f):
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+
+
+async def stream_upload_to_file(
+    file: UploadFile,
+    dest_path: Path,
+    max_bytes: int = None,
+    chunk_size: int = None,
+) -> Tuple[int, str]:
+    """
+    Copia l'upload in `dest_path` a chunk, calcolando lo sha256 al volo.
+    Scrive su un file temporaneo nella stessa directory e lo sposta con
+    os.replace solo a copia completa: in data/current/dicom non compaiono
+    mai file parziali. Oltre `max_bytes` interrompe con 413.
+    Ritorna (dimensione in byte, sha256 esadecimale).
+    """
+    max_bytes = MAX_UPLOAD_BYTES if max_bytes is None else max_bytes
+    chunk_size = chunk_size or UPLOAD_CHUNK_BYTES
+    tmp_path = dest_path.with_name(f".{dest_path.name}.part")
+    hasher = hashlib.sha256()
+    size = 0
+    f = await asyncio.to_thread(open, tmp_path, "wb")
+    try:
+        while True:
+            chunk = await file.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Upload exceeds the {max_bytes // (1024 * 1024)} MB limit",
+                )
+            await asyncio.to_thread(_write_chunk, f, hasher, chunk)
+        await asyncio.to_thread(_close_file, f)
+        await asyncio.to_thread(os.replace, tmp_path, dest_path)
+    except BaseException:
+        f.close()
+        if tmp_path.exists():
+            tmp_path.unlink()
+        raise
+    return size, hasher.hexdigest()
+
+
+async def save_current_dicom(file: UploadFile) -> Dict:
     """
-    1) salva il DICOM in data/current/dicom/<id>.dcm
-    2) genera frame in data/current/frames/<id>/frame_*.png usando il tuo script/func
+    Salva il DICOM in data/current/dicom/<sha256>.dcm (streaming a chunk, atomico).
+
+    Gli upload sono content-addressed: file_id = sha256 del contenuto. Se gli
+    stessi byte sono gia' stati caricati (ed estratti) si ritorna subito
+    l'entry esistente con i suoi frame (deduplicated=True) e si incrementa il
+    refcount usato da delete_current_file; altrimenti i frame vanno estratti
+    con extract_and_register_frames().
     """
     _ensure_dirs()
-    file_id = str(uuid.uuid4())
+    staging_path = UPLOAD_STAGING_DIR / f"{uuid.uuid4()}.dcm"
+    with span("upload") as sp:
+        size_bytes, sha256 = await stream_upload_to_file(file, staging_path)
+        existing = await asyncio.to_thread(_acquire_existing, sha256)
+        sp.set(bytes=size_bytes, deduplicated=existing is not None)
+    if existing is not None:
+        staging_path.unlink()
+        print(f"[doc_service] Duplicate upload {sha256[:12]}, reusing frames (refcount={existing['refcount']})")
+        return {**existing, "deduplicated": True}
+
+    file_id = sha256
     dicom_path = CURRENT_DICOM_DIR / f"{file_id}.dcm"
+    if dicom_path.exists():
+        # stessi byte gia' su disco (upload concorrente o entry incompleta): non si sostituisce
+        # un file che un'estrazione potrebbe star leggendo
+        staging_path.unlink()
+    else:
+        os.replace(staging_path, dicom_path)
+    return {
+        "file_id": file_id,
+        "dicom_path": str(dicom_path),
+        "size_bytes": size_bytes,
+        "sha256": sha256,
+        "frames_dir": str(CURRENT_FRAMES_DIR / file_id),
+        "deduplicated": False,
+    }
+
+
+def extract_and_register_frames(saved: Dict, cancel_event: Optional[threading.Event] = None) -> Dict:
+    """
+    Genera i frame in data/current/frames/<sha256>/frame_*.png e registra l'upload nell'indice.
+    L'estrazione gira in un processo del pool di estrazione (timeout per job,
+    cancellabile con `cancel_event`); bloccante: da chiamare fuori dall'event loop.
+    Upload concorrenti degli stessi byte estraggono una volta sola: gli altri
+    attendono e ricevono l'entry registrata (deduplicated=True).
+    """
+    existing, token = _claim_extraction(saved["sha256"], cancel_event)
+    if existing is not None:
+        return {**existing, "deduplicated": True}
+    try:
+        return _extract_and_register(saved, cancel_event)
+    finally:
+        _release_claim(saved["sha256"], token)
 
-    content = await file.read()
-    dicom_path.write_bytes(content)
 
-    # Estrarre frame dal DICOM appena caricato
-    out_dir = CURRENT_FRAMES_DIR / file_id
+def _extract_and_register(saved: Dict, cancel_event: Optional[threading.Event]) -> Dict:
+    dicom_path = saved["dicom_path"]
+    out_dir = Path(saved["frames_dir"])
     out_dir.mkdir(parents=True, exist_ok=True)
+    frames_error = None
+    with span("frame_extraction", bytes=saved.get("size_bytes")) as sp:
+        try:
+            frames = get_frame_extraction_pool().run(
+                extract_frames, dicom_path, str(out_dir), 12, cancel_event=cancel_event
+            )
+        except FrameExtractionCancelled:
+            # nessuna registrazione: un nuovo upload dello stesso contenuto riestrae
+            raise
+        except Exception as e:
+            # Se l'estrazione fallisce (o va in timeout), restituisce comunque i path base
+            frames = []
+            frames_error = str(e)
+            sp.record_error(e)
+            print(f"[doc_service] Frame extraction failed: {e}")
+        sp.set(frames=len(frames))
     try:
-        frames = extract_frames(str(dicom_path), str(out_dir), n_frames=12)
+        header = _read_header_meta(dicom_path)
     except Exception as e:
-        # Se l'estrazione fallisce, restituisce comunque i path base
-        frames = []
-        print(f"[doc_service] Frame extraction failed: {e}")
+        header = {}
+        print(f"[doc_service] Header read failed: {e}")
 
-    return {
-        "file_id": file_id,
-        "dicom_path": str(dicom_path),
+    entry = _register_upload(saved["sha256"], {
+        "file_id": saved["file_id"],
+        "dicom_path": dicom_path,
+        "size_bytes": saved["size_bytes"],
+        "sha256": saved["sha256"],
         "frames_dir": str(out_dir),
         "frames": frames,
+        "header": header,
         "note": "Frames extracted via scripts/dicom_to_frames_current.extract_frames"
-    }
+    })
+    if frames_error:
+        entry["frames_error"] = frames_error
+    return {**entry, "deduplicated": False}
+
+
+async def save_current_dicom_and_extract_frames(file: UploadFile):
+    """
+    1) salva il DICOM in data/current/dicom/<sha256>.dcm (vedi save_current_dicom)
+    2) genera frame in data/current/frames/<sha256>/frame_*.png usando il tuo script/func,
+       saltato se lo stesso contenuto e' gia' stato estratto
+    """
+    saved = await save_current_dicom(file)
+    if saved["deduplicated"]:
+        return saved
+    cancel_event = threading.Event()
+    try:
+        return await asyncio.to_thread(extract_and_register_frames, saved, cancel_event)
+    except asyncio.CancelledError:
+        # richiesta annullata: termina il processo di estrazione
+        cancel_event.set()
+        raise
 
 def list_current_files():
     _ensure_dirs()
@@ -74,16 +375,28 @@ def delete_current_file(file_id: str = None):
     _ensure_dirs()
     if not file_id:
         return {"ok": False, "error": "file_id required"}
-    
-    dicom_path = CURRENT_DICOM_DIR / f"{file_id}.dcm"
-    frames_dir = CURRENT_FRAMES_DIR / file_id
 
-    if dicom_path.exists():
-        dicom_path.unlink()
+    with _index_lock():
+        index = _load_upload_index()
+        entry = index.get(file_id)
+        if entry is not None and entry.get("refcount", 1) > 1:
+            # altri upload dello stesso contenuto: i file restano
+            entry["refcount"] -= 1
+            _save_upload_index(index)
+            return {"ok": True, "deleted": file_id, "refcount": entry["refcount"]}
+        if entry is not None:
+            del index[file_id]
+            _save_upload_index(index)
+
+        dicom_path = CURRENT_DICOM_DIR / f"{file_id}.dcm"
+        frames_dir = CURRENT_FRAMES_DIR / file_id
+
+        if dicom_path.exists():
+            dicom_path.unlink()
 
-    if frames_dir.exists() and frames_dir.is_dir():
-        for child in frames_dir.glob("*"):
-            child.unlink()
-        frames_dir.rmdir()
+        if frames_dir.exists() and frames_dir.is_dir():
+            for child in frames_dir.glob("*"):
+                child.unlink()
+            frames_dir.rmdir()
 
-    return {"ok": True, "deleted": file_id}
+    return {"ok": True, "deleted": file_id, "refcount": 0}
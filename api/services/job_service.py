@@ -0,0 +1,92 @@
+import os
+import sys
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+# Ensure project root is on path to import scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from scripts.job_queue import JobContext, JobStore, JobWorkerPool, job_view
+from scripts.tracing import current_request_id, start_trace
+
+from api.services import doc_service, rag_service
+
+# Job asincroni (/analyze-case/jobs): store SQLite condiviso tra i worker uvicorn
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join("data", "jobs", "jobs.sqlite"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_STALE_S = float(os.getenv("JOB_STALE_S", "30"))
+JOB_POLL_S = float(os.getenv("JOB_POLL_S", "0.5"))
+
+ANALYZE_CASE = "analyze_case"
+
+_pool: Optional[JobWorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def run_analyze_case_job(params: Dict[str, Any], ctx: JobContext) -> Tuple[bool, Dict[str, Any]]:
+    """
+    Job /analyze-case: estrazione frame (se l'upload non era un duplicato) + analisi multimodale.
+    L'upload estratto e' salvato come checkpoint: un job ripreso dopo un riavvio
+    non ripete l'estrazione (ne' il refcount dell'upload).
+    """
+    # traccia del job con il request ID della richiesta che l'ha creato
+    with start_trace(f"job {ANALYZE_CASE}", request_id=params.get("request_id"), job_id=ctx.job_id) as root:
+        upload = ctx.state.get("upload") or params["upload"]
+        if not upload.get("deduplicated") and "frames" not in upload:
+            with ctx.stage("extract_frames"):
+                upload = doc_service.extract_and_register_frames(upload)
+            ctx.checkpoint("upload", upload)
+
+        with ctx.stage("analysis"):
+            analysis = rag_service.analyze_current_case(
+                report_text=params.get("report_text"),
+                frames_dir=upload.get("frames_dir"),
+                frame_paths=upload.get("frames"),
+                bypass_cache=params.get("no_cache", False),
+            )
+        root.set(ok=analysis.get("ok", False))
+    return analysis.get("ok", False), {**upload, "analysis": analysis}
+
+
+def get_job_pool() -> JobWorkerPool:
+    """Pool di worker del processo, creato e avviato al primo utilizzo."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                store = JobStore(JOB_DB_PATH, stale_after_s=JOB_STALE_S, max_attempts=JOB_MAX_ATTEMPTS)
+                pool = JobWorkerPool(
+                    store,
+                    {ANALYZE_CASE: run_analyze_case_job},
+                    workers=JOB_WORKERS,
+                    poll_interval_s=JOB_POLL_S,
+                )
+                pool.start()
+                _pool = pool
+    return _pool
+
+
+def shutdown_job_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.stop()
+            _pool = None
+
+
+def submit_analyze_case(upload: Dict[str, Any], report_text: Optional[str], no_cache: bool = False) -> str:
+    return get_job_pool().submit(
+        ANALYZE_CASE,
+        {"upload": upload, "report_text": report_text, "no_cache": no_cache, "request_id": current_request_id()},
+    )
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    job = get_job_pool().store.get(job_id)
+    return job_view(job) if job else None
+
+
+def job_counts() -> Dict[str, int]:
+    """Job per stato (queued, running, ...); vuoto se il pool non e' ancora avviato."""
+    pool = _pool
+    return pool.store.counts() if pool is not None else {}
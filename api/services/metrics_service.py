@@ -0,0 +1,118 @@
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+# Ensure project root is on path to import scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from scripts.metrics import HTTP_REQUESTS, HTTP_SECONDS, REGISTRY, Family, counter_family, gauge_family
+from scripts.index_Qdrant import get_query_cache, get_embedding_batcher, index_stats
+from scripts.frame_extraction_pool import get_frame_extraction_pool
+from scripts.multimodal_rag_openai import get_image_cache, get_result_cache
+from scripts.llm_provider import get_llm_provider
+
+from api.services.job_service import job_counts
+
+
+def component_metrics() -> List[Family]:
+    """
+    Stato gia' tenuto dai componenti (cache, code, indice, provider LLM),
+    letto solo allo scrape di /metrics: nessun costo sul percorso delle richieste.
+    """
+    query = get_query_cache().stats()
+    image = get_image_cache().stats()
+    result = get_result_cache().stats()
+    batcher = get_embedding_batcher().stats()
+    frames = get_frame_extraction_pool().stats()
+    llm = get_llm_provider().stats()
+    index = index_stats()
+    jobs = job_counts()
+
+    return [
+        counter_family("rag_cache_requests_total", "Cache lookups by cache and result", [
+            ({"cache": "query", "result": "hit"}, query["hits_memory"] + query["hits_disk"]),
+            ({"cache": "query", "result": "miss"}, query["misses"]),
+            ({"cache": "image", "result": "hit"}, image["hits_memory"] + image["hits_disk"]),
+            ({"cache": "image", "result": "miss"}, image["misses"]),
+            ({"cache": "result", "result": "hit"}, result["hits"]),
+            ({"cache": "result", "result": "miss"}, result["misses"]),
+            ({"cache": "result", "result": "bypass"}, result["bypassed"]),
+        ]),
+        gauge_family("rag_cache_entries", "Entries held in memory by each cache", [
+            ({"cache": "query"}, query["size"]),
+            ({"cache": "image"}, image["size"]),
+            ({"cache": "result"}, result["size"]),
+        ]),
+        gauge_family("rag_image_cache_bytes", "Bytes of encoded image payloads held in memory", [
+            ({}, image["bytes"]),
+        ]),
+        gauge_family("rag_queue_depth", "Work waiting to be processed", [
+            ({"queue": "embedding_batcher"}, batcher["queue_depth"]),
+            ({"queue": "frame_extraction"}, frames["waiting"]),
+            ({"queue": "jobs"}, jobs.get("queued", 0)),
+        ]),
+        gauge_family("rag_frame_extraction_active", "Frame extraction processes running", [
+            ({}, frames["active"]),
+        ]),
+        gauge_family("rag_jobs", "Analysis jobs by status", [
+            ({"status": status}, n) for status, n in sorted(jobs.items())
+        ]),
+        counter_family("rag_embedding_batches_total", "Encode calls made by the embedding batcher", [
+            ({}, batcher["batches"]),
+        ]),
+        counter_family("rag_embedding_batch_items_total", "Queries encoded by the embedding batcher", [
+            ({}, batcher["items"]),
+        ]),
+        counter_family("rag_llm_requests_total", "LLM calls by provider and outcome", [
+            ({"provider": llm["provider"], "outcome": "ok"}, llm["calls"] - llm["failures"]),
+            ({"provider": llm["provider"], "outcome": "error"}, llm["failures"]),
+        ]),
+        gauge_family("rag_index_documents", "Documents indexed per collection", [
+            ({"collection": name}, n) for name, n in sorted(index["documents"].items())
+        ]),
+        gauge_family("rag_index_generation", "Index generation (increments on every reindex that changes it)", [
+            ({}, index["generation"]),
+        ]),
+    ]
+
+
+REGISTRY.register_collector(component_metrics)
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI: conteggio e durata delle richieste HTTP per route.
+    La label e' il template della route (/jobs/{job_id}), non il path,
+    per non far crescere le serie; le risposte in streaming sono misurate
+    fino all'ultimo byte.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        t0 = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope.get("method", "")
+            HTTP_REQUESTS.labels(method, path, status).inc()
+            HTTP_SECONDS.labels(method, path).observe(time.perf_counter() - t0)
@@ -1,20 +1,162 @@
 import os
 import sys
-from typing import Dict, Any, Optional, List
+import math
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, AsyncIterator, Iterator, Optional, List, Tuple
 
 # Add src to path
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
 
-from scripts.index_Qdrant import get_vectorstore, get_embedder
+from scripts.index_Qdrant import get_vectorstore, embed_query, embed_query_future
+from scripts.llm_provider import get_llm_provider
+from scripts.metrics import SEARCH_SECONDS, STAGE_SECONDS
+from scripts.tracing import bind, open_span, span
 
 # Import della pipeline multimodale
 try:
-    from scripts.multimodal_rag_openai import run_multimodal_rag
+    from scripts.multimodal_rag_openai import run_multimodal_rag, iter_multimodal_rag
 except Exception as e:
     run_multimodal_rag = None
+    iter_multimodal_rag = None
     print(f"[rag_service] WARNING: multimodal pipeline unavailable: {e}")
 
 
+# Executor dedicato alle ricerche, separato dal threadpool di default
+# (l'encoding gira sul thread del batcher di index_Qdrant)
+SEARCH_WORKERS = int(os.getenv("RAG_SEARCH_WORKERS", "8"))
+_SEARCH_EXECUTOR = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="rag-search")
+
+# Timeout per collection: allo scadere si risponde con le sole fonti disponibili.
+# Passato anche alla chiamata Qdrant: wait_for non ferma il thread, e una ricerca
+# appesa terrebbe occupato uno slot di _SEARCH_EXECUTOR fino alla risposta.
+SEARCH_TIMEOUT_S = {
+    "cases": float(os.getenv("RAG_CASES_TIMEOUT_S", "5")),
+    "guidelines": float(os.getenv("RAG_GUIDELINES_TIMEOUT_S", "5")),
+}
+TOPK = {"cases": 5, "guidelines": 4}
+
+# Metriche per fase (/metrics), legate una volta sola
+_SEARCH_SECONDS = {name: SEARCH_SECONDS.labels(name) for name in TOPK}
+_LLM_SECONDS = STAGE_SECONDS.labels("llm")
+_LLM_FIRST_TOKEN_SECONDS = STAGE_SECONDS.labels("llm_first_token")
+
+# Risposta /chat: modello scelto dalla richiesta, chiamato tramite il provider LLM
+CHAT_MAX_OUTPUT_TOKENS = int(os.getenv("CHAT_MAX_OUTPUT_TOKENS", "600"))
+CHAT_SYSTEM_PROMPT = """You are a cardiology clinical decision support assistant.
+Answer the question using ONLY the retrieved context (similar cases and guideline chunks).
+- Do NOT invent measurements, findings, or patient details.
+- If the context is insufficient, say so explicitly.
+- Cite each key claim with its CASE id or GUIDELINE source.
+"""
+
+
+def _collections_for(rag_type: str) -> List[str]:
+    collections = []
+    if rag_type in ["cases", "hybrid", "multimodal"]:
+        collections.append("cases")
+    if rag_type in ["guidelines", "hybrid", "multimodal"]:
+        collections.append("guidelines")
+    return collections
+
+
+def _search(vectorstore, collection_name: str, query_emb: List[float]):
+    k = TOPK[collection_name]
+    with span("search", collection=collection_name, k=k) as sp, _SEARCH_SECONDS[collection_name].time():
+        hits = vectorstore.search(
+            collection_name=collection_name,
+            query_vector=query_emb,
+            vector_name="text_embedding",
+            k=k,
+            # timeout lato server/HTTP in secondi interi
+            timeout=max(1, math.ceil(SEARCH_TIMEOUT_S[collection_name])),
+        )
+        sp.set(hits=len(hits))
+        return hits
+
+
+def _hits_to_sources(collection_name: str, hits) -> Tuple[List[Dict[str, Any]], str]:
+    sources = []
+    retrieved_context = ""
+    for hit in hits:
+        if collection_name == "cases":
+            sources.append({
+                "type": "case",
+                "id": hit.id,
+                "score": hit.score,
+                "snippet": hit.text[:200] + "...",
+                "metadata": hit.metadata
+            })
+            retrieved_context += f"\n[CASE {hit.id}]\n{hit.text}\n"
+        else:
+            sources.append({
+                "type": "guideline",
+                "id": hit.id,
+                "score": hit.score,
+                "snippet": hit.text[:200] + "...",
+                "metadata": hit.metadata
+            })
+            retrieved_context += f"\n[GUIDELINE {hit.metadata.get('source', '?')}]\n{hit.text}\n"
+    return sources, retrieved_context
+
+
+def _chat_messages(question: str, retrieved_context: str) -> List[Dict[str, Any]]:
+    return [
+        {"role": "system", "content": CHAT_SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": f"QUESTION:\n{question}\n\nRETRIEVED CONTEXT:\n{retrieved_context or '(no sources retrieved)'}",
+        },
+    ]
+
+
+def _retrieval_only_answer(
+    question: str,
+    rag_type: str,
+    sources: List[Dict[str, Any]],
+    retrieved_context: str,
+) -> str:
+    # risposta senza LLM (provider non disponibile): contesto recuperato. Vale anche per
+    # "multimodal": run_multimodal_rag richiederebbe lo stesso provider appena fallito
+    return f"[RAG stub - {rag_type}]\nQuery: {question}\n\nRetrieved {len(sources)} sources.\n\n{retrieved_context[:500]}..."
+
+
+def _generate_answer(
+    question: str,
+    model: str,
+    rag_type: str,
+    sources: List[Dict[str, Any]],
+    retrieved_context: str,
+) -> str:
+    try:
+        with span("llm", model=model) as sp, _LLM_SECONDS.time():
+            answer = get_llm_provider().generate(model, _chat_messages(question, retrieved_context), CHAT_MAX_OUTPUT_TOKENS)
+            sp.set(output_chars=len(answer))
+            return answer
+    except Exception as e:
+        print(f"[rag_service] WARNING: LLM call failed, answering with retrieved context only: {e}")
+        return _retrieval_only_answer(question, rag_type, sources, retrieved_context)
+
+
+def _build_answer(
+    answer: str,
+    session_id: Optional[str],
+    evaluate: bool,
+    sources: List[Dict[str, Any]],
+) -> Dict[str, Any]:
+    evaluation_obj = None
+    if evaluate:
+        evaluation_obj = {"message": "Evaluation stub (integrate ragas here)"}
+    
+    return {
+        "answer": answer,
+        "sources": sources,
+        "session_id": session_id or "session-auto",
+        "evaluation": evaluation_obj,
+    }
+
+
 def answer_question(
     question: str,
     model: str,
@@ -31,98 +173,200 @@ def answer_question(
     """
     
     vectorstore = get_vectorstore()
-    embedder = get_embedder()
     
-    # Embed query
-    query_emb = embedder.encode([question], normalize_embeddings=True).tolist()[0]
+    # Embed query (via query cache)
+    query_emb = embed_query(question)
     
     sources = []
     retrieved_context = ""
     
     # Retrieval based on rag_type
-    if rag_type in ["cases", "hybrid", "multimodal"]:
-        try:
-            hits = vectorstore.search(
-                collection_name="cases",
-                query_vector=query_emb,
-                vector_name="text_embedding",
-                k=5
-            )
-            for hit in hits:
-                sources.append({
-                    "type": "case",
-                    "id": hit.id,
-                    "score": hit.score,
-                    "snippet": hit.text[:200] + "...",
-                    "metadata": hit.metadata
-                })
-                retrieved_context += f"\n[CASE {hit.id}]\n{hit.text}\n"
-        except Exception as e:
-            print(f"[rag_service] Error retrieving cases: {e}")
-    
-    if rag_type in ["guidelines", "hybrid", "multimodal"]:
+    for collection_name in _collections_for(rag_type):
         try:
-            hits = vectorstore.search(
-                collection_name="guidelines",
-                query_vector=query_emb,
-                vector_name="text_embedding",
-                k=4
-            )
-            for hit in hits:
-                sources.append({
-                    "type": "guideline",
-                    "id": hit.id,
-                    "score": hit.score,
-                    "snippet": hit.text[:200] + "...",
-                    "metadata": hit.metadata
-                })
-                retrieved_context += f"\n[GUIDELINE {hit.metadata.get('source', '?')}]\n{hit.text}\n"
+            hits = _search(vectorstore, collection_name, query_emb)
+            src, ctx = _hits_to_sources(collection_name, hits)
+            sources.extend(src)
+            retrieved_context += ctx
         except Exception as e:
-            print(f"[rag_service] Error retrieving guidelines: {e}")
-    
-    # Build answer (qui puoi integrare OpenAI o altro LLM)
-    # Per ora stub semplice
-    if rag_type == "multimodal":
-        # TODO: chiamare run_multimodal_rag con frame del caso corrente
-        answer = f"[Multimodal RAG stub]\nQuery: {question}\n\nRetrieved {len(sources)} sources.\n\n{retrieved_context[:500]}..."
-    else:
-        answer = f"[RAG stub - {rag_type}]\nQuery: {question}\n\nRetrieved {len(sources)} sources.\n\n{retrieved_context[:500]}..."
-    
-    evaluation_obj = None
-    if evaluate:
-        evaluation_obj = {"message": "Evaluation stub (integrate ragas here)"}
+            print(f"[rag_service] Error retrieving {collection_name}: {e}")
     
-    return {
-        "answer": answer,
+    answer = _generate_answer(question, model, rag_type, sources, retrieved_context)
+    return _build_answer(answer, session_id, evaluate, sources)
+
+
+async def answer_question_async(
+    question: str,
+    model: str,
+    rag_type: str,
+    session_id: Optional[str],
+    evaluate: bool
+) -> Dict[str, Any]:
+    """
+    Variante async di answer_question.
+
+    L'embedding gira sul thread dedicato del batcher (insieme alle altre
+    richieste concorrenti), le ricerche su 'cases' e 'guidelines'
+    partono in parallelo, ognuna con il proprio timeout: una collection lenta o in
+    errore non fa fallire la richiesta, le sue fonti vengono solo omesse e la
+    collection riportata in `timed_out` (lenta) o `failed` (errore), cosi' una
+    risposta parziale si distingue da una senza risultati.
+    """
+    sources, retrieved_context, timed_out, failed = await _retrieve_async(question, rag_type)
+    answer = await asyncio.to_thread(_generate_answer, question, model, rag_type, sources, retrieved_context)
+    out = _build_answer(answer, session_id, evaluate, sources)
+    out["timed_out"] = timed_out or None
+    out["failed"] = failed or None
+    return out
+
+
+async def stream_answer_events(
+    question: str,
+    model: str,
+    rag_type: str,
+    session_id: Optional[str],
+    evaluate: bool
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Variante streaming di answer_question_async: ("sources", ...) appena finito
+    il retrieval, poi ("token", ...) man mano che il modello scrive e ("done", ...)
+    con session_id, evaluation e tempi. Un errore del provider dopo il primo
+    token diventa ("error", ...).
+    """
+    t0 = time.perf_counter()
+    sources, retrieved_context, timed_out, failed = await _retrieve_async(question, rag_type)
+    retrieval_s = time.perf_counter() - t0
+    yield "sources", {
         "sources": sources,
-        "session_id": session_id or "session-auto",
-        "evaluation": evaluation_obj,
+        "timed_out": timed_out or None,
+        "failed": failed or None,
+        "retrieval_s": round(retrieval_s, 4),
     }
 
+    parts: List[str] = []
+    first_token_s = None
+    deltas = None
+    # span non attivato: il generatore async puo' essere chiuso da un altro contesto
+    llm_span = open_span("llm", model=model, stream=True)
+    try:
+        t_llm = time.perf_counter()
+        deltas = get_llm_provider().stream(model, _chat_messages(question, retrieved_context), CHAT_MAX_OUTPUT_TOKENS)
+        while True:
+            # il provider e' bloccante: ogni delta viene letto nel threadpool
+            delta = await asyncio.to_thread(next, deltas, None)
+            if delta is None:
+                _LLM_SECONDS.observe(time.perf_counter() - t_llm)
+                break
+            if first_token_s is None:
+                first_token_s = time.perf_counter() - t0
+                _LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - t_llm)
+                llm_span.set(first_token_ms=round((time.perf_counter() - t_llm) * 1000, 3))
+            parts.append(delta)
+            yield "token", {"text": delta}
+    except Exception as e:
+        llm_span.record_error(e)
+        if parts:
+            yield "error", {"error": f"LLM stream failed: {e}"}
+            return
+        print(f"[rag_service] WARNING: LLM call failed, answering with retrieved context only: {e}")
+        parts = [_retrieval_only_answer(question, rag_type, sources, retrieved_context)]
+        yield "token", {"text": parts[0]}
+    finally:
+        llm_span.set(deltas=len(parts))
+        llm_span.finish()
+        if deltas is not None:
+            try:
+                deltas.close()
+            except ValueError:
+                # generatore ancora in esecuzione nel threadpool (richiesta cancellata)
+                pass
+
+    out = _build_answer("".join(parts), session_id, evaluate, sources)
+    yield "done", {
+        "answer": out["answer"],
+        "session_id": out["session_id"],
+        "evaluation": out["evaluation"],
+        "timings": {
+            "retrieval_s": round(retrieval_s, 4),
+            "first_token_s": round(first_token_s, 4) if first_token_s is not None else None,
+            "total_s": round(time.perf_counter() - t0, 4),
+        },
+    }
+
+
+async def _retrieve_async(question: str, rag_type: str) -> Tuple[List[Dict[str, Any]], str, List[str], List[str]]:
+    loop = asyncio.get_running_loop()
+    vectorstore = await loop.run_in_executor(_SEARCH_EXECUTOR, get_vectorstore)
+    with span("embed") as sp:
+        emb_future = embed_query_future(question)
+        sp.set(cached=emb_future.done())
+        query_emb = await asyncio.wrap_future(emb_future)
+
+    async def search_one(collection_name: str):
+        # bind: lo span della ricerca resta figlio della richiesta anche nell'executor
+        fut = loop.run_in_executor(_SEARCH_EXECUTOR, bind(_search), vectorstore, collection_name, query_emb)
+        return await asyncio.wait_for(fut, timeout=SEARCH_TIMEOUT_S[collection_name])
+
+    collections = _collections_for(rag_type)
+    results = await asyncio.gather(*(search_one(c) for c in collections), return_exceptions=True)
+
+    sources = []
+    retrieved_context = ""
+    timed_out = []
+    failed = []
+    for collection_name, res in zip(collections, results):
+        if isinstance(res, asyncio.TimeoutError):
+            print(f"[rag_service] Timeout retrieving {collection_name} (> {SEARCH_TIMEOUT_S[collection_name]}s)")
+            timed_out.append(collection_name)
+            continue
+        if isinstance(res, BaseException):
+            print(f"[rag_service] Error retrieving {collection_name}: {res}")
+            failed.append(collection_name)
+            continue
+        src, ctx = _hits_to_sources(collection_name, res)
+        sources.extend(src)
+        retrieved_context += ctx
+    return sources, retrieved_context, timed_out, failed
+
+
+DEFAULT_CASE_REPORT = (
+    "Analyze this echocardiography case. Provide probable diagnosis, "
+    "differential, confidence, and cite evidence from images and retrieved cases/guidelines."
+)
+MULTIMODAL_UNAVAILABLE = "Multimodal pipeline unavailable. Ensure OpenAI SDK installed and OPENAI_API_KEY set."
+
+
+def _case_report_text(report_text: Optional[str]) -> str:
+    return report_text.strip() if report_text else DEFAULT_CASE_REPORT
+
 
 def analyze_current_case(
     report_text: Optional[str],
-    frames_dir: Optional[str]
+    frames_dir: Optional[str],
+    frame_paths: Optional[List[str]] = None,
+    bypass_cache: bool = False,
 ) -> Dict[str, Any]:
     """
     Run multimodal RAG using provided frames directory and a report_text.
+    frame_paths (e.g. the frames returned by the upload) avoid listing frames_dir again.
+    bypass_cache skips the analysis result cache and stores the fresh answer.
     If report_text is None, use a generic clinical analysis instruction.
     Requires OPENAI_API_KEY set for vision model.
     """
-    default_report = (
-        "Analyze this echocardiography case. Provide probable diagnosis, "
-        "differential, confidence, and cite evidence from images and retrieved cases/guidelines."
-    )
-    text = report_text.strip() if report_text else default_report
+    text = _case_report_text(report_text)
 
     if run_multimodal_rag is None:
         return {
             "ok": False,
-            "error": "Multimodal pipeline unavailable. Ensure OpenAI SDK installed and OPENAI_API_KEY set.",
+            "error": MULTIMODAL_UNAVAILABLE,
         }
 
     try:
-        output_text = run_multimodal_rag(report_text=text, query_frames_folder=frames_dir)
+        output_text = run_multimodal_rag(
+            report_text=text,
+            query_frames_folder=frames_dir,
+            query_frame_paths=frame_paths or None,
+            bypass_cache=bypass_cache,
+        )
     except Exception as e:
         return {"ok": False, "error": f"Multimodal RAG failed: {e}"}
 
@@ -131,3 +375,28 @@ def analyze_current_case(
         "answer": output_text,
         "frames_dir": frames_dir,
     }
+
+
+def iter_current_case_events(
+    report_text: Optional[str],
+    frames_dir: Optional[str],
+    frame_paths: Optional[List[str]] = None,
+    bypass_cache: bool = False,
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Streaming variant of analyze_current_case: yields the ("sources" | "token" | "done")
+    events of iter_multimodal_rag, or a single ("error", ...) event on failure.
+    """
+    if iter_multimodal_rag is None:
+        yield "error", {"error": MULTIMODAL_UNAVAILABLE}
+        return
+
+    try:
+        yield from iter_multimodal_rag(
+            report_text=_case_report_text(report_text),
+            query_frames_folder=frames_dir,
+            query_frame_paths=frame_paths or None,
+            bypass_cache=bypass_cache,
+        )
+    except Exception as e:
+        yield "error", {"error": f"Multimodal RAG failed: {e}"}
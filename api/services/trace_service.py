@@ -0,0 +1,59 @@
+import os
+import re
+import sys
+from typing import Any, Dict
+
+# Ensure project root is on path to import scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from scripts.tracing import new_request_id, start_trace
+
+REQUEST_ID_HEADER = b"x-request-id"
+_VALID_REQUEST_ID = re.compile(rb"^[A-Za-z0-9._-]{1,128}$")
+
+
+def _incoming_request_id(scope: Dict[str, Any]) -> str:
+    for name, value in scope.get("headers") or []:
+        if name == REQUEST_ID_HEADER and _VALID_REQUEST_ID.match(value):
+            return value.decode("ascii")
+    return new_request_id()
+
+
+class RequestTracingMiddleware:
+    """
+    Middleware ASGI: una traccia per richiesta HTTP con request ID
+    (X-Request-ID del client se valido, altrimenti generato), restituito
+    nell'header X-Request-ID della risposta. La traccia si chiude dopo
+    l'ultimo byte, anche per le risposte in streaming.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = _incoming_request_id(scope)
+        method = scope.get("method", "")
+        with start_trace(f"{method} {scope.get('path', '')}", request_id=request_id, method=method) as root:
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    root.set(status=message["status"])
+                    message = {
+                        **message,
+                        "headers": list(message.get("headers") or []) + [(REQUEST_ID_HEADER, request_id.encode("ascii"))],
+                    }
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            except BaseException:
+                # la risposta 500 la produce ServerErrorMiddleware, piu' esterno
+                root.attrs.setdefault("status", 500)
+                raise
+            finally:
+                route = getattr(scope.get("route"), "path", None)
+                if route:
+                    root.set(route=route)
@@ -1,4 +1,6 @@
 import os
+import json
+import time
 import requests
 import streamlit as st
 from dotenv import load_dotenv
@@ -9,6 +11,40 @@ BASE_URL = f"http://{backend_host}:8000"
 
 st.set_page_config(page_title="Multimodal RAG", layout="wide")
 
+
+def iter_sse(response):
+    """Eventi (nome, dati) da una risposta text/event-stream, man mano che arrivano."""
+    event, data = None, []
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+        elif not line and event:
+            yield event, json.loads("\n".join(data) or "null")
+            event, data = None, []
+
+
+def render_stream(response, answer_box):
+    """Mostra fonti e token appena arrivano; ritorna l'evento finale (done o error)."""
+    text = ""
+    for event, data in iter_sse(response):
+        if event == "sources":
+            src = data.get("sources") or []
+            if src:
+                with st.expander(f"Sources ({len(src)})"):
+                    st.json(src)
+        elif event == "token":
+            text += data.get("text", "")
+            answer_box.markdown(text + "▌")
+        elif event == "done":
+            answer_box.markdown(data.get("answer", text))
+            return data
+        elif event == "error":
+            answer_box.error(data.get("error"))
+            return None
+    return None
+
 st.sidebar.title("Settings")
 model = st.sidebar.selectbox("Model", ["gpt-4o-mini", "llama3", "mistral"])
 rag_type = st.sidebar.selectbox("RAG type", ["cases", "guidelines", "hybrid"])
@@ -37,6 +73,52 @@ with st.expander("Upload DICOM"):
         else:
             st.error(r.text)
 
+with st.expander("Analyze case"):
+    case_dicom = st.file_uploader("Carica un .dcm da analizzare", type=["dcm"], key="case_dicom")
+    report_text = st.text_area("Referto (opzionale)", key="case_report")
+    no_cache = st.checkbox("Ricalcola (ignora la cache dei risultati)", key="case_no_cache")
+    stream_case = st.checkbox("Streaming (risposta mostrata mentre viene generata)", value=True, key="case_stream")
+    if st.button("Analyze") and case_dicom is not None:
+        files = {"file": (case_dicom.name, case_dicom.getvalue(), "application/dicom")}
+        if stream_case:
+            with requests.post(
+                f"{BASE_URL}/analyze-case/stream",
+                files=files,
+                data={"report_text": report_text or None, "no_cache": no_cache},
+                stream=True,
+                timeout=(60, 300),
+            ) as r:
+                if r.status_code == 200:
+                    done = render_stream(r, st.empty())
+                    if done:
+                        st.caption(f"timings: {done.get('timings')} cached: {done.get('cached')}")
+                else:
+                    st.error(r.text)
+        else:
+            r = requests.post(
+                f"{BASE_URL}/analyze-case/jobs",
+                files=files,
+                data={"report_text": report_text or None, "no_cache": no_cache},
+                timeout=60,
+            )
+            if r.status_code == 202:
+                job_id = r.json()["job_id"]
+                status_box = st.empty()
+                # polling con richieste brevi: nessuna connessione tenuta aperta per l'analisi
+                while True:
+                    job = requests.get(f"{BASE_URL}/jobs/{job_id}", timeout=10).json()
+                    status_box.info(f"Job {job_id[:8]}: {job['status']} {job.get('stages') or ''}")
+                    if job["status"] in ("succeeded", "failed"):
+                        break
+                    time.sleep(1.0)
+                analysis = (job.get("result") or {}).get("analysis") or {}
+                if job["status"] == "succeeded":
+                    st.markdown(analysis.get("answer", ""))
+                else:
+                    st.error(job.get("error") or analysis.get("error"))
+            else:
+                st.error(r.text)
+
 for m in st.session_state.messages:
     with st.chat_message(m["role"]):
         st.markdown(m["content"])
@@ -54,26 +136,21 @@ if q:
         "evaluate": st.session_state.get("enable_evaluation", False),
         "session_id": st.session_state.session_id,
     }
-    r = requests.post(f"{BASE_URL}/chat", json=payload, timeout=180)
-    if r.status_code == 200:
-        js = r.json()
-        st.session_state.session_id = js.get("session_id", st.session_state.session_id)
-
-        ans = js.get("answer", "")
-        st.session_state.messages.append({"role": "assistant", "content": ans})
-        with st.chat_message("assistant"):
-            st.markdown(ans)
-
-            src = js.get("sources") or []
-            if src:
-                with st.expander("Sources"):
-                    st.json(src)
+    with st.chat_message("assistant"):
+        answer_box = st.empty()
+        done = None
+        with requests.post(f"{BASE_URL}/chat/stream", json=payload, stream=True, timeout=(10, 180)) as r:
+            if r.status_code == 200:
+                done = render_stream(r, answer_box)
+            else:
+                st.error(r.text)
+        if done:
+            st.session_state.session_id = done.get("session_id", st.session_state.session_id)
+            st.session_state.messages.append({"role": "assistant", "content": done.get("answer", "")})
 
-            ev = js.get("evaluation")
+            ev = done.get("evaluation")
             if ev:
                 st.info(ev.get("message") if isinstance(ev, dict) else ev)
-    else:
-        st.error(r.text)
 
 col1, col2 = st.columns(2)
 with col1:
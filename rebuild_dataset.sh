@@ -1,8 +1,15 @@
 #!/bin/bash
-# Script per rigenerare il dataset da zero
+# Script per rigenerare il dataset
+# Default: build incrementale (solo DICOM nuovi/modificati, via build_manifest.json)
+# --full:  cancella il dataset e lo ricostruisce da zero
 
 set -e
 
+FULL=0
+if [ "$1" == "--full" ]; then
+    FULL=1
+fi
+
 BLUE='\033[0;34m'
 GREEN='\033[0;32m'
 YELLOW='\033[0;33m'
@@ -11,7 +18,7 @@ NC='\033[0m'
 echo -e "${BLUE}=== Rebuild Dataset ===${NC}\n"
 
 # Controlla se esiste già
-if [ -f "data/dataset_built/documents.jsonl" ]; then
+if [ "$FULL" == "1" ] && [ -f "data/dataset_built/documents.jsonl" ]; then
     echo -e "${YELLOW}Dataset already exists. This will DELETE and REBUILD it.${NC}"
     read -p "Continue? (y/N): " -n 1 -r
     echo
@@ -23,6 +30,7 @@ if [ -f "data/dataset_built/documents.jsonl" ]; then
     echo -e "${GREEN}Removing old dataset...${NC}"
     rm -rf data/dataset_built/documents.jsonl
     rm -rf data/dataset_built/labels.csv
+    rm -rf data/dataset_built/build_manifest.json
     rm -rf data/dataset_built/images
 fi
 
@@ -33,7 +41,11 @@ fi
 
 # Build
 echo -e "${GREEN}Building dataset from DICOM files...${NC}"
-python3 scripts/build_dataset.py
+if [ "$FULL" == "1" ]; then
+    python3 scripts/build_dataset.py --full
+else
+    python3 scripts/build_dataset.py
+fi
 
 # Stats
 if [ -f "data/dataset_built/documents.jsonl" ]; then
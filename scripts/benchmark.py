@@ -0,0 +1,466 @@
+"""
+Benchmark end-to-end: latenza e throughput delle fasi principali su dati sintetici.
+
+Fasi (--stages, default tutte):
+- build_dataset: build_dataset su DICOM sintetici (al massimo --max-dicoms file)
+- extract_frames: estrazione frame di un DICOM (percorso di /upload-doc)
+- index_build: indicizzazione completa di documents.jsonl (--cases casi) + linee guida
+- retrieve: retrieve_similar_qdrant su report distinti
+- answer_question: /chat lato servizio (retrieval + LLM)
+- analyze_case: POST /analyze-case/stream, un DICOM nuovo per richiesta
+  (sotto-fasi upload_extract, retrieval, first_token dai tempi dell'evento done)
+- analyze_case_concurrent: come sopra con --concurrency richieste in parallelo
+
+L'LLM e' il provider "fake" (latenza/token rate configurabili, default 0 =
+solo overhead del sistema); l'embedder e' HashEmbedder salvo --embedder model.
+La result cache e' disattivata: ogni analisi percorre tutta la pipeline.
+
+Per ogni fase: campioni, p50/p95/p99/mean/max (ms), throughput (op/s), RSS
+corrente e di picco (MB). Output JSON con --json; con --compare confronta con
+un baseline salvato e termina con codice 1 se una metrica peggiora oltre --threshold.
+
+Uso:
+    python scripts/benchmark.py --scale small --json data/benchmarks/latest.json
+    python scripts/benchmark.py --cases 1000 --stages index_build retrieve
+    python scripts/benchmark.py --scale small --compare data/benchmarks/baseline.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.synthetic_data import (
+    HashEmbedder,
+    generate_case_documents,
+    generate_dicom_tree,
+    generate_guidelines,
+    synthetic_reports,
+    write_synthetic_dicom,
+)
+
+SCALES = {"small": 10, "medium": 1_000, "large": 100_000}
+STAGES = [
+    "build_dataset",
+    "extract_frames",
+    "index_build",
+    "retrieve",
+    "answer_question",
+    "analyze_case",
+    "analyze_case_concurrent",
+]
+
+# metriche confrontate con il baseline: (path nel risultato della fase, True se "piu' alto e' meglio")
+COMPARED_METRICS = [
+    (("latency_ms", "p50"), False),
+    (("latency_ms", "p95"), False),
+    (("latency_ms", "p99"), False),
+    (("throughput_per_s",), True),
+    (("peak_rss_mb",), False),
+]
+
+
+def latency_summary(samples_s: Sequence[float]) -> Dict[str, float]:
+    """p50/p95/p99/mean/max in millisecondi."""
+    ms = np.asarray(samples_s, dtype=float) * 1000.0
+    if ms.size == 0:
+        return {}
+    return {
+        "p50": round(float(np.percentile(ms, 50)), 3),
+        "p95": round(float(np.percentile(ms, 95)), 3),
+        "p99": round(float(np.percentile(ms, 99)), 3),
+        "mean": round(float(ms.mean()), 3),
+        "max": round(float(ms.max()), 3),
+    }
+
+
+def rss_mb() -> float:
+    """RSS corrente del processo (MB)."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    """RSS di picco (MB); ru_maxrss e' in KB su Linux, in byte su macOS."""
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def stage_result(samples_s: Sequence[float], wall_s: float, ops: Optional[int] = None, **extra) -> Dict[str, Any]:
+    ops = len(samples_s) if ops is None else ops
+    out = {
+        "samples": len(samples_s),
+        "latency_ms": latency_summary(samples_s),
+        "throughput_per_s": round(ops / wall_s, 3) if wall_s > 0 else 0.0,
+        "wall_s": round(wall_s, 4),
+        "rss_mb": round(rss_mb(), 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "children_peak_rss_mb": round(peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+    }
+    out.update({k: v for k, v in extra.items() if v is not None})
+    return out
+
+
+def timed(fn: Callable, inputs: Sequence, concurrency: int = 1):
+    """Esegue fn su ogni input (in parallelo se concurrency > 1); ritorna (latenze, risultati, wall)."""
+
+    def one(x):
+        t0 = time.perf_counter()
+        res = fn(x)
+        return time.perf_counter() - t0, res
+
+    t0 = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as ex:
+            pairs = list(ex.map(one, inputs))
+    else:
+        pairs = [one(x) for x in inputs]
+    wall = time.perf_counter() - t0
+    return [p[0] for p in pairs], [p[1] for p in pairs], wall
+
+
+def _parse_sse(body: str) -> List[tuple]:
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.split("\n") if ": " in line)
+        if "event" in fields:
+            events.append((fields["event"], json.loads(fields.get("data", "null"))))
+    return events
+
+
+class BenchmarkRun:
+    """Ambiente isolato (workdir temporanea) e fasi del benchmark."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.workdir = args.workdir or tempfile.mkdtemp(prefix="rag-bench-")
+        self.dataset_dir = os.path.join(self.workdir, "dataset_built")
+        self.guidelines_dir = os.path.join(self.workdir, "guidelines_txt")
+        self.index_ready = False
+        self.reports = synthetic_reports(max(args.queries, args.repeat) * 2, seed=args.seed)
+        self._configure()
+
+    def _configure(self):
+        """Punta i moduli dell'app sulla workdir, embedder/LLM sintetici, result cache spenta."""
+        import scripts.index_Qdrant as iq
+        import scripts.multimodal_rag_openai as mm
+        import scripts.llm_provider as llm
+        from scripts.result_cache import ResultCache
+        from api.services import doc_service
+
+        iq.JSONL_PATH = os.path.join(self.dataset_dir, "documents.jsonl")
+        iq.GUIDELINES_DIR = self.guidelines_dir
+        iq.SNAPSHOT_DIR = os.path.join(self.workdir, "index_snapshot")
+        iq.USE_SNAPSHOT = False
+        iq.QDRANT_MODE = "memory"
+        if self.args.embedder == "hash":
+            iq._embedder = HashEmbedder()
+
+        mm.DATA_DIR = self.dataset_dir
+        mm._frame_manifest = None
+        mm._result_cache = ResultCache(max_entries=0)
+
+        llm._provider = llm.FakeLLMProvider(
+            ttft_ms=self.args.llm_ttft_ms,
+            ttft_sigma=self.args.llm_ttft_sigma,
+            tokens_per_s=self.args.llm_tokens_per_s,
+            output_tokens=self.args.llm_output_tokens,
+            seed=self.args.seed,
+        )
+
+        current = os.path.join(self.workdir, "current")
+        doc_service.CURRENT_DICOM_DIR = doc_service.Path(current, "dicom")
+        doc_service.CURRENT_FRAMES_DIR = doc_service.Path(current, "frames")
+        doc_service.UPLOAD_STAGING_DIR = doc_service.Path(current, "incoming")
+        doc_service.UPLOAD_INDEX_PATH = doc_service.Path(current, "upload_index.json")
+
+    def cleanup(self):
+        if not self.args.keep_workdir and not self.args.workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+    # --- fasi ---
+
+    def build_dataset(self) -> Dict[str, Any]:
+        from scripts.build_dataset import build_dataset
+
+        n = min(self.args.cases, self.args.max_dicoms)
+        raw = os.path.join(self.workdir, "raw_data")
+        generate_dicom_tree(raw, n, frames=self.args.dicom_frames, rows=self.args.dicom_size,
+                            cols=self.args.dicom_size, seed=self.args.seed)
+        out = os.path.join(self.workdir, "built")
+        t0 = time.perf_counter()
+        summary = build_dataset(raw, out, workers=self.args.workers or None, full=True)
+        wall = time.perf_counter() - t0
+        return stage_result([wall], wall, ops=n, files=n, documents=summary.get("documents"),
+                            errors=len(summary.get("errors") or []))
+
+    def extract_frames(self) -> Dict[str, Any]:
+        from scripts.dicom_to_frames_current import extract_frames
+
+        src = os.path.join(self.workdir, "extract.dcm")
+        write_synthetic_dicom(src, frames=self.args.dicom_frames, rows=self.args.dicom_size,
+                              cols=self.args.dicom_size, seed=self.args.seed)
+        outs = [os.path.join(self.workdir, "extract", str(i)) for i in range(self.args.repeat)]
+        lat, _, wall = timed(lambda out: extract_frames(src, out, 12), outs)
+        return stage_result(lat, wall)
+
+    def _prepare_index_sources(self) -> int:
+        if not os.path.exists(os.path.join(self.dataset_dir, "documents.jsonl")):
+            generate_case_documents(os.path.join(self.dataset_dir, "documents.jsonl"), self.args.cases,
+                                    frames_per_case=self.args.frames_per_case, seed=self.args.seed)
+            generate_guidelines(self.guidelines_dir, min(1000, max(3, self.args.cases // 100)), seed=self.args.seed)
+        with open(os.path.join(self.dataset_dir, "documents.jsonl"), "rb") as f:
+            return sum(1 for _ in f)
+
+    def _build_index(self) -> float:
+        import scripts.index_Qdrant as iq
+
+        iq._vectorstore = None
+        iq._initialized = False
+        iq._manifest = {}
+        t0 = time.perf_counter()
+        iq.get_vectorstore()
+        self.index_ready = True
+        return time.perf_counter() - t0
+
+    def _ensure_index(self):
+        if not self.index_ready:
+            self._prepare_index_sources()
+            self._build_index()
+
+    def index_build(self) -> Dict[str, Any]:
+        docs = self._prepare_index_sources()
+        wall = self._build_index()
+        return stage_result([wall], wall, ops=docs, documents=docs)
+
+    def retrieve(self) -> Dict[str, Any]:
+        from scripts.multimodal_rag_openai import retrieve_similar_qdrant
+
+        self._ensure_index()
+        queries = self.reports[: self.args.queries]
+        lat, _, wall = timed(lambda q: retrieve_similar_qdrant("cases", q, 5), queries)
+        return stage_result(lat, wall)
+
+    def answer_question(self) -> Dict[str, Any]:
+        from api.services.rag_service import answer_question
+
+        self._ensure_index()
+        queries = self.reports[: self.args.queries]
+        lat, _, wall = timed(lambda q: answer_question(q, "gpt-4o", "hybrid", None, False), queries)
+        return stage_result(lat, wall)
+
+    def _analyze_inputs(self, n: int, offset: int) -> List[str]:
+        # un DICOM diverso per richiesta: niente dedup dell'upload, estrazione sempre eseguita
+        paths = []
+        for i in range(n):
+            path = os.path.join(self.workdir, "uploads", f"case-{offset + i}.dcm")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_synthetic_dicom(path, frames=self.args.dicom_frames, rows=self.args.dicom_size,
+                                  cols=self.args.dicom_size, seed=self.args.seed + 10_000 + offset + i)
+            paths.append(path)
+        return paths
+
+    def _analyze(self, concurrency: int, offset: int) -> Dict[str, Any]:
+        from fastapi.testclient import TestClient
+        from api.main import app
+
+        self._ensure_index()
+        n = self.args.repeat if concurrency == 1 else max(self.args.repeat, concurrency * 2)
+        paths = self._analyze_inputs(n, offset)
+        client = TestClient(app)
+
+        def one(i):
+            with open(paths[i], "rb") as f:
+                resp = client.post(
+                    "/analyze-case/stream",
+                    files={"file": (os.path.basename(paths[i]), f.read(), "application/dicom")},
+                    data={"report_text": self.reports[i % len(self.reports)]},
+                )
+            events = _parse_sse(resp.text)
+            done = next((d for e, d in events if e == "done"), None)
+            if resp.status_code != 200 or done is None:
+                raise RuntimeError(f"/analyze-case/stream failed: {resp.status_code} {events[-1:] or resp.text[:200]}")
+            return done["timings"]
+
+        lat, timings, wall = timed(one, range(n), concurrency=concurrency)
+        substages = {
+            "upload_extract": latency_summary([l - t["total_s"] for l, t in zip(lat, timings)]),
+            "retrieval": latency_summary([t["retrieval_s"] for t in timings]),
+            "first_token": latency_summary([t["first_token_s"] for t in timings if t.get("first_token_s") is not None]),
+        }
+        return stage_result(lat, wall, concurrency=concurrency, substages=substages)
+
+    def analyze_case(self) -> Dict[str, Any]:
+        return self._analyze(1, offset=0)
+
+    def analyze_case_concurrent(self) -> Dict[str, Any]:
+        return self._analyze(self.args.concurrency, offset=100_000)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    run = BenchmarkRun(args)
+    results: Dict[str, Any] = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("json", "compare")},
+        },
+        "stages": {},
+    }
+    try:
+        for name in args.stages:
+            print(f"[Benchmark] {name}...")
+            try:
+                results["stages"][name] = getattr(run, name)()
+            except Exception as e:
+                print(f"[Benchmark] ERROR in {name}: {type(e).__name__}: {e}")
+                results["stages"][name] = {"error": f"{type(e).__name__}: {e}"}
+    finally:
+        run.cleanup()
+    return results
+
+
+def _metric(stage: Dict[str, Any], path: Sequence[str]) -> Optional[float]:
+    value: Any = stage
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return float(value) if isinstance(value, (int, float)) else None
+
+
+def compare_results(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float = 0.2,
+                    min_delta_ms: float = 1.0) -> List[Dict[str, Any]]:
+    """
+    Metriche peggiorate oltre `threshold` (relativo) rispetto al baseline.
+    Differenze di latenza sotto `min_delta_ms` sono rumore e non vengono segnalate;
+    una fase in errore che nel baseline era riuscita e' una regressione.
+    """
+    regressions = []
+    for name, base in baseline.get("stages", {}).items():
+        cur = current.get("stages", {}).get(name)
+        if cur is None or "error" in base:
+            continue
+        if "error" in cur:
+            regressions.append({"stage": name, "metric": "error", "baseline": None, "current": cur["error"]})
+            continue
+        for path, higher_is_better in COMPARED_METRICS:
+            b, c = _metric(base, path), _metric(cur, path)
+            if not b or c is None:
+                continue
+            change = (c - b) / b
+            worse = -change if higher_is_better else change
+            if path[0] == "latency_ms" and abs(c - b) < min_delta_ms:
+                continue
+            if worse > threshold:
+                regressions.append({
+                    "stage": name,
+                    "metric": ".".join(path),
+                    "baseline": b,
+                    "current": c,
+                    "change_pct": round(change * 100, 1),
+                })
+    return regressions
+
+
+def print_summary(results: Dict[str, Any]):
+    print(f"\n{'stage':<26}{'n':>5}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}{'ops/s':>10}{'peak MB':>10}")
+    for name, r in results["stages"].items():
+        if "error" in r:
+            print(f"{name:<26} ERROR {r['error']}")
+            continue
+        lat = r["latency_ms"]
+        print(
+            f"{name:<26}{r['samples']:>5}{lat['p50']:>11.2f}{lat['p95']:>11.2f}{lat['p99']:>11.2f}"
+            f"{r['throughput_per_s']:>10.2f}{r['peak_rss_mb']:>10.1f}"
+        )
+        for sub, s in (r.get("substages") or {}).items():
+            if s:
+                print(f"  {sub:<24}{'':>5}{s['p50']:>11.2f}{s['p95']:>11.2f}{s['p99']:>11.2f}")
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="End-to-end latency/throughput benchmark on synthetic data")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small", help="small=10, medium=1k, large=100k cases")
+    parser.add_argument("--cases", type=int, help="Number of synthetic cases (overrides --scale)")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--repeat", type=int, default=20, help="Samples for extract_frames / analyze_case")
+    parser.add_argument("--queries", type=int, default=50, help="Queries for retrieve / answer_question")
+    parser.add_argument("--concurrency", type=int, default=4, help="Parallel requests for analyze_case_concurrent")
+    parser.add_argument("--max-dicoms", type=int, default=200, help="Cap on DICOMs generated for build_dataset")
+    parser.add_argument("--dicom-frames", type=int, default=48)
+    parser.add_argument("--dicom-size", type=int, default=256, help="Rows/columns of synthetic DICOM frames")
+    parser.add_argument("--frames-per-case", type=int, default=3, help="Frame documents per synthetic case")
+    parser.add_argument("--workers", type=int, default=0, help="build_dataset workers (0 = BUILD_WORKERS)")
+    parser.add_argument("--embedder", choices=["hash", "model"], default="hash",
+                        help="hash = deterministic offline embedder, model = configured EMBED_BACKEND")
+    parser.add_argument("--llm-ttft-ms", type=float, default=0.0, help="Fake LLM median time to first token")
+    parser.add_argument("--llm-ttft-sigma", type=float, default=0.5)
+    parser.add_argument("--llm-tokens-per-s", type=float, default=0.0, help="Fake LLM token rate (0 = instant)")
+    parser.add_argument("--llm-output-tokens", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="Working directory (default: temporary, removed at the end)")
+    parser.add_argument("--keep-workdir", action="store_true")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--compare", help="Baseline JSON to compare against (exit 1 on regression)")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Relative change flagged as regression")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="Ignore latency changes below this")
+    args = parser.parse_args(argv)
+    if args.cases is None:
+        args.cases = SCALES[args.scale]
+    return args
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = parse_args(argv)
+    results = run_benchmark(args)
+    print_summary(results)
+
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n[Benchmark] Results written to {args.json}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"\n[Benchmark] {len(regressions)} regression(s) vs {args.compare} (threshold {args.threshold:.0%}):")
+            for r in regressions:
+                print(f"  {r['stage']}.{r['metric']}: {r['baseline']} -> {r['current']} ({r.get('change_pct', '-')}%)")
+            return 1
+        print(f"\n[Benchmark] No regressions vs {args.compare} (threshold {args.threshold:.0%}).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,52 @@
+"""
+Build Dataset - DICOM (data/raw_data/<label>/*.dcm) -> documents.jsonl + labels.csv + PNG frame.
+
+Pipeline richiamabile (build_dataset()) o da CLI:
+    python scripts/build_dataset.py [--workers N] [--full]
+
+Ogni DICOM e' processato in modo indipendente (lettura, anonimizzazione,
+decodifica pixel, feature, PNG) su un pool di processi; i risultati sono
+raccolti nell'ordine deterministico dei file (label, nome file) e
+documents.jsonl / labels.csv vengono sostituiti atomicamente a fine build.
+Un file corrotto viene riportato e saltato senza interrompere la build.
+
+Build incrementale: build_manifest.json registra per ogni DICOM (path
+relativo) size, mtime, sha256, case_id, label row e l'intervallo di byte dei
+suoi documenti in documents.jsonl. Alla build successiva i file invariati
+riusano documenti, label e PNG esistenti (copia dei byte, nessuna decodifica);
+solo i file nuovi/modificati vengono processati e le immagini dei casi
+rimossi vengono cancellate. --full ignora il manifest.
+
+documents.jsonl e' scritto da DatasetWriter (un handle bufferizzato, file
+temporaneo rinominato a fine build) che registra anche l'offset di ogni
+documento in documents.jsonl.idx.json per il seek diretto.
+
+frame_manifest.json elenca per ogni caso i PNG esportati (indice, path,
+dimensioni, size): il lato query sceglie i frame da li', senza listdir.
+"""
 import os
+import sys
 import json
 import csv
 import re
+import time
 import hashlib
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
 import numpy as np
 import pydicom
 from pydicom.pixel_data_handlers.util import convert_color_space
 from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.dicom_frames import FrameReader
+from scripts.dataset_writer import DatasetWriter, load_index_entries
+from scripts.frame_manifest import frame_entry, write_frame_manifest
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 RAW_ROOT = os.path.abspath(os.path.join(BASE_DIR, "..", "data", "raw_data"))
@@ -16,12 +56,15 @@ JSONL_PATH = os.path.join(OUT_DIR, "documents.jsonl")
 LABELS_CSV = os.path.join(OUT_DIR, "labels.csv")
 IMAGES_DIR = os.path.join(OUT_DIR, "images")
 
-os.makedirs(OUT_DIR, exist_ok=True)
-os.makedirs(IMAGES_DIR, exist_ok=True)
+LABEL_FIELDS = ["case_id", "label_raw", "label_short", "label_pretty", "group", "file"]
+FRAMES_PER_CASE = 10
+
+BUILD_MANIFEST = "build_manifest.json"
+# da incrementare quando cambia il contenuto generato per un DICOM (forza rebuild completo)
+BUILD_MANIFEST_VERSION = 2
 
-print("RAW_ROOT:", RAW_ROOT)
-print("OUT_DIR:", OUT_DIR)
-print("\n[ANONYMIZATION] Removing sensitive patient data from DICOM metadata...\n")
+# processi del pool (default: tutti i core)
+BUILD_WORKERS = int(os.getenv("BUILD_WORKERS", "0")) or (os.cpu_count() or 1)
 
 # --- SENSITIVE DATA TO EXCLUDE (GDPR/HIPAA compliance) ---
 # These DICOM tags contain patient-identifiable information
@@ -101,116 +144,173 @@ def build_case_card(meta: dict) -> str:
     txt += "Findings: not provided (metadata-only)."
     return txt
 
-def export_representative_frames(ds, case_id: str, n=10):
-    try:
-        pixel_array = ds.pixel_array
-        num_frames = int(safe_get(ds, "NumberOfFrames", 1))
-        if num_frames <= 1:
-            return []
-
-        k = min(n, num_frames)
-        idxs = np.linspace(0, num_frames - 1, k, dtype=int)
+def _export_indices(num_frames: int, n: int) -> List[int]:
+    if num_frames <= 1:
+        return []
+    return np.linspace(0, num_frames - 1, min(n, num_frames), dtype=int).tolist()
 
-        case_img_dir = os.path.join(IMAGES_DIR, case_id)
-        os.makedirs(case_img_dir, exist_ok=True)
 
-        saved = []
-        photometric = safe_get(ds, "PhotometricInterpretation", None)
+def _feature_indices(num_frames: int, max_frames: int) -> List[int]:
+    if num_frames <= 1:
+        return []
+    # sottocampiona per velocità
+    return np.linspace(0, num_frames - 1, min(num_frames, max_frames), dtype=int).tolist()
 
-        for idx in idxs:
-            frame = pixel_array[idx]
 
-            # color conversion if RGB
-            if photometric == "YBR_FULL_422" and frame.ndim == 3 and frame.shape[-1] == 3:
-                frame = convert_color_space(frame, "YBR_FULL_422", "RGB")
+def _save_frame_png(frame, photometric, case_img_dir: str, idx: int) -> Dict:
+    # color conversion if RGB
+    if photometric == "YBR_FULL_422" and frame.ndim == 3 and frame.shape[-1] == 3:
+        frame = convert_color_space(frame, "YBR_FULL_422", "RGB")
 
-            img = Image.fromarray(frame)
-            path = os.path.join(case_img_dir, f"frame_{idx+1}.png")
-            img.save(path)
-            saved.append({"frame_index": int(idx+1), "image_path": path})
+    img = Image.fromarray(frame)
+    path = os.path.join(case_img_dir, f"frame_{idx+1}.png")
+    img.save(path)
+    return {"frame_index": int(idx+1), "image_path": path}
 
-        return saved
-    except Exception:
-        return []
 
-def compute_simple_video_features(ds, max_frames=64):
+class VideoFeatureAccumulator:
     """
-    Estrae feature semplici dal cine US:
+    Feature semplici del cine US calcolate in streaming, un frame alla volta:
     - mean_intensity: media intensità normalizzata
     - motion_energy: differenza media tra frame consecutivi
     - motion_std: deviazione standard del movimento
+    In memoria restano solo il frame corrente e il precedente.
     """
-    try:
-        arr = ds.pixel_array  # shape: (frames, H, W) o (frames, H, W, 3)
-        num_frames = int(safe_get(ds, "NumberOfFrames", 1))
-        if num_frames <= 1:
-            return {}
 
-        # sottocampiona per velocità
-        use_n = min(num_frames, max_frames)
-        idxs = np.linspace(0, num_frames - 1, use_n, dtype=int)
-        x = arr[idxs]
+    def __init__(self):
+        self.count = 0
+        self.intensity_sum = 0.0
+        self.maxv = 0.0
+        self.prev = None
+        self.motion_per_step: List[float] = []
 
+    def add(self, frame):
         # se colore -> converti a grayscale semplice (mean sui canali)
-        if x.ndim == 4 and x.shape[-1] == 3:
-            x = x.mean(axis=-1)
-
+        x = frame.mean(axis=-1) if frame.ndim == 3 and frame.shape[-1] == 3 else frame
         x = x.astype(np.float32)
-
-        # normalizza [0,1] se sembra 8-bit
-        maxv = x.max()
-        if maxv > 1.5:
-            x = x / 255.0
-
-        mean_intensity = float(x.mean())
-
+        self.maxv = max(self.maxv, float(x.max()))
+        self.intensity_sum += float(x.mean())
         # movimento: differenza assoluta tra frame consecutivi
-        diffs = np.abs(x[1:] - x[:-1])
-        motion_per_step = diffs.mean(axis=(1, 2))  # (use_n-1,)
-        motion_energy = float(motion_per_step.mean())
-        motion_std = float(motion_per_step.std())
+        if self.prev is not None:
+            self.motion_per_step.append(float(np.abs(x - self.prev).mean()))
+        self.prev = x
+        self.count += 1
 
+    def result(self) -> Dict:
+        if self.count < 2:
+            return {}
+        # normalizza [0,1] se sembra 8-bit (tutte le feature sono lineari nella scala)
+        scale = 255.0 if self.maxv > 1.5 else 1.0
+        motion = np.asarray(self.motion_per_step, dtype=np.float64) / scale
         return {
-            "mean_intensity": mean_intensity,
-            "motion_energy": motion_energy,
-            "motion_std": motion_std,
-            "feature_frames_used": int(use_n)
+            "mean_intensity": self.intensity_sum / self.count / scale,
+            "motion_energy": float(motion.mean()),
+            "motion_std": float(motion.std()),
+            "feature_frames_used": int(self.count)
         }
+
+
+def export_representative_frames(ds, case_id: str, n=10, images_dir: str = IMAGES_DIR, reader: Optional[FrameReader] = None):
+    try:
+        reader = reader or FrameReader(ds)
+        idxs = _export_indices(reader.num_frames, n)
+        if not idxs:
+            return []
+
+        case_img_dir = os.path.join(images_dir, case_id)
+        os.makedirs(case_img_dir, exist_ok=True)
+
+        photometric = safe_get(ds, "PhotometricInterpretation", None)
+        return [_save_frame_png(frame, photometric, case_img_dir, idx) for idx, frame in reader.frames(idxs)]
     except Exception:
-        return {}
+        return []
 
-# clean build
-open(JSONL_PATH, "w", encoding="utf-8").close()
-labels_rows = []
+def compute_simple_video_features(ds, max_frames=64, reader: Optional[FrameReader] = None):
+    """
+    Estrae feature semplici dal cine US (vedi VideoFeatureAccumulator),
+    decodificando solo i frame campionati.
+    """
+    try:
+        reader = reader or FrameReader(ds)
+        acc = VideoFeatureAccumulator()
+        for _, frame in reader.frames(_feature_indices(reader.num_frames, max_frames)):
+            acc.add(frame)
+        return acc.result()
+    except Exception:
+        return {}
 
-for label_folder in sorted(os.listdir(RAW_ROOT)):
-    label_dir = os.path.join(RAW_ROOT, label_folder)
-    if not os.path.isdir(label_dir):
-        continue
+def extract_features_and_frames(ds, case_id: str, n=10, images_dir: str = IMAGES_DIR, max_frames=64) -> Tuple[Dict, List[Dict]]:
+    """
+    Feature + export PNG in un solo passaggio: l'unione degli indici dei due
+    stadi viene decodificata una volta, in ordine, un frame alla volta.
+    Come le funzioni separate, un errore in uno stadio ne annulla solo l'output.
+    """
+    reader = FrameReader(ds, cache_frames=1)
+    feat_idxs = set(_feature_indices(reader.num_frames, max_frames))
+    export_idxs = set(_export_indices(reader.num_frames, n))
+    photometric = safe_get(ds, "PhotometricInterpretation", None)
+    case_img_dir = os.path.join(images_dir, case_id)
+
+    acc = VideoFeatureAccumulator()
+    saved: List[Dict] = []
+    feat_ok = export_ok = True
+    try:
+        if export_idxs:
+            os.makedirs(case_img_dir, exist_ok=True)
+        for idx, frame in reader.frames(sorted(feat_idxs | export_idxs)):
+            if feat_ok and idx in feat_idxs:
+                try:
+                    acc.add(frame)
+                except Exception:
+                    feat_ok = False
+            if export_ok and idx in export_idxs:
+                try:
+                    saved.append(_save_frame_png(frame, photometric, case_img_dir, idx))
+                except Exception:
+                    export_ok = False
+    except Exception:
+        return {}, []
+    return (acc.result() if feat_ok else {}), (saved if export_ok else [])
 
+def label_info(label_folder: str) -> Dict:
     # if not in map, manage anyway
-    lm = LABEL_MAP.get(label_folder, {
+    return LABEL_MAP.get(label_folder, {
         "short": slugify(label_folder),
         "pretty": label_folder.replace("_", " "),
         "group": "unknown"
     })
 
-    for fname in os.listdir(label_dir):
-        if not fname.lower().endswith(".dcm"):
+
+def list_dicom_files(raw_root: str = RAW_ROOT) -> List[Tuple[str, str]]:
+    """(label_folder, fname) di tutti i DICOM, in ordine deterministico."""
+    files = []
+    for label_folder in sorted(os.listdir(raw_root)):
+        label_dir = os.path.join(raw_root, label_folder)
+        if not os.path.isdir(label_dir):
             continue
+        for fname in sorted(os.listdir(label_dir)):
+            if fname.lower().endswith(".dcm"):
+                files.append((label_folder, fname))
+    return files
+
 
-        fpath = os.path.join(label_dir, fname)
+def process_dicom(raw_root: str, label_folder: str, fname: str, images_dir: str = IMAGES_DIR) -> Dict:
+    """
+    Processa un singolo DICOM (eseguito nei worker del pool).
+    Ritorna {"docs": [...], "label_row": {...}} oppure {"error": "..."}.
+    """
+    fpath = os.path.join(raw_root, label_folder, fname)
+    lm = label_info(label_folder)
+    try:
         ds = pydicom.dcmread(fpath)
-        
+
         # ANONYMIZE: remove patient-identifiable data
         ds = anonymize_dicom_metadata(ds)
 
         case_id = make_case_id(ds, fpath)
-        view = safe_get(ds, "ViewName", None) or safe_get(ds, "View", None) or safe_get(ds, "SeriesDescription",                                                                     None) or "Unknown"
+        view = safe_get(ds, "ViewName", None) or safe_get(ds, "View", None) or safe_get(ds, "SeriesDescription", None) or "Unknown"
         stage = safe_get(ds, "StageName", None) or safe_get(ds, "ProtocolName", None) or "Unknown"
 
-
-
         meta = {
             "case_id": case_id,
             "anonymized": True,  # Flag indicating data has been anonymized
@@ -235,45 +335,257 @@ for label_folder in sorted(os.listdir(RAW_ROOT)):
             "columns": safe_get(ds, "Columns", None),
             "photometric": safe_get(ds, "PhotometricInterpretation", None),
         }
-        feat = compute_simple_video_features(ds)
+        # pixel decodificati una volta sola, solo per i frame usati
+        feat, frames = extract_features_and_frames(ds, case_id, n=FRAMES_PER_CASE, images_dir=images_dir)
         meta.update(feat)
 
-        meta = {k: v for k, v in meta.items() if v is not None}
+        # valori pydicom (IS/DS/PersonName...) -> tipi JSON nel processo worker
+        meta = json.loads(json.dumps({k: v for k, v in meta.items() if v is not None}, default=str))
 
         # 1) index case-card (neutral)
-        case_doc = {
+        docs = [{
             "content": build_case_card(meta),
             "metadata": {**meta, "document_type": "case_card"}
-        }
-        with open(JSONL_PATH, "a", encoding="utf-8") as f:
-            f.write(json.dumps(case_doc, ensure_ascii=False) + "\n")
+        }]
 
         # 2) frames (optional)
-        frames = export_representative_frames(ds, case_id, n=10)
         for fr in frames:
-            fr_doc = {
+            docs.append({
                 "content": f"Representative ultrasound frame from cine loop. View: {meta['view']}, Stage: {meta['stage']}.",
                 "metadata": {**meta, **fr, "document_type": "frame"}
-            }
-            with open(JSONL_PATH, "a", encoding="utf-8") as f:
-                f.write(json.dumps(fr_doc, ensure_ascii=False) + "\n")
+            })
+        # entry del frame manifest (path, dimensioni, size) per il lato query
+        frame_entries = [frame_entry(fr["image_path"], images_dir, fr["frame_index"]) for fr in frames]
+    except Exception as e:
+        return {"file": f"{label_folder}/{fname}", "error": f"{type(e).__name__}: {e}"}
+
+    # 3) labels.csv for validation/split
+    label_row = {
+        "case_id": case_id,
+        "label_raw": label_folder,
+        "label_short": lm["short"],
+        "label_pretty": lm["pretty"],
+        "group": lm["group"],
+        "file": f"{label_folder}/{fname}"
+    }
+    return {
+        "file": label_row["file"],
+        "docs": docs,
+        "label_row": label_row,
+        "frames": frame_entries,
+        "sha256": file_sha256(fpath),
+    }
 
-        # 3) labels.csv for validation/split
-        labels_rows.append({
-            "case_id": case_id,
-            "label_raw": label_folder,
-            "label_short": lm["short"],
-            "label_pretty": lm["pretty"],
-            "group": lm["group"],
-            "file": f"{label_folder}/{fname}"
-        })
-
-with open(LABELS_CSV, "w", newline="", encoding="utf-8") as cf:
-    w = csv.DictWriter(cf, fieldnames=["case_id", "label_raw", "label_short", "label_pretty", "group", "file"])
-    w.writeheader()
-    w.writerows(labels_rows)
-
-print("Build complete!")
-print("JSONL:", JSONL_PATH)
-print("Labels:", LABELS_CSV)
-print("Images dir:", IMAGES_DIR)
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_build_manifest(out_dir: str) -> Optional[Dict]:
+    """
+    Manifest della build precedente, solo se ancora coerente con
+    documents.jsonl (stessa versione, stesso file su disco).
+    """
+    try:
+        with open(os.path.join(out_dir, BUILD_MANIFEST), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        st = os.stat(os.path.join(out_dir, "documents.jsonl"))
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != BUILD_MANIFEST_VERSION or manifest.get("frames_per_case") != FRAMES_PER_CASE:
+        return None
+    if manifest.get("documents") != {"size": st.st_size, "mtime_ns": st.st_mtime_ns}:
+        print("[BuildDataset] documents.jsonl changed outside the build, ignoring manifest")
+        return None
+    return manifest
+
+
+def _is_unchanged(entry: Optional[Dict], path: str, st: os.stat_result, images_dir: str) -> bool:
+    if entry is None or entry.get("size") != st.st_size:
+        return False
+    if entry.get("n_docs", 0) > 1 and not os.path.isdir(os.path.join(images_dir, entry["case_id"])):
+        return False  # PNG cancellati a mano: va rigenerato
+    if entry.get("mtime_ns") == st.st_mtime_ns:
+        return True
+    # stessa size ma mtime diverso (es. copia/touch): decide il contenuto
+    return file_sha256(path) == entry.get("sha256")
+
+
+def _process_task(task: Tuple[str, str, str, str]) -> Dict:
+    return process_dicom(*task)
+
+
+def _write_atomic_json(path: str, obj: Dict):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def build_dataset(
+    raw_root: str = RAW_ROOT,
+    out_dir: str = OUT_DIR,
+    workers: Optional[int] = None,
+    full: bool = False,
+) -> Dict:
+    """
+    Costruisce il dataset da `raw_root` in `out_dir`, riusando gli artefatti
+    dei DICOM invariati (a meno di `full`). Ritorna un riepilogo con numero
+    di casi/documenti, file riusati/processati ed errori per file.
+    """
+    workers = workers or BUILD_WORKERS
+    jsonl_path = os.path.join(out_dir, "documents.jsonl")
+    labels_path = os.path.join(out_dir, "labels.csv")
+    images_dir = os.path.join(out_dir, "images")
+    os.makedirs(images_dir, exist_ok=True)
+
+    print("RAW_ROOT:", raw_root)
+    print("OUT_DIR:", out_dir)
+    print("\n[ANONYMIZATION] Removing sensitive patient data from DICOM metadata...\n")
+
+    t0 = time.perf_counter()
+    prev = None if full else load_build_manifest(out_dir)
+    prev_files = prev["files"] if prev else {}
+
+    # piano: per ogni DICOM (in ordine) riuso dell'entry precedente oppure task
+    plan = []
+    tasks = []
+    for label, fname in list_dicom_files(raw_root):
+        rel = f"{label}/{fname}"
+        path = os.path.join(raw_root, label, fname)
+        st = os.stat(path)
+        entry = prev_files.get(rel)
+        if _is_unchanged(entry, path, st, images_dir):
+            plan.append((rel, {**entry, "mtime_ns": st.st_mtime_ns}))
+        else:
+            if entry is not None:
+                # frame del caso modificato rigenerati da zero
+                shutil.rmtree(os.path.join(images_dir, entry["case_id"]), ignore_errors=True)
+            plan.append((rel, None))
+            tasks.append((raw_root, label, fname, images_dir))
+    print(f"[BuildDataset] {len(plan) - len(tasks)} unchanged, {len(tasks)} to process")
+
+    tmp_labels = labels_path + ".tmp"
+    new_files: Dict[str, Dict] = {}
+    errors = []
+    n_docs = 0
+    reuse = prev is not None and len(tasks) < len(plan)
+    old_jsonl = open(jsonl_path, "rb") if reuse else None
+    # chiavi dei documenti riusati dal vecchio indice: niente re-parse delle righe
+    old_entries = load_index_entries(jsonl_path) if reuse else None
+    known_keys = {offset: key for key, offset, _ in old_entries or []}
+    writer = DatasetWriter(jsonl_path)
+    try:
+        if workers > 1 and len(tasks) > 1:
+            executor = ProcessPoolExecutor(max_workers=min(workers, len(tasks)))
+            results = executor.map(_process_task, tasks)
+        else:
+            executor = None
+            results = map(_process_task, tasks)
+        try:
+            # map() restituisce i risultati nell'ordine dei task
+            for rel, entry in plan:
+                offset = writer.tell()
+                if entry is not None:
+                    writer.copy_range(old_jsonl, entry["offset"], entry["length"], known_keys)
+                    new_files[rel] = {**entry, "offset": offset}
+                    n_docs += entry["n_docs"]
+                    continue
+
+                res = next(results)
+                if "error" in res:
+                    print(f"[BuildDataset] ERROR {res['file']}: {res['error']} (skipped)")
+                    errors.append({"file": res["file"], "error": res["error"]})
+                    continue
+                for doc in res["docs"]:
+                    writer.write(doc)
+                st = os.stat(os.path.join(raw_root, rel))
+                new_files[rel] = {
+                    "size": st.st_size,
+                    "mtime_ns": st.st_mtime_ns,
+                    "sha256": res["sha256"],
+                    "case_id": res["label_row"]["case_id"],
+                    "offset": offset,
+                    "length": writer.tell() - offset,
+                    "n_docs": len(res["docs"]),
+                    "label_row": res["label_row"],
+                    "frames": res["frames"],
+                }
+                n_docs += len(res["docs"])
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        with open(tmp_labels, "w", newline="", encoding="utf-8") as cf:
+            w = csv.DictWriter(cf, fieldnames=LABEL_FIELDS)
+            w.writeheader()
+            w.writerows(e["label_row"] for e in new_files.values())
+
+        writer.commit()
+        os.replace(tmp_labels, labels_path)
+    finally:
+        writer.abort()
+        if old_jsonl is not None:
+            old_jsonl.close()
+        if os.path.exists(tmp_labels):
+            os.remove(tmp_labels)
+
+    st = os.stat(jsonl_path)
+    _write_atomic_json(os.path.join(out_dir, BUILD_MANIFEST), {
+        "version": BUILD_MANIFEST_VERSION,
+        "frames_per_case": FRAMES_PER_CASE,
+        "documents": {"size": st.st_size, "mtime_ns": st.st_mtime_ns},
+        "files": new_files,
+    })
+    write_frame_manifest(out_dir, {e["case_id"]: e["frames"] for e in new_files.values()})
+
+    # PNG dei casi non piu' presenti (DICOM rimossi o con case_id cambiato)
+    live_cases = {e["case_id"] for e in new_files.values()}
+    removed = 0
+    for name in os.listdir(images_dir):
+        if name not in live_cases and os.path.isdir(os.path.join(images_dir, name)):
+            shutil.rmtree(os.path.join(images_dir, name), ignore_errors=True)
+            removed += 1
+
+    summary = {
+        "files": len(plan),
+        "cases": len(new_files),
+        "documents": n_docs,
+        "reused": len(plan) - len(tasks),
+        "processed": len(tasks),
+        "removed_cases": removed,
+        "errors": errors,
+        "workers": workers,
+        "seconds": round(time.perf_counter() - t0, 2),
+    }
+    print("Build complete!")
+    print("JSONL:", jsonl_path)
+    print("Labels:", labels_path)
+    print("Images dir:", images_dir)
+    print(
+        f"[BuildDataset] {summary['cases']}/{summary['files']} files ({summary['reused']} reused, "
+        f"{summary['processed']} processed, {removed} removed), {n_docs} documents, "
+        f"{len(errors)} errors, {workers} workers, {summary['seconds']}s"
+    )
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build documents.jsonl/labels.csv from raw DICOM files")
+    parser.add_argument("--raw-root", default=RAW_ROOT)
+    parser.add_argument("--out-dir", default=OUT_DIR)
+    parser.add_argument("--workers", type=int, default=None, help=f"Process pool size (default {BUILD_WORKERS})")
+    parser.add_argument("--full", action="store_true", help="Ignore the build manifest and reprocess every DICOM")
+    args = parser.parse_args()
+
+    summary = build_dataset(args.raw_root, args.out_dir, workers=args.workers, full=args.full)
+    if summary["files"] and not summary["cases"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Dataset Writer - scrittura bufferizzata e atomica di documents.jsonl + indice di offset.
+
+Un solo handle bufferizzato per tutta la build (nessun open/close per record)
+su un file temporaneo accanto a quello finale. commit() fa flush + fsync e
+lo rinomina con os.replace: chi legge vede sempre o il file vecchio o quello
+nuovo completo, mai uno a meta'. Se la build fallisce il temporaneo viene
+rimosso (abort()).
+
+Per ogni documento viene registrato l'intervallo di byte in un indice
+(<file>.idx.json), cosi' gli stadi successivi possono fare seek diretto
+a un documento senza rileggere tutto il JSONL:
+
+    index = load_index(jsonl_path)
+    doc = read_document(jsonl_path, *index["abc123:frame:4"])
+"""
+import os
+import json
+from typing import Callable, Dict, List, Optional, Tuple
+
+from scripts.incremental_index import case_doc_key
+
+INDEX_SUFFIX = ".idx.json"
+DEFAULT_BUFFER_SIZE = 1 << 20
+
+KeyFn = Callable[[Dict], str]
+
+
+def index_path_for(jsonl_path: str) -> str:
+    return jsonl_path + INDEX_SUFFIX
+
+
+def document_key(doc: Dict) -> str:
+    """Chiave di indice per i documenti di documents.jsonl (case_card / frame)."""
+    return case_doc_key(doc.get("metadata", {}))
+
+
+class DatasetWriter:
+    """
+    Writer JSONL atomico. Uso:
+
+        with DatasetWriter(path) as w:
+            w.write(doc)
+        # commit automatico all'uscita senza eccezioni, abort altrimenti
+    """
+
+    def __init__(self, path: str, key_fn: Optional[KeyFn] = document_key, buffer_size: int = DEFAULT_BUFFER_SIZE):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.key_fn = key_fn
+        self.entries: List[Tuple[str, int, int]] = []
+        self._f = open(self.tmp_path, "wb", buffering=buffer_size)
+        self._closed = False
+
+    def __enter__(self) -> "DatasetWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+        return False
+
+    def tell(self) -> int:
+        return self._f.tell()
+
+    def write(self, doc: Dict, key: Optional[str] = None) -> int:
+        """Scrive un documento; ritorna il suo offset."""
+        data = (json.dumps(doc, ensure_ascii=False) + "\n").encode("utf-8")
+        offset = self._f.tell()
+        self._f.write(data)
+        if key is None and self.key_fn is not None:
+            key = self.key_fn(doc)
+        self.entries.append((key, offset, len(data)))
+        return offset
+
+    def copy_range(self, src, offset: int, length: int, known_keys: Optional[Dict[int, str]] = None) -> int:
+        """
+        Copia `length` byte di righe JSONL gia' serializzate da `src` (file
+        binario aperto, es. il documents.jsonl della build precedente).
+        `known_keys` ({offset nel sorgente: key}, dal vecchio indice) evita di
+        ri-parsare le righe per ricostruire l'indice. Ritorna il nuovo offset.
+        """
+        src.seek(offset)
+        data = src.read(length)
+        new_offset = self._f.tell()
+        self._f.write(data)
+        src_pos, pos = offset, new_offset
+        for line in data.splitlines(keepends=True):
+            key = (known_keys or {}).get(src_pos)
+            if key is None and self.key_fn is not None:
+                key = self.key_fn(json.loads(line))
+            self.entries.append((key, pos, len(line)))
+            src_pos += len(line)
+            pos += len(line)
+        return new_offset
+
+    def commit(self):
+        if self._closed:
+            return
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._f.close()
+        self._closed = True
+        st = os.stat(self.tmp_path)
+        os.replace(self.tmp_path, self.path)
+        _write_index(self.path, self.entries, st)
+
+    def abort(self):
+        if self._closed:
+            return
+        self._f.close()
+        self._closed = True
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def _write_index(jsonl_path: str, entries: List[Tuple[str, int, int]], st: os.stat_result):
+    path = index_path_for(jsonl_path)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(
+            {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "docs": entries},
+            f,
+            ensure_ascii=False,
+        )
+    os.replace(tmp, path)
+
+
+def load_index_entries(jsonl_path: str) -> Optional[List[Tuple[str, int, int]]]:
+    """(key, offset, length) per documento, solo se l'indice corrisponde al file."""
+    try:
+        with open(index_path_for(jsonl_path), "r", encoding="utf-8") as f:
+            index = json.load(f)
+        st = os.stat(jsonl_path)
+    except (OSError, ValueError):
+        return None
+    if index.get("size") != st.st_size or index.get("mtime_ns") != st.st_mtime_ns:
+        return None
+    return [tuple(e) for e in index["docs"]]
+
+
+def load_index(jsonl_path: str) -> Optional[Dict[str, Tuple[int, int]]]:
+    """{key: (offset, length)} per seek diretto; None se l'indice manca o e' stale."""
+    entries = load_index_entries(jsonl_path)
+    if entries is None:
+        return None
+    return {key: (offset, length) for key, offset, length in entries if key is not None}
+
+
+def read_document(jsonl_path: str, offset: int, length: int) -> Dict:
+    with open(jsonl_path, "rb") as f:
+        f.seek(offset)
+        return json.loads(f.read(length))
@@ -0,0 +1,94 @@
+"""
+DICOM Frames - accesso ai singoli frame di un cine loop senza decodificarlo tutto.
+
+`ds.pixel_array` decomprime l'intero loop (centinaia di frame) anche quando
+ne servono pochi. FrameReader decodifica solo gli indici richiesti:
+con pydicom >= 3 usa `pydicom.pixels.pixel_array(ds, index=i)`, che per le
+transfer syntax encapsulated (JPEG, RLE, ...) estrae e decodifica il solo
+fragment del frame e per quelle native legge solo i suoi byte.
+
+I frame decodificati restano in una piccola cache LRU, cosi' stadi diversi
+della stessa build (feature, export PNG) condividono la stessa decodifica.
+Il risultato e' identico a `ds.pixel_array[i]` (stessa conversione colore).
+"""
+from collections import OrderedDict
+from typing import Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+
+try:
+    from pydicom.pixels import iter_pixels as _iter_pixels, pixel_array as _pixel_array  # pydicom >= 3
+except ImportError:  # pydicom 2.x: nessuna decodifica per frame
+    _iter_pixels = _pixel_array = None
+
+DEFAULT_CACHE_FRAMES = 16
+
+
+class FrameReader:
+    """Decodifica lazy e per indice dei frame di un dataset pydicom."""
+
+    def __init__(self, ds, cache_frames: int = DEFAULT_CACHE_FRAMES):
+        self.ds = ds
+        self.num_frames = int(getattr(ds, "NumberOfFrames", 1) or 1)
+        self.cache_frames = max(1, cache_frames)
+        self._cache: "OrderedDict[int, np.ndarray]" = OrderedDict()
+        self._full: Optional[np.ndarray] = None
+        # frame effettivamente decodificati (le hit in cache non contano)
+        self.decoded = 0
+
+    def frame(self, index: int) -> np.ndarray:
+        """Frame `index` come array (rows, cols[, samples])."""
+        if not 0 <= index < self.num_frames:
+            raise IndexError(f"Frame {index} out of range (0..{self.num_frames - 1})")
+        cached = self._cache.get(index)
+        if cached is not None:
+            self._cache.move_to_end(index)
+            return cached
+
+        arr = self._decode(index)
+        self.decoded += 1
+        self._put(index, arr)
+        return arr
+
+    def frames(self, indices: Iterable[int]) -> Iterator[Tuple[int, np.ndarray]]:
+        """
+        (indice, frame) per gli indici richiesti, nell'ordine dato.
+        I frame non in cache sono decodificati in streaming con un solo
+        iteratore pydicom (meno overhead di una chiamata per frame); in
+        memoria resta un frame alla volta, oltre alla cache.
+        """
+        indices = [int(i) for i in indices]
+        for i in indices:
+            if not 0 <= i < self.num_frames:
+                raise IndexError(f"Frame {i} out of range (0..{self.num_frames - 1})")
+        if _iter_pixels is None or self.num_frames <= 1:
+            for i in indices:
+                yield i, self.frame(i)
+            return
+
+        hits = {i: self._cache[i] for i in indices if i in self._cache}
+        missing = [i for i in indices if i not in hits]
+        decoded = _iter_pixels(self.ds, indices=missing) if missing else iter(())
+        for i in indices:
+            if i in hits:
+                if i in self._cache:
+                    self._cache.move_to_end(i)
+                yield i, hits[i]
+                continue
+            arr = next(decoded)
+            self.decoded += 1
+            self._put(i, arr)
+            yield i, arr
+
+    def _put(self, index: int, arr: np.ndarray):
+        self._cache[index] = arr
+        if len(self._cache) > self.cache_frames:
+            self._cache.popitem(last=False)
+
+    def _decode(self, index: int) -> np.ndarray:
+        if _pixel_array is not None:
+            return _pixel_array(self.ds, index=index if self.num_frames > 1 else None)
+        # fallback pydicom 2.x: decodifica completa, una sola volta
+        if self._full is None:
+            self._full = self.ds.pixel_array
+        return self._full[index] if self.num_frames > 1 else self._full
@@ -1,10 +1,15 @@
 import os
+import sys
 import argparse
 import numpy as np
 import pydicom
 from pydicom.pixel_data_handlers.util import convert_color_space
 from PIL import Image
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.dicom_frames import FrameReader
+
 
 def ensure_dir(path: str):
     os.makedirs(path, exist_ok=True)
@@ -50,10 +55,11 @@ def save_frame(frame, out_path: str):
 
 def extract_frames(dicom_path: str, out_dir: str, n_frames: int = 12):
     ds = pydicom.dcmread(dicom_path)
-    arr = ds.pixel_array  # triggers decompression if needed
+    # decodifica solo i frame campionati, uno alla volta
+    reader = FrameReader(ds, cache_frames=1)
 
     # Determine frames
-    num_frames = int(getattr(ds, "NumberOfFrames", 1))
+    num_frames = reader.num_frames
     if num_frames <= 1:
         # single frame case
         idxs = [0]
@@ -63,8 +69,7 @@ def extract_frames(dicom_path: str, out_dir: str, n_frames: int = 12):
     ensure_dir(out_dir)
 
     saved_paths = []
-    for out_i, idx in enumerate(idxs, start=1):
-        frame = arr[idx] if arr.ndim >= 3 else arr  # multiframe vs single
+    for out_i, (idx, frame) in enumerate(reader.frames(idxs), start=1):
         frame = to_rgb_if_needed(ds, frame)
         out_path = os.path.join(out_dir, f"frame_{out_i:02d}.png")
         save_frame(frame, out_path)
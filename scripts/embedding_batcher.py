@@ -0,0 +1,123 @@
+"""
+Embedding Batcher - raggruppa query concorrenti in un'unica chiamata encode().
+
+Ogni richiesta fa submit() del proprio testo e riceve un Future. Un thread
+dedicato raccoglie i testi in coda per al massimo `max_wait_ms` (o finche'
+il batch arriva a `max_batch`), esegue un solo encode() sul gruppo e
+restituisce a ciascun chiamante il proprio vettore.
+"""
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+Vector = List[float]
+EncodeFn = Callable[[List[str]], "list"]
+
+_STOP = object()
+
+
+class EmbeddingBatcher:
+    """Scheduler a micro-batch attorno a un encode_fn(texts) -> matrice (N x D)."""
+
+    def __init__(
+        self,
+        encode_fn: EncodeFn,
+        max_batch: int = 32,
+        max_wait_ms: float = 5.0,
+    ):
+        self.encode_fn = encode_fn
+        self.max_batch = max(1, max_batch)
+        self.max_wait_s = max(0.0, max_wait_ms) / 1000.0
+        self._queue: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.errors = 0
+        self.max_batch_seen = 0
+        self.batch_size_counts: Dict[int, int] = {}
+        self.encode_seconds = 0.0
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    # -----------------------------
+    # API
+    # -----------------------------
+    def submit(self, text: str) -> Future:
+        fut: Future = Future()
+        self._queue.put((text, fut))
+        return fut
+
+    def embed(self, text: str, timeout: Optional[float] = None) -> Vector:
+        return self.submit(text).result(timeout=timeout)
+
+    def close(self):
+        self._queue.put(_STOP)
+        self._thread.join(timeout=5)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "batches": self.batches,
+                "items": self.items,
+                "errors": self.errors,
+                "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+                "max_batch_size": self.max_batch_seen,
+                "batch_size_counts": dict(sorted(self.batch_size_counts.items())),
+                "avg_encode_ms": 1000.0 * self.encode_seconds / self.batches if self.batches else 0.0,
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait_s * 1000.0,
+            }
+
+    # -----------------------------
+    # Worker
+    # -----------------------------
+    def _collect(self, first) -> List:
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait_s
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch = self._collect(first)
+            # i chiamanti che hanno gia' rinunciato (cancel) non entrano nel batch
+            batch = [(t, f) for t, f in batch if f.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            t0 = time.perf_counter()
+            try:
+                vectors = self.encode_fn([t for t, _ in batch])
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            elapsed = time.perf_counter() - t0
+
+            for (_, fut), vec in zip(batch, vectors):
+                fut.set_result(vec.tolist() if hasattr(vec, "tolist") else list(vec))
+
+            n = len(batch)
+            with self._lock:
+                self.batches += 1
+                self.items += n
+                self.encode_seconds += elapsed
+                self.max_batch_seen = max(self.max_batch_seen, n)
+                self.batch_size_counts[n] = self.batch_size_counts.get(n, 0) + 1
@@ -0,0 +1,142 @@
+"""
+Query Embedding Cache - cache a due livelli per gli embedding delle query.
+
+- L1: LRU in-process (OrderedDict) con limite di dimensione e TTL
+- L2: opzionale, SQLite su disco condiviso tra i worker (WAL)
+
+Chiave: (model_id, testo normalizzato). Il tier su disco registra il model_id
+con cui e' stato popolato e si svuota da solo se il modello cambia.
+"""
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from scripts.sqlite_kv import SqliteKV
+
+Vector = List[float]
+
+
+def normalize_query(text: str) -> str:
+    """Collassa whitespace: query che differiscono solo per spazi condividono l'entry."""
+    return " ".join(text.split())
+
+
+def cache_key(model_id: str, text: str) -> str:
+    return hashlib.sha256(f"{model_id}\0{normalize_query(text)}".encode("utf-8")).hexdigest()
+
+
+def _encode_vector(vector: Vector) -> bytes:
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def _decode_vector(blob: bytes) -> Vector:
+    return np.frombuffer(blob, dtype=np.float32).tolist()
+
+
+class QueryEmbeddingCache:
+    """Cache LRU+TTL in memoria con tier opzionale su disco e contatori hit/miss."""
+
+    def __init__(
+        self,
+        model_id: str,
+        max_entries: int = 1024,
+        ttl_s: float = 3600.0,
+        disk_path: Optional[str] = None,
+        disk_max_entries: int = 100_000,
+    ):
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._mem: "OrderedDict[str, tuple]" = OrderedDict()
+        # namespace = model_id: con un modello diverso gli embedding su disco vengono scartati
+        self._disk = SqliteKV(
+            disk_path,
+            "embeddings",
+            encode=_encode_vector,
+            decode=_decode_vector,
+            ttl_s=ttl_s,
+            max_entries=disk_max_entries,
+            namespace=model_id,
+        ) if disk_path else None
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+    def _mem_get(self, key: str) -> Optional[Vector]:
+        with self._lock:
+            item = self._mem.get(key)
+            if item is None:
+                return None
+            vector, expires = item
+            if self.ttl_s and time.monotonic() > expires:
+                del self._mem[key]
+                return None
+            self._mem.move_to_end(key)
+            return vector
+
+    def _mem_put(self, key: str, vector: Vector):
+        with self._lock:
+            self._mem[key] = (vector, time.monotonic() + self.ttl_s)
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_entries:
+                self._mem.popitem(last=False)
+
+    def get(self, text: str) -> Optional[Vector]:
+        key = cache_key(self.model_id, text)
+        vector = self._mem_get(key)
+        if vector is not None:
+            self.hits_memory += 1
+            return vector
+        if self._disk is not None:
+            try:
+                vector = self._disk.get(key)
+            except sqlite3.Error as e:
+                print(f"[EmbeddingCache] WARNING: disk tier read failed: {e}")
+                vector = None
+            if vector is not None:
+                self.hits_disk += 1
+                self._mem_put(key, vector)
+                return vector
+        self.misses += 1
+        return None
+
+    def put(self, text: str, vector: Vector):
+        key = cache_key(self.model_id, text)
+        self._mem_put(key, vector)
+        if self._disk is not None:
+            try:
+                self._disk.put(key, vector)
+            except sqlite3.Error as e:
+                print(f"[EmbeddingCache] WARNING: disk tier write failed: {e}")
+
+    def get_or_compute(self, text: str, compute: Callable[[str], Vector]) -> Vector:
+        vector = self.get(text)
+        if vector is None:
+            vector = compute(normalize_query(text))
+            self.put(text, vector)
+        return vector
+
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+        if self._disk is not None:
+            self._disk.clear()
+
+    def stats(self) -> Dict:
+        lookups = self.hits_memory + self.hits_disk + self.misses
+        return {
+            "model_id": self.model_id,
+            "size": len(self._mem),
+            "max_entries": self.max_entries,
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "hit_rate": (self.hits_memory + self.hits_disk) / lookups if lookups else 0.0,
+            "disk_enabled": self._disk is not None,
+        }
@@ -0,0 +1,189 @@
+"""
+Parity + throughput: backend ONNX (int8) vs SentenceTransformer (torch).
+
+- cosine agreement: coseno tra il vettore torch e quello ONNX dello stesso testo
+- Hit@k: la query embeddata con ONNX, cercata sul corpus embeddato con torch
+  (cioe' le collection esistenti), ritrova il top-1 di torch entro i primi k?
+- overlap@k: frazione dei top-k torch presenti nei top-k ONNX
+- throughput: documenti/s in indicizzazione e latenza di una singola query
+
+Uso:
+    python scripts/eval_onnx_parity.py [--limit 500] [--json out.json] [--min-cosine 0.99]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from typing import Callable, Dict, List, Sequence
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+K_LIST = [1, 3, 5, 10]
+
+# query cliniche "libere", oltre ai testi delle case card
+SAMPLE_QUERIES = [
+    "normal left ventricular function",
+    "dilated cardiomyopathy with reduced ejection fraction",
+    "inferoapical akinesia after myocardial infarction",
+    "septal hypertrophy in apical four chamber view",
+    "stress echocardiography wall motion abnormality",
+]
+
+
+def cosine_agreement(a: np.ndarray, b: np.ndarray) -> Dict[str, float]:
+    """Statistiche del coseno riga per riga tra due matrici di embedding."""
+    a = a / np.clip(np.linalg.norm(a, axis=1, keepdims=True), 1e-12, None)
+    b = b / np.clip(np.linalg.norm(b, axis=1, keepdims=True), 1e-12, None)
+    cos = (a * b).sum(axis=1)
+    return {
+        "mean": float(cos.mean()),
+        "min": float(cos.min()),
+        "p05": float(np.percentile(cos, 5)),
+    }
+
+
+def top_k(queries: np.ndarray, corpus: np.ndarray, k: int) -> np.ndarray:
+    """Indici dei k documenti piu' simili (prodotto scalare su vettori normalizzati)."""
+    scores = queries @ corpus.T
+    k = min(k, corpus.shape[0])
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(scores, idx, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(idx, order, axis=1)
+
+
+def retrieval_agreement(
+    ref_queries: np.ndarray,
+    test_queries: np.ndarray,
+    ref_corpus: np.ndarray,
+    k_list: Sequence[int] = K_LIST,
+) -> Dict[str, float]:
+    """Hit@k e overlap@k del backend in test rispetto a quello di riferimento."""
+    kmax = max(k_list)
+    ref = top_k(ref_queries, ref_corpus, kmax)
+    test = top_k(test_queries, ref_corpus, kmax)
+    out = {}
+    for k in k_list:
+        hits = [ref[i, 0] in test[i, :k] for i in range(len(ref))]
+        overlap = [len(set(ref[i, :k]) & set(test[i, :k])) / min(k, ref.shape[1]) for i in range(len(ref))]
+        out[f"hit@{k}"] = float(np.mean(hits))
+        out[f"overlap@{k}"] = float(np.mean(overlap))
+    return out
+
+
+def measure_throughput(encode: Callable[[List[str]], np.ndarray], texts: List[str], queries: List[str]) -> Dict[str, float]:
+    """docs/s su tutto il corpus + latenza p50/p95 (ms) di query singole."""
+    encode(texts[:8])  # warmup
+    t0 = time.perf_counter()
+    encode(texts)
+    elapsed = time.perf_counter() - t0
+
+    latencies = []
+    for q in queries:
+        t1 = time.perf_counter()
+        encode([q])
+        latencies.append((time.perf_counter() - t1) * 1000.0)
+    return {
+        "docs_per_second": len(texts) / elapsed if elapsed else 0.0,
+        "query_p50_ms": float(np.percentile(latencies, 50)),
+        "query_p95_ms": float(np.percentile(latencies, 95)),
+    }
+
+
+def load_corpus(limit: int) -> List[str]:
+    """Testi indicizzati (case card, frame, chunk delle linee guida)."""
+    import scripts.index_Qdrant as index_qdrant
+
+    texts = []
+    sources = []
+    if os.path.exists(index_qdrant.JSONL_PATH):
+        sources.append(index_qdrant._iter_case_docs())
+    sources.append(index_qdrant._iter_guideline_docs())
+    for it in sources:
+        for _, text, _ in it:
+            texts.append(text)
+            if limit and len(texts) >= limit:
+                return texts
+    return texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ONNX vs torch embedding parity and throughput")
+    parser.add_argument("--limit", type=int, default=0, help="Max corpus documents (0 = all)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--fp32", action="store_true", help="Compare the non-quantized ONNX model")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--min-cosine", type=float, default=0.99, help="Fail if mean cosine is below")
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+    import scripts.index_Qdrant as index_qdrant
+    from scripts.onnx_embedder import CONFIG_FILE, OnnxEmbedder, export_onnx
+
+    corpus = load_corpus(args.limit)
+    if not corpus:
+        print("[ONNXParity] ERROR: empty corpus (build the dataset first)")
+        sys.exit(1)
+    queries = SAMPLE_QUERIES + corpus[: min(len(corpus), 50)]
+
+    model_dir = index_qdrant.ONNX_MODEL_DIR
+    if not os.path.exists(os.path.join(model_dir, CONFIG_FILE)):
+        export_onnx(index_qdrant.EMB_MODEL, model_dir, quantize=True)
+
+    torch_model = SentenceTransformer(index_qdrant.EMB_MODEL, device="cpu")
+    onnx_model = OnnxEmbedder(model_dir, quantized=not args.fp32)
+
+    def torch_encode(texts):
+        return torch_model.encode(texts, normalize_embeddings=True, batch_size=args.batch_size)
+
+    def onnx_encode(texts):
+        return onnx_model.encode(texts, normalize_embeddings=True, batch_size=args.batch_size)
+
+    print(f"[ONNXParity] Corpus: {len(corpus)} documents, {len(queries)} queries")
+    torch_corpus = torch_encode(corpus)
+    onnx_corpus = onnx_encode(corpus)
+
+    results = {
+        "model": index_qdrant.EMB_MODEL,
+        "onnx_model": onnx_model.model_path,
+        "corpus_size": len(corpus),
+        "cosine": cosine_agreement(torch_corpus, onnx_corpus),
+        "retrieval": retrieval_agreement(torch_encode(queries), onnx_encode(queries), torch_corpus),
+        "throughput": {
+            "torch": measure_throughput(torch_encode, corpus, queries),
+            "onnx": measure_throughput(onnx_encode, corpus, queries),
+        },
+    }
+    t, o = results["throughput"]["torch"], results["throughput"]["onnx"]
+    results["throughput"]["speedup"] = o["docs_per_second"] / t["docs_per_second"] if t["docs_per_second"] else 0.0
+
+    print("\n=== Cosine agreement (torch vs onnx, same text) ===")
+    for name, value in results["cosine"].items():
+        print(f"{name:>5}: {value:.4f}")
+    print("\n=== Retrieval vs existing (torch) collection ===")
+    for k in K_LIST:
+        r = results["retrieval"]
+        print(f"Hit@{k}: {r[f'hit@{k}']:.4f} | overlap@{k}: {r[f'overlap@{k}']:.4f}")
+    print("\n=== Throughput ===")
+    for backend in ("torch", "onnx"):
+        th = results["throughput"][backend]
+        print(
+            f"{backend:>5}: {th['docs_per_second']:.1f} docs/s | "
+            f"query p50 {th['query_p50_ms']:.1f} ms, p95 {th['query_p95_ms']:.1f} ms"
+        )
+    print(f"speedup: {results['throughput']['speedup']:.2f}x")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n[ONNXParity] Results written to {args.json}")
+
+    if results["cosine"]["mean"] < args.min_cosine:
+        print(f"[ONNXParity] FAIL: mean cosine {results['cosine']['mean']:.4f} < {args.min_cosine}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
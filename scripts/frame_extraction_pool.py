@@ -0,0 +1,162 @@
+"""
+Frame Extraction Pool - estrazione frame DICOM in processi separati, con timeout e cancellazione.
+
+Decodifica pydicom ed encoding PNG sono CPU-bound: eseguiti nel processo
+dell'API bloccano l'event loop (e il GIL) per tutte le altre richieste.
+Qui ogni estrazione gira in un processo figlio:
+
+- concorrenza limitata a FRAME_EXTRACT_WORKERS processi alla volta
+  (le richieste in eccesso attendono uno slot);
+- timeout per job (FRAME_EXTRACT_TIMEOUT_S): allo scadere il figlio viene
+  terminato e si solleva FrameExtractionTimeout;
+- cancellazione: run_async() cancellato (es. shutdown) termina il figlio.
+
+Un ProcessPoolExecutor non permette di interrompere un singolo task in
+esecuzione, per questo ogni job ha il suo processo: con il metodo
+"forkserver" (moduli di decodifica precaricati) l'avvio costa una fork.
+"""
+import os
+import time
+import asyncio
+import threading
+import multiprocessing as mp
+from typing import Any, Callable, Optional
+
+from scripts.metrics import STAGE_SECONDS
+
+FRAME_EXTRACT_WORKERS = int(os.getenv("FRAME_EXTRACT_WORKERS", "0")) or min(2, os.cpu_count() or 1)
+FRAME_EXTRACT_TIMEOUT_S = float(os.getenv("FRAME_EXTRACT_TIMEOUT_S", "120"))
+
+_PRELOAD = ["numpy", "pydicom", "PIL.Image", "scripts.dicom_to_frames_current"]
+
+# attesa dello slot + estrazione nel figlio
+_EXTRACT_SECONDS = STAGE_SECONDS.labels("frame_extraction")
+
+
+class FrameExtractionTimeout(TimeoutError):
+    pass
+
+
+class FrameExtractionCancelled(Exception):
+    pass
+
+
+def _child(conn, target: Callable, args: tuple):
+    try:
+        conn.send(("ok", target(*args)))
+    except BaseException as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+class FrameExtractionPool:
+    """Esegue funzioni CPU-bound in processi figli, max `workers` alla volta."""
+
+    def __init__(self, workers: int = FRAME_EXTRACT_WORKERS, timeout_s: float = FRAME_EXTRACT_TIMEOUT_S):
+        self.workers = max(1, workers)
+        self.timeout_s = timeout_s
+        method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+        self._ctx = mp.get_context(method)
+        if method == "forkserver":
+            self._ctx.set_forkserver_preload(_PRELOAD)
+        self._slots = threading.BoundedSemaphore(self.workers)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.cancelled = 0
+
+    def run(
+        self,
+        target: Callable,
+        *args: Any,
+        timeout_s: Optional[float] = None,
+        cancel_event: Optional[threading.Event] = None,
+    ) -> Any:
+        """
+        Esegue target(*args) in un processo figlio e ne ritorna il risultato
+        (bloccante: da thread, non dall'event loop). Il timeout decorre
+        dall'avvio del figlio, non dall'attesa dello slot.
+        """
+        timeout_s = self.timeout_s if timeout_s is None else timeout_s
+        t0 = time.perf_counter()
+        with self._lock:
+            self.waiting += 1
+        try:
+            while not self._slots.acquire(timeout=0.1):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise FrameExtractionCancelled("cancelled while waiting for a worker")
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        try:
+            value = self._run_in_child(target, args, timeout_s, cancel_event)
+        finally:
+            self._slots.release()
+        _EXTRACT_SECONDS.observe(time.perf_counter() - t0)
+        return value
+
+    def _run_in_child(self, target, args, timeout_s, cancel_event):
+        parent_conn, child_conn = self._ctx.Pipe(duplex=False)
+        proc = self._ctx.Process(target=_child, args=(child_conn, target, args), daemon=True)
+        proc.start()
+        child_conn.close()
+        with self._lock:
+            self.active += 1
+        deadline = time.monotonic() + timeout_s if timeout_s else None
+        try:
+            while not parent_conn.poll(0.05):
+                if cancel_event is not None and cancel_event.is_set():
+                    self.cancelled += 1
+                    raise FrameExtractionCancelled("frame extraction cancelled")
+                if deadline is not None and time.monotonic() > deadline:
+                    self.timeouts += 1
+                    raise FrameExtractionTimeout(f"frame extraction exceeded {timeout_s:.0f}s")
+                if not proc.is_alive() and not parent_conn.poll():
+                    raise RuntimeError(f"frame extraction process died (exit code {proc.exitcode})")
+            status, value = parent_conn.recv()
+        finally:
+            if proc.is_alive():
+                proc.terminate()
+            proc.join(5)
+            parent_conn.close()
+            with self._lock:
+                self.active -= 1
+        if status == "error":
+            raise RuntimeError(value)
+        self.completed += 1
+        return value
+
+    async def run_async(self, target: Callable, *args: Any, timeout_s: Optional[float] = None) -> Any:
+        """Come run(), senza bloccare l'event loop; la cancellazione termina il figlio."""
+        cancel_event = threading.Event()
+        try:
+            return await asyncio.to_thread(self.run, target, *args, timeout_s=timeout_s, cancel_event=cancel_event)
+        except asyncio.CancelledError:
+            cancel_event.set()
+            raise
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "active": self.active,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "timeouts": self.timeouts,
+            "cancelled": self.cancelled,
+        }
+
+
+_pool: Optional[FrameExtractionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_frame_extraction_pool() -> FrameExtractionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = FrameExtractionPool()
+    return _pool
@@ -0,0 +1,115 @@
+"""
+Frame Manifest - elenco precalcolato dei frame PNG per caso (data/dataset_built/frame_manifest.json).
+
+Scritto da build_dataset a fine build:
+    {"version": 1, "images_dir": "images",
+     "cases": {case_id: [{"frame_index", "path", "width", "height", "bytes"}, ...]}}
+con i frame di ogni caso in ordine di frame_index e `path` relativo a images_dir.
+
+FrameManifest lo carica una volta in memoria: scegliere quali frame allegare
+al prompt non richiede listdir/sort sul filesystem. Il file viene ricaricato
+solo se cambia (size/mtime), controllato al massimo ogni `refresh_s` secondi.
+"""
+import os
+import json
+import time
+import threading
+from typing import Dict, List, Optional
+
+FRAME_MANIFEST = "frame_manifest.json"
+FRAME_MANIFEST_VERSION = 1
+
+
+def frame_entry(image_path: str, images_dir: str, frame_index: int) -> Dict:
+    """Entry del manifest per un PNG appena scritto (legge solo l'header)."""
+    from PIL import Image
+
+    with Image.open(image_path) as img:
+        width, height = img.size
+    return {
+        "frame_index": int(frame_index),
+        "path": os.path.relpath(image_path, images_dir).replace(os.sep, "/"),
+        "width": width,
+        "height": height,
+        "bytes": os.path.getsize(image_path),
+    }
+
+
+def write_frame_manifest(out_dir: str, cases: Dict[str, List[Dict]], images_dir: str = "images"):
+    path = os.path.join(out_dir, FRAME_MANIFEST)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "version": FRAME_MANIFEST_VERSION,
+                "images_dir": images_dir,
+                "cases": {
+                    cid: sorted(frames, key=lambda fr: fr["frame_index"])
+                    for cid, frames in sorted(cases.items())
+                },
+            },
+            f,
+            ensure_ascii=False,
+        )
+    os.replace(tmp, path)
+
+
+class FrameManifest:
+    """Vista in memoria del frame manifest, con refresh quando il file cambia."""
+
+    def __init__(self, path: str, refresh_s: float = 5.0):
+        self.path = path
+        self.refresh_s = refresh_s
+        self._lock = threading.Lock()
+        self._cases: Optional[Dict[str, List[Dict]]] = None
+        self._sig = None
+        self._checked_at = float("-inf")
+        self.loads = 0
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.refresh_s:
+            return
+        with self._lock:
+            if now - self._checked_at < self.refresh_s:
+                return
+            self._checked_at = now
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                self._cases, self._sig = None, None
+                return
+            sig = (st.st_size, st.st_mtime_ns)
+            if sig == self._sig:
+                return
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"[FrameManifest] WARNING: cannot load {self.path}: {e}")
+                return
+            if data.get("version") != FRAME_MANIFEST_VERSION:
+                print(f"[FrameManifest] WARNING: unsupported manifest version {data.get('version')}")
+                self._cases, self._sig = None, sig
+                return
+            root = os.path.join(os.path.dirname(os.path.abspath(self.path)), data.get("images_dir", "images"))
+            # path assoluti risolti una volta al caricamento
+            self._cases = {
+                cid: [{**fr, "abs_path": os.path.join(root, fr["path"])} for fr in frames]
+                for cid, frames in data.get("cases", {}).items()
+            }
+            self._sig = sig
+            self.loads += 1
+
+    @property
+    def available(self) -> bool:
+        self._maybe_reload()
+        return self._cases is not None
+
+    def frames(self, case_id: str) -> List[Dict]:
+        """Entry dei frame del caso (in ordine di frame_index); [] se il caso non e' nel manifest."""
+        self._maybe_reload()
+        return (self._cases or {}).get(case_id, [])
+
+    def frame_paths(self, case_id: str) -> List[str]:
+        return [fr["abs_path"] for fr in self.frames(case_id)]
@@ -0,0 +1,173 @@
+"""
+Image Payload Cache - data URL pronti per il prompt vision, ridimensionati e ricompressi.
+
+Ogni immagine (frame PNG a piena risoluzione) viene renderizzata una volta:
+lato lungo ridotto a `max_side`, ricodificata in JPEG/WebP con la qualita'
+configurata e convertita in data URL base64. Il risultato e' messo in cache:
+
+- L1: LRU in-process limitata in byte (non in numero di entry)
+- L2: opzionale, SQLite su disco condiviso tra i worker (WAL)
+
+Chiave: (path assoluto, mtime_ns, size, impostazioni di rendering). Un file
+modificato o un cambio di impostazioni producono una chiave nuova; le entry
+vecchie escono per LRU. fmt="original" ripristina il comportamento precedente
+(file inviato cosi' com'e').
+"""
+import io
+import os
+import base64
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from scripts.sqlite_kv import SqliteKV
+
+_MIME = {"jpeg": "image/jpeg", "webp": "image/webp", "png": "image/png"}
+
+
+@dataclass(frozen=True)
+class RenderSettings:
+    fmt: str = "jpeg"  # jpeg | webp | png | original
+    max_side: int = 768
+    quality: int = 80
+
+    def __post_init__(self):
+        if self.fmt not in ("jpeg", "webp", "png", "original"):
+            raise ValueError(f"Unsupported image payload format: {self.fmt}")
+
+    def key(self) -> str:
+        return f"{self.fmt}:{self.max_side}:{self.quality}"
+
+
+def _encode_original(path: str) -> str:
+    with open(path, "rb") as f:
+        b = f.read()
+    mime = "image/png" if path.lower().endswith(".png") else "image/jpeg"
+    return f"data:{mime};base64,{base64.b64encode(b).decode('utf-8')}"
+
+
+def render_data_url(path: str, settings: RenderSettings) -> str:
+    """Legge l'immagine, la ridimensiona/ricodifica secondo `settings` e ritorna il data URL."""
+    if settings.fmt == "original":
+        return _encode_original(path)
+    from PIL import Image
+
+    with Image.open(path) as img:
+        img.load()
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        if settings.max_side and max(img.size) > settings.max_side:
+            img.thumbnail((settings.max_side, settings.max_side), Image.LANCZOS)
+        buf = io.BytesIO()
+        if settings.fmt == "png":
+            img.save(buf, format="PNG", optimize=True)
+        else:
+            img.save(buf, format=settings.fmt.upper(), quality=settings.quality)
+    b64 = base64.b64encode(buf.getvalue()).decode("ascii")
+    return f"data:{_MIME[settings.fmt]};base64,{b64}"
+
+
+def payload_key(path: str, st: os.stat_result, settings: RenderSettings) -> str:
+    raw = f"{os.path.abspath(path)}\0{st.st_mtime_ns}\0{st.st_size}\0{settings.key()}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ImagePayloadCache:
+    """Cache LRU (limite in byte) di data URL renderizzati, con tier opzionale su disco."""
+
+    def __init__(
+        self,
+        settings: Optional[RenderSettings] = None,
+        max_bytes: int = 64 * 1024 * 1024,
+        disk_path: Optional[str] = None,
+        disk_max_entries: int = 50_000,
+    ):
+        self.settings = settings or RenderSettings()
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._mem: "OrderedDict[str, str]" = OrderedDict()
+        self._bytes = 0
+        self._disk = SqliteKV(disk_path, "payloads", max_entries=disk_max_entries) if disk_path else None
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.source_bytes = 0
+        self.payload_bytes = 0
+
+    def _mem_get(self, key: str) -> Optional[str]:
+        with self._lock:
+            data_url = self._mem.get(key)
+            if data_url is not None:
+                self._mem.move_to_end(key)
+            return data_url
+
+    def _mem_put(self, key: str, data_url: str):
+        size = len(data_url)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._mem.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._mem[key] = data_url
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._mem.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def get_data_url(self, path: str) -> str:
+        """Data URL dell'immagine `path` con le impostazioni della cache (render al primo accesso)."""
+        st = os.stat(path)
+        key = payload_key(path, st, self.settings)
+        data_url = self._mem_get(key)
+        if data_url is not None:
+            self.hits_memory += 1
+            return data_url
+        if self._disk is not None:
+            try:
+                data_url = self._disk.get(key)
+            except sqlite3.Error as e:
+                print(f"[ImageCache] WARNING: disk tier read failed: {e}")
+                data_url = None
+            if data_url is not None:
+                self.hits_disk += 1
+                self._mem_put(key, data_url)
+                return data_url
+
+        self.misses += 1
+        data_url = render_data_url(path, self.settings)
+        self.source_bytes += st.st_size
+        self.payload_bytes += len(data_url)
+        self._mem_put(key, data_url)
+        if self._disk is not None:
+            try:
+                self._disk.put(key, data_url)
+            except sqlite3.Error as e:
+                print(f"[ImageCache] WARNING: disk tier write failed: {e}")
+        return data_url
+
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+            self._bytes = 0
+        if self._disk is not None:
+            self._disk.clear()
+
+    def stats(self) -> Dict:
+        lookups = self.hits_memory + self.hits_disk + self.misses
+        return {
+            "settings": self.settings.key(),
+            "size": len(self._mem),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "hit_rate": (self.hits_memory + self.hits_disk) / lookups if lookups else 0.0,
+            # rapporto payload/sorgente sulle immagini renderizzate (< 1 = richiesta piu' piccola)
+            "compression_ratio": self.payload_bytes / self.source_bytes if self.source_bytes else None,
+            "disk_enabled": self._disk is not None,
+        }
@@ -0,0 +1,234 @@
+"""
+Incremental Indexer - sincronizza una collection Qdrant con le sue sorgenti.
+
+Mantiene un manifest per collection:
+    {doc_key: {"id": point_id, "hash": content_hash, "text_hash": text_hash}}
+
+Ad ogni run:
+- documenti nuovi o con testo cambiato -> embedding + upsert (a batch)
+- documenti con solo metadata cambiati -> overwrite del payload, nessun embedding
+- documenti spariti dalla sorgente      -> delete dei punti
+- documenti invariati                    -> nessuna operazione
+
+Gli id dei punti sono deterministici (uuid5 di collection + doc_key), quindi
+lo stesso documento finisce sempre sullo stesso punto. Chiave e hash sono
+salvati anche nel payload, cosi' il manifest puo' essere ricostruito dalla
+collection stessa (es. Qdrant remoto condiviso tra piu' repliche).
+
+La sorgente e' consumata in streaming: in memoria resta al massimo un batch
+di documenti/embedding alla volta (oltre al manifest), indipendentemente
+dalla dimensione del corpus.
+"""
+import json
+import time
+import uuid
+import hashlib
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from qdrant_client import QdrantClient
+
+# (doc_key, text, metadata)
+SourceDoc = Tuple[str, str, Dict]
+EmbedFn = Callable[[List[str]], List[List[float]]]
+
+DEFAULT_BATCH_SIZE = 64
+
+
+def point_id(collection_name: str, doc_key: str) -> str:
+    """Id deterministico del punto per un documento."""
+    return str(uuid.uuid5(uuid.NAMESPACE_DNS, f"{collection_name}/{doc_key}"))
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def content_hash(text: str, metadata: Dict) -> str:
+    """Hash di testo + metadata: cambia se cambia qualsiasi parte del payload."""
+    blob = json.dumps({"text": text, "metadata": metadata}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def case_doc_key(metadata: Dict) -> str:
+    """Chiave stabile per case_card e frame di documents.jsonl."""
+    doc_type = metadata.get("document_type", "unknown")
+    if doc_type == "frame":
+        return f"{metadata.get('case_id')}:frame:{metadata.get('frame_index')}"
+    return f"{metadata.get('case_id')}:{doc_type}"
+
+
+def guideline_doc_key(source: str, chunk_id: int) -> str:
+    return f"{source}#{chunk_id}"
+
+
+@dataclass
+class SyncStats:
+    added: int = 0
+    updated: int = 0
+    payload_only: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+    embedded_batches: int = 0
+    doc_types: Dict[str, int] = field(default_factory=dict)
+    scanned: int = 0
+    embedded: int = 0
+    embed_seconds: float = 0.0
+    started: float = field(default_factory=time.perf_counter)
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    @property
+    def docs_per_second(self) -> float:
+        """Throughput di embedding+upsert (documenti embeddati al secondo)."""
+        return self.embedded / self.embed_seconds if self.embed_seconds else 0.0
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.added or self.updated or self.payload_only or self.deleted)
+
+    def summary(self) -> str:
+        return (
+            f"{self.added} added, {self.updated} updated, {self.payload_only} payload-only, "
+            f"{self.deleted} deleted, {self.unchanged} unchanged ({self.embedded_batches} embedding batches, "
+            f"{self.docs_per_second:.1f} docs/s, {self.elapsed:.2f}s)"
+        )
+
+
+# campi di servizio nel payload (usati per ricostruire il manifest)
+DOC_KEY_FIELD = "doc_key"
+HASH_FIELD = "content_hash"
+TEXT_HASH_FIELD = "text_hash"
+
+
+def _payload(text: str, metadata: Dict, key: str, h: str, th: str) -> Dict:
+    # stesso layout di QdrantVectorstore._process_chunk (datapizza) + campi di servizio
+    return {"text": text, **metadata, DOC_KEY_FIELD: key, HASH_FIELD: h, TEXT_HASH_FIELD: th}
+
+
+def manifest_from_collection(client: "QdrantClient", collection_name: str, page_size: int = 256) -> Dict[str, Dict]:
+    """
+    Ricostruisce il manifest leggendo i payload della collection (senza vettori).
+    Punti senza doc_key (indicizzati da versioni precedenti) ricevono una chiave
+    fittizia: non corrispondendo a nessuna sorgente verranno rimossi al sync.
+    """
+    manifest: Dict[str, Dict] = {}
+    offset = None
+    while True:
+        records, offset = client.scroll(
+            collection_name=collection_name,
+            limit=page_size,
+            offset=offset,
+            with_payload=[DOC_KEY_FIELD, HASH_FIELD, TEXT_HASH_FIELD],
+            with_vectors=False,
+        )
+        for r in records:
+            payload = r.payload or {}
+            key = payload.get(DOC_KEY_FIELD) or f"legacy:{r.id}"
+            manifest[key] = {"id": str(r.id), "hash": payload.get(HASH_FIELD), "text_hash": payload.get(TEXT_HASH_FIELD)}
+        if offset is None:
+            break
+    return manifest
+
+
+def sync_collection(
+    client: "QdrantClient",
+    collection_name: str,
+    docs: Iterable[SourceDoc],
+    embed_fn: EmbedFn,
+    manifest: Dict[str, Dict],
+    vector_name: str = "text_embedding",
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    progress: Optional[Callable[[SyncStats], None]] = None,
+) -> SyncStats:
+    """
+    Porta la collection allo stato descritto da `docs`.
+    `manifest` (entries della collection) viene aggiornato in-place.
+    `progress`, se passato, viene chiamato dopo ogni batch embeddato.
+    """
+    from qdrant_client import models
+
+    stats = SyncStats()
+    seen = set()
+    pending: List[Tuple[str, str, Dict, str, str, str]] = []
+
+    def flush():
+        if not pending:
+            return
+        t0 = time.perf_counter()
+        vectors = embed_fn([p[1] for p in pending])
+        client.upsert(
+            collection_name=collection_name,
+            points=[
+                models.PointStruct(id=pid, vector={vector_name: vec}, payload=_payload(text, meta, key, h, th))
+                for (key, text, meta, pid, h, th), vec in zip(pending, vectors)
+            ],
+            wait=True,
+        )
+        for key, _, _, pid, h, th in pending:
+            manifest[key] = {"id": pid, "hash": h, "text_hash": th}
+        stats.embed_seconds += time.perf_counter() - t0
+        stats.embedded += len(pending)
+        stats.embedded_batches += 1
+        pending.clear()
+        if progress is not None:
+            progress(stats)
+
+    for key, text, metadata in docs:
+        if key in seen:
+            # chiave duplicata nella sorgente: tiene la prima occorrenza
+            continue
+        seen.add(key)
+        stats.scanned += 1
+        dt = metadata.get("document_type", "unknown")
+        stats.doc_types[dt] = stats.doc_types.get(dt, 0) + 1
+
+        h = content_hash(text, metadata)
+        entry = manifest.get(key)
+        if entry is not None and entry.get("hash") == h:
+            stats.unchanged += 1
+            continue
+
+        th = text_hash(text)
+        pid = point_id(collection_name, key)
+        if entry is not None and entry.get("text_hash") == th:
+            # stesso testo -> stesso embedding, basta riscrivere il payload
+            client.overwrite_payload(
+                collection_name=collection_name,
+                payload=_payload(text, metadata, key, h, th),
+                points=[pid],
+                wait=True,
+            )
+            manifest[key] = {"id": pid, "hash": h, "text_hash": th}
+            stats.payload_only += 1
+            continue
+
+        if entry is None:
+            stats.added += 1
+        else:
+            stats.updated += 1
+        pending.append((key, text, metadata, pid, h, th))
+        if len(pending) >= batch_size:
+            flush()
+    flush()
+
+    stale = [k for k in manifest if k not in seen]
+    # un punto "legacy" puo' avere lo stesso id di un documento appena riscritto
+    live_ids = {manifest[k]["id"] for k in seen if k in manifest}
+    for i in range(0, len(stale), batch_size):
+        keys = stale[i:i + batch_size]
+        ids = [manifest[k]["id"] for k in keys if manifest[k]["id"] not in live_ids]
+        if ids:
+            client.delete(
+                collection_name=collection_name,
+                points_selector=models.PointIdsList(points=ids),
+                wait=True,
+            )
+        for k in keys:
+            del manifest[k]
+    stats.deleted = len(stale)
+
+    return stats
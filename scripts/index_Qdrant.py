@@ -1,15 +1,52 @@
 """
-Vectorstore Manager - Singleton con pipeline datapizza per Qdrant in-memory.
+Vectorstore Manager - Singleton con pipeline datapizza per Qdrant.
+
+Backend (QDRANT_MODE):
+- "memory" (default): Qdrant in-memory per processo, persistito con snapshot su disco
+- "remote": server Qdrant condiviso (QDRANT_HOST/QDRANT_PORT), client unico con
+  connection pool e gRPC opzionale; l'indice vive sul server ed e' condiviso tra le repliche
+
+Import senza side effect: datapizza/qdrant_client/sentence-transformers vengono
+importati solo quando serve (primo get_vectorstore()/get_embedder()).
 """
 import os
+import sys
 import json
 import glob
+import time
 import uuid
-from typing import Optional
-from datapizza.core.vectorstore import VectorConfig
-from datapizza.vectorstores.qdrant import QdrantVectorstore
-from datapizza.type.type import Chunk, DenseEmbedding
-from sentence_transformers import SentenceTransformer
+import socket
+import inspect
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from datapizza.vectorstores.qdrant import QdrantVectorstore
+    from sentence_transformers import SentenceTransformer
+
+# Project root nel path (anche quando lanciato come script)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.index_snapshot import (
+    compute_fingerprint,
+    load_snapshot,
+    save_snapshot,
+    read_snapshot_meta,
+    read_snapshot_manifest,
+)
+from scripts.incremental_index import (
+    SyncStats,
+    sync_collection,
+    manifest_from_collection,
+    case_doc_key,
+    guideline_doc_key,
+)
+from scripts.embedding_cache import QueryEmbeddingCache, normalize_query
+from scripts.embedding_batcher import EmbeddingBatcher
+from scripts.metrics import STAGE_SECONDS
+from scripts.tracing import span
 
 # --- PATHS ---
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -21,51 +58,257 @@ JSONL_PATH = os.path.join(DATASET_DIR, "documents.jsonl")
 EMB_MODEL = "all-MiniLM-L6-v2"
 EMBEDDING_DIM = 384
 
+# Backend di embedding: "torch" (SentenceTransformer) o "onnx" (onnxruntime, int8 di default)
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", os.path.join(DATA_DIR, "models", f"{EMB_MODEL}-onnx"))
+ONNX_QUANTIZED = os.getenv("ONNX_QUANTIZED", "1") != "0"
+# thread intra-op della sessione onnxruntime (il pool di torch e' di processo: vedi API_TORCH_THREADS)
+EMBED_ONNX_THREADS = int(os.getenv("EMBED_ONNX_THREADS", "0")) or None
+
+# Chunking guidelines
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 150
+
+# Documenti embeddati e upsertati per batch durante l'indicizzazione
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "64"))
+
+# Backend Qdrant
+QDRANT_MODE = os.getenv("QDRANT_MODE", "memory")
+QDRANT_HOST = os.getenv("QDRANT_HOST", "localhost")
+QDRANT_PORT = int(os.getenv("QDRANT_PORT", "6333"))
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "0") == "1"
+QDRANT_API_KEY = os.getenv("QDRANT_API_KEY") or None
+QDRANT_POOL_SIZE = int(os.getenv("QDRANT_POOL_SIZE", "8"))
+QDRANT_TIMEOUT_S = int(os.getenv("QDRANT_TIMEOUT_S", "10"))
+# collection di servizio sul server remoto con fingerprint/parametri dell'indice
+STATE_COLLECTION = "index_state"
+_STATE_POINT_ID = str(uuid.uuid5(uuid.NAMESPACE_DNS, "index_state"))
+# lease sulla (ri)costruzione dell'indice remoto: una sola replica indicizza, le altre attendono
+INDEX_LOCK_COLLECTION = "index_state_lock"
+INDEX_LOCK_TTL_S = float(os.getenv("QDRANT_INDEX_LOCK_TTL_S", "120"))
+INDEX_LOCK_POLL_S = float(os.getenv("QDRANT_INDEX_LOCK_POLL_S", "2"))
+
+# Snapshot su disco delle collection (evita di ri-embeddare tutto ad ogni avvio)
+SNAPSHOT_DIR = os.getenv("INDEX_SNAPSHOT_DIR", os.path.join(DATA_DIR, "index_snapshot"))
+USE_SNAPSHOT = os.getenv("INDEX_SNAPSHOT", "1") != "0"
+COLLECTIONS = ["cases", "guidelines"]
+
+# Cache embedding delle query (L1 in memoria, L2 opzionale su disco condiviso)
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL_S = float(os.getenv("QUERY_CACHE_TTL_S", "3600"))
+QUERY_CACHE_DISK_PATH = os.getenv("QUERY_CACHE_DISK_PATH") or None
+
+# Micro-batching delle query concorrenti verso il modello
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "32"))
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "5"))
+
 # -----------------------------
 # Singleton Vectorstore
 # -----------------------------
-_vectorstore: Optional[QdrantVectorstore] = None
-_embedder: Optional[SentenceTransformer] = None
+_vectorstore: Optional["QdrantVectorstore"] = None
+_embedder: Optional["SentenceTransformer"] = None
 _initialized = False
+# manifest dell'indexer incrementale: {collection: {doc_key: {...}}}
+_manifest: dict = {}
+_query_cache: Optional[QueryEmbeddingCache] = None
+_batcher: Optional[EmbeddingBatcher] = None
+# incrementata a ogni modifica dell'indice fatta da questo processo (metriche/stats)
+_index_generation = 0
+# fingerprint del contenuto servito da questo processo (snapshot caricato o ultimo refresh)
+_served_fingerprint: Optional[str] = None
+# protegge l'inizializzazione dei singleton da richieste concorrenti
+_init_lock = threading.RLock()
+# serializza refresh/rebuild (/reindex, /flush-rag, job): il manifest non e' thread-safe
+_refresh_lock = threading.RLock()
+# lease remoto tenuto da questo processo (letto/scritto solo sotto _refresh_lock)
+_lease_held = False
+
+_EMBED_SECONDS = STAGE_SECONDS.labels("embed")
 
 
 class LocalEmbedder:
-    """Adapter per SentenceTransformer -> embeddings."""
-    def __init__(self, model: SentenceTransformer):
+    """Adapter per SentenceTransformer / OnnxEmbedder -> embeddings."""
+    def __init__(self, model: "SentenceTransformer"):
         self.model = model
     
     def embed(self, texts: list[str]) -> list[list[float]]:
-        return self.model.encode(texts, normalize_embeddings=True).tolist()
+        return self.model.encode(texts, normalize_embeddings=True, batch_size=len(texts) or 1).tolist()
+
+
+def _create_vectorstore() -> "QdrantVectorstore":
+    """Crea il vectorstore per il backend configurato (QDRANT_MODE)."""
+    from datapizza.vectorstores.qdrant import QdrantVectorstore
+
+    if QDRANT_MODE == "remote":
+        print(
+            f"[IndexQdrant] Connecting to Qdrant at {QDRANT_HOST}:{QDRANT_PORT} "
+            f"(grpc={'on, port ' + str(QDRANT_GRPC_PORT) if QDRANT_PREFER_GRPC else 'off'})..."
+        )
+        from qdrant_client import QdrantClient
+
+        client_kwargs = {
+            "grpc_port": QDRANT_GRPC_PORT,
+            "prefer_grpc": QDRANT_PREFER_GRPC,
+            "timeout": QDRANT_TIMEOUT_S,
+        }
+        # pool_size solo dove il client lo supporta (qdrant_client recenti)
+        if "pool_size" in inspect.signature(QdrantClient.__init__).parameters:
+            client_kwargs["pool_size"] = QDRANT_POOL_SIZE
+        else:
+            print("[IndexQdrant] WARNING: qdrant_client without pool_size support, using default pool.")
+        # un solo client per processo: connessioni HTTP keep-alive / canali gRPC riusati
+        return QdrantVectorstore(host=QDRANT_HOST, port=QDRANT_PORT, api_key=QDRANT_API_KEY, **client_kwargs)
+    if QDRANT_MODE != "memory":
+        raise ValueError(f"Unknown QDRANT_MODE '{QDRANT_MODE}' (expected 'memory' or 'remote')")
+    print("[IndexQdrant] Initializing Qdrant in-memory...")
+    return QdrantVectorstore(location=":memory:")
 
 
-def get_vectorstore() -> QdrantVectorstore:
+def get_vectorstore() -> "QdrantVectorstore":
     """Ritorna il vectorstore singleton, inizializzandolo se necessario."""
     global _vectorstore, _embedder, _initialized
     
-    if _vectorstore is None:
-        print("[IndexQdrant] Initializing Qdrant in-memory...")
-        _vectorstore = QdrantVectorstore(location=":memory:")
-        _embedder = SentenceTransformer(EMB_MODEL)
+    if _vectorstore is not None and _initialized:
+        return _vectorstore
     
-    if not _initialized:
-        print("[IndexQdrant] Auto-indexing collections...")
-        _ensure_collections_populated()
-        _initialized = True
+    with _init_lock:
+        if _vectorstore is None:
+            _vectorstore = _create_vectorstore()
+        
+        if not _initialized:
+            print("[IndexQdrant] Auto-indexing collections...")
+            with span("index.init", mode=QDRANT_MODE):
+                _ensure_collections_populated()
+            _initialized = True
     
     return _vectorstore
 
 
-def get_embedder() -> SentenceTransformer:
-    """Ritorna il sentence transformer singleton."""
+def _create_embedder():
+    """Crea l'embedder per il backend configurato (EMBED_BACKEND)."""
+    if EMBED_BACKEND == "onnx":
+        from scripts.onnx_embedder import OnnxEmbedder, ensure_onnx_model
+
+        # controlla il file del modello richiesto (int8 o fp32), non solo la config
+        ensure_onnx_model(EMB_MODEL, ONNX_MODEL_DIR, quantized=ONNX_QUANTIZED)
+        print(f"[IndexQdrant] Loading ONNX embedder ({'int8' if ONNX_QUANTIZED else 'fp32'})...")
+        return OnnxEmbedder(ONNX_MODEL_DIR, quantized=ONNX_QUANTIZED, intra_op_threads=EMBED_ONNX_THREADS)
+    if EMBED_BACKEND != "torch":
+        raise ValueError(f"Unknown EMBED_BACKEND '{EMBED_BACKEND}' (expected 'torch' or 'onnx')")
+    from sentence_transformers import SentenceTransformer
+
+    print(f"[IndexQdrant] Loading SentenceTransformer '{EMB_MODEL}'...")
+    return SentenceTransformer(EMB_MODEL)
+
+
+def get_embedder() -> "SentenceTransformer":
+    """Ritorna l'embedder singleton (SentenceTransformer o OnnxEmbedder, stessa encode())."""
     global _embedder
     if _embedder is None:
-        _embedder = SentenceTransformer(EMB_MODEL)
+        with _init_lock:
+            if _embedder is None:
+                _embedder = _create_embedder()
     return _embedder
 
 
-def _ensure_collections_populated():
+def embedding_model_id() -> str:
+    """Identificativo del modello usato per le query (chiave della query cache)."""
+    if EMBED_BACKEND == "onnx":
+        return f"{EMB_MODEL}+onnx-{'int8' if ONNX_QUANTIZED else 'fp32'}"
+    return EMB_MODEL
+
+
+def get_query_cache() -> QueryEmbeddingCache:
+    """Ritorna la cache singleton degli embedding delle query."""
+    global _query_cache
+    if _query_cache is None:
+        with _init_lock:
+            if _query_cache is None:
+                _query_cache = QueryEmbeddingCache(
+                    model_id=embedding_model_id(),
+                    max_entries=QUERY_CACHE_SIZE,
+                    ttl_s=QUERY_CACHE_TTL_S,
+                    disk_path=QUERY_CACHE_DISK_PATH,
+                )
+    return _query_cache
+
+
+def get_embedding_batcher() -> EmbeddingBatcher:
+    """Ritorna lo scheduler singleton che raggruppa gli encode delle query."""
+    global _batcher
+    if _batcher is None:
+        with _init_lock:
+            if _batcher is None:
+                _batcher = EmbeddingBatcher(
+                    lambda texts: get_embedder().encode(texts, normalize_embeddings=True, batch_size=len(texts)),
+                    max_batch=EMBED_BATCH_MAX,
+                    max_wait_ms=EMBED_BATCH_WAIT_MS,
+                )
+    return _batcher
+
+
+def embed_query_future(text: str) -> Future:
+    """
+    Embedding di una query come Future: risolto subito se in cache,
+    altrimenti accodato al batcher (e salvato in cache al completamento).
+    """
+    t0 = time.perf_counter()
+    cache = get_query_cache()
+    vector = cache.get(text)
+    if vector is not None:
+        _EMBED_SECONDS.observe(time.perf_counter() - t0)
+        fut: Future = Future()
+        fut.set_result(vector)
+        return fut
+
+    fut = get_embedding_batcher().submit(normalize_query(text))
+
+    def _store(f: Future):
+        if not f.cancelled() and f.exception() is None:
+            # attesa in coda + encode del batch
+            _EMBED_SECONDS.observe(time.perf_counter() - t0)
+            cache.put(text, f.result())
+
+    fut.add_done_callback(_store)
+    return fut
+
+
+def embed_query(text: str) -> list[float]:
+    """Embedding normalizzato di una query, passando per query cache e batcher."""
+    with span("embed") as sp:
+        fut = embed_query_future(text)
+        sp.set(cached=fut.done())
+        return fut.result()
+
+
+def _source_files() -> list[str]:
+    """File sorgente da cui dipende il contenuto dell'indice."""
+    return [JSONL_PATH] + glob.glob(os.path.join(GUIDELINES_DIR, "*.txt"))
+
+
+def _index_params() -> dict:
+    """Parametri che, se cambiano, invalidano tutti gli embedding."""
+    return {
+        "emb_model": EMB_MODEL,
+        "embedding_dim": EMBEDDING_DIM,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+    }
+
+
+def _index_fingerprint() -> str:
+    """Fingerprint di sorgenti + modello + parametri di chunking."""
+    return compute_fingerprint(_source_files(), _index_params())
+
+
+def _ensure_collections_populated(use_snapshot: bool = USE_SNAPSHOT):
     """Controlla e popola le collection 'cases' e 'guidelines' se vuote."""
-    global _vectorstore, _embedder
+    global _vectorstore, _embedder, _manifest, _served_fingerprint
+    
+    if QDRANT_MODE == "remote":
+        _ensure_remote_collections()
+        return
     
     # Collection 'cases'
     try:
@@ -88,127 +331,402 @@ def _ensure_collections_populated():
     except:
         pass
     
-    print("[IndexQdrant] Creating and indexing collections...")
-    _create_and_index_all()
+    client = _vectorstore.get_client()
+    fingerprint = _index_fingerprint()
+    meta = read_snapshot_meta(SNAPSHOT_DIR) if use_snapshot else None
 
+    if meta and meta.get("fingerprint") == fingerprint and load_snapshot(client, SNAPSHOT_DIR, fingerprint):
+        _manifest = read_snapshot_manifest(SNAPSHOT_DIR)
+        _served_fingerprint = fingerprint
+        return
 
-def _create_and_index_all():
-    """Crea e indicizza tutte le collection."""
-    global _vectorstore, _embedder
-    
-    # Crea collection 'cases'
-    vector_config = [VectorConfig(name="text_embedding", dimensions=EMBEDDING_DIM)]
-    
-    try:
-        _vectorstore.delete_collection("cases")
-    except:
-        pass
-    
-    _vectorstore.create_collection("cases", vector_config=vector_config)
-    
-    # Indicizza cases e frames
-    _index_cases()
-    
-    # Crea collection 'guidelines'
+    if meta and meta.get("params") == _index_params() and load_snapshot(client, SNAPSHOT_DIR, meta["fingerprint"]):
+        # stesso modello/chunking ma sorgenti cambiate -> aggiorna solo i delta
+        print("[IndexQdrant] Sources changed since snapshot, syncing incrementally...")
+        _manifest = read_snapshot_manifest(SNAPSHOT_DIR)
+    else:
+        print("[IndexQdrant] Creating and indexing collections...")
+        _create_and_index_all()
+        return
+
+    refresh_index()
+
+
+def _read_remote_state(client) -> Optional[dict]:
+    """Stato dell'indice salvato sul server (fingerprint + parametri)."""
     try:
-        _vectorstore.delete_collection("guidelines")
-    except:
-        pass
-    
-    _vectorstore.create_collection("guidelines", vector_config=vector_config)
-    _index_guidelines()
+        if not client.collection_exists(STATE_COLLECTION):
+            return None
+        points = client.retrieve(STATE_COLLECTION, ids=[_STATE_POINT_ID], with_payload=True)
+        return points[0].payload if points else None
+    except Exception as e:
+        print(f"[IndexQdrant] WARNING: could not read index state: {e}")
+        return None
 
 
-def _index_cases():
-    """Indicizza cases e frames da documents.jsonl."""
-    global _vectorstore, _embedder
-    
-    if not os.path.exists(JSONL_PATH):
-        print(f"[IndexQdrant] WARNING: {JSONL_PATH} not found. Skipping cases indexing.")
+def _write_remote_state(client, fingerprint: str):
+    from qdrant_client import models
+
+    if not client.collection_exists(STATE_COLLECTION):
+        client.create_collection(
+            STATE_COLLECTION,
+            vectors_config=models.VectorParams(size=1, distance=models.Distance.DOT),
+        )
+    client.upsert(
+        STATE_COLLECTION,
+        points=[
+            models.PointStruct(
+                id=_STATE_POINT_ID,
+                vector=[0.0],
+                payload={
+                    "fingerprint": fingerprint,
+                    "params": _index_params(),
+                    "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                },
+            )
+        ],
+        wait=True,
+    )
+
+
+class _RemoteIndexLease:
+    """
+    Lease sulla (ri)costruzione dell'indice remoto, condiviso tra repliche.
+
+    L'acquisizione e' la create_collection di INDEX_LOCK_COLLECTION, atomica
+    lato server (fallisce se esiste gia'). La scadenza sta nel payload ed e'
+    rinnovata da un thread finche' il lease e' tenuto: una replica morta a
+    meta' indicizzazione blocca le altre al massimo per INDEX_LOCK_TTL_S.
+    """
+
+    def __init__(self, client, ttl_s: float = INDEX_LOCK_TTL_S):
+        self.client = client
+        self.ttl_s = ttl_s
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stop = threading.Event()
+        self._renewer: Optional[threading.Thread] = None
+        # lock senza payload (holder morto tra create e upsert): scade dopo ttl dalla prima osservazione
+        self._empty_since: Optional[float] = None
+
+    def _write_expiry(self):
+        from qdrant_client import models
+
+        self.client.upsert(
+            INDEX_LOCK_COLLECTION,
+            points=[
+                models.PointStruct(
+                    id=_STATE_POINT_ID,
+                    vector=[0.0],
+                    payload={"owner": self.owner, "expires_at": time.time() + self.ttl_s},
+                )
+            ],
+            wait=True,
+        )
+
+    def _expired(self) -> bool:
+        try:
+            points = self.client.retrieve(INDEX_LOCK_COLLECTION, ids=[_STATE_POINT_ID], with_payload=True)
+        except Exception:
+            return False
+        if points:
+            self._empty_since = None
+            return points[0].payload.get("expires_at", 0) < time.time()
+        if self._empty_since is None:
+            self._empty_since = time.time()
+        return time.time() - self._empty_since > self.ttl_s
+
+    def try_acquire(self) -> bool:
+        from qdrant_client import models
+
+        try:
+            self.client.create_collection(
+                INDEX_LOCK_COLLECTION,
+                vectors_config=models.VectorParams(size=1, distance=models.Distance.DOT),
+            )
+        except Exception:
+            if self._expired():
+                # holder scaduto: si libera il lock e si riprova al prossimo giro
+                print("[IndexQdrant] WARNING: remote index lock expired, breaking it.")
+                try:
+                    self.client.delete_collection(INDEX_LOCK_COLLECTION)
+                except Exception:
+                    pass
+                self._empty_since = None
+            return False
+        self._write_expiry()
+        self._stop.clear()
+        self._renewer = threading.Thread(target=self._renew, name="index-lock-renew", daemon=True)
+        self._renewer.start()
+        return True
+
+    def _renew(self):
+        while not self._stop.wait(self.ttl_s / 3):
+            try:
+                self._write_expiry()
+            except Exception as e:
+                print(f"[IndexQdrant] WARNING: could not renew index lock: {e}")
+
+    def release(self):
+        self._stop.set()
+        if self._renewer is not None:
+            self._renewer.join()
+            self._renewer = None
+        try:
+            self.client.delete_collection(INDEX_LOCK_COLLECTION)
+        except Exception as e:
+            print(f"[IndexQdrant] WARNING: could not release index lock: {e}")
+
+
+def _remote_index_current(client, fingerprint: str) -> bool:
+    state = _read_remote_state(client)
+    return bool(
+        state
+        and state.get("fingerprint") == fingerprint
+        and all(client.collection_exists(c) for c in COLLECTIONS)
+    )
+
+
+def _load_remote_manifest(client):
+    """Manifest dai payload del server: /stats e il prossimo /reindex non ripartono da zero."""
+    global _manifest
+    _manifest = {name: manifest_from_collection(client, name) for name in COLLECTIONS if client.collection_exists(name)}
+
+
+@contextmanager
+def _index_write_lock(done=None):
+    """
+    Serializza le scritture sull'indice: _refresh_lock nel processo e, in modalita'
+    remote, il lease condiviso tra repliche (rientrante). Appena preso il lease il
+    manifest viene ricaricato dal server, che altre repliche possono aver aggiornato.
+    Se `done()` diventa vero durante l'attesa si esce senza lease (yield False).
+    """
+    global _lease_held
+    with _refresh_lock:
+        if QDRANT_MODE != "remote" or _lease_held:
+            yield True
+            return
+        client = _vectorstore.get_client()
+        lease = _RemoteIndexLease(client)
+        waiting = False
+        while not lease.try_acquire():
+            if done is not None and done():
+                yield False
+                return
+            if not waiting:
+                print("[IndexQdrant] Another replica is indexing, waiting for the remote index...")
+                waiting = True
+            time.sleep(INDEX_LOCK_POLL_S)
+        _lease_held = True
+        try:
+            _load_remote_manifest(client)
+            yield True
+        finally:
+            _lease_held = False
+            lease.release()
+
+
+def _ensure_remote_collections():
+    """
+    Backend remoto: se lo stato sul server corrisponde alle sorgenti locali non
+    indicizza nulla; altrimenti una sola replica (lease) sincronizza i delta
+    (o ricostruisce tutto se modello/chunking sono cambiati) e le altre
+    attendono che il fingerprint sul server corrisponda.
+    """
+    client = _vectorstore.get_client()
+    fingerprint = _index_fingerprint()
+    if _remote_index_current(client, fingerprint):
+        print("[IndexQdrant] Remote collections are up to date, skipping indexing.")
+        _load_remote_manifest(client)
         return
-    
-    print(f"[IndexQdrant] Loading documents from {JSONL_PATH}...")
-    
-    # Carica tutti i documenti (case_card + frame)
-    docs_text = []
-    docs_metadata = []
-    
+
+    with _index_write_lock(done=lambda: _remote_index_current(client, fingerprint)) as locked:
+        if not locked:
+            print("[IndexQdrant] Remote index built by another replica.")
+            _load_remote_manifest(client)
+            return
+        # ricontrollo sotto lease (manifest gia' ricaricato): l'indice puo' essere stato completato nel frattempo
+        if _remote_index_current(client, fingerprint):
+            return
+        state = _read_remote_state(client)
+        if state and state.get("params") == _index_params():
+            print("[IndexQdrant] Remote index is out of date, syncing incrementally...")
+            refresh_index()
+        else:
+            print("[IndexQdrant] Remote index missing or built with different parameters, rebuilding...")
+            _create_and_index_all()
+
+
+def _create_and_index_all():
+    """Crea e indicizza tutte le collection (rebuild completo)."""
+    global _vectorstore, _manifest
+
+    with _index_write_lock():
+        for name in COLLECTIONS:
+            try:
+                _vectorstore.delete_collection(name)
+            except:
+                pass
+        _manifest = {}
+
+        refresh_index(force_snapshot=True)
+
+
+def _ensure_collection(name: str) -> dict:
+    """Crea la collection se non esiste e ritorna il suo manifest."""
+    from datapizza.core.vectorstore import VectorConfig
+
+    vector_config = [VectorConfig(name="text_embedding", dimensions=EMBEDDING_DIM)]
+    client = _vectorstore.get_client()
+    if not client.collection_exists(name):
+        _vectorstore.create_collection(name, vector_config=vector_config)
+        _manifest[name] = {}
+    elif name not in _manifest:
+        # manifest non disponibile (es. server remoto): ricostruito dai payload
+        _manifest[name] = manifest_from_collection(client, name)
+    return _manifest[name]
+
+
+def index_generation() -> int:
+    """Generazione corrente dell'indice (cambia dopo ogni reindex che modifica le collection)."""
+    return _index_generation
+
+
+def index_version() -> str:
+    """
+    Versione del contenuto dell'indice, uguale in tutti i processi che servono lo
+    stesso contenuto (chiave delle cache dei risultati). In modalita' remote e' il
+    fingerprint salvato sul server, che cambia anche per un /reindex fatto da
+    un'altra replica; in modalita' memory quello dello snapshot/refresh locale.
+    """
+    if QDRANT_MODE == "remote" and _vectorstore is not None:
+        state = _read_remote_state(_vectorstore.get_client())
+        if state and state.get("fingerprint"):
+            return state["fingerprint"]
+    return _served_fingerprint or f"generation-{_index_generation}"
+
+
+def index_stats() -> dict:
+    """Documenti per collection dal manifest in memoria (nessuna chiamata a Qdrant)."""
+    return {
+        "initialized": _initialized,
+        "generation": _index_generation,
+        "documents": {name: len(_manifest[name]) for name in COLLECTIONS if name in _manifest},
+    }
+
+
+def _embed_fn():
+    return LocalEmbedder(get_embedder()).embed
+
+
+def refresh_index(force_snapshot: bool = False) -> dict:
+    """
+    Sincronizza incrementalmente 'cases' e 'guidelines' con le sorgenti:
+    embedda solo documenti nuovi/modificati e rimuove quelli spariti.
+    Salva un nuovo snapshot se qualcosa e' cambiato. In modalita' remote
+    i delta sono calcolati sotto lease contro il manifest del server.
+    """
+    global _index_generation, _served_fingerprint
+
+    with _index_write_lock():
+        with span("index.refresh") as sp:
+            stats = {
+                "cases": _index_cases(),
+                "guidelines": _index_guidelines(),
+            }
+            sp.set(**{name: s.summary() for name, s in stats.items() if s is not None})
+        changed = any(s is not None and s.changed for s in stats.values())
+        if changed or force_snapshot:
+            _index_generation += 1
+        fingerprint = _index_fingerprint()
+        _served_fingerprint = fingerprint
+
+        if QDRANT_MODE == "remote":
+            client = _vectorstore.get_client()
+            # sorgenti con fingerprint nuovo ma nessun delta: lo stato va comunque aggiornato
+            if changed or force_snapshot or (_read_remote_state(client) or {}).get("fingerprint") != fingerprint:
+                _write_remote_state(client, fingerprint)
+        elif USE_SNAPSHOT and (changed or force_snapshot):
+            try:
+                save_snapshot(
+                    _vectorstore.get_client(),
+                    SNAPSHOT_DIR,
+                    fingerprint,
+                    COLLECTIONS,
+                    extra_meta={"params": _index_params()},
+                    manifest=_manifest,
+                )
+            except Exception as e:
+                print(f"[IndexQdrant] WARNING: could not save index snapshot: {e}")
+
+        return {name: (s.summary() if s is not None else "skipped") for name, s in stats.items()}
+
+
+def _progress_printer(collection_name: str, every_s: float = 5.0):
+    """Callback di progresso: stampa al piu' una riga ogni `every_s` secondi."""
+    last = [0.0]
+
+    def report(stats: SyncStats):
+        if stats.elapsed - last[0] < every_s:
+            return
+        last[0] = stats.elapsed
+        print(
+            f"[IndexQdrant] {collection_name}: {stats.scanned} scanned, {stats.embedded} embedded "
+            f"({stats.embedded_batches} batches, {stats.docs_per_second:.1f} docs/s)"
+        )
+
+    return report
+
+
+def _iter_case_docs():
+    """Documenti (case_card + frame) da documents.jsonl."""
     with open(JSONL_PATH, "r", encoding="utf-8") as f:
         for line in f:
             obj = json.loads(line)
-            doc_type = obj["metadata"].get("document_type")
+            metadata = obj["metadata"]
+            doc_type = metadata.get("document_type")
             # Indicizza sia case_card che frame
             if doc_type not in ["case_card", "frame"]:
                 continue
-            docs_text.append(obj["content"])
-            docs_metadata.append(obj["metadata"])
-    
-    if not docs_text:
-        print("[IndexQdrant] No documents found.")
-        return
-    
-    print(f"[IndexQdrant] Embedding {len(docs_text)} documents...")
-    
-    # Genera embeddings usando LocalEmbedder
-    local_embedder = LocalEmbedder(_embedder)
-    embeddings = local_embedder.embed(docs_text)
+            metadata = {**metadata, "original_id": metadata.get("case_id", "unknown")}
+            yield case_doc_key(metadata), obj["content"], metadata
+
+
+def _index_cases() -> Optional[SyncStats]:
+    """Indicizza (incrementalmente) cases e frames da documents.jsonl."""
+    if not os.path.exists(JSONL_PATH):
+        print(f"[IndexQdrant] WARNING: {JSONL_PATH} not found. Skipping cases indexing.")
+        return None
+    
+    print(f"[IndexQdrant] Syncing documents from {JSONL_PATH}...")
+    manifest = _ensure_collection("cases")
+    stats = sync_collection(
+        _vectorstore.get_client(),
+        "cases",
+        _iter_case_docs(),
+        _embed_fn(),
+        manifest,
+        batch_size=INDEX_BATCH_SIZE,
+        progress=_progress_printer("cases"),
+    )
     
-    # Aggiungi a Qdrant
-    print(f"[IndexQdrant] Adding documents to Qdrant...")
+    types_str = ", ".join([f"{v} {k}s" for k, v in stats.doc_types.items()])
+    print(f"[IndexQdrant] ✓ Cases synced ({types_str}): {stats.summary()}.")
+    return stats
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP):
     chunks = []
-    for i in range(len(docs_text)):
-        case_id = docs_metadata[i].get("case_id", f"unknown_{i}")
-        doc_uuid = str(uuid.uuid5(uuid.NAMESPACE_DNS, f"case_{case_id}_{i}"))
-        emb = DenseEmbedding(name="text_embedding", vector=embeddings[i])
-        
-        metadata = docs_metadata[i].copy()
-        metadata["original_id"] = case_id
-        
-        chunks.append(
-            Chunk(
-                id=doc_uuid,
-                text=docs_text[i],
-                embeddings=[emb],
-                metadata=metadata
-            )
-        )
-    
-    _vectorstore.add(chunk=chunks, collection_name="cases")
-    
-    # Conta i tipi di documenti indicizzati
-    doc_types = {}
-    for m in docs_metadata:
-        dt = m.get("document_type", "unknown")
-        doc_types[dt] = doc_types.get(dt, 0) + 1
-    
-    types_str = ", ".join([f"{v} {k}s" for k, v in doc_types.items()])
-    print(f"[IndexQdrant] ✓ Indexed {len(docs_text)} documents ({types_str}).")
+    start = 0
+    while start < len(text):
+        end = start + chunk_size
+        chunks.append(text[start:end])
+        start = end - overlap
+    return chunks
 
 
-def _index_guidelines():
-    """Indicizza guidelines da file .txt."""
-    global _vectorstore, _embedder
-    
-    if not os.path.isdir(GUIDELINES_DIR):
-        print(f"[IndexQdrant] WARNING: {GUIDELINES_DIR} not found. Skipping guidelines indexing.")
-        return
-    
-    print(f"[IndexQdrant] Loading guidelines from {GUIDELINES_DIR}...")
-    
-    def chunk_text(text: str, chunk_size: int = 800, overlap: int = 150):
-        chunks = []
-        start = 0
-        while start < len(text):
-            end = start + chunk_size
-            chunks.append(text[start:end])
-            start = end - overlap
-        return chunks
-    
-    docs_text = []
-    docs_metadata = []
-    idx = 0
-    
-    for path in glob.glob(os.path.join(GUIDELINES_DIR, "*.txt")):
+def _iter_guideline_docs():
+    """Chunk delle guidelines da file .txt."""
+    for path in sorted(glob.glob(os.path.join(GUIDELINES_DIR, "*.txt"))):
         fname = os.path.basename(path)
         with open(path, "r", encoding="utf-8") as f:
             text = f.read().strip()
@@ -216,44 +734,35 @@ def _index_guidelines():
         if not text:
             continue
         
-        chunks = chunk_text(text)
-        for j, chunk in enumerate(chunks):
-            docs_text.append(chunk)
-            docs_metadata.append({
+        for j, chunk in enumerate(chunk_text(text)):
+            key = guideline_doc_key(fname, j)
+            yield key, chunk, {
                 "source": fname,
                 "chunk_id": j,
                 "document_type": "guideline",
-                "original_id": f"guideline_{idx}"
-            })
-            idx += 1
-    
-    if not docs_text:
-        print("[IndexQdrant] No guidelines found.")
-        return
-    
-    print(f"[IndexQdrant] Embedding {len(docs_text)} guideline chunks...")
-    
-    # Genera embeddings
-    local_embedder = LocalEmbedder(_embedder)
-    embeddings = local_embedder.embed(docs_text)
-    
-    # Aggiungi a Qdrant
-    print(f"[IndexQdrant] Adding guidelines to Qdrant...")
-    chunks = []
-    for i in range(len(docs_text)):
-        doc_uuid = str(uuid.uuid5(uuid.NAMESPACE_DNS, f"guideline_{i}"))
-        emb = DenseEmbedding(name="text_embedding", vector=embeddings[i])
-        chunks.append(
-            Chunk(
-                id=doc_uuid,
-                text=docs_text[i],
-                embeddings=[emb],
-                metadata=docs_metadata[i]
-            )
-        )
-    
-    _vectorstore.add(chunk=chunks, collection_name="guidelines")
-    print(f"[IndexQdrant] ✓ Indexed {len(docs_text)} guideline chunks from {len(set(m['source'] for m in docs_metadata))} files.")
+                "original_id": f"guideline_{key}"
+            }
+
+
+def _index_guidelines() -> Optional[SyncStats]:
+    """Indicizza (incrementalmente) guidelines da file .txt."""
+    if not os.path.isdir(GUIDELINES_DIR):
+        print(f"[IndexQdrant] WARNING: {GUIDELINES_DIR} not found. Skipping guidelines indexing.")
+        return None
+    
+    print(f"[IndexQdrant] Syncing guidelines from {GUIDELINES_DIR}...")
+    manifest = _ensure_collection("guidelines")
+    stats = sync_collection(
+        _vectorstore.get_client(),
+        "guidelines",
+        _iter_guideline_docs(),
+        _embed_fn(),
+        manifest,
+        batch_size=INDEX_BATCH_SIZE,
+        progress=_progress_printer("guidelines"),
+    )
+    print(f"[IndexQdrant] ✓ Guidelines synced: {stats.summary()}.")
+    return stats
 
 
 def reset_collections():
@@ -265,18 +774,10 @@ def reset_collections():
     
     print("[IndexQdrant] Resetting all collections...")
     
-    try:
-        _vectorstore.delete_collection("cases")
-    except:
-        pass
-    
-    try:
-        _vectorstore.delete_collection("guidelines")
-    except:
-        pass
-    
     _initialized = False
-    _ensure_collections_populated()
+    # reset esplicito: ricostruisce dalle sorgenti ignorando lo snapshot esistente
+    _create_and_index_all()
+    _initialized = True
     
     print("[IndexQdrant] ✓ Collections reset complete.")
 
@@ -292,9 +793,8 @@ if __name__ == "__main__":
     print("\n✓ Vectorstore ready and populated!")
     
     # Test search
-    emb = get_embedder()
     test_query = "dilated cardiomyopathy with reduced ejection fraction"
-    test_emb = emb.encode([test_query], normalize_embeddings=True).tolist()[0]
+    test_emb = embed_query(test_query)
     
     print(f"\nTest search: '{test_query}'")
     results = vs.search(
@@ -0,0 +1,255 @@
+"""
+Index Snapshot - salva/ricarica le collection Qdrant (vettori + payload) su disco.
+
+Lo snapshot e' identificato da un fingerprint calcolato su:
+- contenuto dei file sorgente (documents.jsonl, guidelines *.txt)
+- nome del modello di embedding e dimensione dei vettori
+- parametri di chunking
+
+All'avvio, se il fingerprint coincide, le collection vengono ricaricate
+dallo snapshot senza ri-calcolare gli embedding.
+
+Layout su disco:
+    <snapshot_dir>/meta.json                   fingerprint + config collection
+    <snapshot_dir>/manifest.json               manifest dell'indexer incrementale
+    <snapshot_dir>/<collection>.vectors.npy    matrice float32 (N x D)
+    <snapshot_dir>/<collection>.points.jsonl   id + payload, stesso ordine
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from qdrant_client import QdrantClient
+
+# v2: payload con doc_key/content_hash/text_hash
+SNAPSHOT_FORMAT_VERSION = 2
+META_FILE = "meta.json"
+MANIFEST_FILE = "manifest.json"
+
+# pagina usata per scroll/upsert durante save/load
+PAGE_SIZE = 256
+
+
+def _file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def compute_fingerprint(source_files: Iterable[str], params: Dict) -> str:
+    """
+    Fingerprint deterministico di sorgenti + parametri di indicizzazione.
+    I file mancanti contribuiscono come "missing" (cosi' la loro comparsa invalida lo snapshot).
+    """
+    h = hashlib.sha256()
+    h.update(f"format={SNAPSHOT_FORMAT_VERSION}\n".encode("utf-8"))
+    h.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    for path in sorted(source_files):
+        name = os.path.basename(path)
+        digest = _file_digest(path) if os.path.isfile(path) else "missing"
+        h.update(f"\n{name}:{digest}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def read_snapshot_meta(snapshot_dir: str) -> Optional[Dict]:
+    meta_path = os.path.join(snapshot_dir, META_FILE)
+    if not os.path.isfile(meta_path):
+        return None
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def read_snapshot_manifest(snapshot_dir: str) -> Dict[str, Dict]:
+    """Manifest salvato insieme allo snapshot ({} se assente)."""
+    path = os.path.join(snapshot_dir, MANIFEST_FILE)
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _vectors_config(client: "QdrantClient", collection_name: str) -> Dict[str, Dict]:
+    vectors = client.get_collection(collection_name).config.params.vectors
+    if not isinstance(vectors, dict):
+        raise ValueError(f"Collection '{collection_name}' uses an unnamed vector; only named vectors are supported")
+    return {
+        name: {"size": params.size, "distance": params.distance.value}
+        for name, params in vectors.items()
+    }
+
+
+def _dump_collection(client: "QdrantClient", collection_name: str, out_dir: str) -> Dict:
+    """Scrive vettori e payload di una collection, pagina per pagina."""
+    vectors_cfg = _vectors_config(client, collection_name)
+    if len(vectors_cfg) != 1:
+        raise ValueError(f"Collection '{collection_name}' has {len(vectors_cfg)} vectors; expected exactly one")
+    vector_name, cfg = next(iter(vectors_cfg.items()))
+
+    # la matrice viene scritta direttamente su un .npy memory-mapped:
+    # la memoria resta pari a una pagina di scroll, non all'intera collection
+    total = client.count(collection_name, exact=True).count
+    matrix = np.lib.format.open_memmap(
+        os.path.join(out_dir, f"{collection_name}.vectors.npy"),
+        mode="w+",
+        dtype=np.float32,
+        shape=(total, cfg["size"]),
+    )
+    points_path = os.path.join(out_dir, f"{collection_name}.points.jsonl")
+    count = 0
+    offset = None
+    with open(points_path, "w", encoding="utf-8") as f:
+        while True:
+            records, offset = client.scroll(
+                collection_name=collection_name,
+                limit=PAGE_SIZE,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+            for r in records:
+                if count >= total:
+                    raise ValueError(f"Collection '{collection_name}' changed while saving the snapshot")
+                f.write(json.dumps({"id": str(r.id), "payload": r.payload}, ensure_ascii=False) + "\n")
+                matrix[count] = r.vector[vector_name]
+                count += 1
+            if offset is None:
+                break
+    matrix.flush()
+    del matrix
+    if count != total:
+        raise ValueError(f"Collection '{collection_name}' changed while saving the snapshot")
+
+    return {"vector_name": vector_name, "size": cfg["size"], "distance": cfg["distance"], "count": count}
+
+
+def save_snapshot(
+    client: "QdrantClient",
+    snapshot_dir: str,
+    fingerprint: str,
+    collection_names: List[str],
+    extra_meta: Optional[Dict] = None,
+    manifest: Optional[Dict] = None,
+) -> None:
+    """
+    Salva le collection indicate in snapshot_dir.
+    Scrive prima in una directory temporanea e poi la sostituisce, cosi' un crash
+    a meta' non lascia mai uno snapshot parziale con un fingerprint valido.
+    """
+    t0 = time.perf_counter()
+    parent = os.path.dirname(os.path.abspath(snapshot_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = f"{snapshot_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    try:
+        collections = {}
+        for name in collection_names:
+            if not client.collection_exists(name):
+                continue
+            collections[name] = _dump_collection(client, name, tmp_dir)
+
+        meta = {
+            "format": SNAPSHOT_FORMAT_VERSION,
+            "fingerprint": fingerprint,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "collections": collections,
+            **(extra_meta or {}),
+        }
+        with open(os.path.join(tmp_dir, META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        if manifest is not None:
+            with open(os.path.join(tmp_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+
+        old_dir = f"{snapshot_dir}.old-{os.getpid()}"
+        if os.path.exists(snapshot_dir):
+            os.replace(snapshot_dir, old_dir)
+        os.replace(tmp_dir, snapshot_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    total = sum(c["count"] for c in collections.values())
+    print(f"[IndexSnapshot] ✓ Saved {total} points to {snapshot_dir} in {time.perf_counter() - t0:.2f}s.")
+
+
+def _load_collection(client: "QdrantClient", snapshot_dir: str, collection_name: str, cfg: Dict) -> None:
+    from qdrant_client import models
+
+    vector_name = cfg["vector_name"]
+    matrix = np.load(os.path.join(snapshot_dir, f"{collection_name}.vectors.npy"), mmap_mode="r")
+    if matrix.shape != (cfg["count"], cfg["size"]):
+        raise ValueError(f"Snapshot for '{collection_name}' is corrupt: vectors shape {matrix.shape}")
+
+    if client.collection_exists(collection_name):
+        client.delete_collection(collection_name)
+    client.create_collection(
+        collection_name=collection_name,
+        vectors_config={
+            vector_name: models.VectorParams(size=cfg["size"], distance=models.Distance(cfg["distance"]))
+        },
+    )
+
+    batch: List["models.PointStruct"] = []
+    with open(os.path.join(snapshot_dir, f"{collection_name}.points.jsonl"), "r", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            obj = json.loads(line)
+            batch.append(
+                models.PointStruct(
+                    id=obj["id"],
+                    vector={vector_name: matrix[i].tolist()},
+                    payload=obj["payload"],
+                )
+            )
+            if len(batch) >= PAGE_SIZE:
+                client.upsert(collection_name=collection_name, points=batch, wait=True)
+                batch = []
+    if batch:
+        client.upsert(collection_name=collection_name, points=batch, wait=True)
+
+
+def load_snapshot(client: "QdrantClient", snapshot_dir: str, fingerprint: str) -> bool:
+    """
+    Ricarica le collection dallo snapshot se il fingerprint coincide.
+    Ritorna False (senza toccare il client) se lo snapshot manca o e' obsoleto.
+    """
+    meta = read_snapshot_meta(snapshot_dir)
+    if meta is None:
+        print(f"[IndexSnapshot] No snapshot found in {snapshot_dir}.")
+        return False
+    if meta.get("format") != SNAPSHOT_FORMAT_VERSION or meta.get("fingerprint") != fingerprint:
+        print("[IndexSnapshot] Snapshot is stale (fingerprint changed), rebuild required.")
+        return False
+
+    t0 = time.perf_counter()
+    try:
+        for name, cfg in meta.get("collections", {}).items():
+            _load_collection(client, snapshot_dir, name, cfg)
+    except Exception as e:
+        print(f"[IndexSnapshot] WARNING: failed to load snapshot ({e}), rebuild required.")
+        for name in meta.get("collections", {}):
+            try:
+                client.delete_collection(name)
+            except Exception:
+                pass
+        return False
+
+    total = sum(c["count"] for c in meta.get("collections", {}).values())
+    print(f"[IndexSnapshot] ✓ Loaded {total} points from snapshot in {time.perf_counter() - t0:.2f}s.")
+    return True
@@ -0,0 +1,294 @@
+"""
+Job Queue - coda di job persistente su SQLite con pool di worker limitato.
+
+- JobStore: tabella `jobs` in SQLite (WAL), condivisibile tra piu' processi
+  (es. worker uvicorn). Il claim di un job e' atomico (BEGIN IMMEDIATE).
+- JobWorkerPool: N thread che prelevano job in ordine FIFO e li eseguono con
+  l'handler registrato per il loro `kind`; throughput limitato dal numero di
+  worker, non dalle connessioni HTTP.
+
+Sopravvivenza ai riavvii: i job in esecuzione aggiornano un heartbeat. Un job
+`running` con heartbeat scaduto (processo morto/riavviato) torna in coda e
+viene ripreso, fino a `max_attempts` tentativi. Gli handler possono salvare
+checkpoint nello `state` del job per non ripetere stadi gia' completati.
+
+Stati: queued -> running -> succeeded | failed
+"""
+import os
+import time
+import json
+import uuid
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+_COLUMNS = (
+    "id", "kind", "status", "params", "state", "stages", "result", "error",
+    "attempts", "worker", "created_at", "started_at", "finished_at", "heartbeat_at",
+)
+_JSON_COLUMNS = ("params", "state", "stages", "result")
+
+
+class JobStore:
+    """Persistenza dei job; una connessione SQLite per thread."""
+
+    def __init__(self, path: str, stale_after_s: float = 30.0, max_attempts: int = 3):
+        self.path = path
+        self.stale_after_s = stale_after_s
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._init_schema()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL,"
+            " params TEXT, state TEXT, stages TEXT, result TEXT, error TEXT,"
+            " attempts INTEGER NOT NULL DEFAULT 0, worker TEXT,"
+            " created_at REAL, started_at REAL, finished_at REAL, heartbeat_at REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _row_to_job(row) -> Dict[str, Any]:
+        job = dict(zip(_COLUMNS, row))
+        for col in _JSON_COLUMNS:
+            job[col] = json.loads(job[col]) if job[col] is not None else None
+        return job
+
+    def create(self, kind: str, params: Dict[str, Any]) -> str:
+        job_id = uuid.uuid4().hex
+        self._conn().execute(
+            "INSERT INTO jobs (id, kind, status, params, state, stages, created_at)"
+            " VALUES (?, ?, ?, ?, '{}', '{}', ?)",
+            (job_id, kind, QUEUED, json.dumps(params), time.time()),
+        )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def claim_next(self, worker: str) -> Optional[Dict[str, Any]]:
+        """Prende il job in coda piu' vecchio (o uno rimasto orfano) e lo marca running."""
+        now = time.time()
+        with self._transaction() as conn:
+            self._recover_stale(conn, now)
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1,"
+                " started_at = ?, heartbeat_at = ? WHERE id = ?",
+                (RUNNING, worker, now, now, row[0]),
+            )
+        return self.get(row[0])
+
+    def _recover_stale(self, conn: sqlite3.Connection, now: float):
+        # running senza heartbeat recente: il processo che lo eseguiva non c'e' piu'
+        cutoff = now - self.stale_after_s
+        conn.execute(
+            "UPDATE jobs SET status = ?, finished_at = ?, error = 'worker lost (max attempts reached)'"
+            " WHERE status = ? AND heartbeat_at < ? AND attempts >= ?",
+            (FAILED, now, RUNNING, cutoff, self.max_attempts),
+        )
+        conn.execute(
+            "UPDATE jobs SET status = ?, worker = NULL WHERE status = ? AND heartbeat_at < ?",
+            (QUEUED, RUNNING, cutoff),
+        )
+
+    def heartbeat(self, job_ids, worker: str):
+        if not job_ids:
+            return
+        marks = ", ".join("?" for _ in job_ids)
+        self._conn().execute(
+            f"UPDATE jobs SET heartbeat_at = ? WHERE worker = ? AND status = ? AND id IN ({marks})",
+            (time.time(), worker, RUNNING, *job_ids),
+        )
+
+    def update_progress(self, job_id: str, stages: Dict[str, float], state: Dict[str, Any]):
+        self._conn().execute(
+            "UPDATE jobs SET stages = ?, state = ?, heartbeat_at = ? WHERE id = ?",
+            (json.dumps(stages), json.dumps(state), time.time(), job_id),
+        )
+
+    def finish(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None):
+        self._conn().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+            (status, json.dumps(result), error, time.time(), job_id),
+        )
+
+    def counts(self) -> Dict[str, int]:
+        rows = self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: n for status, n in rows}
+
+
+class JobContext:
+    """Passato all'handler: tempi per stadio e checkpoint persistenti."""
+
+    def __init__(self, store: JobStore, job: Dict[str, Any]):
+        self.store = store
+        self.job_id = job["id"]
+        self.stages: Dict[str, float] = dict(job.get("stages") or {})
+        self.state: Dict[str, Any] = dict(job.get("state") or {})
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = round(time.perf_counter() - t0, 4)
+            self.store.update_progress(self.job_id, self.stages, self.state)
+
+    def checkpoint(self, key: str, value: Any):
+        self.state[key] = value
+        self.store.update_progress(self.job_id, self.stages, self.state)
+
+
+# handler(params, ctx) -> (ok, result); ok=False o un'eccezione marcano il job come failed
+Handler = Callable[[Dict[str, Any], JobContext], Any]
+
+
+class JobWorkerPool:
+    """Pool di thread che esegue i job di un JobStore."""
+
+    def __init__(
+        self,
+        store: JobStore,
+        handlers: Dict[str, Handler],
+        workers: int = 2,
+        poll_interval_s: float = 0.5,
+        heartbeat_s: float = 5.0,
+    ):
+        self.store = store
+        self.handlers = handlers
+        self.workers = max(1, workers)
+        self.poll_interval_s = poll_interval_s
+        self.heartbeat_s = heartbeat_s
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._wakeup = threading.Condition()
+        self._stop = threading.Event()
+        self._running: Dict[str, float] = {}
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        t = threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True)
+        t.start()
+        self._threads.append(t)
+        print(f"[JobQueue] {self.workers} workers started ({self.worker_id})")
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self.notify()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def notify(self):
+        """Sveglia un worker (job appena accodato in questo processo)."""
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def submit(self, kind: str, params: Dict[str, Any]) -> str:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = self.store.create(kind, params)
+        self.notify()
+        return job_id
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.heartbeat_s):
+            try:
+                self.store.heartbeat(list(self._running), self.worker_id)
+            except sqlite3.Error as e:
+                print(f"[JobQueue] WARNING: heartbeat failed: {e}")
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            try:
+                job = self.store.claim_next(self.worker_id)
+            except sqlite3.Error as e:
+                print(f"[JobQueue] WARNING: claim failed: {e}")
+                job = None
+            if job is None:
+                # polling: i job possono arrivare anche da altri processi
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval_s)
+                continue
+            self._run(job)
+
+    def _run(self, job: Dict[str, Any]):
+        handler = self.handlers.get(job["kind"])
+        ctx = JobContext(self.store, job)
+        self._running[job["id"]] = time.time()
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown job kind: {job['kind']}")
+            ok, result = handler(job["params"], ctx)
+            error = result.get("error") if not ok and isinstance(result, dict) else None
+            self.store.finish(job["id"], SUCCEEDED if ok else FAILED, result=result, error=error)
+        except Exception as e:
+            print(f"[JobQueue] Job {job['id']} ({job['kind']}) failed: {e}")
+            self.store.finish(job["id"], FAILED, error=str(e))
+        finally:
+            self._running.pop(job["id"], None)
+
+
+def job_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Rappresentazione pubblica di un job (per GET /jobs/{id})."""
+    started, finished = job.get("started_at"), job.get("finished_at")
+    return {
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "created_at": job["created_at"],
+        "started_at": started,
+        "finished_at": finished,
+        "queued_s": round(started - job["created_at"], 4) if started else None,
+        "run_s": round(finished - started, 4) if started and finished else None,
+        "stages": job.get("stages") or {},
+        "result": job.get("result"),
+        "error": job.get("error"),
+    }
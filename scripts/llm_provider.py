@@ -0,0 +1,298 @@
+"""
+LLM Provider - interfaccia unica per le chiamate al modello (vision e testo).
+
+Backend selezionato con LLM_PROVIDER:
+
+- "openai" (default): Responses API dell'SDK ufficiale
+- "fake": stand-in locale deterministico, senza rete. Latenza al primo token
+  log-normale (LLM_FAKE_TTFT_MS mediana, LLM_FAKE_TTFT_SIGMA), token emessi
+  a LLM_FAKE_TOKENS_PER_S, LLM_FAKE_FAILURE_RATE di errori iniettati.
+  Il testo dipende solo dall'input: stessa richiesta -> stessa risposta
+- "record": chiama LLM_RECORD_INNER (default openai) e salva ogni risposta
+  (testo, delta, tempi) nel cassette JSONL LLM_CASSETTE_PATH
+- "replay": risponde dal cassette; con LLM_REPLAY_TIMING=1 riproduce anche
+  i tempi registrati. Richiesta non registrata -> LLMProviderError
+
+Le richieste usano il formato `input` della Responses API
+([{"role": ..., "content": ...}]); stream() ritorna i delta di testo e
+chiude la connessione a monte se il consumatore si ferma.
+"""
+import os
+import json
+import math
+import time
+import random
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, List, Optional
+
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai").lower()
+LLM_RECORD_INNER = os.getenv("LLM_RECORD_INNER", "openai").lower()
+LLM_CASSETTE_PATH = os.getenv("LLM_CASSETTE_PATH", os.path.join("data", "llm", "cassette.jsonl"))
+LLM_REPLAY_TIMING = os.getenv("LLM_REPLAY_TIMING", "0") == "1"
+
+LLM_FAKE_TTFT_MS = float(os.getenv("LLM_FAKE_TTFT_MS", "800"))
+LLM_FAKE_TTFT_SIGMA = float(os.getenv("LLM_FAKE_TTFT_SIGMA", "0.5"))
+LLM_FAKE_TOKENS_PER_S = float(os.getenv("LLM_FAKE_TOKENS_PER_S", "50"))
+LLM_FAKE_OUTPUT_TOKENS = int(os.getenv("LLM_FAKE_OUTPUT_TOKENS", "200"))
+LLM_FAKE_FAILURE_RATE = float(os.getenv("LLM_FAKE_FAILURE_RATE", "0"))
+LLM_FAKE_SEED = int(os.getenv("LLM_FAKE_SEED", "0"))
+
+
+class LLMProviderError(RuntimeError):
+    pass
+
+
+def request_key(model: str, messages: List[Dict[str, Any]], max_output_tokens: int) -> str:
+    """Hash di una richiesta (immagini comprese): chiave del cassette record/replay."""
+    payload = json.dumps(
+        {"model": model, "input": messages, "max_output_tokens": max_output_tokens},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMProvider(ABC):
+    """Interfaccia: generate() per la risposta completa, stream() per i delta."""
+
+    name = "base"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+
+    def _count(self, failed: bool = False):
+        with self._lock:
+            self.calls += 1
+            if failed:
+                self.failures += 1
+
+    def generate(self, model: str, messages: List[Dict[str, Any]], max_output_tokens: int) -> str:
+        return "".join(self.stream(model, messages, max_output_tokens))
+
+    @abstractmethod
+    def stream(self, model: str, messages: List[Dict[str, Any]], max_output_tokens: int) -> Iterator[str]:
+        """Delta di testo della risposta; chiudere il generatore chiude la richiesta a monte."""
+
+    def stats(self) -> Dict:
+        return {"provider": self.name, "calls": self.calls, "failures": self.failures}
+
+
+class OpenAIProvider(LLMProvider):
+    """Responses API di OpenAI (client creato al primo utilizzo)."""
+
+    name = "openai"
+
+    def __init__(self):
+        super().__init__()
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI()
+        return self._client
+
+    def generate(self, model, messages, max_output_tokens):
+        try:
+            resp = self.client.responses.create(model=model, input=messages, max_output_tokens=max_output_tokens)
+        except Exception:
+            self._count(failed=True)
+            raise
+        self._count()
+        return resp.output_text
+
+    def stream(self, model, messages, max_output_tokens):
+        try:
+            stream = self.client.responses.create(
+                model=model, input=messages, max_output_tokens=max_output_tokens, stream=True
+            )
+        except Exception:
+            self._count(failed=True)
+            raise
+        try:
+            for event in stream:
+                if getattr(event, "type", None) == "response.output_text.delta":
+                    yield event.delta
+        except Exception:
+            # stream interrotto a monte dopo l'apertura
+            self._count(failed=True)
+            raise
+        else:
+            self._count()
+        finally:
+            # consumatore fermo (es. client SSE disconnesso): chiude la connessione
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+
+
+_FAKE_WORDS = (
+    "left ventricle dilated reduced ejection fraction wall motion normal septum "
+    "hypokinesis valve regurgitation mild moderate severe probable diagnosis differential "
+    "confidence evidence frames case guideline recommend follow-up echo"
+).split()
+
+
+class FakeLLMProvider(LLMProvider):
+    """Stand-in locale: testo deterministico dall'input, latenza e errori configurabili."""
+
+    name = "fake"
+
+    def __init__(
+        self,
+        ttft_ms: float = LLM_FAKE_TTFT_MS,
+        ttft_sigma: float = LLM_FAKE_TTFT_SIGMA,
+        tokens_per_s: float = LLM_FAKE_TOKENS_PER_S,
+        output_tokens: int = LLM_FAKE_OUTPUT_TOKENS,
+        failure_rate: float = LLM_FAKE_FAILURE_RATE,
+        seed: int = LLM_FAKE_SEED,
+    ):
+        super().__init__()
+        self.ttft_ms = ttft_ms
+        self.ttft_sigma = ttft_sigma
+        self.tokens_per_s = tokens_per_s
+        self.output_tokens = output_tokens
+        self.failure_rate = failure_rate
+        self._rng = random.Random(seed)
+
+    def _sample(self):
+        """(ttft in secondi, errore iniettato?) dal generatore condiviso."""
+        with self._lock:
+            ttft = self.ttft_ms / 1000.0 * math.exp(self._rng.gauss(0.0, self.ttft_sigma)) if self.ttft_ms > 0 else 0.0
+            fail = self._rng.random() < self.failure_rate
+        return ttft, fail
+
+    def tokens(self, model: str, messages: List[Dict[str, Any]], max_output_tokens: int) -> List[str]:
+        digest = request_key(model, messages, max_output_tokens)
+        rng = random.Random(digest)
+        n = min(self.output_tokens, max_output_tokens)
+        return [f"[fake:{digest[:8]}]"] + [" " + rng.choice(_FAKE_WORDS) for _ in range(n - 1)]
+
+    def stream(self, model, messages, max_output_tokens):
+        ttft, fail = self._sample()
+        time.sleep(ttft)
+        if fail:
+            self._count(failed=True)
+            raise LLMProviderError("Injected LLM failure (fake provider)")
+        self._count()
+        interval = 1.0 / self.tokens_per_s if self.tokens_per_s > 0 else 0.0
+        for i, tok in enumerate(self.tokens(model, messages, max_output_tokens)):
+            if i and interval:
+                time.sleep(interval)
+            yield tok
+
+
+class RecordingProvider(LLMProvider):
+    """Inoltra a `inner` e appende risposte e tempi al cassette JSONL."""
+
+    name = "record"
+
+    def __init__(self, inner: LLMProvider, path: str = LLM_CASSETTE_PATH):
+        super().__init__()
+        self.inner = inner
+        self.path = path
+        self._write_lock = threading.Lock()
+
+    def _append(self, key: str, deltas: List[str], ttft_s: float, total_s: float):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        line = json.dumps(
+            {"key": key, "deltas": deltas, "ttft_s": round(ttft_s, 4), "total_s": round(total_s, 4)},
+            ensure_ascii=False,
+        )
+        with self._write_lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def stream(self, model, messages, max_output_tokens):
+        key = request_key(model, messages, max_output_tokens)
+        t0 = time.perf_counter()
+        ttft_s = None
+        deltas: List[str] = []
+        try:
+            for delta in self.inner.stream(model, messages, max_output_tokens):
+                if ttft_s is None:
+                    ttft_s = time.perf_counter() - t0
+                deltas.append(delta)
+                yield delta
+        except Exception:
+            self._count(failed=True)
+            raise
+        self._count()
+        # solo risposte complete (uno stream interrotto non arriva qui)
+        self._append(key, deltas, ttft_s or 0.0, time.perf_counter() - t0)
+
+    def stats(self) -> Dict:
+        return {**super().stats(), "inner": self.inner.name, "cassette": self.path}
+
+
+class ReplayProvider(LLMProvider):
+    """Risponde dal cassette registrato, opzionalmente con i tempi originali."""
+
+    name = "replay"
+
+    def __init__(self, path: str = LLM_CASSETTE_PATH, timing: bool = LLM_REPLAY_TIMING):
+        super().__init__()
+        self.path = path
+        self.timing = timing
+        self.misses = 0
+        self._records: Dict[str, Dict] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        rec = json.loads(line)
+                        self._records[rec["key"]] = rec
+        print(f"[LLMProvider] Replay cassette {path}: {len(self._records)} recorded responses")
+
+    def stream(self, model, messages, max_output_tokens):
+        rec = self._records.get(request_key(model, messages, max_output_tokens))
+        if rec is None:
+            with self._lock:
+                self.misses += 1
+            self._count(failed=True)
+            raise LLMProviderError(f"Request not recorded in cassette {self.path}")
+        self._count()
+        deltas = rec["deltas"]
+        if self.timing:
+            time.sleep(rec.get("ttft_s", 0.0))
+        interval = (rec.get("total_s", 0.0) - rec.get("ttft_s", 0.0)) / max(1, len(deltas) - 1) if self.timing else 0.0
+        for i, delta in enumerate(deltas):
+            if i and interval > 0:
+                time.sleep(interval)
+            yield delta
+
+    def stats(self) -> Dict:
+        return {**super().stats(), "recorded": len(self._records), "misses": self.misses}
+
+
+def create_llm_provider(name: str = LLM_PROVIDER) -> LLMProvider:
+    if name == "openai":
+        return OpenAIProvider()
+    if name == "fake":
+        return FakeLLMProvider()
+    if name == "record":
+        if LLM_RECORD_INNER in ("record", "replay"):
+            raise ValueError(f"LLM_RECORD_INNER must be a live provider, got '{LLM_RECORD_INNER}'")
+        return RecordingProvider(create_llm_provider(LLM_RECORD_INNER))
+    if name == "replay":
+        return ReplayProvider()
+    raise ValueError(f"Unknown LLM_PROVIDER '{name}' (expected 'openai', 'fake', 'record' or 'replay')")
+
+
+_provider: Optional[LLMProvider] = None
+_provider_lock = threading.Lock()
+
+
+def get_llm_provider() -> LLMProvider:
+    """Provider singleton del processo (LLM_PROVIDER)."""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = create_llm_provider()
+                print(f"[LLMProvider] Using '{_provider.name}' provider")
+    return _provider
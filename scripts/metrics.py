@@ -0,0 +1,342 @@
+"""
+Metrics - contatori, istogrammi e gauge in formato Prometheus (text exposition 0.0.4).
+
+Pensato per il percorso caldo delle richieste:
+- i figli con label si legano una volta (STAGE_SECONDS.labels("embed")) e si
+  riusano: nessun lookup ne' allocazione per osservazione
+- contatori e istogrammi sono a shard per thread: inc()/observe() scrivono
+  solo nella cella del thread corrente, senza lock; lo scrape somma le celle
+- lo stato gia' tenuto dai componenti (cache, code, indice) non viene
+  duplicato: si registra un collector letto solo allo scrape
+
+Nessuna dipendenza esterna (prometheus_client non e' richiesto).
+"""
+import math
+import time
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# bucket (secondi) da ~1 ms a 60 s: copre embedding/ricerche e chiamate LLM
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# (labels, valore) di un campione; famiglia = (nome, tipo, help, campioni)
+Sample = Tuple[Dict[str, str], float]
+Family = Tuple[str, str, str, List[Sample]]
+
+
+class _Shards:
+    """Celle per thread (liste di float) sommate alla lettura."""
+
+    __slots__ = ("_size", "_local", "_cells", "_lock")
+
+    def __init__(self, size: int):
+        self._size = size
+        self._local = threading.local()
+        self._cells: List[List[float]] = []
+        self._lock = threading.Lock()
+
+    def cell(self) -> List[float]:
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = [0.0] * self._size
+            with self._lock:
+                self._cells.append(cell)
+            self._local.cell = cell
+            return cell
+
+    def totals(self) -> List[float]:
+        with self._lock:
+            cells = list(self._cells)
+        out = [0.0] * self._size
+        for cell in cells:
+            for i, v in enumerate(cell):
+                out[i] += v
+        return out
+
+
+class _Timer:
+    __slots__ = ("_observe", "_t0")
+
+    def __init__(self, observe: Callable[[float], None]):
+        self._observe = observe
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._observe(time.perf_counter() - self._t0)
+        return False
+
+
+class CounterChild:
+    __slots__ = ("_shards",)
+
+    def __init__(self):
+        self._shards = _Shards(1)
+
+    def inc(self, n: float = 1.0):
+        self._shards.cell()[0] += n
+
+    def value(self) -> float:
+        return self._shards.totals()[0]
+
+
+class HistogramChild:
+    __slots__ = ("_bounds", "_shards")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self._bounds = bounds
+        # una cella per bucket, +Inf, poi la somma
+        self._shards = _Shards(len(bounds) + 2)
+
+    def observe(self, value: float):
+        cell = self._shards.cell()
+        cell[bisect_left(self._bounds, value)] += 1
+        cell[-1] += value
+
+    def time(self) -> _Timer:
+        """Context manager che osserva la durata del blocco (secondi)."""
+        return _Timer(self.observe)
+
+    def snapshot(self) -> Tuple[List[Tuple[float, float]], float, float]:
+        """(bucket cumulativi [(le, count)], count, sum)."""
+        totals = self._shards.totals()
+        cumulative, running = [], 0.0
+        for bound, n in zip(self._bounds + (math.inf,), totals[:-1]):
+            running += n
+            cumulative.append((bound, running))
+        return cumulative, running, totals[-1]
+
+
+class GaugeChild:
+    __slots__ = ("_value", "_fn", "_lock")
+
+    def __init__(self):
+        self._value = 0.0
+        self._fn: Optional[Callable[[], float]] = None
+        self._lock = threading.Lock()
+
+    def set(self, value: float):
+        self._value = value
+
+    def inc(self, n: float = 1.0):
+        with self._lock:
+            self._value += n
+
+    def dec(self, n: float = 1.0):
+        self.inc(-n)
+
+    def set_function(self, fn: Callable[[], float]):
+        """Valore letto da fn() a ogni scrape."""
+        self._fn = fn
+
+    def value(self) -> float:
+        return float(self._fn()) if self._fn is not None else self._value
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **kwargs):
+        """Figlio per i valori delle label (da legare una volta fuori dal percorso caldo)."""
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        key = tuple(str(v) for v in values)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {key}")
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _items(self):
+        with self._lock:
+            return list(self._children.items())
+
+    def collect(self) -> Family:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return CounterChild()
+
+    def inc(self, n: float = 1.0):
+        self.labels().inc(n)
+
+    def collect(self) -> Family:
+        samples = [(dict(zip(self.labelnames, k)), c.value()) for k, c in self._items()]
+        return self.name, self.kind, self.help, samples
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return GaugeChild()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def set_function(self, fn: Callable[[], float]):
+        self.labels().set_function(fn)
+
+    def collect(self) -> Family:
+        samples = [(dict(zip(self.labelnames, k)), c.value()) for k, c in self._items()]
+        return self.name, self.kind, self.help, samples
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets if b != math.inf))
+
+    def _new_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self) -> _Timer:
+        return self.labels().time()
+
+    def collect(self) -> Family:
+        samples: List[Sample] = []
+        for key, child in self._items():
+            labels = dict(zip(self.labelnames, key))
+            cumulative, count, total = child.snapshot()
+            for bound, n in cumulative:
+                samples.append(({**labels, "le": _format_value(bound)}, n))
+            samples.append(({**labels, "__suffix__": "_count"}, count))
+            samples.append(({**labels, "__suffix__": "_sum"}, total))
+        return self.name, self.kind, self.help, samples
+
+
+class MetricsRegistry:
+    """Metriche registrate per nome + collector valutati allo scrape."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, help: str, labelnames: Sequence[str], **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric '{name}' already registered with a different type or labels")
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help, labelnames, buckets=buckets)
+
+    def register_collector(self, fn: Callable[[], Iterable[Family]]):
+        """fn() -> famiglie (nome, tipo, help, [(labels, valore)]) lette a ogni scrape."""
+        with self._lock:
+            if fn not in self._collectors:
+                self._collectors.append(fn)
+
+    def collect(self) -> List[Family]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        families = [m.collect() for m in metrics]
+        for fn in collectors:
+            try:
+                families.extend(fn())
+            except Exception as e:
+                # uno scrape non deve fallire per un componente non disponibile
+                print(f"[Metrics] WARNING: collector {getattr(fn, '__name__', fn)} failed: {e}")
+        return families
+
+    def render(self) -> str:
+        return render_families(self.collect())
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render_families(families: Iterable[Family]) -> str:
+    lines: List[str] = []
+    for name, kind, help, samples in families:
+        lines.append(f"# HELP {name} {_escape(help)}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            labels = dict(labels)
+            suffix = labels.pop("__suffix__", "_bucket" if "le" in labels and kind == "histogram" else "")
+            label_str = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+            lines.append(f"{name}{suffix}{{{label_str}}} {_format_value(value)}" if label_str
+                         else f"{name}{suffix} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# ----------------------------------
+# Metriche della pipeline RAG
+# ----------------------------------
+STAGE_SECONDS = REGISTRY.histogram(
+    "rag_stage_duration_seconds",
+    "Duration of RAG pipeline stages (embed, frame_extraction, image_encode, prompt_build, llm, llm_first_token)",
+    ["stage"],
+)
+SEARCH_SECONDS = REGISTRY.histogram(
+    "rag_search_duration_seconds", "Vector search duration per collection", ["collection"]
+)
+HTTP_REQUESTS = REGISTRY.counter(
+    "rag_http_requests_total", "HTTP requests by route and status code", ["method", "route", "status"]
+)
+HTTP_SECONDS = REGISTRY.histogram(
+    "rag_http_request_duration_seconds", "HTTP request duration, including streamed bodies", ["method", "route"]
+)
+
+
+def counter_family(name: str, help: str, samples: List[Sample]) -> Family:
+    return name, "counter", help, samples
+
+
+def gauge_family(name: str, help: str, samples: List[Sample]) -> Family:
+    return name, "gauge", help, samples
@@ -1,12 +1,19 @@
 import os
 import sys
-import base64
-from typing import List, Dict, Any, Optional, Tuple
+import time
+import threading
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 
 # Add src to path per import del vectorstore_manager
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
 
-from scripts.index_Qdrant import get_vectorstore, get_embedder
+from scripts.index_Qdrant import get_vectorstore, embed_query, embedding_model_id, index_version
+from scripts.image_payload_cache import ImagePayloadCache, RenderSettings
+from scripts.frame_manifest import FRAME_MANIFEST, FrameManifest
+from scripts.result_cache import ResultCache, analysis_cache_key
+from scripts.llm_provider import get_llm_provider
+from scripts.metrics import SEARCH_SECONDS, STAGE_SECONDS
+from scripts.tracing import open_span, span
 
 # ----------------------------------
 # Config
@@ -14,10 +21,6 @@ from scripts.index_Qdrant import get_vectorstore, get_embedder
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.abspath(os.path.join(BASE_DIR, "..", "data", "dataset_built"))
 
-# Usa il vectorstore manager (auto-indexing al primo utilizzo)
-vectorstore = get_vectorstore()
-embedder = get_embedder()
-
 TOPK_CASES = 5
 TOPK_GUIDES = 4
 
@@ -26,20 +29,86 @@ MAX_QUERY_FRAMES = 12
 MAX_SIMILAR_FRAMES_TOTAL = 12
 
 MODEL_VISION = "gpt-4o"
-# OpenAI client dal SDK ufficiale
-from openai import OpenAI
-client = OpenAI()
+MAX_OUTPUT_TOKENS = 900
+
+# Immagini del prompt: ridimensionate/ricodificate una volta e servite dalla cache
+# (IMAGE_PAYLOAD_FORMAT=original invia i PNG cosi' come sono)
+IMAGE_PAYLOAD_FORMAT = os.getenv("IMAGE_PAYLOAD_FORMAT", "jpeg").lower()
+IMAGE_PAYLOAD_MAX_SIDE = int(os.getenv("IMAGE_PAYLOAD_MAX_SIDE", "768"))
+IMAGE_PAYLOAD_QUALITY = int(os.getenv("IMAGE_PAYLOAD_QUALITY", "80"))
+IMAGE_CACHE_MAX_MB = float(os.getenv("IMAGE_CACHE_MAX_MB", "64"))
+IMAGE_CACHE_DISK_PATH = os.getenv("IMAGE_CACHE_DISK_PATH") or None
+
+# Frame dei casi simili dal frame manifest della build (in memoria, ricontrollato ogni N s)
+FRAME_MANIFEST_REFRESH_S = float(os.getenv("FRAME_MANIFEST_REFRESH_S", "5"))
+
+# Cache dei risultati di run_multimodal_rag (RESULT_CACHE_SIZE=0 per disattivarla)
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "256"))
+RESULT_CACHE_TTL_S = float(os.getenv("RESULT_CACHE_TTL_S", "3600"))
+
+# Chiamate al modello tramite get_llm_provider() (LLM_PROVIDER: openai | fake | record | replay)
+# (il vectorstore arriva da get_vectorstore(): auto-indexing alla prima ricerca)
+
+# Metriche per fase (/metrics), legate una volta sola
+_SEARCH_SECONDS = {name: SEARCH_SECONDS.labels(name) for name in ("cases", "guidelines")}
+_IMAGE_ENCODE_SECONDS = STAGE_SECONDS.labels("image_encode")
+_PROMPT_BUILD_SECONDS = STAGE_SECONDS.labels("prompt_build")
+_LLM_SECONDS = STAGE_SECONDS.labels("llm")
+_LLM_FIRST_TOKEN_SECONDS = STAGE_SECONDS.labels("llm_first_token")
+
+
+_image_cache: Optional[ImagePayloadCache] = None
+_image_cache_lock = threading.Lock()
+
+
+def get_image_cache() -> ImagePayloadCache:
+    """Ritorna la cache singleton dei payload immagine."""
+    global _image_cache
+    if _image_cache is None:
+        with _image_cache_lock:
+            if _image_cache is None:
+                _image_cache = ImagePayloadCache(
+                    settings=RenderSettings(
+                        fmt=IMAGE_PAYLOAD_FORMAT,
+                        max_side=IMAGE_PAYLOAD_MAX_SIDE,
+                        quality=IMAGE_PAYLOAD_QUALITY,
+                    ),
+                    max_bytes=int(IMAGE_CACHE_MAX_MB * 1024 * 1024),
+                    disk_path=IMAGE_CACHE_DISK_PATH,
+                )
+    return _image_cache
+
+
+_result_cache: Optional[ResultCache] = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> ResultCache:
+    """Ritorna la cache singleton dei risultati delle analisi."""
+    global _result_cache
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                _result_cache = ResultCache(max_entries=RESULT_CACHE_SIZE, ttl_s=RESULT_CACHE_TTL_S)
+    return _result_cache
+
+
+_frame_manifest: Optional[FrameManifest] = None
+
+
+def get_frame_manifest() -> FrameManifest:
+    global _frame_manifest
+    if _frame_manifest is None:
+        _frame_manifest = FrameManifest(os.path.join(DATA_DIR, FRAME_MANIFEST), refresh_s=FRAME_MANIFEST_REFRESH_S)
+    return _frame_manifest
 
 # ----------------------------------
 # Helpers
 # ----------------------------------
 def image_to_data_url(path: str) -> str:
-    """Encode local image as data URL for OpenAI image input."""
-    with open(path, "rb") as f:
-        b = f.read()
-    b64 = base64.b64encode(b).decode("utf-8")
-    mime = "image/png" if path.lower().endswith(".png") else "image/jpeg"
-    return f"data:{mime};base64,{b64}"
+    """Encode local image as data URL for OpenAI image input (resized/re-encoded, cached)."""
+    with _IMAGE_ENCODE_SECONDS.time():
+        return get_image_cache().get_data_url(path)
 
 def uniform_sample(items: List[str], n: int) -> List[str]:
     if n <= 0:
@@ -61,6 +130,11 @@ def list_frames_in_folder(folder: Optional[str]) -> List[str]:
     )
 
 def pick_frames_for_case(case_id: str, n: int) -> List[str]:
+    manifest = get_frame_manifest()
+    if manifest.available:
+        # frame in ordine temporale, senza accesso al filesystem
+        return uniform_sample(manifest.frame_paths(case_id), n)
+    # dataset costruito senza frame manifest: listing della directory del caso
     case_dir = os.path.join(DATA_DIR, "images", case_id)
     frames = list_frames_in_folder(case_dir)
     return uniform_sample(frames, n)
@@ -68,20 +142,28 @@ def pick_frames_for_case(case_id: str, n: int) -> List[str]:
 def retrieve_similar_qdrant(
     collection_name: str,
     query_text: str,
-    k: int
+    k: int,
+    query_vector: Optional[List[float]] = None,
 ) -> Dict[str, Any]:
     """Retrieve similar documents from Qdrant collection."""
-    # embed query
-    q_emb = embedder.encode([query_text], normalize_embeddings=True).tolist()[0]
+    # embed query (via query cache, a meno che il vettore sia gia' calcolato)
+    q_emb = query_vector if query_vector is not None else embed_query(query_text)
     
     try:
         # search in Qdrant (vector_name deve corrispondere a quello in index_Qdrant.py)
-        hits = vectorstore.search(
-            collection_name=collection_name,
-            query_vector=q_emb,
-            vector_name="text_embedding",  # allineato con index_Qdrant.py
-            k=k
-        )
+        vectorstore = get_vectorstore()
+        t0 = time.perf_counter()
+        with span("search", collection=collection_name, k=k) as sp:
+            hits = vectorstore.search(
+                collection_name=collection_name,
+                query_vector=q_emb,
+                vector_name="text_embedding",  # allineato con index_Qdrant.py
+                k=k
+            )
+            sp.set(hits=len(hits))
+        timer = _SEARCH_SECONDS.get(collection_name)
+        if timer is not None:
+            timer.observe(time.perf_counter() - t0)
     except Exception as e:
         print(f"[WARNING] Search failed for collection '{collection_name}': {e}")
         hits = []
@@ -211,23 +293,188 @@ RETRIEVED GUIDELINES:
 # ----------------------------------
 # Main pipeline
 # ----------------------------------
+def _analysis_params() -> Dict[str, Any]:
+    """Parametri che influenzano l'output di un'analisi (parte della chiave della result cache)."""
+    return {
+        "topk_cases": TOPK_CASES,
+        "topk_guides": TOPK_GUIDES,
+        "frames_per_similar_case": FRAMES_PER_SIMILAR_CASE,
+        "max_similar_frames": MAX_SIMILAR_FRAMES_TOTAL,
+        "model": MODEL_VISION,
+        "llm_provider": get_llm_provider().name,
+        "max_output_tokens": MAX_OUTPUT_TOKENS,
+        "system_prompt": SYSTEM_PROMPT,
+        "image_payload": get_image_cache().settings.key(),
+        "embedding_model": embedding_model_id(),
+    }
+
+
+def _query_frames(query_frames_folder: Optional[str], query_frame_paths: Optional[List[str]]) -> List[str]:
+    if query_frame_paths is None:
+        query_frame_paths = list_frames_in_folder(query_frames_folder)
+    return uniform_sample(query_frame_paths, MAX_QUERY_FRAMES)
+
+
+def _result_key(report_text: str, query_frame_paths: List[str]) -> str:
+    # indice inizializzato prima di leggerne la versione
+    get_vectorstore()
+    return analysis_cache_key(report_text, query_frame_paths, _analysis_params(), index_version())
+
+
 def run_multimodal_rag(
     report_text: str,
     query_frames_folder: Optional[str] = None,
     query_frame_paths: Optional[List[str]] = None,
+    bypass_cache: bool = False,
 ) -> str:
-    """Main RAG pipeline: retrieve cases/guidelines, build multimodal prompt, call OpenAI."""
+    """
+    Main RAG pipeline: retrieve cases/guidelines, build multimodal prompt, call the vision model.
+    Identical analyses (same normalized report, frame contents, parameters and index
+    version) are served from the result cache; bypass_cache forces a fresh call.
+    """
+    query_frame_paths = _query_frames(query_frames_folder, query_frame_paths)
+
+    cache = get_result_cache()
+    with span("multimodal_rag", frames=len(query_frame_paths), bypass_cache=bypass_cache) as sp:
+        if cache.max_entries <= 0:
+            return _run_multimodal_rag(report_text, query_frame_paths)["answer"]
+
+        computed = []
+
+        def compute():
+            computed.append(True)
+            return _run_multimodal_rag(report_text, query_frame_paths)
+
+        result = cache.get_or_compute(
+            _result_key(report_text, query_frame_paths),
+            compute,
+            bypass=bypass_cache,
+        )
+        sp.set(cached=not computed)
+        return result["answer"]
+
+
+def iter_multimodal_rag(
+    report_text: str,
+    query_frames_folder: Optional[str] = None,
+    query_frame_paths: Optional[List[str]] = None,
+    bypass_cache: bool = False,
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Streaming variant of run_multimodal_rag, yields (event, data):
+    - "sources": retrieved cases/guidelines, as soon as retrieval is done
+    - "token": answer text delta from the model
+    - "done": full answer, timings (retrieval_s, first_token_s, total_s) and cached flag
+    The complete answer is stored in the same result cache used by run_multimodal_rag.
+    """
+    t0 = time.perf_counter()
+    query_frame_paths = _query_frames(query_frames_folder, query_frame_paths)
+
+    cache = get_result_cache()
+    key = None
+    if cache.max_entries > 0:
+        with span("result_cache", bypass=bypass_cache) as sp:
+            key = _result_key(report_text, query_frame_paths)
+            hit = cache.lookup(key, bypass=bypass_cache)
+            sp.set(hit=hit is not None)
+        if hit is not None:
+            yield "sources", {"sources": hit["sources"]}
+            yield "token", {"text": hit["answer"]}
+            yield "done", {
+                "answer": hit["answer"],
+                "cached": True,
+                "timings": {"total_s": round(time.perf_counter() - t0, 4)},
+            }
+            return
+
+    sources, messages = _prepare_request(report_text, query_frame_paths)
+    retrieval_s = time.perf_counter() - t0
+    yield "sources", {"sources": sources, "retrieval_s": round(retrieval_s, 4)}
+
+    parts: List[str] = []
+    first_token_s = None
+    t_llm = time.perf_counter()
+    # generatore: lo span non viene attivato (ogni next() puo' girare in un contesto diverso)
+    llm_span = open_span("llm", model=MODEL_VISION, stream=True)
+    deltas = get_llm_provider().stream(MODEL_VISION, messages, MAX_OUTPUT_TOKENS)
+    try:
+        for delta in deltas:
+            if first_token_s is None:
+                first_token_s = time.perf_counter() - t0
+                _LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - t_llm)
+                llm_span.set(first_token_ms=round((time.perf_counter() - t_llm) * 1000, 3))
+            parts.append(delta)
+            yield "token", {"text": delta}
+    except Exception as e:
+        llm_span.record_error(e)
+        raise
+    finally:
+        # client disconnesso: chiude lo stream del provider (e la connessione a monte)
+        deltas.close()
+        llm_span.set(deltas=len(parts))
+        llm_span.finish()
+    _LLM_SECONDS.observe(time.perf_counter() - t_llm)
+
+    answer = "".join(parts)
+    if key is not None:
+        cache.put(key, {"answer": answer, "sources": sources})
+    yield "done", {
+        "answer": answer,
+        "cached": False,
+        "timings": {
+            "retrieval_s": round(retrieval_s, 4),
+            "first_token_s": round(first_token_s, 4) if first_token_s is not None else None,
+            "total_s": round(time.perf_counter() - t0, 4),
+        },
+    }
+
+
+def _analysis_sources(cases_res: Dict[str, Any], guides_res: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Fonti recuperate nel formato di /chat (type, id, score, snippet, metadata)."""
+    sources = []
+    for kind, res in (("case", cases_res), ("guideline", guides_res)):
+        if not res:
+            continue
+        for doc_id, meta, doc, score in zip(
+            res["ids"][0], res["metadatas"][0], res["documents"][0], res["distances"][0]
+        ):
+            sources.append({
+                "type": kind,
+                "id": doc_id,
+                "score": score,
+                "snippet": doc[:200] + "...",
+                "metadata": meta,
+            })
+    return sources
+
+
+def _prepare_request(report_text: str, query_frame_paths: List[str]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Retrieval + prompt multimodale: ritorna (fonti, input per la Responses API)."""
+    # embedding del report una sola volta per entrambe le collection
+    query_vector = embed_query(report_text)
+
     # 1) Retrieve similar cases
-    cases_res = retrieve_similar_qdrant("cases", report_text, TOPK_CASES)
+    cases_res = retrieve_similar_qdrant("cases", report_text, TOPK_CASES, query_vector=query_vector)
     if not cases_res["ids"][0]:
         print("[WARNING] No similar cases found. Check if 'cases' collection is populated.")
 
     # 2) Retrieve guidelines (optional)
-    guides_res = retrieve_similar_qdrant("guidelines", report_text, TOPK_GUIDES)
+    guides_res = retrieve_similar_qdrant("guidelines", report_text, TOPK_GUIDES, query_vector=query_vector)
     if not guides_res["ids"][0]:
         print("[INFO] No guidelines found. Continuing without guideline context.")
         guides_res = None
 
+    with span("prompt_build", query_frames=len(query_frame_paths)), _PROMPT_BUILD_SECONDS.time():
+        messages = _build_messages(report_text, query_frame_paths, cases_res, guides_res)
+    return _analysis_sources(cases_res, guides_res), messages
+
+
+def _build_messages(
+    report_text: str,
+    query_frame_paths: List[str],
+    cases_res: Dict[str, Any],
+    guides_res: Optional[Dict[str, Any]],
+) -> List[Dict[str, Any]]:
     # 3) kNN vote
     knn_candidates = knn_vote_labels(
         cases_res["metadatas"][0],
@@ -235,38 +482,44 @@ def run_multimodal_rag(
         topn=3
     )
 
-    # 4) Frames
-    if query_frame_paths is None:
-        query_frame_paths = list_frames_in_folder(query_frames_folder)
-    query_frame_paths = uniform_sample(query_frame_paths, MAX_QUERY_FRAMES)
-
-    # 5) Supporting frames from similar cases
-    case_ids = cases_res["ids"][0]
+    # 4) Supporting frames from similar cases: gli id dei hit sono UUID dei punti Qdrant,
+    # manifest e images/ sono per case_id (case_card e frame dello stesso caso contati una volta)
+    case_ids: List[str] = []
+    for meta in cases_res["metadatas"][0]:
+        cid = meta.get("case_id") or meta.get("original_id")
+        if cid and cid not in case_ids:
+            case_ids.append(cid)
     similar_frames: List[str] = []
     for cid in case_ids:
         similar_frames.extend(pick_frames_for_case(cid, FRAMES_PER_SIMILAR_CASE))
     similar_frames = uniform_sample(similar_frames, MAX_SIMILAR_FRAMES_TOTAL)
 
-    # 6) Build prompt context
+    # 5) Build prompt context
     user_text = build_user_payload(report_text, knn_candidates, cases_res, guides_res)
 
-    # 7) Build multimodal content
+    # 6) Build multimodal content
     content: List[Dict[str, Any]] = [{"type": "input_text", "text": user_text}]
-    for p in query_frame_paths:
-        content.append({"type": "input_image", "image_url": image_to_data_url(p)})
-    for p in similar_frames:
-        content.append({"type": "input_image", "image_url": image_to_data_url(p)})
-
-    # 8) OpenAI call
-    resp = client.responses.create(
-        model=MODEL_VISION,
-        input=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": content},
-        ],
-        max_output_tokens=900,
-    )
-    return resp.output_text
+    with span("image_encode", query_frames=len(query_frame_paths), similar_frames=len(similar_frames)) as sp:
+        for p in query_frame_paths:
+            content.append({"type": "input_image", "image_url": image_to_data_url(p)})
+        for p in similar_frames:
+            content.append({"type": "input_image", "image_url": image_to_data_url(p)})
+        sp.set(image_bytes=sum(len(c["image_url"]) for c in content[1:]))
+
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": content},
+    ]
+
+
+def _run_multimodal_rag(report_text: str, query_frame_paths: List[str]) -> Dict[str, Any]:
+    sources, messages = _prepare_request(report_text, query_frame_paths)
+
+    # 7) Vision model call
+    with span("llm", model=MODEL_VISION) as sp, _LLM_SECONDS.time():
+        answer = get_llm_provider().generate(MODEL_VISION, messages, MAX_OUTPUT_TOKENS)
+        sp.set(output_chars=len(answer))
+    return {"answer": answer, "sources": sources}
 
 # ----------------------------------
 # CLI
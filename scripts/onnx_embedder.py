@@ -0,0 +1,204 @@
+"""
+ONNX Embedder - backend CPU alternativo a SentenceTransformer.
+
+Il transformer di all-MiniLM-L6-v2 viene esportato in ONNX e quantizzato
+int8 (quantizzazione dinamica dei pesi) ed eseguito con onnxruntime.
+Tokenizzazione, mean pooling e normalizzazione replicano la pipeline di
+sentence-transformers, quindi i vettori restano compatibili con le
+collection gia' indicizzate con il backend torch.
+
+`OnnxEmbedder.encode()` ha la stessa firma usata nel repo per
+SentenceTransformer.encode(), cosi' puo' essere restituito da get_embedder().
+
+Export (richiede torch + transformers, una tantum):
+    python scripts/onnx_embedder.py --out data/models/all-MiniLM-L6-v2-onnx-int8
+"""
+import os
+import json
+import argparse
+from typing import List, Optional
+
+import numpy as np
+
+MODEL_FILE = "model.onnx"
+QUANTIZED_MODEL_FILE = "model.int8.onnx"
+CONFIG_FILE = "embedder_config.json"
+
+
+def _require_onnxruntime():
+    try:
+        import onnxruntime
+    except ImportError as e:
+        raise ImportError(
+            "EMBED_BACKEND=onnx requires onnxruntime: pip install onnxruntime"
+        ) from e
+    return onnxruntime
+
+
+def mean_pool(token_embeddings: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+    """Media dei token embedding pesata dalla attention mask (come sentence-transformers)."""
+    mask = attention_mask[..., None].astype(token_embeddings.dtype)
+    summed = (token_embeddings * mask).sum(axis=1)
+    counts = np.clip(mask.sum(axis=1), 1e-9, None)
+    return summed / counts
+
+
+def l2_normalize(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.clip(norms, 1e-12, None)
+
+
+class OnnxEmbedder:
+    """Embedder onnxruntime con interfaccia compatibile con SentenceTransformer.encode()."""
+
+    def __init__(self, model_dir: str, quantized: bool = True, intra_op_threads: Optional[int] = None):
+        ort = _require_onnxruntime()
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(model_dir, CONFIG_FILE), "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+        self.max_seq_length = int(self.config.get("max_seq_length", 256))
+        self.normalize = bool(self.config.get("normalize", True))
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+        model_path = os.path.join(model_dir, QUANTIZED_MODEL_FILE if quantized else MODEL_FILE)
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            opts.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(model_path, sess_options=opts, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.model_path = model_path
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        enc = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_seq_length,
+            return_tensors="np",
+        )
+        feeds = {k: v.astype(np.int64) for k, v in enc.items() if k in self.input_names}
+        token_embeddings = self.session.run(None, feeds)[0]
+        return mean_pool(token_embeddings, enc["attention_mask"])
+
+    def encode(self, texts, normalize_embeddings: bool = False, batch_size: int = 32, **kwargs) -> np.ndarray:
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        # come sentence-transformers: batch per lunghezza simile, meno padding
+        order = np.argsort([-len(t) for t in texts], kind="stable")
+        out: List[Optional[np.ndarray]] = [None] * len(texts)
+        batch_size = max(1, batch_size)
+        for start in range(0, len(texts), batch_size):
+            idx = order[start:start + batch_size]
+            vectors = self._encode_batch([texts[i] for i in idx])
+            for i, vec in zip(idx, vectors):
+                out[i] = vec
+
+        result = np.stack(out).astype(np.float32)
+        if self.normalize or normalize_embeddings:
+            result = l2_normalize(result)
+        return result[0] if single else result
+
+
+def export_onnx(model_name: str, out_dir: str, quantize: bool = True, opset: int = 14) -> str:
+    """
+    Esporta il transformer di un modello sentence-transformers in ONNX
+    (e versione int8 se `quantize`). Ritorna la directory del modello.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(out_dir, exist_ok=True)
+    st = SentenceTransformer(model_name, device="cpu")
+    transformer = st[0]
+    hf_model = transformer.auto_model.eval()
+    tokenizer = transformer.tokenizer
+    normalize = any(type(m).__name__ == "Normalize" for m in st)
+
+    dummy = tokenizer(["export sample"], return_tensors="pt")
+    input_names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in dummy]
+    dynamic_axes = {n: {0: "batch", 1: "seq"} for n in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "seq"}
+
+    model_path = os.path.join(out_dir, MODEL_FILE)
+    print(f"[OnnxEmbedder] Exporting {model_name} -> {model_path}")
+    with torch.no_grad():
+        torch.onnx.export(
+            hf_model,
+            tuple(dummy[n] for n in input_names),
+            model_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+        )
+
+    if quantize:
+        quantize_onnx(out_dir)
+
+    tokenizer.save_pretrained(out_dir)
+    with open(os.path.join(out_dir, CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "model": model_name,
+                "max_seq_length": st.max_seq_length,
+                "normalize": normalize,
+                "quantized": quantize,
+                "opset": opset,
+            },
+            f,
+            indent=2,
+        )
+    return out_dir
+
+
+def quantize_onnx(model_dir: str) -> str:
+    """Quantizzazione dinamica int8 di model.onnx -> model.int8.onnx. Ritorna il path int8."""
+    _require_onnxruntime()
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    q_path = os.path.join(model_dir, QUANTIZED_MODEL_FILE)
+    print(f"[OnnxEmbedder] Quantizing (dynamic int8) -> {q_path}")
+    quantize_dynamic(os.path.join(model_dir, MODEL_FILE), q_path, weight_type=QuantType.QInt8)
+    return q_path
+
+
+def ensure_onnx_model(model_name: str, model_dir: str, quantized: bool = True) -> str:
+    """
+    Garantisce in `model_dir` il file di modello richiesto dal backend
+    (int8 o fp32). Un export fp32 (--no-quantize) a cui manca solo la versione
+    int8 viene quantizzato sul posto; altrimenti si esporta da capo.
+    """
+    config_path = os.path.join(model_dir, CONFIG_FILE)
+    needed = os.path.join(model_dir, QUANTIZED_MODEL_FILE if quantized else MODEL_FILE)
+    if os.path.exists(config_path) and os.path.exists(needed):
+        return model_dir
+    if quantized and os.path.exists(config_path) and os.path.exists(os.path.join(model_dir, MODEL_FILE)):
+        print(f"[OnnxEmbedder] int8 model missing in {model_dir}, quantizing the fp32 export...")
+        quantize_onnx(model_dir)
+        with open(config_path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        config["quantized"] = True
+        with open(config_path, "w", encoding="utf-8") as f:
+            json.dump(config, f, indent=2)
+        return model_dir
+    print(f"[OnnxEmbedder] ONNX model not found in {model_dir}, exporting...")
+    return export_onnx(model_name, model_dir, quantize=quantized)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a sentence-transformers model to (int8) ONNX")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--out", required=True, help="Output directory")
+    parser.add_argument("--no-quantize", action="store_true", help="Export fp32 only")
+    args = parser.parse_args()
+    export_onnx(args.model, args.out, quantize=not args.no_quantize)
+
+
+if __name__ == "__main__":
+    main()
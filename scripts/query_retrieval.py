@@ -1,56 +1,65 @@
 import os
-from sentence_transformers import SentenceTransformer
-
-from datapizza.vectorstores.qdrant import QdrantVectorstore
 
 # -----------------------------
 # Setup
 # -----------------------------
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-# use Qdrant in-memory
-vectorstore = QdrantVectorstore(location=":memory:")
-
-# if server Qdrant:
-# vectorstore = QdrantVectorstore(host="localhost", port=6333)
 
 # collection
 COLLECTION_NAME = "cases"
+EMB_MODEL = "all-MiniLM-L6-v2"
 
-# -----------------------------
-# Model
-# -----------------------------
-model = SentenceTransformer("all-MiniLM-L6-v2")
 
-print("Ready. Empty query to exit.")
+def main():
+    # import qui: caricare il modulo non deve inizializzare modello e vectorstore
+    from sentence_transformers import SentenceTransformer
+    from datapizza.vectorstores.qdrant import QdrantVectorstore
+
+    # use Qdrant in-memory
+    vectorstore = QdrantVectorstore(location=":memory:")
+
+    # if server Qdrant:
+    # vectorstore = QdrantVectorstore(host="localhost", port=6333)
+
+    # -----------------------------
+    # Model
+    # -----------------------------
+    model = SentenceTransformer(EMB_MODEL)
+
+    print("Ready. Empty query to exit.")
+
+    while True:
+        q = input("\nQuery: ").strip()
+        if not q:
+            break
+
+        # 1) fai embedding alla query
+        q_emb = model.encode([q], normalize_embeddings=True).tolist()[0]
 
-while True:
-    q = input("\nQuery: ").strip()
-    if not q:
-        break
+        # 2) cerca nel vectorstore
+        # `vector_name` deve essere il nome usato quando hai creato la collection
+        results = vectorstore.search(
+            collection_name=COLLECTION_NAME,
+            query_vector=q_emb,
+            vector_name="text_embeddings",  # o come si chiama il tuo vettore
+            k=5
+        )
 
-    # 1) fai embedding alla query
-    q_emb = model.encode([q], normalize_embeddings=True).tolist()[0]
+        # 3) stampa
+        if not results:
+            print("No results found.")
+            continue
 
-    # 2) cerca nel vectorstore
-    # `vector_name` deve essere il nome usato quando hai creato la collection
-    results = vectorstore.search(
-        collection_name=COLLECTION_NAME,
-        query_vector=q_emb,
-        vector_name="text_embeddings",  # o come si chiama il tuo vettore
-        k=5
-    )
+        print(f"\nTop {len(results)} results:")
 
-    # 3) stampa
-    if not results:
-        print("No results found.")
-        continue
+        for i, chunk in enumerate(results, start=1):
+            meta = chunk.metadata
+            text = chunk.text
+            score = chunk.score
 
-    print(f"\nTop {len(results)} results:")
+            print(f"\n#{i} id={chunk.id}  score={score:.4f}")
+            print(text)
 
-    for i, chunk in enumerate(results, start=1):
-        meta = chunk.metadata
-        text = chunk.text
-        score = chunk.score
 
-        print(f"\n#{i} id={chunk.id}  score={score:.4f}")
-        print(text)
+if __name__ == "__main__":
+    main()
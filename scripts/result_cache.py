@@ -0,0 +1,145 @@
+"""
+Result Cache - cache dei risultati di run_multimodal_rag.
+
+Chiave: sha256 di report normalizzato, contenuto dei frame della query,
+parametri di retrieval/prompt, modello e versione dell'indice. Un reindex,
+anche fatto da un'altra replica, cambia la versione (index_Qdrant.index_version()),
+quindi le analisi calcolate sul vecchio indice non vengono piu' trovate ed
+escono per LRU/TTL.
+
+- LRU in-process con limite di entry e TTL
+- single-flight: richieste identiche concorrenti (doppio click, retry dopo
+  timeout del client) aspettano il primo calcolo invece di ripeterlo
+- gli errori non vengono messi in cache
+"""
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from scripts.embedding_cache import normalize_query
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def analysis_cache_key(report_text: str, frame_paths: List[str], params: Dict[str, Any], index_version: str) -> str:
+    """Chiave di un'analisi: report normalizzato + byte dei frame (in ordine) + parametri + versione indice."""
+    h = hashlib.sha256()
+    h.update(normalize_query(report_text).encode("utf-8"))
+    for path in frame_paths:
+        h.update(b"\0frame\0" + file_digest(path).encode("ascii"))
+    h.update(b"\0params\0" + json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+    h.update(f"\0index\0{index_version}".encode("utf-8"))
+    return h.hexdigest()
+
+
+class ResultCache:
+    """LRU+TTL con single-flight per chiave e contatori hit/miss."""
+
+    def __init__(self, max_entries: int = 256, ttl_s: float = 3600.0):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._mem: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, threading.Event] = {}
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.coalesced = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._mem.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if self.ttl_s and time.monotonic() > expires:
+                del self._mem[key]
+                return None
+            self._mem.move_to_end(key)
+            return value
+
+    def lookup(self, key: str, bypass: bool = False) -> Optional[Any]:
+        """get() con contatori, per chi calcola e salva il valore da se' (es. streaming)."""
+        if bypass:
+            self.bypassed += 1
+            return None
+        value = self.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value: Any):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._mem[key] = (value, time.monotonic() + self.ttl_s)
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_entries:
+                self._mem.popitem(last=False)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any], bypass: bool = False) -> Any:
+        """
+        Valore in cache per `key`, altrimenti compute(). Con `bypass` calcola
+        sempre e aggiorna la cache con il risultato fresco.
+        """
+        if bypass:
+            self.bypassed += 1
+            value = compute()
+            self.put(key, value)
+            return value
+
+        while True:
+            value = self.get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            with self._lock:
+                event = self._inflight.get(key)
+                if event is None:
+                    event = self._inflight[key] = threading.Event()
+                    owner = True
+                else:
+                    owner = False
+            if owner:
+                break
+            # stesso calcolo gia' in corso: attende e rilegge (se fallito, riprova)
+            self.coalesced += 1
+            event.wait()
+
+        self.misses += 1
+        try:
+            value = compute()
+            self.put(key, value)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._mem),
+            "max_entries": self.max_entries,
+            "ttl_s": self.ttl_s,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "coalesced": self.coalesced,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,102 @@
+"""
+SQLite KV - tabella chiave/valore su disco condivisa tra i worker (WAL).
+
+Tier L2 delle cache in-process (embedding delle query, payload immagine):
+- una connessione per thread
+- TTL opzionale, controllato in lettura
+- ogni 100 scritture si tengono solo le `max_entries` entry piu' recenti
+- `encode`/`decode` convertono i valori da/verso la colonna `value`
+- `namespace` (es. il modello di embedding) e' salvato in meta: se cambia
+  la tabella viene svuotata
+"""
+import os
+import time
+import sqlite3
+import threading
+from typing import Any, Callable, Optional
+
+
+def _identity(value: Any) -> Any:
+    return value
+
+
+class SqliteKV:
+    """Tabella `table` (key, value, created) in un file SQLite condiviso."""
+
+    def __init__(
+        self,
+        path: str,
+        table: str,
+        encode: Callable[[Any], Any] = _identity,
+        decode: Callable[[Any], Any] = _identity,
+        ttl_s: float = 0.0,
+        max_entries: int = 0,
+        namespace: Optional[str] = None,
+    ):
+        if not table.isidentifier():
+            raise ValueError(f"Invalid table name: {table!r}")
+        self.path = path
+        self.table = table
+        self.encode = encode
+        self.decode = decode
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.namespace = namespace
+        self._local = threading.local()
+        self._puts = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._init_schema()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._conn()
+        with conn:
+            columns = [row[1] for row in conn.execute(f"PRAGMA table_info({self.table})")]
+            if columns and "value" not in columns:
+                # tabella di una versione precedente (colonne diverse): e' una cache, si riparte
+                conn.execute(f"DROP TABLE {self.table}")
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, value BLOB, created REAL)")
+            if self.namespace is None:
+                return
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT)")
+            meta_key = f"{self.table}.namespace"
+            row = conn.execute("SELECT v FROM meta WHERE k = ?", (meta_key,)).fetchone()
+            if row is None or row[0] != self.namespace:
+                conn.execute(f"DELETE FROM {self.table}")
+                conn.execute("INSERT OR REPLACE INTO meta (k, v) VALUES (?, ?)", (meta_key, self.namespace))
+
+    def get(self, key: str) -> Optional[Any]:
+        row = self._conn().execute(f"SELECT value, created FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if self.ttl_s and time.time() - row[1] > self.ttl_s:
+            return None
+        return self.decode(row[0])
+
+    def put(self, key: str, value: Any):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created) VALUES (?, ?, ?)",
+                (key, self.encode(value), time.time()),
+            )
+            self._puts += 1
+            if self.max_entries and self._puts % 100 == 0:
+                conn.execute(
+                    f"DELETE FROM {self.table} WHERE key NOT IN "
+                    f"(SELECT key FROM {self.table} ORDER BY created DESC LIMIT ?)",
+                    (self.max_entries,),
+                )
+
+    def clear(self):
+        conn = self._conn()
+        with conn:
+            conn.execute(f"DELETE FROM {self.table}")
@@ -0,0 +1,178 @@
+"""
+Synthetic Data - generatori deterministici per test e benchmark (nessun dato reale).
+
+- write_synthetic_dicom / generate_dicom_tree: DICOM US multi-frame nella
+  struttura di data/raw_data (<label>/<file>.dcm)
+- generate_case_documents: documents.jsonl (case card + frame) come lo
+  scrive build_dataset, senza passare dai DICOM: serve per le scale
+  (100k casi) dove generare e decodificare i DICOM non e' l'oggetto della misura
+- generate_guidelines: file .txt di linee guida da chunkare e indicizzare
+- HashEmbedder: stand-in di SentenceTransformer (stesso testo -> stesso vettore)
+"""
+import os
+import json
+import hashlib
+from typing import List
+
+import numpy as np
+
+LABELS = [
+    "Normal",
+    "Normal_with_septal_hypertrophy",
+    "dilated_cardiomyopathy_with_global_dysfunction",
+    "inferoapical_septal_akinesia",
+]
+VIEWS = ["4CH", "2CH", "PLAX", "PSAX", "3CH"]
+STAGES = ["Basale", "Low dose", "Peak", "Recovery"]
+
+_WORDS = (
+    "left right ventricle atrium septum wall motion hypokinesis akinesia dilated "
+    "ejection fraction reduced preserved mitral aortic valve regurgitation stenosis "
+    "apical inferior lateral anterior segment strain thickening function global "
+    "echocardiography stress dobutamine ischemia viability recommendation class level"
+).split()
+
+
+class HashEmbedder:
+    """
+    Deterministic stand-in for SentenceTransformer (no model download).
+    Same text -> same 384-dim vector; counts encoded texts and calls.
+    """
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+        self.calls = 0
+        self.encoded = 0
+
+    def encode(self, texts, normalize_embeddings=False, **kwargs):
+        self.calls += 1
+        self.encoded += len(texts)
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, t in enumerate(texts):
+            seed = int.from_bytes(hashlib.sha256(t.encode("utf-8")).digest()[:4], "little")
+            out[i] = np.random.default_rng(seed).standard_normal(self.dim)
+        if normalize_embeddings:
+            out /= np.linalg.norm(out, axis=1, keepdims=True)
+        return out
+
+
+def write_synthetic_dicom(path, frames=4, rows=16, cols=16, sop_uid=None, seed=0):
+    """Write a small multi-frame 8-bit MONOCHROME2 ultrasound DICOM with patient tags."""
+    import pydicom
+    from pydicom.dataset import FileDataset, FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.3.1"  # US Multi-frame Image Storage
+    meta.MediaStorageSOPInstanceUID = sop_uid or generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    ds = FileDataset(str(path), {}, file_meta=meta, preamble=b"\0" * 128)
+    ds.SOPClassUID = meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.PatientName = "Test^Patient"
+    ds.PatientID = "12345"
+    ds.Modality = "US"
+    ds.SeriesDescription = "4CH"
+    ds.Rows, ds.Columns = rows, cols
+    ds.NumberOfFrames = frames
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated = 8
+    ds.BitsStored = 8
+    ds.HighBit = 7
+    ds.PixelRepresentation = 0
+    ds.CineRate = 25
+    pixels = np.random.default_rng(seed).integers(0, 255, size=(frames, rows, cols), dtype=np.uint8)
+    ds.PixelData = pixels.tobytes()
+
+    if int(pydicom.__version__.split(".")[0]) >= 3:
+        ds.save_as(str(path), enforce_file_format=True)
+    else:
+        ds.is_little_endian = True
+        ds.is_implicit_VR = False
+        ds.save_as(str(path), write_like_original=False)
+    return pixels
+
+
+def generate_dicom_tree(root: str, n_cases: int, frames: int = 24, rows: int = 64, cols: int = 64, seed: int = 0) -> List[str]:
+    """n_cases DICOM distribuiti sulle etichette di LABELS; ritorna i path."""
+    paths = []
+    for i in range(n_cases):
+        label_dir = os.path.join(root, LABELS[i % len(LABELS)])
+        os.makedirs(label_dir, exist_ok=True)
+        path = os.path.join(label_dir, f"IM-{i:06d}.dcm")
+        write_synthetic_dicom(path, frames=frames, rows=rows, cols=cols, seed=seed + i)
+        paths.append(path)
+    return paths
+
+
+def _sentence(rng: np.random.Generator, n_words: int) -> str:
+    return " ".join(rng.choice(_WORDS, size=n_words)).capitalize() + "."
+
+
+def generate_case_documents(jsonl_path: str, n_cases: int, frames_per_case: int = 3, seed: int = 0) -> int:
+    """Scrive documents.jsonl con n_cases case card + frame_per_case frame ciascuno; ritorna i documenti."""
+    from scripts.build_dataset import build_case_card, label_info
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.dirname(os.path.abspath(jsonl_path)), exist_ok=True)
+    n_docs = 0
+    with open(jsonl_path, "w", encoding="utf-8") as f:
+        for i in range(n_cases):
+            label = LABELS[i % len(LABELS)]
+            lm = label_info(label)
+            meta = {
+                "case_id": hashlib.sha256(f"synthetic-{seed}-{i}".encode()).hexdigest()[:12],
+                "anonymized": True,
+                "diagnosis_label_raw": label,
+                "diagnosis_label_short": lm["short"],
+                "diagnosis_label_pretty": lm["pretty"],
+                "diagnosis_group": lm["group"],
+                "source_path": f"{label}/IM-{i:06d}.dcm",
+                "modality": "US",
+                "view": VIEWS[int(rng.integers(len(VIEWS)))],
+                "stage": STAGES[int(rng.integers(len(STAGES)))],
+                "num_frames": int(rng.integers(20, 120)),
+                "fps": 25,
+                "rows": 480,
+                "columns": 640,
+                "photometric": "MONOCHROME2",
+                "mean_intensity": float(rng.random()),
+                "motion_energy": float(rng.random() / 10),
+                "motion_std": float(rng.random() / 20),
+                "feature_frames_used": 64,
+            }
+            f.write(json.dumps({"content": build_case_card(meta), "metadata": {**meta, "document_type": "case_card"}}) + "\n")
+            for j in range(frames_per_case):
+                f.write(json.dumps({
+                    "content": f"Representative ultrasound frame from cine loop. View: {meta['view']}, Stage: {meta['stage']}.",
+                    "metadata": {
+                        **meta,
+                        "frame_index": j + 1,
+                        "image_path": f"images/{meta['case_id']}/frame_{j + 1:03d}.png",
+                        "document_type": "frame",
+                    },
+                }) + "\n")
+            n_docs += 1 + frames_per_case
+    return n_docs
+
+
+def generate_guidelines(out_dir: str, n_files: int, paragraphs: int = 20, seed: int = 0) -> List[str]:
+    """n_files linee guida sintetiche (.txt), `paragraphs` paragrafi ciascuna."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for i in range(n_files):
+        path = os.path.join(out_dir, f"synthetic_guideline_{i:04d}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            for _ in range(paragraphs):
+                f.write(" ".join(_sentence(rng, int(rng.integers(8, 20))) for _ in range(5)) + "\n\n")
+        paths.append(path)
+    return paths
+
+
+def synthetic_reports(n: int, seed: int = 0) -> List[str]:
+    """Referti/domande sintetiche distinti (nessun hit nella query cache tra loro)."""
+    rng = np.random.default_rng(seed)
+    return [f"{_sentence(rng, 12)} {_sentence(rng, 10)} (#{i})" for i in range(n)]
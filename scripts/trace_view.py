@@ -0,0 +1,169 @@
+"""
+Trace View - vista "flame" delle tracce scritte da scripts/tracing.py.
+
+Per ogni traccia stampa l'albero degli span con durata, tempo proprio (self,
+escluso il tempo dei figli) e una barra posizionata sulla timeline della
+richiesta: span concorrenti (es. ricerche su cases e guidelines) appaiono
+sovrapposti. Con --summary aggrega per nome di span su tutte le tracce
+selezionate (totale, self, p50/p95).
+
+Uso:
+    python scripts/trace_view.py                      # ultime 5 tracce
+    python scripts/trace_view.py --slowest 10
+    python scripts/trace_view.py --request-id 3f2a9c...
+    python scripts/trace_view.py --min-ms 2000 --summary
+"""
+import os
+import sys
+import json
+import argparse
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.tracing import TRACE_PATH, trace_files
+
+_SKIP_ATTRS = {"method"}
+
+
+def load_traces(path: str = TRACE_PATH) -> List[Dict[str, Any]]:
+    """Tracce dai file (backup ruotati compresi), dalla piu' vecchia; righe illeggibili saltate."""
+    traces = []
+    for file in trace_files(path):
+        with open(file, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    traces.append(json.loads(line))
+                except ValueError:
+                    continue
+    return traces
+
+
+def select_traces(
+    traces: List[Dict[str, Any]],
+    request_id: Optional[str] = None,
+    min_ms: float = 0.0,
+    slowest: Optional[int] = None,
+    last: int = 5,
+) -> List[Dict[str, Any]]:
+    if request_id:
+        return [t for t in traces if t.get("request_id", "").startswith(request_id)]
+    selected = [t for t in traces if t.get("duration_ms", 0.0) >= min_ms]
+    if slowest:
+        return sorted(selected, key=lambda t: t["duration_ms"], reverse=True)[:slowest]
+    return selected[-last:] if last else selected
+
+
+def self_ms(node: Dict[str, Any]) -> float:
+    """Durata meno l'unione degli intervalli dei figli (figli paralleli non contati due volte)."""
+    intervals = sorted(
+        (c["start_ms"], c["start_ms"] + c["duration_ms"]) for c in node.get("children", [])
+    )
+    covered, cur_start, cur_end = 0.0, None, None
+    for s, e in intervals:
+        if cur_end is None or s > cur_end:
+            if cur_end is not None:
+                covered += cur_end - cur_start
+            cur_start, cur_end = s, e
+        else:
+            cur_end = max(cur_end, e)
+    if cur_end is not None:
+        covered += cur_end - cur_start
+    return max(0.0, node["duration_ms"] - covered)
+
+
+def _walk(node: Dict[str, Any], depth: int = 0) -> Iterator[tuple]:
+    yield node, depth
+    for child in sorted(node.get("children", []), key=lambda c: c["start_ms"]):
+        yield from _walk(child, depth + 1)
+
+
+def _format_attrs(node: Dict[str, Any]) -> str:
+    parts = [f"{k}={v}" for k, v in (node.get("attrs") or {}).items() if k not in _SKIP_ATTRS]
+    if node.get("thread"):
+        parts.append(f"@{node['thread']}")
+    if node.get("error"):
+        parts.append(f"ERROR {node['error']}")
+    if node.get("unfinished"):
+        parts.append("(unfinished)")
+    return " ".join(parts)
+
+
+def render_trace(trace: Dict[str, Any], width: int = 40) -> str:
+    total = trace["duration_ms"] or 1e-9
+    lines = [
+        f"request {trace.get('request_id')}  {trace['name']}  {trace['duration_ms']:.1f} ms"
+        + (f"  (dropped spans: {trace['dropped_spans']})" if trace.get("dropped_spans") else "")
+    ]
+    lines.append(f"{'total ms':>10} {'self ms':>9}  {'timeline':<{width + 2}}  span")
+    for node, depth in _walk(trace):
+        offset = min(width - 1, int(node["start_ms"] / total * width))
+        length = max(1, min(width - offset, round(node["duration_ms"] / total * width)))
+        bar = " " * offset + "#" * length + " " * (width - offset - length)
+        lines.append(
+            f"{node['duration_ms']:>10.1f} {self_ms(node):>9.1f}  |{bar}|  "
+            f"{'  ' * depth}{node['name']} {_format_attrs(node)}".rstrip()
+        )
+    return "\n".join(lines)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def summarize(traces: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Per nome di span: conteggio, tempo totale e proprio, p50/p95 della durata."""
+    by_name: Dict[str, Dict[str, Any]] = {}
+    for trace in traces:
+        for node, depth in _walk(trace):
+            name = node["name"] if depth else "(request)"
+            row = by_name.setdefault(name, {"span": name, "count": 0, "total_ms": 0.0, "self_ms": 0.0, "durations": []})
+            row["count"] += 1
+            row["total_ms"] += node["duration_ms"]
+            row["self_ms"] += self_ms(node)
+            row["durations"].append(node["duration_ms"])
+    rows = []
+    for row in by_name.values():
+        durations = row.pop("durations")
+        row["p50_ms"] = _percentile(durations, 50)
+        row["p95_ms"] = _percentile(durations, 95)
+        rows.append(row)
+    return sorted(rows, key=lambda r: r["self_ms"], reverse=True)
+
+
+def render_summary(rows: List[Dict[str, Any]]) -> str:
+    lines = [f"{'span':<24}{'count':>7}{'total ms':>12}{'self ms':>12}{'p50 ms':>10}{'p95 ms':>10}"]
+    for r in rows:
+        lines.append(
+            f"{r['span']:<24}{r['count']:>7}{r['total_ms']:>12.1f}{r['self_ms']:>12.1f}"
+            f"{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Flame-style view of request traces")
+    parser.add_argument("--path", default=TRACE_PATH, help=f"Trace log (default {TRACE_PATH})")
+    parser.add_argument("--request-id", help="Show the trace(s) with this request ID (prefix match)")
+    parser.add_argument("--slowest", type=int, help="Show the N slowest traces")
+    parser.add_argument("--last", type=int, default=5, help="Show the last N traces (default 5, 0 = all)")
+    parser.add_argument("--min-ms", type=float, default=0.0, help="Only traces at least this slow")
+    parser.add_argument("--width", type=int, default=40, help="Timeline width in characters")
+    parser.add_argument("--summary", action="store_true", help="Aggregate time per span name instead")
+    args = parser.parse_args(argv)
+
+    traces = select_traces(load_traces(args.path), args.request_id, args.min_ms, args.slowest, args.last)
+    if not traces:
+        print(f"[TraceView] No traces found in {args.path}")
+        return 1
+    if args.summary:
+        print(f"[TraceView] {len(traces)} traces")
+        print(render_summary(summarize(traces)))
+        return 0
+    print("\n\n".join(render_trace(t, args.width) for t in traces))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,364 @@
+"""
+Tracing - span annidati per richiesta, esportati in un JSONL locale a rotazione.
+
+- start_trace(name, request_id=...) apre lo span radice (una richiesta HTTP,
+  un job); span(name, **attrs) apre uno span figlio dello span corrente.
+  Lo span corrente vive in un ContextVar: asyncio.to_thread e i task lo
+  ereditano; per executor e thread espliciti si passa bind(fn)
+- open_span() crea uno span senza renderlo corrente, da chiudere con
+  finish(): per i generatori, che tra un yield e l'altro possono cambiare
+  thread/contesto
+- fuori da una traccia span() non fa nulla (costo: una lettura del ContextVar)
+
+Tail-based sampling alla chiusura della radice: si scrive sempre una traccia
+piu' lenta di TRACE_SLOW_MS o in errore, le altre con probabilita'
+TRACE_SAMPLE_RATE. Serializzazione e scrittura avvengono su un thread
+dedicato (la chiusura della radice sull'event loop costa solo un put in coda).
+Il file TRACE_PATH ruota oltre TRACE_MAX_MB (TRACE_BACKUPS file .1, .2, ...).
+Visualizzazione: scripts/trace_view.py.
+"""
+import os
+import json
+import time
+import uuid
+import queue
+import random
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "1") != "0"
+TRACE_PATH = os.getenv("TRACE_PATH", os.path.join("data", "traces", "traces.jsonl"))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "1000"))
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_MAX_MB = float(os.getenv("TRACE_MAX_MB", "20"))
+TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS", "3"))
+# tracce in attesa di scrittura: oltre, quelle nuove vengono scartate (e contate)
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "1000"))
+# limite di span per traccia (es. reindex con migliaia di batch): oltre vengono contati e scartati
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "1000"))
+
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+class _Trace:
+    __slots__ = ("request_id", "span_ids", "dropped")
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.span_ids = itertools.count()
+        self.dropped = 0
+
+
+class Span:
+    """Span di una traccia: nome, attributi, tempi (perf_counter) e figli."""
+
+    __slots__ = ("name", "trace", "span_id", "parent", "start", "end", "attrs", "children", "error", "thread")
+
+    def __init__(self, name: str, trace: _Trace, span_id: int, parent: Optional["Span"], attrs: Dict[str, Any]):
+        self.name = name
+        self.trace = trace
+        self.span_id = span_id
+        self.parent = parent
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attrs = attrs
+        self.children: List["Span"] = []
+        self.error: Optional[str] = None
+        self.thread = threading.current_thread().name
+        if parent is not None:
+            parent.children.append(self)
+
+    @property
+    def request_id(self) -> str:
+        return self.trace.request_id
+
+    @property
+    def duration_s(self) -> Optional[float]:
+        return None if self.end is None else self.end - self.start
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def record_error(self, exc: BaseException):
+        self.error = f"{type(exc).__name__}: {exc}"
+
+    def finish(self):
+        if self.end is None:
+            self.end = time.perf_counter()
+
+    def to_dict(self, origin: float, until: float, parent_thread: Optional[str] = None) -> Dict[str, Any]:
+        end = self.end if self.end is not None else until
+        out: Dict[str, Any] = {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round((end - self.start) * 1000, 3),
+        }
+        if self.attrs:
+            # copia: uno span ancora aperto (es. ricerca oltre il timeout) puo' aggiornarli dal suo thread
+            out["attrs"] = dict(self.attrs)
+        if self.error:
+            out["error"] = self.error
+        if self.end is None:
+            out["unfinished"] = True
+        if parent_thread is not None and self.thread != parent_thread:
+            out["thread"] = self.thread
+        if self.children:
+            out["children"] = [c.to_dict(origin, until, self.thread) for c in list(self.children)]
+        return out
+
+
+class _NoopSpan:
+    """Span fuori traccia (o oltre TRACE_MAX_SPANS): ignora tutto."""
+
+    __slots__ = ()
+    request_id = None
+    duration_s = None
+
+    def set(self, **attrs):
+        pass
+
+    def record_error(self, exc: BaseException):
+        pass
+
+    def finish(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def current_request_id() -> Optional[str]:
+    sp = _current.get()
+    return sp.trace.request_id if sp is not None else None
+
+
+def open_span(name: str, **attrs):
+    """Span figlio dello span corrente, non attivato: chiuderlo con finish()."""
+    parent = _current.get()
+    if parent is None:
+        return NOOP_SPAN
+    trace = parent.trace
+    span_id = next(trace.span_ids)
+    if span_id >= TRACE_MAX_SPANS:
+        trace.dropped += 1
+        return NOOP_SPAN
+    return Span(name, trace, span_id, parent, attrs)
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Any]:
+    """Span figlio dello span corrente, attivo nel blocco (errori registrati e rilanciati)."""
+    sp = open_span(name, **attrs)
+    if sp is NOOP_SPAN:
+        yield sp
+        return
+    token = _current.set(sp)
+    try:
+        yield sp
+    except BaseException as e:
+        sp.record_error(e)
+        raise
+    finally:
+        sp.finish()
+        _current.reset(token)
+
+
+@contextmanager
+def start_trace(name: str, request_id: Optional[str] = None, **attrs) -> Iterator[Any]:
+    """
+    Span radice di una nuova traccia; alla chiusura la traccia passa
+    all'exporter (tail-based sampling). Con TRACE_ENABLED=0 non fa nulla.
+    """
+    if not TRACE_ENABLED:
+        yield NOOP_SPAN
+        return
+    trace = _Trace(request_id or new_request_id())
+    root = Span(name, trace, next(trace.span_ids), None, attrs)
+    token = _current.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        root.record_error(e)
+        raise
+    finally:
+        root.finish()
+        _current.reset(token)
+        try:
+            get_trace_exporter().offer(root)
+        except Exception as e:
+            print(f"[Tracing] WARNING: trace export failed: {e}")
+
+
+def bind(fn: Callable) -> Callable:
+    """fn eseguita nel contesto corrente (span e request ID) anche su un altro thread/executor."""
+    ctx = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # copia per chiamata: la stessa funzione puo' girare su piu' thread insieme
+        return ctx.copy().run(fn, *args, **kwargs)
+
+    return run
+
+
+def trace_to_dict(root: Span) -> Dict[str, Any]:
+    out = root.to_dict(root.start, root.end or time.perf_counter())
+    out = {
+        "request_id": root.trace.request_id,
+        "ts": round(time.time() - (time.perf_counter() - root.start), 3),
+        **out,
+    }
+    if root.trace.dropped:
+        out["dropped_spans"] = root.trace.dropped
+    return out
+
+
+class TraceExporter:
+    """
+    Scrittura JSONL (una traccia per riga) con rotazione per dimensione e
+    tail-based sampling. offer() decide e accoda; un solo thread writer
+    serializza e scrive, anche durante picchi di errori o latenza.
+    """
+
+    def __init__(
+        self,
+        path: str = TRACE_PATH,
+        slow_ms: float = TRACE_SLOW_MS,
+        sample_rate: float = TRACE_SAMPLE_RATE,
+        max_bytes: int = int(TRACE_MAX_MB * 1024 * 1024),
+        backups: int = TRACE_BACKUPS,
+        seed: Optional[int] = None,
+        queue_size: int = TRACE_QUEUE_SIZE,
+    ):
+        self.path = path
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.backups = max(0, backups)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._size: Optional[int] = None
+        self._queue: "queue.Queue[Span]" = queue.Queue(maxsize=max(1, queue_size))
+        self._writer: Optional[threading.Thread] = None
+        self.offered = 0
+        self.exported = 0
+        self.dropped = 0
+        self.rotations = 0
+
+    def should_export(self, root: Span) -> bool:
+        duration_ms = (root.duration_s or 0.0) * 1000
+        if duration_ms >= self.slow_ms or root.error or int(root.attrs.get("status", 0) or 0) >= 500:
+            return True
+        with self._lock:
+            return self._rng.random() < self.sample_rate
+
+    def offer(self, root: Span) -> bool:
+        """Decide alla fine della richiesta se tenere la traccia; True se accodata per la scrittura."""
+        with self._lock:
+            self.offered += 1
+        if not self.should_export(root):
+            return False
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(root)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def _ensure_writer(self):
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, name="trace-writer", daemon=True)
+                    self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            root = self._queue.get()
+            try:
+                self.write(trace_to_dict(root))
+            except Exception as e:
+                print(f"[Tracing] WARNING: trace export failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """Attende la scrittura delle tracce gia' accodate (test, shutdown)."""
+        self._queue.join()
+
+    def write(self, record: Dict[str, Any]):
+        line = (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        with self._lock:
+            if self._size is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            if self._size and self._size + len(line) > self.max_bytes:
+                self._rotate()
+            with open(self.path, "ab") as f:
+                f.write(line)
+            self._size += len(line)
+            self.exported += 1
+
+    def _rotate(self):
+        if self.backups == 0:
+            os.remove(self.path)
+        else:
+            for i in range(self.backups - 1, 0, -1):
+                src = f"{self.path}.{i}"
+                if os.path.exists(src):
+                    os.replace(src, f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        self._size = 0
+        self.rotations += 1
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": TRACE_ENABLED,
+            "path": self.path,
+            "slow_ms": self.slow_ms,
+            "sample_rate": self.sample_rate,
+            "offered": self.offered,
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "queued": self._queue.qsize(),
+            "rotations": self.rotations,
+        }
+
+
+def trace_files(path: str = TRACE_PATH) -> List[str]:
+    """File di trace dal piu' vecchio al piu' recente (backup ruotati compresi)."""
+    rotated = []
+    i = 1
+    while os.path.exists(f"{path}.{i}"):
+        rotated.append(f"{path}.{i}")
+        i += 1
+    files = list(reversed(rotated))
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+_exporter: Optional[TraceExporter] = None
+_exporter_lock = threading.Lock()
+
+
+def get_trace_exporter() -> TraceExporter:
+    """Exporter singleton del processo (TRACE_PATH)."""
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = TraceExporter()
+    return _exporter
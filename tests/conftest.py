@@ -8,6 +8,9 @@ import os
 # Add project root to path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+# generatori condivisi con scripts/benchmark.py (write_synthetic_dicom importato anche dai test)
+from scripts.synthetic_data import HashEmbedder, write_synthetic_dicom  # noqa: F401
+
 
 @pytest.fixture(scope="session")
 def project_root():
@@ -57,6 +60,23 @@ def mock_dicom_metadata():
     }
 
 
+@pytest.fixture
+def fake_embedder():
+    """Return a deterministic fake sentence-transformer."""
+    return HashEmbedder()
+
+
+@pytest.fixture
+def raw_dicom_tree(tmp_path):
+    """Return a raw_data-like tree (<label>/<file>.dcm) with synthetic DICOMs."""
+    root = tmp_path / "raw_data"
+    for label, n in [("Normal", 2), ("dilated_cardiomyopathy_with_global_dysfunction", 1)]:
+        (root / label).mkdir(parents=True)
+        for i in range(n):
+            write_synthetic_dicom(root / label / f"IM-{i:04d}.dcm", frames=12, seed=len(label) + i)
+    return root
+
+
 # Configure pytest
 def pytest_configure(config):
     """Configure pytest with custom markers."""
@@ -53,7 +53,7 @@ def test_analyze_case_with_stubbed_rag(sample_dicom_path, monkeypatch):
     # Stub multimodal rag to avoid external OpenAI dependency
     from api.services import rag_service
 
-    def stub_run_multimodal_rag(report_text: str, query_frames_folder: str = None, query_frame_paths=None):
+    def stub_run_multimodal_rag(report_text: str, query_frames_folder: str = None, query_frame_paths=None, bypass_cache=False):
         return f"TEST_OUTPUT for {os.path.basename(query_frames_folder or '')} | report: {report_text[:30]}"
 
     monkeypatch.setattr(rag_service, "run_multimodal_rag", stub_run_multimodal_rag, raising=True)
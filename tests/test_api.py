@@ -166,6 +166,45 @@ class TestFlushRagEndpoint:
         assert "ok" in data or "message" in data
 
 
+class TestReindexEndpoint:
+    """Test /reindex endpoint."""
+
+    def test_reindex_failure_returns_500(self, monkeypatch):
+        import api.main as main
+
+        def broken():
+            raise RuntimeError("qdrant down")
+
+        monkeypatch.setattr(main, "get_vectorstore", lambda: None)
+        monkeypatch.setattr(main, "refresh_index", broken)
+
+        response = client.post("/reindex")
+
+        assert response.status_code == 500
+        assert response.json() == {"ok": False, "error": "qdrant down"}
+
+
+class TestTorchThreads:
+    """Test that torch threads are only set by the API lifespan, on request."""
+
+    def _start(self, monkeypatch, threads):
+        import api.main as main
+
+        calls = []
+        monkeypatch.setattr(main, "RAG_WARMUP", False)
+        monkeypatch.setattr(main, "API_TORCH_THREADS", threads)
+        monkeypatch.setattr(main, "_set_torch_threads", calls.append)
+        with TestClient(app):
+            pass
+        return calls
+
+    def test_set_when_configured(self, monkeypatch):
+        assert self._start(monkeypatch, 3) == [3]
+
+    def test_untouched_by_default(self, monkeypatch):
+        assert self._start(monkeypatch, 0) == []
+
+
 class TestCORSHeaders:
     """Test CORS configuration."""
     
@@ -0,0 +1,132 @@
+"""
+Unit tests for the benchmark suite and synthetic data generators.
+Tests percentile summaries, baseline comparison and a tiny end-to-end run.
+"""
+import pytest
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__))))
+
+from scripts import benchmark
+from scripts.synthetic_data import generate_case_documents, generate_guidelines, synthetic_reports
+
+
+def _result(p95=10.0, throughput=100.0, peak=200.0, error=None):
+    if error:
+        return {"stages": {"retrieve": {"error": error}}}
+    return {
+        "stages": {
+            "retrieve": {
+                "latency_ms": {"p50": 5.0, "p95": p95, "p99": p95},
+                "throughput_per_s": throughput,
+                "peak_rss_mb": peak,
+            }
+        }
+    }
+
+
+class TestSyntheticData:
+    """Test the deterministic generators."""
+
+    def test_case_documents(self, tmp_path):
+        path = tmp_path / "documents.jsonl"
+        n = generate_case_documents(str(path), 5, frames_per_case=2, seed=1)
+
+        rows = [json.loads(line) for line in path.read_text().splitlines()]
+        assert n == len(rows) == 15
+        cards = [r for r in rows if r["metadata"]["document_type"] == "case_card"]
+        assert len({r["metadata"]["case_id"] for r in cards}) == 5
+        assert generate_case_documents(str(tmp_path / "again.jsonl"), 5, frames_per_case=2, seed=1) == n
+        assert (tmp_path / "again.jsonl").read_text() == path.read_text()
+
+    def test_guidelines_and_reports(self, tmp_path):
+        paths = generate_guidelines(str(tmp_path), 2, paragraphs=3)
+        assert len(paths) == 2 and all(os.path.getsize(p) > 0 for p in paths)
+
+        reports = synthetic_reports(20)
+        assert len(set(reports)) == 20 and reports == synthetic_reports(20)
+
+
+class TestSummary:
+    """Test latency summaries."""
+
+    def test_percentiles(self):
+        lat = benchmark.latency_summary([i / 1000 for i in range(1, 101)])
+        assert lat["p50"] == pytest.approx(50.5)
+        assert lat["p99"] == pytest.approx(99.01)
+        assert lat["max"] == pytest.approx(100.0)
+        assert benchmark.latency_summary([]) == {}
+
+    def test_stage_result(self):
+        r = benchmark.stage_result([0.01, 0.02], wall_s=0.5, ops=10, documents=10)
+        assert r["samples"] == 2 and r["throughput_per_s"] == 20.0
+        assert r["documents"] == 10 and r["peak_rss_mb"] > 0
+
+
+class TestCompare:
+    """Test regression detection against a baseline."""
+
+    def test_no_regression_within_threshold(self):
+        assert benchmark.compare_results(_result(p95=11.0), _result(p95=10.0), threshold=0.2) == []
+
+    def test_latency_and_throughput_regressions(self):
+        regs = benchmark.compare_results(_result(p95=20.0, throughput=50.0), _result(), threshold=0.2)
+        assert {r["metric"] for r in regs} == {"latency_ms.p95", "latency_ms.p99", "throughput_per_s"}
+
+    def test_small_absolute_delta_ignored(self):
+        base = _result(p95=0.1)
+        assert benchmark.compare_results(_result(p95=0.5), base, threshold=0.2, min_delta_ms=1.0) == []
+
+    def test_new_error_is_regression(self):
+        regs = benchmark.compare_results(_result(error="boom"), _result())
+        assert regs[0]["metric"] == "error"
+        assert benchmark.compare_results(_result(), _result(error="boom")) == []
+
+
+class TestEndToEnd:
+    """Tiny benchmark run on a temporary workdir."""
+
+    def test_run_and_compare(self, tmp_path, monkeypatch):
+        import scripts.index_Qdrant as iq
+        import scripts.multimodal_rag_openai as mm
+        import scripts.llm_provider as llm
+        from api.services import doc_service
+
+        for module, names in (
+            (iq, ["JSONL_PATH", "GUIDELINES_DIR", "SNAPSHOT_DIR", "USE_SNAPSHOT", "QDRANT_MODE",
+                  "_embedder", "_vectorstore", "_initialized", "_manifest"]),
+            (mm, ["DATA_DIR", "_frame_manifest", "_result_cache"]),
+            (llm, ["_provider"]),
+            (doc_service, ["CURRENT_DICOM_DIR", "CURRENT_FRAMES_DIR", "UPLOAD_STAGING_DIR", "UPLOAD_INDEX_PATH"]),
+        ):
+            for name in names:
+                monkeypatch.setattr(module, name, getattr(module, name))
+
+        out = tmp_path / "latest.json"
+        argv = [
+            "--cases", "3", "--repeat", "2", "--dicom-frames", "4", "--dicom-size", "16", "--workers", "1",
+            "--stages", "build_dataset", "extract_frames", "index_build",
+            "--workdir", str(tmp_path / "work"), "--json", str(out),
+        ]
+        assert benchmark.main(argv) == 0
+
+        results = json.loads(out.read_text())
+        assert set(results["stages"]) == {"build_dataset", "extract_frames", "index_build"}
+        assert results["stages"]["extract_frames"]["samples"] == 2
+        assert results["stages"]["index_build"]["documents"] == 12
+        assert results["meta"]["config"]["cases"] == 3
+
+        # baseline molto piu' veloce -> regressione, exit code 1
+        fast = json.loads(out.read_text())
+        for stage in fast["stages"].values():
+            stage["latency_ms"] = {k: v / 100 for k, v in stage["latency_ms"].items()}
+            stage["throughput_per_s"] *= 100
+        baseline = tmp_path / "baseline.json"
+        baseline.write_text(json.dumps(fast))
+        assert benchmark.main(argv + ["--compare", str(baseline)]) == 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
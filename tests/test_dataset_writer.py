@@ -0,0 +1,134 @@
+"""
+Unit tests for the buffered, atomic documents.jsonl writer.
+Tests temp-file rename, abort cleanup and the per-document offset index.
+"""
+import pytest
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__))))
+
+from scripts.dataset_writer import (
+    DatasetWriter,
+    index_path_for,
+    load_index,
+    load_index_entries,
+    read_document,
+)
+from scripts.build_dataset import build_dataset
+from tests.conftest import write_synthetic_dicom
+
+
+def _doc(case_id, frame=None):
+    meta = {"case_id": case_id, "document_type": "frame" if frame is not None else "case_card"}
+    if frame is not None:
+        meta["frame_index"] = frame
+    return {"id": f"{case_id}-{frame}", "text": f"caso {case_id} è", "metadata": meta}
+
+
+class TestDatasetWriter:
+    """Test atomic commit and offset bookkeeping."""
+
+    def test_commit_replaces_file_atomically(self, tmp_path):
+        path = str(tmp_path / "documents.jsonl")
+        with open(path, "w") as f:
+            f.write("old\n")
+
+        with DatasetWriter(path) as w:
+            w.write(_doc("a"))
+            # durante la scrittura i lettori vedono ancora il file vecchio
+            assert open(path).read() == "old\n"
+            assert os.path.exists(w.tmp_path)
+
+        assert not os.path.exists(path + ".tmp")
+        assert json.loads(open(path, encoding="utf-8").read())["id"] == "a-None"
+
+    def test_abort_keeps_old_file(self, tmp_path):
+        path = str(tmp_path / "documents.jsonl")
+        with open(path, "w") as f:
+            f.write("old\n")
+
+        with pytest.raises(RuntimeError):
+            with DatasetWriter(path) as w:
+                w.write(_doc("a"))
+                raise RuntimeError("build failed")
+
+        assert open(path).read() == "old\n"
+        assert not os.path.exists(path + ".tmp")
+        assert not os.path.exists(index_path_for(path))
+
+    def test_offsets_seek_to_documents(self, tmp_path):
+        path = str(tmp_path / "documents.jsonl")
+        docs = [_doc("a"), _doc("a", 0), _doc("a", 5), _doc("b")]
+        with DatasetWriter(path) as w:
+            for d in docs:
+                w.write(d)
+
+        index = load_index(path)
+        assert set(index) == {"a:case_card", "a:frame:0", "a:frame:5", "b:case_card"}
+        assert read_document(path, *index["a:frame:5"]) == docs[2]
+
+    def test_copy_range_reindexes_copied_lines(self, tmp_path):
+        src_path = str(tmp_path / "old.jsonl")
+        with DatasetWriter(src_path) as w:
+            for d in (_doc("a"), _doc("b"), _doc("b", 1)):
+                w.write(d)
+        old = {k: (o, n) for k, o, n in load_index_entries(src_path)}
+
+        path = str(tmp_path / "new.jsonl")
+        offset, length = old["b:case_card"][0], old["b:case_card"][1] + old["b:frame:1"][1]
+        with open(src_path, "rb") as src, DatasetWriter(path) as w:
+            w.write(_doc("c"))
+            w.copy_range(src, offset, length)
+
+        index = load_index(path)
+        assert read_document(path, *index["b:frame:1"]) == _doc("b", 1)
+        assert read_document(path, *index["c:case_card"]) == _doc("c")
+
+    def test_stale_index_ignored(self, tmp_path):
+        path = str(tmp_path / "documents.jsonl")
+        with DatasetWriter(path) as w:
+            w.write(_doc("a"))
+        with open(path, "a") as f:
+            f.write(json.dumps(_doc("z")) + "\n")
+
+        assert load_index(path) is None
+
+
+class TestBuildDocumentIndex:
+    """Test that build_dataset keeps the offset index in sync with documents.jsonl."""
+
+    def _check_index(self, out_dir):
+        path = str(out_dir / "documents.jsonl")
+        index = load_index(path)
+        lines = open(path, encoding="utf-8").read().splitlines()
+        assert index is not None and len(index) == len(lines)
+        for line in lines:
+            doc = json.loads(line)
+            key = f"{doc['metadata']['case_id']}:" + (
+                f"frame:{doc['metadata']['frame_index']}"
+                if doc["metadata"]["document_type"] == "frame"
+                else doc["metadata"]["document_type"]
+            )
+            assert read_document(path, *index[key]) == doc
+
+    def test_full_build_index(self, raw_dicom_tree, tmp_path):
+        out = tmp_path / "out"
+        build_dataset(str(raw_dicom_tree), str(out), workers=1)
+        self._check_index(out)
+
+    def test_incremental_build_index(self, raw_dicom_tree, tmp_path):
+        out = tmp_path / "out"
+        build_dataset(str(raw_dicom_tree), str(out), workers=1)
+        write_synthetic_dicom(raw_dicom_tree / "Normal" / "IM-0000.dcm", frames=6, seed=7)
+        write_synthetic_dicom(raw_dicom_tree / "Normal" / "IM-0100.dcm", frames=12, seed=42)
+
+        summary = build_dataset(str(raw_dicom_tree), str(out), workers=1)
+
+        assert summary["reused"] == 2 and summary["processed"] == 2
+        self._check_index(out)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,91 @@
+"""
+Unit tests for frame-selective DICOM pixel access.
+Tests FrameReader against ds.pixel_array and the single-pass build stage.
+"""
+import pytest
+import os
+import sys
+import numpy as np
+import pydicom
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__))))
+
+from scripts.dicom_frames import FrameReader
+from scripts.build_dataset import extract_features_and_frames, export_representative_frames
+from tests.conftest import write_synthetic_dicom
+
+
+@pytest.fixture
+def cine(tmp_path):
+    path = tmp_path / "cine.dcm"
+    pixels = write_synthetic_dicom(path, frames=20, rows=8, cols=8, seed=3)
+    return pydicom.dcmread(str(path)), pixels
+
+
+class TestFrameReader:
+    """Test per-index decoding and caching."""
+
+    def test_frame_matches_pixel_array(self, cine):
+        ds, pixels = cine
+        reader = FrameReader(ds)
+        for i in (0, 7, 19):
+            assert np.array_equal(reader.frame(i), pixels[i])
+        assert reader.decoded == 3
+
+    def test_frames_decodes_only_requested(self, cine):
+        ds, pixels = cine
+        reader = FrameReader(ds)
+        out = list(reader.frames([2, 5, 11]))
+        assert [i for i, _ in out] == [2, 5, 11]
+        assert all(np.array_equal(f, pixels[i]) for i, f in out)
+        assert reader.decoded == 3
+
+    def test_cache_shared_between_calls(self, cine):
+        ds, _ = cine
+        reader = FrameReader(ds, cache_frames=4)
+        list(reader.frames([1, 2, 3]))
+        list(reader.frames([2, 3, 4]))
+        assert reader.decoded == 4, "Cached frames must not be decoded again"
+
+    def test_cache_bounded(self, cine):
+        ds, _ = cine
+        reader = FrameReader(ds, cache_frames=2)
+        list(reader.frames(range(10)))
+        assert len(reader._cache) == 2
+
+    def test_out_of_range(self, cine):
+        ds, _ = cine
+        with pytest.raises(IndexError):
+            FrameReader(ds).frame(20)
+
+
+class TestSinglePassBuild:
+    """Test that features and PNG export share one decode per frame."""
+
+    def test_union_decoded_once(self, cine, tmp_path, monkeypatch):
+        ds, _ = cine
+        created = []
+        original_init = FrameReader.__init__
+
+        def tracking_init(self, *args, **kwargs):
+            original_init(self, *args, **kwargs)
+            created.append(self)
+
+        monkeypatch.setattr(FrameReader, "__init__", tracking_init)
+        feat, frames = extract_features_and_frames(ds, "case", n=5, images_dir=str(tmp_path))
+
+        assert feat["feature_frames_used"] == 20
+        assert len(frames) == 5
+        assert len(created) == 1 and created[0].decoded == 20
+
+    def test_matches_separate_stages(self, cine, tmp_path):
+        ds, _ = cine
+        feat, frames = extract_features_and_frames(ds, "case", n=5, images_dir=str(tmp_path / "a"), max_frames=8)
+        separate = export_representative_frames(ds, "case", n=5, images_dir=str(tmp_path / "b"))
+
+        assert [f["frame_index"] for f in frames] == [f["frame_index"] for f in separate]
+        assert feat["feature_frames_used"] == 8
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
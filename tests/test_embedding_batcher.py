@@ -0,0 +1,120 @@
+"""
+Unit tests for the micro-batching embedding scheduler.
+"""
+import pytest
+import os
+import sys
+import time
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__))))
+
+from scripts.embedding_batcher import EmbeddingBatcher
+import scripts.index_Qdrant as index_qdrant
+
+
+class TestEmbeddingBatcher:
+    """Test batching, result routing and error propagation."""
+
+    def test_single_request(self, fake_embedder):
+        batcher = EmbeddingBatcher(lambda t: fake_embedder.encode(t, normalize_embeddings=True), max_wait_ms=1)
+        try:
+            vec = batcher.embed("normal echo", timeout=5)
+            expected = fake_embedder.encode(["normal echo"], normalize_embeddings=True)[0].tolist()
+            assert vec == pytest.approx(expected)
+        finally:
+            batcher.close()
+
+    def test_concurrent_requests_are_batched(self, fake_embedder):
+        gate = threading.Event()
+
+        def encode(texts):
+            gate.wait(5)  # tiene occupato il worker finche' la coda si riempie
+            return fake_embedder.encode(texts, normalize_embeddings=True)
+
+        batcher = EmbeddingBatcher(encode, max_batch=16, max_wait_ms=50)
+        try:
+            futures = [batcher.submit(f"query {i}") for i in range(9)]
+            gate.set()
+            results = [f.result(timeout=5) for f in futures]
+            encode_calls = fake_embedder.calls
+
+            for i, vec in enumerate(results):
+                expected = fake_embedder.encode([f"query {i}"], normalize_embeddings=True)[0].tolist()
+                assert vec == pytest.approx(expected), "Each caller must get its own vector"
+
+            stats = batcher.stats()
+            assert stats["items"] == 9
+            assert stats["batches"] < 9
+            assert stats["max_batch_size"] > 1
+            assert encode_calls == stats["batches"]
+        finally:
+            batcher.close()
+
+    def test_max_batch_respected(self, fake_embedder):
+        gate = threading.Event()
+
+        def encode(texts):
+            gate.wait(5)
+            return fake_embedder.encode(texts)
+
+        batcher = EmbeddingBatcher(encode, max_batch=4, max_wait_ms=50)
+        try:
+            futures = [batcher.submit(f"q{i}") for i in range(10)]
+            gate.set()
+            for f in futures:
+                f.result(timeout=5)
+            assert batcher.stats()["max_batch_size"] <= 4
+        finally:
+            batcher.close()
+
+    def test_encode_error_propagates(self):
+        def encode(texts):
+            raise RuntimeError("model unavailable")
+
+        batcher = EmbeddingBatcher(encode, max_wait_ms=1)
+        try:
+            with pytest.raises(RuntimeError, match="model unavailable"):
+                batcher.embed("x", timeout=5)
+            assert batcher.stats()["errors"] == 1
+            assert batcher.stats()["queue_depth"] == 0
+        finally:
+            batcher.close()
+
+
+
+class TestSingletons:
+    """Test that concurrent first requests share one batcher and one query cache."""
+
+    def test_created_once(self, monkeypatch):
+        created = []
+
+        def slow(name):
+            def factory(*args, **kwargs):
+                time.sleep(0.05)
+                created.append(name)
+                return object()
+            return factory
+
+        monkeypatch.setattr(index_qdrant, "_batcher", None)
+        monkeypatch.setattr(index_qdrant, "_query_cache", None)
+        monkeypatch.setattr(index_qdrant, "EmbeddingBatcher", slow("batcher"))
+        monkeypatch.setattr(index_qdrant, "QueryEmbeddingCache", slow("cache"))
+
+        results = []
+
+        def first_request():
+            results.append((index_qdrant.get_embedding_batcher(), index_qdrant.get_query_cache()))
+
+        threads = [threading.Thread(target=first_request) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert sorted(created) == ["batcher", "cache"]
+        assert len(set(results)) == 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,95 @@
+"""
+Unit tests for the query embedding cache.
+Tests LRU/TTL behaviour, the shared disk tier and model invalidation.
+"""
+import pytest
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__))))
+
+from scripts.embedding_cache import QueryEmbeddingCache, normalize_query
+
+
+def _compute_counter():
+    calls = []
+
+    def compute(text):
+        calls.append(text)
+        return [float(len(text)), 1.0, 0.0]
+
+    return compute, calls
+
+
+class TestMemoryTier:
+    """Test in-process LRU tier."""
+
+    def test_hit_skips_compute(self):
+        cache = QueryEmbeddingCache("model-a", max_entries=10)
+        compute, calls = _compute_counter()
+
+        v1 = cache.get_or_compute("normal echo", compute)
+        v2 = cache.get_or_compute("normal echo", compute)
+
+        assert v1 == v2
+        assert len(calls) == 1
+        stats = cache.stats()
+        assert stats["hits_memory"] == 1 and stats["misses"] == 1
+
+    def test_whitespace_normalized(self):
+        cache = QueryEmbeddingCache("model-a")
+        compute, calls = _compute_counter()
+        cache.get_or_compute("normal   echo ", compute)
+        cache.get_or_compute("normal echo", compute)
+        assert calls == ["normal echo"]
+        assert normalize_query("  a \n b ") == "a b"
+
+    def test_lru_eviction(self):
+        cache = QueryEmbeddingCache("model-a", max_entries=2)
+        compute, calls = _compute_counter()
+        cache.get_or_compute("a", compute)
+        cache.get_or_compute("b", compute)
+        cache.get_or_compute("a", compute)  # 'a' becomes most recent
+        cache.get_or_compute("c", compute)  # evicts 'b'
+        cache.get_or_compute("a", compute)
+        cache.get_or_compute("b", compute)
+        assert calls == ["a", "b", "c", "b"]
+
+    def test_ttl_expiry(self):
+        cache = QueryEmbeddingCache("model-a", ttl_s=0.05)
+        compute, calls = _compute_counter()
+        cache.get_or_compute("a", compute)
+        time.sleep(0.1)
+        cache.get_or_compute("a", compute)
+        assert len(calls) == 2
+
+
+class TestDiskTier:
+    """Test shared SQLite tier."""
+
+    def test_shared_between_instances(self, tmp_path):
+        path = str(tmp_path / "cache.sqlite")
+        compute, calls = _compute_counter()
+
+        QueryEmbeddingCache("model-a", disk_path=path).get_or_compute("query", compute)
+        other = QueryEmbeddingCache("model-a", disk_path=path)
+        vector = other.get_or_compute("query", compute)
+
+        assert len(calls) == 1, "Second worker should hit the disk tier"
+        assert vector == pytest.approx([5.0, 1.0, 0.0])
+        assert other.stats()["hits_disk"] == 1
+
+    def test_model_change_invalidates_disk(self, tmp_path):
+        path = str(tmp_path / "cache.sqlite")
+        compute, calls = _compute_counter()
+
+        QueryEmbeddingCache("model-a", disk_path=path).get_or_compute("query", compute)
+        QueryEmbeddingCache("model-b", disk_path=path).get_or_compute("query", compute)
+        QueryEmbeddingCache("model-a", disk_path=path).get_or_compute("query", compute)
+
+        assert len(calls) == 3, "Switching model should drop the disk tier"
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,107 @@
+"""
+Unit tests for the out-of-process frame extraction pool.
+Tests results, error propagation, timeouts, cancellation and event-loop responsiveness.
+"""
+import pytest
+import os
+import sys
+import time
+import asyncio
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__))))
+
+from scripts.frame_extraction_pool import FrameExtractionPool, FrameExtractionTimeout, FrameExtractionCancelled
+from scripts.dicom_to_frames_current import extract_frames
+from tests.conftest import write_synthetic_dicom
+
+
+@pytest.fixture
+def pool():
+    return FrameExtractionPool(workers=2, timeout_s=30)
+
+
+class TestFrameExtractionPool:
+    """Test process isolation of CPU-bound work."""
+
+    def test_extract_frames_in_child(self, pool, tmp_path):
+        src = tmp_path / "cine.dcm"
+        write_synthetic_dicom(src, frames=6)
+
+        frames = pool.run(extract_frames, str(src), str(tmp_path / "out"), 4)
+
+        assert len(frames) == 4 and all(os.path.exists(p) for p in frames)
+        assert pool.stats()["completed"] == 1 and pool.stats()["active"] == 0
+
+    def test_child_error_propagates(self, pool):
+        with pytest.raises(RuntimeError, match="ValueError"):
+            pool.run(int, "not a number")
+
+    def test_timeout_terminates_child(self, pool):
+        t0 = time.perf_counter()
+        with pytest.raises(FrameExtractionTimeout):
+            pool.run(time.sleep, 30, timeout_s=0.5)
+        assert time.perf_counter() - t0 < 10
+        assert pool.stats()["timeouts"] == 1 and pool.stats()["active"] == 0
+
+    def test_cancel_event(self, pool):
+        cancel = threading.Event()
+        threading.Timer(0.3, cancel.set).start()
+        with pytest.raises(FrameExtractionCancelled):
+            pool.run(time.sleep, 30, cancel_event=cancel)
+        assert pool.stats()["cancelled"] == 1
+
+    def test_async_cancellation(self, pool):
+        async def scenario():
+            task = asyncio.create_task(pool.run_async(time.sleep, 30))
+            await asyncio.sleep(0.3)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            # il figlio viene terminato in background dal thread di run()
+            deadline = time.time() + 5
+            while pool.stats()["active"] and time.time() < deadline:
+                await asyncio.sleep(0.05)
+
+        asyncio.run(scenario())
+        assert pool.stats()["active"] == 0 and pool.stats()["cancelled"] == 1
+
+    def test_event_loop_stays_responsive(self, pool):
+        async def scenario():
+            job = asyncio.create_task(pool.run_async(sum, range(30_000_000)))
+            worst = 0.0
+            while not job.done():
+                t0 = time.perf_counter()
+                await asyncio.sleep(0.01)
+                worst = max(worst, time.perf_counter() - t0)
+            return await job, worst
+
+        result, worst_tick = asyncio.run(scenario())
+        assert result == sum(range(30_000_000))
+        assert worst_tick < 0.25, f"event loop blocked for {worst_tick:.3f}s"
+
+    def test_concurrency_bounded(self, tmp_path):
+        pool = FrameExtractionPool(workers=1, timeout_s=30)
+        peak = [0]
+
+        def watch():
+            while not done.is_set():
+                peak[0] = max(peak[0], pool.stats()["active"])
+                time.sleep(0.01)
+
+        done = threading.Event()
+        watcher = threading.Thread(target=watch)
+        watcher.start()
+        threads = [threading.Thread(target=pool.run, args=(time.sleep, 0.2)) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        done.set()
+        watcher.join()
+
+        assert peak[0] == 1 and pool.stats()["completed"] == 3
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,132 @@
+"""
+Unit tests for the precomputed frame manifest.
+Tests generation at build time, in-memory lookups, refresh on change and the query-side picker.
+"""
+import pytest
+import os
+import sys
+import json
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__))))
+
+from scripts.frame_manifest import FRAME_MANIFEST, FrameManifest, write_frame_manifest
+from scripts.build_dataset import build_dataset
+from scripts.incremental_index import point_id
+import scripts.index_Qdrant as iq
+import scripts.multimodal_rag_openai as mm
+
+
+def _entry(i, case="c1"):
+    return {"frame_index": i, "path": f"{case}/frame_{i}.png", "width": 16, "height": 16, "bytes": 100}
+
+
+class TestFrameManifestBuild:
+    """Test that build_dataset writes a manifest consistent with the PNGs."""
+
+    def test_manifest_lists_exported_frames(self, raw_dicom_tree, tmp_path):
+        out = tmp_path / "out"
+        summary = build_dataset(str(raw_dicom_tree), str(out), workers=1)
+
+        data = json.loads((out / FRAME_MANIFEST).read_text())
+        assert len(data["cases"]) == summary["cases"]
+        for case_id, frames in data["cases"].items():
+            assert [f["frame_index"] for f in frames] == sorted(f["frame_index"] for f in frames)
+            for fr in frames:
+                png = out / "images" / fr["path"]
+                assert png.exists() and png.stat().st_size == fr["bytes"]
+                assert (fr["width"], fr["height"]) == (16, 16)
+
+    def test_manifest_kept_on_incremental_build(self, raw_dicom_tree, tmp_path):
+        out = tmp_path / "out"
+        build_dataset(str(raw_dicom_tree), str(out), workers=1)
+        first = json.loads((out / FRAME_MANIFEST).read_text())
+
+        summary = build_dataset(str(raw_dicom_tree), str(out), workers=1)
+
+        assert summary["processed"] == 0
+        assert json.loads((out / FRAME_MANIFEST).read_text()) == first
+
+
+class TestFrameManifestReader:
+    """Test lookups and refresh."""
+
+    def test_frames_in_index_order(self, tmp_path):
+        write_frame_manifest(str(tmp_path), {"c1": [_entry(10), _entry(2), _entry(5)]})
+        manifest = FrameManifest(str(tmp_path / FRAME_MANIFEST))
+
+        paths = manifest.frame_paths("c1")
+        assert paths == [str(tmp_path / "images" / f"c1/frame_{i}.png") for i in (2, 5, 10)]
+        assert manifest.frames("missing") == []
+
+    def test_reload_only_when_changed(self, tmp_path):
+        write_frame_manifest(str(tmp_path), {"c1": [_entry(1)]})
+        manifest = FrameManifest(str(tmp_path / FRAME_MANIFEST), refresh_s=0)
+        manifest.frames("c1")
+        manifest.frames("c1")
+        assert manifest.loads == 1
+
+        write_frame_manifest(str(tmp_path), {"c1": [_entry(1)], "c2": [_entry(3, "c2")]})
+        os.utime(tmp_path / FRAME_MANIFEST, ns=(0, 10**9))
+        assert len(manifest.frames("c2")) == 1 and manifest.loads == 2
+
+    def test_refresh_throttled(self, tmp_path):
+        manifest = FrameManifest(str(tmp_path / FRAME_MANIFEST), refresh_s=3600)
+        assert not manifest.available
+        write_frame_manifest(str(tmp_path), {"c1": [_entry(1)]})
+        # entro l'intervallo nessun nuovo stat del file
+        assert not manifest.available
+
+
+class TestPickFrames:
+    """Test pick_frames_for_case with and without a manifest."""
+
+    def test_uses_manifest_without_listing(self, tmp_path, monkeypatch):
+        write_frame_manifest(str(tmp_path), {"c1": [_entry(i) for i in range(1, 13)]})
+        monkeypatch.setattr(mm, "_frame_manifest", FrameManifest(str(tmp_path / FRAME_MANIFEST)))
+        monkeypatch.setattr(mm.os, "listdir", lambda *a: pytest.fail("filesystem listing on hot path"))
+
+        picked = mm.pick_frames_for_case("c1", 3)
+        assert [os.path.basename(p) for p in picked] == ["frame_1.png", "frame_6.png", "frame_12.png"]
+
+    def test_falls_back_to_listing(self, tmp_path, monkeypatch):
+        case_dir = tmp_path / "images" / "c1"
+        case_dir.mkdir(parents=True)
+        for i in range(3):
+            (case_dir / f"frame_{i}.png").write_bytes(b"x")
+        monkeypatch.setattr(mm, "DATA_DIR", str(tmp_path))
+        monkeypatch.setattr(mm, "_frame_manifest", FrameManifest(str(tmp_path / FRAME_MANIFEST)))
+
+        assert len(mm.pick_frames_for_case("c1", 2)) == 2
+
+    def test_similar_case_frames_reach_prompt(self, tmp_path, monkeypatch):
+        jsonl = tmp_path / "documents.jsonl"
+        docs = [
+            {"content": "Case c1", "metadata": {"case_id": "c1", "document_type": "case_card", "diagnosis_label_raw": "HCM"}},
+            {"content": "Frame of c1", "metadata": {"case_id": "c1", "document_type": "frame", "frame_index": 1}},
+            {"content": "Case c2", "metadata": {"case_id": "c2", "document_type": "case_card", "diagnosis_label_raw": "DCM"}},
+        ]
+        jsonl.write_text("".join(json.dumps(d) + "\n" for d in docs))
+        monkeypatch.setattr(iq, "JSONL_PATH", str(jsonl))
+        # hit come li restituisce Qdrant: id = UUID del punto, metadata dell'indexer
+        hits = [
+            SimpleNamespace(id=point_id("cases", key), metadata=meta, text=text, score=0.9)
+            for key, text, meta in iq._iter_case_docs()
+        ]
+        monkeypatch.setattr(mm, "get_vectorstore", lambda: SimpleNamespace(search=lambda **kw: hits))
+        write_frame_manifest(str(tmp_path), {"c1": [_entry(i) for i in range(4)], "c2": [_entry(i, "c2") for i in range(4)]})
+        monkeypatch.setattr(mm, "_frame_manifest", FrameManifest(str(tmp_path / FRAME_MANIFEST)))
+        monkeypatch.setattr(mm, "FRAMES_PER_SIMILAR_CASE", 2)
+        monkeypatch.setattr(mm, "MAX_SIMILAR_FRAMES_TOTAL", 10)
+        encoded = []
+        monkeypatch.setattr(mm, "image_to_data_url", lambda p: encoded.append(p) or "data:image/png;base64,")
+
+        cases_res = mm.retrieve_similar_qdrant("cases", "report", 5, query_vector=[0.0])
+        mm._build_messages("report", [], cases_res, None)
+
+        cases = [os.path.basename(os.path.dirname(p)) for p in encoded]
+        assert cases == ["c1", "c1", "c2", "c2"]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,124 @@
+"""
+Unit tests for the vision image payload cache.
+Tests rendering (resize/re-encode), cache keys, byte-bounded LRU and the disk tier.
+"""
+import pytest
+import os
+import sys
+import io
+import base64
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__))))
+
+from scripts.image_payload_cache import ImagePayloadCache, RenderSettings, render_data_url
+import scripts.multimodal_rag_openai as mm
+
+
+def _frame(path, w=800, h=600, seed=0):
+    """Frame sintetico simile a un'eco: fondo scuro, settore a gradiente con poco rumore."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:h, 0:w]
+    img = (np.clip(255 - np.hypot(xx - w / 2, yy) / 3, 0, 255) + rng.normal(0, 4, (h, w))).clip(0, 255)
+    Image.fromarray(np.stack([img] * 3, axis=-1).astype(np.uint8)).save(path)
+    return str(path)
+
+
+def _decode(data_url):
+    header, b64 = data_url.split(",", 1)
+    return header, Image.open(io.BytesIO(base64.b64decode(b64)))
+
+
+class TestRender:
+    """Test resize and re-encoding."""
+
+    def test_jpeg_resized_and_smaller(self, tmp_path):
+        path = _frame(tmp_path / "f.png")
+        url = render_data_url(path, RenderSettings(fmt="jpeg", max_side=400, quality=75))
+
+        header, img = _decode(url)
+        assert header == "data:image/jpeg;base64"
+        assert max(img.size) == 400 and img.size == (400, 300)
+        assert len(url) < os.path.getsize(path) / 3
+
+    def test_webp(self, tmp_path):
+        path = _frame(tmp_path / "f.png")
+        header, img = _decode(render_data_url(path, RenderSettings(fmt="webp", max_side=256)))
+        assert header == "data:image/webp;base64" and max(img.size) == 256
+
+    def test_original_passthrough(self, tmp_path):
+        path = _frame(tmp_path / "f.png")
+        url = render_data_url(path, RenderSettings(fmt="original"))
+        assert base64.b64decode(url.split(",", 1)[1]) == open(path, "rb").read()
+
+    def test_unknown_format_rejected(self):
+        with pytest.raises(ValueError):
+            RenderSettings(fmt="gif")
+
+
+class TestImagePayloadCache:
+    """Test hits, invalidation and memory bound."""
+
+    def test_second_lookup_is_memory_hit(self, tmp_path):
+        path = _frame(tmp_path / "f.png")
+        cache = ImagePayloadCache()
+
+        first = cache.get_data_url(path)
+        assert cache.get_data_url(path) is first
+        stats = cache.stats()
+        assert stats["misses"] == 1 and stats["hits_memory"] == 1
+        assert stats["compression_ratio"] < 0.5
+
+    def test_modified_file_rerendered(self, tmp_path):
+        path = _frame(tmp_path / "f.png", seed=1)
+        cache = ImagePayloadCache()
+        first = cache.get_data_url(path)
+
+        _frame(tmp_path / "f.png", w=640, h=480, seed=2)
+        os.utime(path, ns=(0, 10**9))
+
+        assert cache.get_data_url(path) != first
+        assert cache.stats()["misses"] == 2
+
+    def test_settings_are_part_of_key(self, tmp_path):
+        path = _frame(tmp_path / "f.png")
+        disk = str(tmp_path / "payloads.sqlite")
+        small = ImagePayloadCache(RenderSettings(max_side=128), disk_path=disk).get_data_url(path)
+        large = ImagePayloadCache(RenderSettings(max_side=512), disk_path=disk).get_data_url(path)
+        assert _decode(small)[1].size != _decode(large)[1].size
+
+    def test_lru_bounded_by_bytes(self, tmp_path):
+        paths = [_frame(tmp_path / f"f{i}.png", seed=i) for i in range(4)]
+        one = len(ImagePayloadCache().get_data_url(paths[0]))
+        cache = ImagePayloadCache(max_bytes=int(one * 2.5))
+
+        for p in paths:
+            cache.get_data_url(p)
+
+        stats = cache.stats()
+        assert stats["size"] == 2 and stats["bytes"] <= cache.max_bytes
+
+    def test_disk_tier_shared(self, tmp_path):
+        path = _frame(tmp_path / "f.png")
+        disk = str(tmp_path / "payloads.sqlite")
+        url = ImagePayloadCache(disk_path=disk).get_data_url(path)
+
+        other = ImagePayloadCache(disk_path=disk)
+        assert other.get_data_url(path) == url
+        assert other.stats()["hits_disk"] == 1 and other.stats()["misses"] == 0
+
+
+class TestPromptImages:
+    """Test that the vision pipeline uses the cache."""
+
+    def test_image_to_data_url_cached(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(mm, "_image_cache", ImagePayloadCache())
+        path = _frame(tmp_path / "f.png")
+
+        assert mm.image_to_data_url(path) is mm.image_to_data_url(path)
+        assert mm.get_image_cache().stats()["hits_memory"] == 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,63 @@
+"""
+Import-time budget tests.
+Importing the API and the scripts must not load models, build indexes or create clients.
+Each import runs in a fresh interpreter so earlier tests cannot pre-load modules.
+"""
+import pytest
+import os
+import sys
+import json
+import subprocess
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# secondi; generoso per CI lente (in locale l'import di api.main richiede < 1s)
+IMPORT_BUDGET_S = float(os.getenv("IMPORT_BUDGET_S", "5"))
+HEAVY_MODULES = ["torch", "sentence_transformers", "transformers", "openai", "datapizza", "qdrant_client"]
+
+
+def _import_in_subprocess(module: str) -> dict:
+    code = (
+        "import sys, time, json\n"
+        "t0 = time.perf_counter()\n"
+        f"import {module}\n"
+        "elapsed = time.perf_counter() - t0\n"
+        f"heavy = [m for m in {HEAVY_MODULES!r} if m in sys.modules]\n"
+        "print(json.dumps({'elapsed': elapsed, 'heavy': heavy}))\n"
+    )
+    env = {**os.environ, "HF_HUB_OFFLINE": "1", "OPENAI_API_KEY": ""}
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=PROJECT_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    assert out.returncode == 0, out.stderr
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+class TestImportBudget:
+    """Test that imports are lazy and fast."""
+
+    @pytest.mark.parametrize("module", [
+        "api.main",
+        "scripts.index_Qdrant",
+        "scripts.multimodal_rag_openai",
+        "scripts.index_guidelines",
+        "scripts.query_retrieval",
+    ])
+    def test_no_heavy_imports(self, module):
+        result = _import_in_subprocess(module)
+        assert result["heavy"] == [], f"{module} imported {result['heavy']} at import time"
+
+    def test_api_import_within_budget(self):
+        result = _import_in_subprocess("api.main")
+        assert result["elapsed"] < IMPORT_BUDGET_S, (
+            f"Importing api.main took {result['elapsed']:.2f}s (budget {IMPORT_BUDGET_S}s)"
+        )
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
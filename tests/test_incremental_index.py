@@ -0,0 +1,203 @@
+"""
+Unit tests for incremental indexing.
+Tests manifest-driven sync and the index_Qdrant snapshot + refresh flow.
+"""
+import pytest
+import os
+import sys
+import json
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__))))
+
+from qdrant_client import QdrantClient, models
+from datapizza.vectorstores.qdrant import QdrantVectorstore
+
+from scripts.incremental_index import sync_collection, point_id, case_doc_key
+import scripts.index_Qdrant as index_qdrant
+
+
+def _make_collection(client, name="cases", dim=384):
+    client.create_collection(
+        name,
+        vectors_config={"text_embedding": models.VectorParams(size=dim, distance=models.Distance.COSINE)},
+    )
+
+
+def _embed(fake_embedder):
+    return lambda texts: fake_embedder.encode(texts, normalize_embeddings=True).tolist()
+
+
+class TestSyncCollection:
+    """Test sync_collection diffing against the manifest."""
+
+    def test_initial_sync_adds_everything(self, fake_embedder):
+        client = QdrantClient(location=":memory:")
+        _make_collection(client)
+        manifest = {}
+        docs = [(f"k{i}", f"text {i}", {"document_type": "case_card"}) for i in range(5)]
+
+        stats = sync_collection(client, "cases", docs, _embed(fake_embedder), manifest, batch_size=2)
+
+        assert stats.added == 5
+        assert stats.embedded_batches == 3
+        assert client.count("cases").count == 5
+        assert manifest["k0"]["id"] == point_id("cases", "k0")
+
+    def test_unchanged_docs_not_reembedded(self, fake_embedder):
+        client = QdrantClient(location=":memory:")
+        _make_collection(client)
+        manifest = {}
+        docs = [(f"k{i}", f"text {i}", {"document_type": "case_card"}) for i in range(5)]
+        sync_collection(client, "cases", docs, _embed(fake_embedder), manifest)
+        before = fake_embedder.encoded
+
+        docs.append(("k5", "text 5", {"document_type": "case_card"}))
+        stats = sync_collection(client, "cases", docs, _embed(fake_embedder), manifest)
+
+        assert stats.added == 1 and stats.unchanged == 5
+        assert fake_embedder.encoded - before == 1, "Only the new document should be embedded"
+        assert client.count("cases").count == 6
+
+    def test_changed_and_removed_docs(self, fake_embedder):
+        client = QdrantClient(location=":memory:")
+        _make_collection(client)
+        manifest = {}
+        docs = [(f"k{i}", f"text {i}", {"document_type": "case_card"}) for i in range(3)]
+        sync_collection(client, "cases", docs, _embed(fake_embedder), manifest)
+
+        docs = [
+            ("k0", "text 0 changed", {"document_type": "case_card"}),
+            ("k1", "text 1", {"document_type": "case_card", "view": "4CH"}),
+        ]
+        stats = sync_collection(client, "cases", docs, _embed(fake_embedder), manifest)
+
+        assert stats.updated == 1
+        assert stats.payload_only == 1
+        assert stats.deleted == 1
+        assert set(manifest) == {"k0", "k1"}
+        assert client.count("cases").count == 2
+
+        point = client.retrieve("cases", ids=[point_id("cases", "k1")])[0]
+        assert point.payload["view"] == "4CH"
+        assert point.payload["text"] == "text 1"
+
+    def test_streaming_batches_bounded(self, fake_embedder):
+        client = QdrantClient(location=":memory:")
+        _make_collection(client)
+        consumed = []
+        batch_sizes = []
+
+        def docs():
+            for i in range(10):
+                consumed.append(i)
+                yield f"k{i}", f"text {i}", {"document_type": "frame"}
+
+        def embed(texts):
+            # quando arriva un batch, la sorgente non deve essere gia' stata letta tutta
+            batch_sizes.append(len(texts))
+            assert len(consumed) < 10 or sum(batch_sizes) == 10
+            return fake_embedder.encode(texts, normalize_embeddings=True).tolist()
+
+        progress_calls = []
+        stats = sync_collection(
+            client, "cases", docs(), embed, {}, batch_size=3,
+            progress=lambda st: progress_calls.append(st.embedded),
+        )
+
+        assert batch_sizes == [3, 3, 3, 1]
+        assert progress_calls == [3, 6, 9, 10]
+        assert stats.embedded == 10 and stats.scanned == 10
+        assert stats.docs_per_second > 0
+
+    def test_case_doc_key_stable(self):
+        assert case_doc_key({"case_id": "abc", "document_type": "case_card"}) == "abc:case_card"
+        assert case_doc_key({"case_id": "abc", "document_type": "frame", "frame_index": 7}) == "abc:frame:7"
+
+
+class TestIndexQdrantRefresh:
+    """Test snapshot load + incremental refresh in index_Qdrant."""
+
+    @pytest.fixture
+    def sources(self, tmp_path, monkeypatch, fake_embedder):
+        jsonl = tmp_path / "documents.jsonl"
+        guides = tmp_path / "guidelines_txt"
+        guides.mkdir()
+        (guides / "normal.txt").write_text("Normal echo findings. " * 20)
+        docs = [
+            {"content": f"Ultrasound study {i}", "metadata": {"case_id": f"c{i}", "document_type": "case_card"}}
+            for i in range(3)
+        ]
+        jsonl.write_text("".join(json.dumps(d) + "\n" for d in docs))
+
+        monkeypatch.setattr(index_qdrant, "JSONL_PATH", str(jsonl))
+        monkeypatch.setattr(index_qdrant, "GUIDELINES_DIR", str(guides))
+        monkeypatch.setattr(index_qdrant, "SNAPSHOT_DIR", str(tmp_path / "snapshot"))
+        monkeypatch.setattr(index_qdrant, "USE_SNAPSHOT", True)
+        monkeypatch.setattr(index_qdrant, "_embedder", fake_embedder)
+        monkeypatch.setattr(index_qdrant, "_manifest", {})
+        monkeypatch.setattr(index_qdrant, "_served_fingerprint", None)
+        return jsonl
+
+    def _fresh_store(self, monkeypatch):
+        vs = QdrantVectorstore(location=":memory:")
+        monkeypatch.setattr(index_qdrant, "_vectorstore", vs)
+        return vs
+
+    def test_restart_loads_snapshot_without_embedding(self, sources, monkeypatch, fake_embedder):
+        self._fresh_store(monkeypatch)
+        index_qdrant._ensure_collections_populated()
+        assert fake_embedder.encoded > 0
+
+        # "restart": nuovo client in-memory, stesso snapshot
+        vs = self._fresh_store(monkeypatch)
+        before = fake_embedder.encoded
+        index_qdrant._ensure_collections_populated()
+        assert fake_embedder.encoded == before, "Snapshot load should not embed anything"
+        assert vs.get_client().count("cases").count == 3
+
+    def test_restart_after_new_case_embeds_only_delta(self, sources, monkeypatch, fake_embedder):
+        self._fresh_store(monkeypatch)
+        index_qdrant._ensure_collections_populated()
+
+        with open(sources, "a") as f:
+            f.write(json.dumps({"content": "Ultrasound study new", "metadata": {"case_id": "new", "document_type": "case_card"}}) + "\n")
+
+        vs = self._fresh_store(monkeypatch)
+        before = fake_embedder.encoded
+        index_qdrant._ensure_collections_populated()
+        assert fake_embedder.encoded - before == 1
+        assert vs.get_client().count("cases").count == 4
+
+    def test_concurrent_refreshes_serialized(self, sources, monkeypatch, fake_embedder):
+        self._fresh_store(monkeypatch)
+        monkeypatch.setattr(index_qdrant, "USE_SNAPSHOT", False)
+        index_qdrant._ensure_collections_populated()
+        with open(sources, "a") as f:
+            for i in range(200):
+                f.write(json.dumps({"content": f"New study {i}", "metadata": {"case_id": f"n{i}", "document_type": "case_card"}}) + "\n")
+
+        before, generation = fake_embedder.encoded, index_qdrant.index_generation()
+        version = index_qdrant.index_version()
+        errors = []
+
+        def refresh():
+            try:
+                index_qdrant.refresh_index()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=refresh) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert not errors
+        assert fake_embedder.encoded - before == 200, "The delta must be embedded once"
+        assert index_qdrant.index_generation() == generation + 1
+        assert index_qdrant.index_version() != version
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,109 @@
+"""
+Unit tests for index_snapshot module.
+Tests fingerprinting and save/load round-trip of Qdrant collections.
+"""
+import pytest
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__))))
+
+from qdrant_client import QdrantClient, models
+
+from scripts.index_snapshot import compute_fingerprint, save_snapshot, load_snapshot, read_snapshot_meta
+
+
+PARAMS = {"emb_model": "test-model", "chunk_size": 800, "chunk_overlap": 150}
+
+
+@pytest.fixture
+def populated_client():
+    """In-memory Qdrant with a small 'cases' collection."""
+    client = QdrantClient(location=":memory:")
+    client.create_collection(
+        "cases",
+        vectors_config={"text_embedding": models.VectorParams(size=4, distance=models.Distance.COSINE)},
+    )
+    points = [
+        models.PointStruct(
+            id=f"00000000-0000-0000-0000-00000000000{i}",
+            vector={"text_embedding": [float(i), 1.0, 0.0, 0.5]},
+            payload={"text": f"case {i}", "case_id": f"c{i}"},
+        )
+        for i in range(1, 6)
+    ]
+    client.upsert("cases", points=points, wait=True)
+    return client
+
+
+class TestFingerprint:
+    """Test snapshot fingerprint computation."""
+
+    def test_fingerprint_deterministic(self, tmp_path):
+        src = tmp_path / "documents.jsonl"
+        src.write_text('{"content": "a"}\n')
+        assert compute_fingerprint([str(src)], PARAMS) == compute_fingerprint([str(src)], PARAMS)
+
+    def test_fingerprint_changes_with_content(self, tmp_path):
+        src = tmp_path / "documents.jsonl"
+        src.write_text('{"content": "a"}\n')
+        fp1 = compute_fingerprint([str(src)], PARAMS)
+        src.write_text('{"content": "b"}\n')
+        assert compute_fingerprint([str(src)], PARAMS) != fp1
+
+    def test_fingerprint_changes_with_params(self, tmp_path):
+        src = tmp_path / "documents.jsonl"
+        src.write_text('{"content": "a"}\n')
+        fp1 = compute_fingerprint([str(src)], PARAMS)
+        fp2 = compute_fingerprint([str(src)], {**PARAMS, "emb_model": "other-model"})
+        assert fp1 != fp2
+
+    def test_fingerprint_missing_file(self, tmp_path):
+        missing = tmp_path / "missing.jsonl"
+        fp1 = compute_fingerprint([str(missing)], PARAMS)
+        missing.write_text("x")
+        assert compute_fingerprint([str(missing)], PARAMS) != fp1
+
+
+class TestSnapshotRoundTrip:
+    """Test save/load of collections."""
+
+    def test_save_and_load(self, populated_client, tmp_path):
+        snap_dir = str(tmp_path / "snap")
+        save_snapshot(populated_client, snap_dir, "fp-1", ["cases", "guidelines"])
+
+        meta = read_snapshot_meta(snap_dir)
+        assert meta["fingerprint"] == "fp-1"
+        assert meta["collections"]["cases"]["count"] == 5
+        assert "guidelines" not in meta["collections"], "Missing collections should be skipped"
+
+        fresh = QdrantClient(location=":memory:")
+        assert load_snapshot(fresh, snap_dir, "fp-1") is True
+        assert fresh.count("cases").count == 5
+
+        hits = fresh.query_points("cases", query=[5.0, 1.0, 0.0, 0.5], using="text_embedding", limit=1).points
+        assert hits[0].payload["case_id"] == "c5"
+        assert hits[0].payload["text"] == "case 5"
+
+    def test_stale_fingerprint_not_loaded(self, populated_client, tmp_path):
+        snap_dir = str(tmp_path / "snap")
+        save_snapshot(populated_client, snap_dir, "fp-1", ["cases"])
+
+        fresh = QdrantClient(location=":memory:")
+        assert load_snapshot(fresh, snap_dir, "fp-2") is False
+        assert not fresh.collection_exists("cases")
+
+    def test_missing_snapshot(self, tmp_path):
+        fresh = QdrantClient(location=":memory:")
+        assert load_snapshot(fresh, str(tmp_path / "nope"), "fp-1") is False
+
+    def test_overwrite_snapshot(self, populated_client, tmp_path):
+        snap_dir = str(tmp_path / "snap")
+        save_snapshot(populated_client, snap_dir, "fp-1", ["cases"])
+        save_snapshot(populated_client, snap_dir, "fp-2", ["cases"])
+        assert read_snapshot_meta(snap_dir)["fingerprint"] == "fp-2"
+        assert not any(p.name.startswith("snap.") for p in tmp_path.iterdir()), "Temp dirs should be cleaned up"
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,203 @@
+"""
+Unit tests for the background job subsystem.
+Tests the SQLite job store, the worker pool, restart recovery and the /analyze-case/jobs API.
+"""
+import pytest
+import os
+import sys
+import time
+
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__))))
+
+from scripts.job_queue import JobStore, JobWorkerPool, JobContext, job_view, QUEUED, RUNNING, SUCCEEDED, FAILED
+from api.main import app
+from api.services import doc_service, job_service, rag_service
+from tests.conftest import write_synthetic_dicom
+
+
+def _wait(store, job_id, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = store.get(job_id)
+        if job["status"] in (SUCCEEDED, FAILED):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} still {store.get(job_id)['status']}")
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite"), stale_after_s=0.2, max_attempts=2)
+
+
+class TestJobStore:
+    """Test persistence, FIFO claim and stale recovery."""
+
+    def test_claim_fifo(self, store):
+        first = store.create("k", {"n": 1})
+        second = store.create("k", {"n": 2})
+
+        job = store.claim_next("w1")
+        assert job["id"] == first and job["status"] == RUNNING and job["attempts"] == 1
+        assert store.claim_next("w2")["id"] == second
+        assert store.claim_next("w3") is None
+
+    def test_jobs_survive_reopen(self, store, tmp_path):
+        job_id = store.create("k", {"n": 1})
+        reopened = JobStore(store.path)
+        assert reopened.get(job_id)["params"] == {"n": 1}
+        assert reopened.get(job_id)["status"] == QUEUED
+
+    def test_stale_running_job_requeued(self, store):
+        job_id = store.create("k", {})
+        store.claim_next("dead-worker")
+        time.sleep(0.3)
+
+        job = store.claim_next("new-worker")
+        assert job["id"] == job_id and job["attempts"] == 2 and job["worker"] == "new-worker"
+
+    def test_stale_job_fails_after_max_attempts(self, store):
+        job_id = store.create("k", {})
+        store.claim_next("w1")
+        time.sleep(0.3)
+        store.claim_next("w2")
+        time.sleep(0.3)
+
+        assert store.claim_next("w3") is None
+        assert store.get(job_id)["status"] == FAILED
+
+    def test_heartbeat_keeps_job(self, store):
+        job_id = store.create("k", {})
+        store.claim_next("w1")
+        time.sleep(0.15)
+        store.heartbeat([job_id], "w1")
+        time.sleep(0.1)
+
+        assert store.claim_next("w2") is None
+        assert store.get(job_id)["status"] == RUNNING
+
+
+class TestJobWorkerPool:
+    """Test execution, stage timings and failures."""
+
+    def test_runs_handler_with_stages(self, store):
+        def handler(params, ctx):
+            with ctx.stage("double"):
+                value = params["n"] * 2
+            ctx.checkpoint("seen", True)
+            return True, {"value": value}
+
+        pool = JobWorkerPool(store, {"double": handler}, workers=2, poll_interval_s=0.05)
+        pool.start()
+        try:
+            job = _wait(store, pool.submit("double", {"n": 21}))
+        finally:
+            pool.stop()
+
+        view = job_view(job)
+        assert view["status"] == SUCCEEDED and view["result"] == {"value": 42}
+        assert "double" in view["stages"] and view["queued_s"] >= 0
+        assert job["state"] == {"seen": True}
+
+    def test_failures_reported(self, store):
+        def boom(params, ctx):
+            raise RuntimeError("boom")
+
+        pool = JobWorkerPool(store, {"boom": boom, "not_ok": lambda p, c: (False, {"error": "nope"})},
+                             workers=1, poll_interval_s=0.05)
+        pool.start()
+        try:
+            a = _wait(store, pool.submit("boom", {}))
+            b = _wait(store, pool.submit("not_ok", {}))
+        finally:
+            pool.stop()
+
+        assert a["status"] == FAILED and a["error"] == "boom"
+        assert b["status"] == FAILED and b["error"] == "nope"
+
+    def test_unknown_kind_rejected(self, store):
+        with pytest.raises(ValueError):
+            JobWorkerPool(store, {}).submit("missing", {})
+
+    def test_bounded_concurrency(self, store):
+        active, peak = [0], [0]
+
+        def slow(params, ctx):
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+            time.sleep(0.05)
+            active[0] -= 1
+            return True, None
+
+        pool = JobWorkerPool(store, {"slow": slow}, workers=2, poll_interval_s=0.01)
+        pool.start()
+        try:
+            ids = [pool.submit("slow", {}) for _ in range(6)]
+            for job_id in ids:
+                _wait(store, job_id)
+        finally:
+            pool.stop()
+        assert peak[0] <= 2
+
+
+class TestAnalyzeCaseJobs:
+    """Test /analyze-case/jobs and GET /jobs/{id}."""
+
+    @pytest.fixture
+    def api_env(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(doc_service, "CURRENT_DICOM_DIR", tmp_path / "dicom")
+        monkeypatch.setattr(doc_service, "CURRENT_FRAMES_DIR", tmp_path / "frames")
+        monkeypatch.setattr(doc_service, "UPLOAD_STAGING_DIR", tmp_path / "incoming")
+        monkeypatch.setattr(doc_service, "UPLOAD_INDEX_PATH", tmp_path / "upload_index.json")
+        monkeypatch.setattr(job_service, "JOB_DB_PATH", str(tmp_path / "jobs.sqlite"))
+        monkeypatch.setattr(job_service, "JOB_POLL_S", 0.05)
+        monkeypatch.setattr(
+            rag_service, "run_multimodal_rag",
+            lambda report_text, query_frames_folder=None, query_frame_paths=None, bypass_cache=False: f"ANSWER {report_text}",
+        )
+        job_service.shutdown_job_pool()
+        yield tmp_path
+        job_service.shutdown_job_pool()
+
+    def test_submit_and_poll(self, api_env):
+        src = api_env / "cine.dcm"
+        write_synthetic_dicom(src, frames=4)
+        client = TestClient(app)
+
+        resp = client.post(
+            "/analyze-case/jobs",
+            files={"file": ("cine.dcm", src.read_bytes(), "application/dicom")},
+            data={"report_text": "sospetta cardiomiopatia"},
+        )
+        assert resp.status_code == 202, resp.text
+        job_id = resp.json()["job_id"]
+
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            job = client.get(f"/jobs/{job_id}").json()
+            if job["status"] in (SUCCEEDED, FAILED):
+                break
+            time.sleep(0.05)
+
+        assert job["status"] == SUCCEEDED, job
+        assert set(job["stages"]) == {"extract_frames", "analysis"}
+        assert job["result"]["analysis"]["answer"] == "ANSWER sospetta cardiomiopatia"
+        assert len(job["result"]["frames"]) > 0
+
+    def test_resumed_job_skips_extraction(self, api_env, monkeypatch):
+        upload = {"file_id": "x", "frames_dir": "/tmp/frames-x", "frames": ["a.png"]}
+        ctx = JobContext(JobStore(job_service.JOB_DB_PATH), {"id": "j", "state": {"upload": upload}})
+        monkeypatch.setattr(doc_service, "extract_and_register_frames", lambda saved: pytest.fail("re-extracted"))
+
+        ok, result = job_service.run_analyze_case_job({"upload": {"file_id": "x"}, "report_text": "r"}, ctx)
+
+        assert ok and result["frames"] == ["a.png"] and "extract_frames" not in ctx.stages
+
+    def test_unknown_job_404(self, api_env):
+        assert TestClient(app).get("/jobs/does-not-exist").status_code == 404
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,141 @@
+"""
+Unit tests for the pluggable LLM provider.
+Tests the deterministic fake (latency, token rate, failure injection), record/replay
+and outcome counting of the OpenAI stream.
+"""
+import pytest
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__))))
+
+from scripts.llm_provider import (
+    FakeLLMProvider,
+    LLMProvider,
+    LLMProviderError,
+    OpenAIProvider,
+    RecordingProvider,
+    ReplayProvider,
+    create_llm_provider,
+)
+
+MESSAGES = [{"role": "user", "content": [{"type": "input_text", "text": "LV dilated, EF 30%"}]}]
+
+
+class TestFakeProvider:
+    """Test the offline stand-in."""
+
+    def test_deterministic_text(self):
+        a = FakeLLMProvider(ttft_ms=0, tokens_per_s=0, output_tokens=30, seed=1)
+        b = FakeLLMProvider(ttft_ms=0, tokens_per_s=0, output_tokens=30, seed=2)
+
+        text = a.generate("gpt-4o", MESSAGES, 900)
+        assert text == b.generate("gpt-4o", MESSAGES, 900)
+        assert text != a.generate("gpt-4o", MESSAGES + [{"role": "user", "content": "more"}], 900)
+        assert len(list(a.stream("gpt-4o", MESSAGES, 10))) == 10
+
+    def test_latency_and_token_rate(self):
+        llm = FakeLLMProvider(ttft_ms=50, ttft_sigma=0, tokens_per_s=200, output_tokens=11)
+
+        t0 = time.perf_counter()
+        stream = llm.stream("gpt-4o", MESSAGES, 900)
+        next(stream)
+        ttft = time.perf_counter() - t0
+        list(stream)
+        total = time.perf_counter() - t0
+
+        assert 0.045 <= ttft < 0.2
+        assert total - ttft >= 10 / 200 * 0.9
+
+    def test_failure_injection(self):
+        llm = FakeLLMProvider(ttft_ms=0, tokens_per_s=0, failure_rate=0.5, seed=3)
+        failures = 0
+        for _ in range(200):
+            try:
+                llm.generate("gpt-4o", MESSAGES, 20)
+            except LLMProviderError:
+                failures += 1
+
+        assert 60 < failures < 140
+        assert llm.stats()["failures"] == failures and llm.stats()["calls"] == 200
+
+    def test_unknown_provider(self):
+        with pytest.raises(ValueError):
+            create_llm_provider("nope")
+
+
+class TestRecordReplay:
+    """Test cassette recording and replay."""
+
+    def test_roundtrip(self, tmp_path):
+        cassette = str(tmp_path / "cassette.jsonl")
+        inner = FakeLLMProvider(ttft_ms=0, tokens_per_s=0, output_tokens=8)
+        recorded = RecordingProvider(inner, cassette).generate("gpt-4o", MESSAGES, 900)
+
+        replay = ReplayProvider(cassette)
+        assert replay.generate("gpt-4o", MESSAGES, 900) == recorded
+        assert list(replay.stream("gpt-4o", MESSAGES, 900)) == list(inner.stream("gpt-4o", MESSAGES, 900))
+
+        with pytest.raises(LLMProviderError):
+            replay.generate("gpt-4o-mini", MESSAGES, 900)
+        assert replay.stats()["misses"] == 1
+
+    def test_interrupted_stream_not_recorded(self, tmp_path):
+        cassette = str(tmp_path / "cassette.jsonl")
+        rec = RecordingProvider(FakeLLMProvider(ttft_ms=0, tokens_per_s=0, output_tokens=8), cassette)
+        stream = rec.stream("gpt-4o", MESSAGES, 900)
+        next(stream)
+        stream.close()
+
+        assert ReplayProvider(cassette).stats()["recorded"] == 0
+
+    def test_replay_timing(self, tmp_path):
+        cassette = str(tmp_path / "cassette.jsonl")
+        RecordingProvider(FakeLLMProvider(ttft_ms=60, ttft_sigma=0, tokens_per_s=0), cassette).generate(
+            "gpt-4o", MESSAGES, 900
+        )
+
+        t0 = time.perf_counter()
+        ReplayProvider(cassette, timing=True).generate("gpt-4o", MESSAGES, 900)
+        assert time.perf_counter() - t0 >= 0.05
+
+        t0 = time.perf_counter()
+        ReplayProvider(cassette, timing=False).generate("gpt-4o", MESSAGES, 900)
+        assert time.perf_counter() - t0 < 0.05
+
+
+
+class TestOpenAIProvider:
+    """Test call/failure counting around the OpenAI stream."""
+
+    def _provider(self, events):
+        def create(**kwargs):
+            for event in events:
+                if isinstance(event, Exception):
+                    raise event
+                yield SimpleNamespace(type="response.output_text.delta", delta=event)
+
+        llm = OpenAIProvider()
+        llm._client = SimpleNamespace(responses=SimpleNamespace(create=create))
+        return llm
+
+    def test_completed_stream_counted_as_success(self):
+        llm = self._provider(["a", "b"])
+        assert "".join(llm.stream("gpt-4o", MESSAGES, 900)) == "ab"
+        assert llm.stats()["calls"] == 1 and llm.stats()["failures"] == 0
+
+    def test_failure_mid_stream_counted(self):
+        llm = self._provider(["a", ConnectionError("reset")])
+        with pytest.raises(ConnectionError):
+            list(llm.stream("gpt-4o", MESSAGES, 900))
+        assert llm.stats()["calls"] == 1 and llm.stats()["failures"] == 1
+
+    def test_base_class_is_abstract(self):
+        with pytest.raises(TypeError):
+            LLMProvider()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
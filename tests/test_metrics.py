@@ -0,0 +1,113 @@
+"""
+Unit tests for the metrics registry and the /metrics endpoint.
+Tests sharded counters/histograms, Prometheus text rendering and per-stage instrumentation.
+"""
+import pytest
+import os
+import sys
+import time
+import threading
+
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__))))
+
+from scripts.metrics import STAGE_SECONDS, MetricsRegistry
+from api.main import app
+
+
+def _sample(text: str, line_prefix: str) -> float:
+    for line in text.splitlines():
+        if line.startswith(line_prefix + " "):
+            return float(line.rsplit(" ", 1)[1])
+    raise AssertionError(f"{line_prefix} not in output")
+
+
+class TestRegistry:
+    """Test counters, histograms, gauges and rendering."""
+
+    def test_counter_sums_thread_shards(self):
+        counter = MetricsRegistry().counter("c_total", "help", ["kind"]).labels("a")
+
+        def work():
+            for _ in range(10_000):
+                counter.inc()
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert counter.value() == 80_000
+
+    def test_histogram_buckets_cumulative(self):
+        reg = MetricsRegistry()
+        hist = reg.histogram("h_seconds", "help", ["stage"], buckets=[0.1, 1.0])
+        child = hist.labels(stage="x")
+        for v in (0.05, 0.1, 0.5, 2.0):
+            child.observe(v)
+
+        text = reg.render()
+        assert "# TYPE h_seconds histogram" in text
+        assert _sample(text, 'h_seconds_bucket{stage="x",le="0.1"}') == 2
+        assert _sample(text, 'h_seconds_bucket{stage="x",le="1"}') == 3
+        assert _sample(text, 'h_seconds_bucket{stage="x",le="+Inf"}') == 4
+        assert _sample(text, 'h_seconds_count{stage="x"}') == 4
+        assert _sample(text, 'h_seconds_sum{stage="x"}') == pytest.approx(2.65)
+
+    def test_gauge_function_and_escaping(self):
+        reg = MetricsRegistry()
+        reg.gauge("g", "help", ["path"]).labels('a"b').set_function(lambda: 7)
+        assert 'g{path="a\\"b"} 7' in reg.render()
+
+    def test_conflicting_registration(self):
+        reg = MetricsRegistry()
+        reg.counter("m", "help", ["a"])
+        assert reg.counter("m", "help", ["a"]) is reg.counter("m", "help", ["a"])
+        with pytest.raises(ValueError):
+            reg.histogram("m", "help", ["a"])
+        with pytest.raises(ValueError):
+            reg.counter("m", "help").labels("x", "y")
+
+    def test_failing_collector_skipped(self):
+        reg = MetricsRegistry()
+        reg.counter("ok_total", "help").inc()
+
+        def broken():
+            raise RuntimeError("component down")
+
+        reg.register_collector(broken)
+        assert "ok_total 1" in reg.render()
+
+    def test_hot_path_overhead(self):
+        child = MetricsRegistry().histogram("x_seconds", "help").labels()
+        t0 = time.perf_counter()
+        for _ in range(100_000):
+            child.observe(0.01)
+        # ordine del microsecondo per osservazione
+        assert time.perf_counter() - t0 < 1.0
+
+
+class TestMetricsEndpoint:
+    """Test GET /metrics."""
+
+    def test_exposition(self):
+        STAGE_SECONDS.labels("embed").observe(0.002)
+        client = TestClient(app)
+        client.get("/jobs/does-not-exist")
+
+        resp = client.get("/metrics")
+
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+        text = resp.text
+        assert _sample(text, 'rag_stage_duration_seconds_count{stage="embed"}') >= 1
+        assert _sample(text, 'rag_http_requests_total{method="GET",route="/jobs/{job_id}",status="404"}') >= 1
+        assert 'rag_cache_requests_total{cache="query",result="hit"}' in text
+        assert 'rag_queue_depth{queue="embedding_batcher"}' in text
+        assert "rag_index_generation" in text
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,197 @@
+"""
+Unit tests for the ONNX embedding backend.
+Tests pooling, batching order, parity metrics and backend selection.
+Set ONNX_TEST_MODEL_DIR to an exported model to also run the real onnxruntime parity test.
+"""
+import pytest
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__))))
+
+import scripts.onnx_embedder as onnx_embedder
+from scripts.onnx_embedder import OnnxEmbedder, mean_pool, l2_normalize
+from scripts.eval_onnx_parity import cosine_agreement, retrieval_agreement, top_k
+import scripts.index_Qdrant as index_qdrant
+
+
+class FakeTokenizer:
+    """Un token per parola; id = lunghezza della parola."""
+
+    def __call__(self, texts, padding, truncation, max_length, return_tensors):
+        tokens = [[len(w) for w in t.split()][:max_length] for t in texts]
+        width = max(len(t) for t in tokens)
+        ids = np.zeros((len(texts), width), dtype=np.int64)
+        mask = np.zeros((len(texts), width), dtype=np.int64)
+        for i, t in enumerate(tokens):
+            ids[i, :len(t)] = t
+            mask[i, :len(t)] = 1
+        return {"input_ids": ids, "attention_mask": mask}
+
+
+class FakeSession:
+    """Token embedding = [id, 1, 0...]; i token di padding valgono 99 (devono essere ignorati)."""
+
+    def __init__(self):
+        self.batch_shapes = []
+
+    def run(self, outputs, feeds):
+        ids = feeds["input_ids"]
+        self.batch_shapes.append(ids.shape)
+        out = np.zeros(ids.shape + (4,), dtype=np.float32)
+        out[..., 0] = np.where(feeds["attention_mask"] == 1, ids, 99)
+        out[..., 1] = 1.0
+        return [out]
+
+
+def _fake_embedder(normalize=False):
+    emb = OnnxEmbedder.__new__(OnnxEmbedder)
+    emb.tokenizer = FakeTokenizer()
+    emb.session = FakeSession()
+    emb.input_names = {"input_ids", "attention_mask"}
+    emb.max_seq_length = 256
+    emb.normalize = normalize
+    return emb
+
+
+class TestPooling:
+    """Test mean pooling / normalization helpers."""
+
+    def test_mean_pool_ignores_padding(self):
+        tokens = np.array([[[1.0, 2.0], [3.0, 4.0], [100.0, 100.0]]])
+        mask = np.array([[1, 1, 0]])
+        assert mean_pool(tokens, mask).tolist() == [[2.0, 3.0]]
+
+    def test_l2_normalize(self):
+        out = l2_normalize(np.array([[3.0, 4.0], [0.0, 0.0]]))
+        assert out[0].tolist() == pytest.approx([0.6, 0.8])
+        assert out[1].tolist() == [0.0, 0.0]
+
+
+class TestOnnxEmbedderEncode:
+    """Test encode() with a fake onnxruntime session."""
+
+    def test_results_keep_input_order(self):
+        emb = _fake_embedder()
+        texts = ["a", "three words here", "hello world"]
+        out = emb.encode(texts, batch_size=2)
+        # componente 0 = media delle lunghezze delle parole, padding escluso
+        assert out[:, 0].tolist() == pytest.approx([1.0, 14 / 3, 5.0])
+        assert out.dtype == np.float32
+
+    def test_batches_sorted_by_length(self):
+        emb = _fake_embedder()
+        emb.encode(["x", "a b c d", "y", "e f g h"], batch_size=2)
+        # i due testi lunghi finiscono nello stesso batch: niente padding sprecato
+        assert emb.session.batch_shapes == [(2, 4), (2, 1)]
+
+    def test_normalize_and_single_string(self):
+        emb = _fake_embedder(normalize=True)
+        vec = emb.encode("hello world")
+        assert vec.shape == (4,)
+        assert np.linalg.norm(vec) == pytest.approx(1.0)
+
+
+class TestParityMetrics:
+    """Test parity/Hit@k helpers of eval_onnx_parity."""
+
+    def test_identical_embeddings_agree(self):
+        rng = np.random.default_rng(0)
+        corpus = l2_normalize(rng.standard_normal((20, 8)))
+        queries = l2_normalize(rng.standard_normal((5, 8)))
+
+        assert cosine_agreement(corpus, corpus)["min"] == pytest.approx(1.0)
+        r = retrieval_agreement(queries, queries, corpus, k_list=[1, 5])
+        assert r["hit@1"] == 1.0 and r["overlap@5"] == 1.0
+
+    def test_perturbed_queries_degrade_gracefully(self):
+        rng = np.random.default_rng(1)
+        corpus = l2_normalize(rng.standard_normal((50, 16)))
+        queries = corpus[:10]
+        noisy = l2_normalize(queries + 0.01 * rng.standard_normal(queries.shape))
+
+        assert cosine_agreement(queries, noisy)["mean"] > 0.99
+        assert retrieval_agreement(queries, noisy, corpus, k_list=[1, 3])["hit@3"] == 1.0
+
+    def test_top_k_sorted(self):
+        corpus = np.eye(4)
+        q = np.array([[0.1, 0.9, 0.5, 0.0]])
+        assert top_k(q, corpus, 3).tolist() == [[1, 2, 0]]
+
+
+class TestBackendSelection:
+    """Test EMBED_BACKEND wiring in index_Qdrant."""
+
+    def test_unknown_backend_rejected(self, monkeypatch):
+        monkeypatch.setattr(index_qdrant, "EMBED_BACKEND", "tpu")
+        with pytest.raises(ValueError):
+            index_qdrant._create_embedder()
+
+    def test_query_cache_key_depends_on_backend(self, monkeypatch):
+        torch_id = index_qdrant.embedding_model_id()
+        monkeypatch.setattr(index_qdrant, "EMBED_BACKEND", "onnx")
+        assert index_qdrant.embedding_model_id() != torch_id
+
+    def test_index_params_unchanged(self, monkeypatch):
+        # i vettori ONNX sono drop-in: cambiare backend non invalida l'indice
+        params = index_qdrant._index_params()
+        monkeypatch.setattr(index_qdrant, "EMBED_BACKEND", "onnx")
+        assert index_qdrant._index_params() == params
+
+
+class TestEnsureOnnxModel:
+    """Test that the model file the backend loads is checked, not just the config."""
+
+    @pytest.fixture
+    def calls(self, monkeypatch):
+        calls = []
+        monkeypatch.setattr(onnx_embedder, "export_onnx", lambda name, out_dir, quantize: calls.append(("export", quantize)))
+        monkeypatch.setattr(onnx_embedder, "quantize_onnx", lambda model_dir: calls.append(("quantize",)))
+        return calls
+
+    def _export(self, model_dir, *files):
+        with open(model_dir / onnx_embedder.CONFIG_FILE, "w") as f:
+            f.write('{"quantized": false}')
+        for name in files:
+            (model_dir / name).write_bytes(b"")
+
+    def test_fp32_export_quantized_in_place(self, tmp_path, calls):
+        self._export(tmp_path, onnx_embedder.MODEL_FILE)
+        onnx_embedder.ensure_onnx_model("m", str(tmp_path), quantized=True)
+
+        assert calls == [("quantize",)]
+        with open(tmp_path / onnx_embedder.CONFIG_FILE) as f:
+            assert '"quantized": true' in f.read()
+
+    def test_complete_export_reused(self, tmp_path, calls):
+        self._export(tmp_path, onnx_embedder.MODEL_FILE, onnx_embedder.QUANTIZED_MODEL_FILE)
+        onnx_embedder.ensure_onnx_model("m", str(tmp_path), quantized=True)
+        onnx_embedder.ensure_onnx_model("m", str(tmp_path), quantized=False)
+
+        assert calls == []
+
+    def test_missing_model_exported(self, tmp_path, calls):
+        onnx_embedder.ensure_onnx_model("m", str(tmp_path / "none"), quantized=True)
+        # config presente ma senza model.onnx: non si puo' quantizzare, si riesporta
+        self._export(tmp_path)
+        onnx_embedder.ensure_onnx_model("m", str(tmp_path), quantized=False)
+
+        assert calls == [("export", True), ("export", False)]
+
+
+@pytest.mark.skipif(not os.getenv("ONNX_TEST_MODEL_DIR"), reason="ONNX_TEST_MODEL_DIR not set")
+class TestRealOnnxModel:
+    """Parity against SentenceTransformer on an exported model."""
+
+    def test_parity_with_torch(self):
+        from sentence_transformers import SentenceTransformer
+
+        texts = ["Normal echo findings", "Dilated cardiomyopathy, reduced ejection fraction"]
+        onnx_vecs = OnnxEmbedder(os.environ["ONNX_TEST_MODEL_DIR"]).encode(texts, normalize_embeddings=True)
+        torch_vecs = SentenceTransformer(index_qdrant.EMB_MODEL).encode(texts, normalize_embeddings=True)
+        assert cosine_agreement(torch_vecs, onnx_vecs)["min"] > 0.98
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
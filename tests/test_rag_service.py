@@ -0,0 +1,145 @@
+"""
+Unit tests for rag_service retrieval.
+Tests concurrent retrieval and per-collection timeouts of the async /chat path.
+"""
+import pytest
+import os
+import sys
+import time
+import asyncio
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__))))
+
+from api.services import rag_service
+from scripts.llm_provider import FakeLLMProvider
+
+
+def _done_future(text):
+    fut = Future()
+    fut.set_result([0.1] * 384)
+    return fut
+
+
+class SlowVectorstore:
+    """Fake vectorstore: every search sleeps for the configured delay (or raises it)."""
+
+    def __init__(self, delays):
+        self.delays = delays
+        self.timeouts = {}
+
+    def search(self, collection_name, query_vector, vector_name, k, timeout=None):
+        self.timeouts[collection_name] = timeout
+        delay = self.delays[collection_name]
+        if isinstance(delay, Exception):
+            raise delay
+        time.sleep(delay)
+        return [
+            SimpleNamespace(
+                id=f"{collection_name}-{i}",
+                score=0.9 - i * 0.1,
+                text=f"{collection_name} text {i}",
+                metadata={"source": f"{collection_name}.txt"},
+            )
+            for i in range(2)
+        ]
+
+
+@pytest.fixture
+def fake_backend(monkeypatch):
+    llm = FakeLLMProvider(ttft_ms=0, tokens_per_s=0, output_tokens=20)
+
+    def install(delays):
+        vs = SlowVectorstore(delays)
+        monkeypatch.setattr(rag_service, "get_vectorstore", lambda: vs)
+        monkeypatch.setattr(rag_service, "embed_query", lambda text: [0.1] * 384)
+        monkeypatch.setattr(rag_service, "embed_query_future", _done_future)
+        monkeypatch.setattr(rag_service, "get_llm_provider", lambda: llm)
+        return vs
+    return install
+
+
+class TestAnswerQuestionAsync:
+    """Test async retrieval path."""
+
+    def test_searches_run_concurrently(self, fake_backend):
+        fake_backend({"cases": 0.3, "guidelines": 0.3})
+
+        t0 = time.perf_counter()
+        out = asyncio.run(rag_service.answer_question_async("q", "gpt-4o", "hybrid", None, False))
+        elapsed = time.perf_counter() - t0
+
+        assert len(out["sources"]) == 4
+        assert out["timed_out"] is None
+        assert elapsed < 0.55, f"Searches should overlap, took {elapsed:.2f}s"
+
+    def test_timeout_returns_partial_sources(self, fake_backend, monkeypatch):
+        fake_backend({"cases": 0.0, "guidelines": 0.5})
+        monkeypatch.setitem(rag_service.SEARCH_TIMEOUT_S, "guidelines", 0.1)
+
+        out = asyncio.run(rag_service.answer_question_async("q", "gpt-4o", "hybrid", None, False))
+
+        assert out["timed_out"] == ["guidelines"]
+        assert out["failed"] is None
+        assert {s["type"] for s in out["sources"]} == {"case"}
+
+    def test_failed_collection_reported(self, fake_backend):
+        fake_backend({"cases": ConnectionError("qdrant unreachable"), "guidelines": 0.0})
+
+        out = asyncio.run(rag_service.answer_question_async("q", "gpt-4o", "hybrid", None, False))
+
+        assert out["failed"] == ["cases"]
+        assert out["timed_out"] is None
+        assert {s["type"] for s in out["sources"]} == {"guideline"}
+
+    def test_timeout_passed_to_search(self, fake_backend, monkeypatch):
+        vs = fake_backend({"cases": 0.0, "guidelines": 0.0})
+        monkeypatch.setitem(rag_service.SEARCH_TIMEOUT_S, "cases", 2.5)
+        monkeypatch.setitem(rag_service.SEARCH_TIMEOUT_S, "guidelines", 0.2)
+
+        asyncio.run(rag_service.answer_question_async("q", "gpt-4o", "hybrid", None, False))
+
+        # la ricerca nel worker e' limitata lato client, non solo da wait_for
+        assert vs.timeouts == {"cases": 3, "guidelines": 1}
+
+    def test_matches_sync_answer(self, fake_backend):
+        fake_backend({"cases": 0.0, "guidelines": 0.0})
+
+        sync_out = rag_service.answer_question("q", "gpt-4o", "guidelines", "s1", False)
+        async_out = asyncio.run(rag_service.answer_question_async("q", "gpt-4o", "guidelines", "s1", False))
+
+        assert async_out["answer"] == sync_out["answer"]
+        assert async_out["sources"] == sync_out["sources"]
+
+
+class TestChatLLM:
+    """Test the /chat answer generation through the LLM provider."""
+
+    def test_answer_from_provider(self, fake_backend, monkeypatch):
+        fake_backend({"cases": 0.0, "guidelines": 0.0})
+        prompts = []
+        llm = FakeLLMProvider(ttft_ms=0, tokens_per_s=0, output_tokens=5)
+        original = llm.generate
+        monkeypatch.setattr(llm, "generate", lambda model, messages, n: prompts.append((model, messages)) or original(model, messages, n))
+        monkeypatch.setattr(rag_service, "get_llm_provider", lambda: llm)
+
+        out = rag_service.answer_question("q", "gpt-4o-mini", "guidelines", None, False)
+
+        assert out["answer"].startswith("[fake:")
+        model, messages = prompts[0]
+        assert model == "gpt-4o-mini" and "guidelines text 0" in messages[1]["content"]
+
+    def test_provider_failure_falls_back_to_context(self, fake_backend, monkeypatch):
+        fake_backend({"cases": 0.0, "guidelines": 0.0})
+        monkeypatch.setattr(
+            rag_service, "get_llm_provider", lambda: FakeLLMProvider(ttft_ms=0, failure_rate=1.0)
+        )
+
+        out = asyncio.run(rag_service.answer_question_async("q", "gpt-4o", "cases", None, False))
+
+        assert out["answer"].startswith("[RAG stub - cases]") and len(out["sources"]) == 2
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
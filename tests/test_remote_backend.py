@@ -0,0 +1,351 @@
+"""
+Unit tests for the remote Qdrant backend.
+Two API replicas share one Qdrant: the second must reuse the index instead of re-embedding.
+Set QDRANT_TEST_URL (e.g. http://localhost:6333) to also run against a real server.
+"""
+import pytest
+import os
+import sys
+import json
+import time
+import threading
+import importlib.util
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__))))
+
+from qdrant_client import QdrantClient, models
+from datapizza.vectorstores.qdrant import QdrantVectorstore
+
+from scripts.incremental_index import manifest_from_collection, sync_collection, point_id
+from scripts.synthetic_data import HashEmbedder
+import scripts.index_Qdrant as index_qdrant
+import datapizza.vectorstores.qdrant as datapizza_qdrant
+import qdrant_client
+
+
+class SharedServer:
+    """Stand-in for a Qdrant server: every "replica" gets a vectorstore on the same client."""
+
+    def __init__(self):
+        self.client = QdrantClient(location=":memory:")
+
+    def new_replica(self):
+        vs = QdrantVectorstore(location=":memory:")
+        vs.client = self.client
+        return vs
+
+
+@pytest.fixture
+def remote_sources(tmp_path, monkeypatch, fake_embedder):
+    jsonl = tmp_path / "documents.jsonl"
+    guides = tmp_path / "guidelines_txt"
+    guides.mkdir()
+    (guides / "normal.txt").write_text("Normal echo findings. " * 20)
+    docs = [
+        {"content": f"Ultrasound study {i}", "metadata": {"case_id": f"c{i}", "document_type": "case_card"}}
+        for i in range(3)
+    ]
+    jsonl.write_text("".join(json.dumps(d) + "\n" for d in docs))
+
+    monkeypatch.setattr(index_qdrant, "QDRANT_MODE", "remote")
+    monkeypatch.setattr(index_qdrant, "JSONL_PATH", str(jsonl))
+    monkeypatch.setattr(index_qdrant, "GUIDELINES_DIR", str(guides))
+    monkeypatch.setattr(index_qdrant, "SNAPSHOT_DIR", str(tmp_path / "snapshot"))
+    monkeypatch.setattr(index_qdrant, "_embedder", fake_embedder)
+    monkeypatch.setattr(index_qdrant, "_manifest", {})
+    monkeypatch.setattr(index_qdrant, "_served_fingerprint", None)
+    return jsonl
+
+
+class SlowEmbedder(HashEmbedder):
+    """HashEmbedder lento e thread-safe: allarga la finestra di race tra repliche."""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def encode(self, texts, **kwargs):
+        time.sleep(0.05)
+        with self._lock:
+            return super().encode(texts, **kwargs)
+
+
+def _load_replica_module(name, server, embedder):
+    """Seconda copia del modulo con stato di processo proprio, come una replica separata."""
+    spec = importlib.util.spec_from_file_location(name, index_qdrant.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.QDRANT_MODE = "remote"
+    module.JSONL_PATH = index_qdrant.JSONL_PATH
+    module.GUIDELINES_DIR = index_qdrant.GUIDELINES_DIR
+    module.SNAPSHOT_DIR = index_qdrant.SNAPSHOT_DIR
+    module.INDEX_LOCK_POLL_S = 0.02
+    module._embedder = embedder
+    module._create_vectorstore = server.new_replica
+    return module
+
+
+def _start_replica(server, monkeypatch):
+    """Simula l'avvio di una replica dell'API (stato di processo azzerato)."""
+    vs = server.new_replica()
+    monkeypatch.setattr(index_qdrant, "_vectorstore", vs)
+    monkeypatch.setattr(index_qdrant, "_manifest", {})
+    index_qdrant._ensure_collections_populated()
+    return vs
+
+
+class TestRemoteBackend:
+    """Test shared-index behaviour in QDRANT_MODE=remote."""
+
+    def test_second_replica_does_not_reembed(self, remote_sources, monkeypatch, fake_embedder):
+        server = SharedServer()
+        _start_replica(server, monkeypatch)
+        assert fake_embedder.encoded > 0
+        assert server.client.count("cases").count == 3
+
+        before = fake_embedder.encoded
+        _start_replica(server, monkeypatch)
+        assert fake_embedder.encoded == before, "Second replica should reuse the shared index"
+        assert not os.path.exists(index_qdrant.SNAPSHOT_DIR), "Remote mode must not write local snapshots"
+
+    def test_replica_syncs_only_delta(self, remote_sources, monkeypatch, fake_embedder):
+        server = SharedServer()
+        _start_replica(server, monkeypatch)
+
+        with open(remote_sources, "a") as f:
+            f.write(json.dumps({"content": "Ultrasound study new", "metadata": {"case_id": "new", "document_type": "case_card"}}) + "\n")
+
+        before = fake_embedder.encoded
+        _start_replica(server, monkeypatch)
+        assert fake_embedder.encoded - before == 1
+        assert server.client.count("cases").count == 4
+
+    def test_concurrent_replicas_build_once(self, remote_sources, monkeypatch):
+        server = SharedServer()
+        embedder = SlowEmbedder()
+        replicas = [
+            _load_replica_module(f"index_qdrant_replica_{i}", server, embedder)
+            for i in range(2)
+        ]
+        deleted = []
+        original_delete = QdrantClient.delete_collection
+        monkeypatch.setattr(
+            QdrantClient, "delete_collection",
+            lambda self, name, **kw: (deleted.append(name), original_delete(self, name, **kw))[1],
+        )
+
+        errors = []
+
+        def start(module):
+            try:
+                module.get_vectorstore()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=start, args=(m,)) for m in replicas]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(timeout=30)
+
+        assert not errors
+        # un solo build: 3 case card + chunk guidelines embeddati una volta
+        docs = server.client.count("cases").count + server.client.count("guidelines").count
+        assert embedder.encoded == docs
+        assert set(deleted) <= {index_qdrant.INDEX_LOCK_COLLECTION}
+        assert not server.client.collection_exists(index_qdrant.INDEX_LOCK_COLLECTION)
+        for module in replicas:
+            assert module.index_stats()["documents"]["cases"] == 3
+
+    def test_up_to_date_replica_loads_manifest(self, remote_sources, monkeypatch, fake_embedder):
+        server = SharedServer()
+        _start_replica(server, monkeypatch)
+        _start_replica(server, monkeypatch)
+
+        stats = index_qdrant.index_stats()["documents"]
+        assert stats["cases"] == 3 and stats["guidelines"] > 0
+
+        writes = []
+        monkeypatch.setattr(index_qdrant, "_write_remote_state", lambda *a: writes.append(a))
+        index_qdrant.refresh_index()
+        assert writes == [], "Unchanged index must not rewrite the remote state"
+
+    def test_concurrent_reindex_embeds_delta_once(self, remote_sources, monkeypatch):
+        server = SharedServer()
+        embedder = SlowEmbedder()
+        replicas = [
+            _load_replica_module(f"index_qdrant_reindex_{i}", server, embedder)
+            for i in range(2)
+        ]
+        for module in replicas:
+            module.get_vectorstore()
+
+        with open(remote_sources, "a") as f:
+            f.write(json.dumps({"content": "Ultrasound study new", "metadata": {"case_id": "new", "document_type": "case_card"}}) + "\n")
+
+        before = embedder.encoded
+        threads = [threading.Thread(target=m.refresh_index) for m in replicas]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(timeout=30)
+
+        assert embedder.encoded - before == 1, "Only one replica should embed the delta"
+        assert server.client.count("cases").count == 4
+        assert not server.client.collection_exists(index_qdrant.INDEX_LOCK_COLLECTION)
+
+    def test_reindex_diffs_against_server_manifest(self, remote_sources, monkeypatch):
+        server = SharedServer()
+        first = _load_replica_module("index_qdrant_stale_0", server, HashEmbedder())
+        second = _load_replica_module("index_qdrant_stale_1", server, HashEmbedder())
+        first.get_vectorstore()
+        second.get_vectorstore()
+
+        with open(remote_sources, "a") as f:
+            f.write(json.dumps({"content": "Ultrasound study new", "metadata": {"case_id": "new", "document_type": "case_card"}}) + "\n")
+        first.refresh_index()
+
+        # il manifest in memoria della seconda replica e' vecchio: deve ricaricarlo sotto lease
+        before = second._embedder.encoded
+        second.refresh_index()
+        assert second._embedder.encoded == before
+        assert second.index_stats()["documents"]["cases"] == 4
+
+    def test_result_key_follows_reindex_by_other_replica(self, remote_sources, monkeypatch, fake_embedder):
+        import scripts.multimodal_rag_openai as multimodal
+
+        server = SharedServer()
+        _start_replica(server, monkeypatch)
+        monkeypatch.setattr(index_qdrant, "_initialized", True)
+        key = multimodal._result_key("report", [])
+        generation = index_qdrant.index_generation()
+
+        with open(remote_sources, "a") as f:
+            f.write(json.dumps({"content": "Ultrasound study new", "metadata": {"case_id": "new", "document_type": "case_card"}}) + "\n")
+        # /reindex servito da un'altra replica: questo processo non chiama refresh_index()
+        other = _load_replica_module("index_qdrant_other", server, HashEmbedder())
+        other.get_vectorstore()
+        other.refresh_index()
+
+        assert index_qdrant.index_generation() == generation
+        assert multimodal._result_key("report", []) != key
+
+    def test_expired_lease_is_broken(self, monkeypatch):
+        client = QdrantClient(location=":memory:")
+        dead = index_qdrant._RemoteIndexLease(client, ttl_s=0.05)
+        assert dead.try_acquire()
+        dead._stop.set()  # replica morta: nessun rinnovo
+
+        other = index_qdrant._RemoteIndexLease(client, ttl_s=0.05)
+        assert not other.try_acquire()
+        time.sleep(0.1)
+        assert not other.try_acquire()  # scaduto: lock liberato, si riprova al giro dopo
+        assert other.try_acquire()
+        other.release()
+        assert not client.collection_exists(index_qdrant.INDEX_LOCK_COLLECTION)
+
+    def test_remote_client_settings(self, monkeypatch):
+        captured = {}
+
+        class FakeVectorstore:
+            def __init__(self, **kwargs):
+                captured.update(kwargs)
+
+        monkeypatch.setattr(datapizza_qdrant, "QdrantVectorstore", FakeVectorstore)
+        monkeypatch.setattr(index_qdrant, "QDRANT_MODE", "remote")
+        monkeypatch.setattr(index_qdrant, "QDRANT_HOST", "qdrant")
+        monkeypatch.setattr(index_qdrant, "QDRANT_PORT", 7333)
+        monkeypatch.setattr(index_qdrant, "QDRANT_GRPC_PORT", 7334)
+        monkeypatch.setattr(index_qdrant, "QDRANT_PREFER_GRPC", True)
+        monkeypatch.setattr(index_qdrant, "QDRANT_API_KEY", "secret")
+        monkeypatch.setattr(index_qdrant, "QDRANT_POOL_SIZE", 4)
+        monkeypatch.setattr(index_qdrant, "QDRANT_TIMEOUT_S", 3)
+
+        index_qdrant._create_vectorstore()
+
+        assert captured == {
+            "host": "qdrant",
+            "port": 7333,
+            "api_key": "secret",
+            "grpc_port": 7334,
+            "prefer_grpc": True,
+            "pool_size": 4,
+            "timeout": 3,
+        }
+
+    def test_pool_size_skipped_on_old_client(self, monkeypatch):
+        captured = {}
+
+        class FakeVectorstore:
+            def __init__(self, **kwargs):
+                captured.update(kwargs)
+
+        class OldQdrantClient:
+            def __init__(self, host=None, port=6333, grpc_port=6334, prefer_grpc=False, timeout=None, **kwargs):
+                pass
+
+        monkeypatch.setattr(datapizza_qdrant, "QdrantVectorstore", FakeVectorstore)
+        monkeypatch.setattr(qdrant_client, "QdrantClient", OldQdrantClient)
+        monkeypatch.setattr(index_qdrant, "QDRANT_MODE", "remote")
+
+        index_qdrant._create_vectorstore()
+
+        assert "pool_size" not in captured
+        assert captured["timeout"] == index_qdrant.QDRANT_TIMEOUT_S
+
+    def test_unknown_mode_rejected(self, monkeypatch):
+        monkeypatch.setattr(index_qdrant, "QDRANT_MODE", "cloud")
+        with pytest.raises(ValueError):
+            index_qdrant._create_vectorstore()
+
+
+class TestManifestFromCollection:
+    """Test manifest reconstruction from point payloads."""
+
+    def test_roundtrip(self, fake_embedder):
+        server = SharedServer()
+        server.client.create_collection(
+            "cases",
+            vectors_config={"text_embedding": models.VectorParams(size=384, distance=models.Distance.COSINE)},
+        )
+        manifest = {}
+        docs = [(f"k{i}", f"text {i}", {"document_type": "case_card"}) for i in range(4)]
+        embed = lambda texts: fake_embedder.encode(texts, normalize_embeddings=True).tolist()
+        sync_collection(server.client, "cases", docs, embed, manifest, batch_size=3)
+
+        assert manifest_from_collection(server.client, "cases", page_size=2) == manifest
+
+    def test_legacy_point_with_same_id_survives(self, fake_embedder):
+        client = QdrantClient(location=":memory:")
+        client.create_collection(
+            "cases",
+            vectors_config={"text_embedding": models.VectorParams(size=384, distance=models.Distance.COSINE)},
+        )
+        # punto scritto senza campi di servizio, ma con l'id deterministico
+        client.upsert("cases", points=[models.PointStruct(
+            id=point_id("cases", "k0"), vector={"text_embedding": [0.1] * 384}, payload={"text": "text 0"},
+        )])
+        manifest = manifest_from_collection(client, "cases")
+        embed = lambda texts: fake_embedder.encode(texts, normalize_embeddings=True).tolist()
+
+        stats = sync_collection(client, "cases", [("k0", "text 0", {})], embed, manifest)
+
+        assert stats.added == 1 and stats.deleted == 1
+        assert client.count("cases").count == 1
+        assert set(manifest) == {"k0"}
+
+
+@pytest.mark.skipif(not os.getenv("QDRANT_TEST_URL"), reason="QDRANT_TEST_URL not set")
+class TestRealServer:
+    """Integration test against a running Qdrant server."""
+
+    def test_state_roundtrip(self):
+        client = QdrantClient(url=os.environ["QDRANT_TEST_URL"])
+        index_qdrant._write_remote_state(client, "test-fingerprint")
+        state = index_qdrant._read_remote_state(client)
+        assert state["fingerprint"] == "test-fingerprint"
+        assert state["params"] == index_qdrant._index_params()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
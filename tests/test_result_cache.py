@@ -0,0 +1,169 @@
+"""
+Unit tests for the multimodal analysis result cache.
+Tests cache keys, TTL/LRU eviction, bypass, single-flight and invalidation on reindex.
+"""
+import pytest
+import os
+import sys
+import time
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__))))
+
+from scripts.result_cache import ResultCache, analysis_cache_key
+from scripts.incremental_index import SyncStats
+import scripts.index_Qdrant as iq
+import scripts.multimodal_rag_openai as mm
+
+
+def _frames(tmp_path, n=2, tag=b"a"):
+    paths = []
+    for i in range(n):
+        p = tmp_path / f"frame_{i}.png"
+        p.write_bytes(tag * (i + 10))
+        paths.append(str(p))
+    return paths
+
+
+class TestAnalysisCacheKey:
+    """Test what the key depends on."""
+
+    def test_whitespace_insensitive(self, tmp_path):
+        frames = _frames(tmp_path)
+        assert analysis_cache_key("LV  dilated\n EF 30%", frames, {}, "v1") == analysis_cache_key(
+            "LV dilated EF 30%", frames, {}, "v1"
+        )
+
+    def test_frame_content_params_and_index_version(self, tmp_path):
+        frames = _frames(tmp_path)
+        base = analysis_cache_key("report", frames, {"topk": 5}, "v1")
+
+        assert analysis_cache_key("report", frames, {"topk": 6}, "v1") != base
+        assert analysis_cache_key("report", frames, {"topk": 5}, "v2") != base
+        assert analysis_cache_key("report", frames[::-1], {"topk": 5}, "v1") != base
+
+        _frames(tmp_path, tag=b"b")
+        assert analysis_cache_key("report", frames, {"topk": 5}, "v1") != base
+
+
+class TestResultCache:
+    """Test hits, eviction, bypass and concurrent identical requests."""
+
+    def test_hit_after_compute(self):
+        cache = ResultCache()
+        calls = []
+        compute = lambda: calls.append(1) or "answer"
+
+        assert cache.get_or_compute("k", compute) == "answer"
+        assert cache.get_or_compute("k", compute) == "answer"
+        assert len(calls) == 1
+        assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+    def test_ttl_and_lru(self, monkeypatch):
+        cache = ResultCache(max_entries=2, ttl_s=10)
+        for k in ("a", "b", "c"):
+            cache.put(k, k)
+        assert cache.get("a") is None and cache.get("c") == "c"
+
+        now = time.monotonic()
+        monkeypatch.setattr("scripts.result_cache.time.monotonic", lambda: now + 11)
+        assert cache.get("c") is None
+
+    def test_bypass_recomputes_and_refreshes(self):
+        cache = ResultCache()
+        cache.put("k", "old")
+
+        assert cache.get_or_compute("k", lambda: "new", bypass=True) == "new"
+        assert cache.get("k") == "new"
+        assert cache.stats()["bypassed"] == 1
+
+    def test_errors_not_cached(self):
+        cache = ResultCache()
+
+        def fail():
+            raise RuntimeError("upstream error")
+
+        with pytest.raises(RuntimeError):
+            cache.get_or_compute("k", fail)
+        assert cache.get_or_compute("k", lambda: "ok") == "ok"
+
+    def test_concurrent_identical_requests_coalesced(self):
+        cache = ResultCache()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "answer"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("k", slow))) for _ in range(3)]
+        threads[0].start()
+        started.wait(5)
+        for t in threads[1:]:
+            t.start()
+        time.sleep(0.05)
+        release.set()
+        for t in threads:
+            t.join(5)
+
+        assert results == ["answer"] * 3 and len(calls) == 1
+
+
+class TestRunMultimodalRagCache:
+    """Test the cache around run_multimodal_rag."""
+
+    @pytest.fixture
+    def pipeline(self, monkeypatch):
+        calls = []
+        monkeypatch.setattr(mm, "_result_cache", ResultCache())
+        monkeypatch.setattr(mm, "get_vectorstore", lambda: None)
+        monkeypatch.setattr(
+            mm, "_run_multimodal_rag",
+            lambda report, frames: calls.append(frames) or {"answer": f"ANSWER {len(calls)}", "sources": []},
+        )
+        return calls
+
+    def test_identical_analysis_served_from_cache(self, tmp_path, pipeline):
+        frames = _frames(tmp_path)
+        first = mm.run_multimodal_rag("report", query_frame_paths=frames)
+
+        assert mm.run_multimodal_rag("report ", query_frames_folder=str(tmp_path)) == first
+        assert len(pipeline) == 1
+
+        assert mm.run_multimodal_rag("report", query_frame_paths=frames, bypass_cache=True) != first
+        assert len(pipeline) == 2
+
+    def test_reindex_invalidates(self, tmp_path, pipeline, monkeypatch):
+        frames = _frames(tmp_path)
+        monkeypatch.setattr(iq, "QDRANT_MODE", "memory")
+        monkeypatch.setattr(iq, "USE_SNAPSHOT", False)
+        monkeypatch.setattr(iq, "_served_fingerprint", None)
+        monkeypatch.setattr(iq, "_index_guidelines", lambda: None)
+        monkeypatch.setattr(iq, "_index_cases", lambda: SyncStats(unchanged=3))
+        monkeypatch.setattr(iq, "_index_fingerprint", lambda: "sources-v1")
+        iq.refresh_index()
+        mm.run_multimodal_rag("report", query_frame_paths=frames)
+
+        iq.refresh_index()
+        mm.run_multimodal_rag("report", query_frame_paths=frames)
+        assert len(pipeline) == 1, "Reindex without changes keeps the cache"
+
+        monkeypatch.setattr(iq, "_index_cases", lambda: SyncStats(added=1))
+        monkeypatch.setattr(iq, "_index_fingerprint", lambda: "sources-v2")
+        iq.refresh_index()
+        mm.run_multimodal_rag("report", query_frame_paths=frames)
+        assert len(pipeline) == 2
+
+    def test_disabled(self, tmp_path, pipeline, monkeypatch):
+        monkeypatch.setattr(mm, "_result_cache", ResultCache(max_entries=0))
+        frames = _frames(tmp_path)
+        mm.run_multimodal_rag("report", query_frame_paths=frames)
+        mm.run_multimodal_rag("report", query_frame_paths=frames)
+        assert len(pipeline) == 2
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
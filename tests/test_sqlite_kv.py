@@ -0,0 +1,72 @@
+"""
+Unit tests for the shared SQLite key/value tier.
+Tests codecs, TTL, pruning, namespace invalidation and legacy-table migration.
+"""
+import pytest
+import os
+import sys
+import json
+import sqlite3
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__))))
+
+from scripts.sqlite_kv import SqliteKV
+
+
+class TestSqliteKV:
+    """Test SqliteKV."""
+
+    def test_codec_roundtrip_shared_file(self, tmp_path):
+        path = str(tmp_path / "kv.sqlite")
+        kv = SqliteKV(path, "docs", encode=json.dumps, decode=json.loads)
+        kv.put("a", {"x": [1, 2]})
+
+        assert SqliteKV(path, "docs", encode=json.dumps, decode=json.loads).get("a") == {"x": [1, 2]}
+        assert SqliteKV(path, "other").get("a") is None
+
+    def test_ttl(self, tmp_path, monkeypatch):
+        kv = SqliteKV(str(tmp_path / "kv.sqlite"), "docs", ttl_s=10)
+        kv.put("a", "v")
+        assert kv.get("a") == "v"
+
+        now = time.time()
+        monkeypatch.setattr("scripts.sqlite_kv.time.time", lambda: now + 11)
+        assert kv.get("a") is None
+
+    def test_pruned_to_max_entries(self, tmp_path):
+        kv = SqliteKV(str(tmp_path / "kv.sqlite"), "docs", max_entries=10)
+        for i in range(100):
+            kv.put(f"k{i}", str(i))
+
+        count = kv._conn().execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+        assert count == 10
+        assert kv.get("k99") == "99" and kv.get("k0") is None
+
+    def test_namespace_change_clears_only_its_table(self, tmp_path):
+        path = str(tmp_path / "kv.sqlite")
+        SqliteKV(path, "embeddings", namespace="model-a").put("q", "v1")
+        SqliteKV(path, "payloads").put("img", "data")
+
+        assert SqliteKV(path, "embeddings", namespace="model-a").get("q") == "v1"
+        assert SqliteKV(path, "embeddings", namespace="model-b").get("q") is None
+        assert SqliteKV(path, "payloads").get("img") == "data"
+
+    def test_legacy_table_replaced(self, tmp_path):
+        path = str(tmp_path / "kv.sqlite")
+        with sqlite3.connect(path) as conn:
+            conn.execute("CREATE TABLE payloads (key TEXT PRIMARY KEY, data_url TEXT, created REAL)")
+            conn.execute("INSERT INTO payloads VALUES ('old', 'x', 0)")
+
+        kv = SqliteKV(path, "payloads")
+        kv.put("new", "y")
+
+        assert kv.get("new") == "y" and kv.get("old") is None
+
+    def test_invalid_table_name(self, tmp_path):
+        with pytest.raises(ValueError):
+            SqliteKV(str(tmp_path / "kv.sqlite"), "x; DROP TABLE meta")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
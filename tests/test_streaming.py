@@ -0,0 +1,174 @@
+"""
+Unit tests for the Server-Sent Events endpoints.
+Tests the streaming multimodal pipeline, /chat/stream and /analyze-case/stream event order.
+"""
+import pytest
+import os
+import sys
+import json
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__))))
+
+from scripts.result_cache import ResultCache
+from scripts.llm_provider import FakeLLMProvider, LLMProvider
+import scripts.multimodal_rag_openai as mm
+from api.main import app
+from api.services import doc_service, rag_service
+from tests.conftest import write_synthetic_dicom
+
+
+def _parse_sse(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+class ScriptedProvider(LLMProvider):
+    """Provider con delta fissi; conta gli stream chiusi."""
+
+    name = "scripted"
+
+    def __init__(self, deltas):
+        super().__init__()
+        self.deltas = deltas
+        self.closed = 0
+
+    def stream(self, model, messages, max_output_tokens):
+        self._count()
+        try:
+            yield from self.deltas
+        finally:
+            self.closed += 1
+
+
+class TestIterMultimodalRag:
+    """Test the streaming pipeline and its result cache integration."""
+
+    @pytest.fixture
+    def fake_pipeline(self, tmp_path, monkeypatch):
+        llm = ScriptedProvider(["Probable ", "DCM."])
+        sources = [{"type": "case", "id": "c1", "score": 0.9, "snippet": "...", "metadata": {}}]
+        monkeypatch.setattr(mm, "_result_cache", ResultCache())
+        monkeypatch.setattr(mm, "get_vectorstore", lambda: None)
+        monkeypatch.setattr(mm, "_prepare_request", lambda report, frames: (sources, []))
+        monkeypatch.setattr(mm, "get_llm_provider", lambda: llm)
+        frame = tmp_path / "frame_0.png"
+        frame.write_bytes(b"png")
+        return llm, [str(frame)]
+
+    def test_sources_then_tokens_then_done(self, fake_pipeline):
+        llm, frames = fake_pipeline
+        events = list(mm.iter_multimodal_rag("report", query_frame_paths=frames))
+
+        assert [e for e, _ in events] == ["sources", "token", "token", "done"]
+        assert events[0][1]["sources"][0]["id"] == "c1"
+        done = events[-1][1]
+        assert done["answer"] == "Probable DCM." and done["cached"] is False
+        assert done["timings"]["first_token_s"] <= done["timings"]["total_s"]
+        assert llm.closed == 1
+
+    def test_streamed_answer_cached(self, fake_pipeline):
+        llm, frames = fake_pipeline
+        list(mm.iter_multimodal_rag("report", query_frame_paths=frames))
+
+        events = list(mm.iter_multimodal_rag("report", query_frame_paths=frames))
+        assert events[-1][1]["cached"] is True and events[0][1]["sources"]
+        assert mm.run_multimodal_rag("report", query_frame_paths=frames) == "Probable DCM."
+        assert llm.calls == 1
+
+        list(mm.iter_multimodal_rag("report", query_frame_paths=frames, bypass_cache=True))
+        assert llm.calls == 2
+
+    def test_disconnect_closes_upstream(self, fake_pipeline):
+        llm, frames = fake_pipeline
+        gen = mm.iter_multimodal_rag("report", query_frame_paths=frames)
+        next(gen)
+        next(gen)
+        gen.close()
+
+        assert llm.closed == 1
+        assert mm.get_result_cache().stats()["size"] == 0
+
+
+class TestChatStream:
+    """Test POST /chat/stream."""
+
+    def test_event_order(self, monkeypatch):
+        hit = SimpleNamespace(id="g-1", score=0.8, text="guideline text", metadata={"source": "esc.txt"})
+        vs = SimpleNamespace(search=lambda **kw: [hit])
+        emb = Future()
+        emb.set_result([0.1] * 384)
+        monkeypatch.setattr(rag_service, "get_vectorstore", lambda: vs)
+        monkeypatch.setattr(rag_service, "embed_query_future", lambda text: emb)
+        monkeypatch.setattr(
+            rag_service, "get_llm_provider", lambda: FakeLLMProvider(ttft_ms=0, tokens_per_s=0, output_tokens=4)
+        )
+
+        resp = TestClient(app).post(
+            "/chat/stream",
+            json={"question": "q", "model": "gpt-4o", "rag_type": "guidelines"},
+        )
+
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("text/event-stream")
+        events = _parse_sse(resp.text)
+        assert [e for e, _ in events] == ["sources"] + ["token"] * 4 + ["done"]
+        assert events[0][1]["sources"][0]["id"] == "g-1"
+        assert events[-1][1]["answer"] == "".join(d["text"] for e, d in events if e == "token")
+        assert events[-1][1]["timings"]["first_token_s"] is not None
+
+
+class TestAnalyzeCaseStream:
+    """Test POST /analyze-case/stream."""
+
+    @pytest.fixture
+    def api_env(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(doc_service, "CURRENT_DICOM_DIR", tmp_path / "dicom")
+        monkeypatch.setattr(doc_service, "CURRENT_FRAMES_DIR", tmp_path / "frames")
+        monkeypatch.setattr(doc_service, "UPLOAD_STAGING_DIR", tmp_path / "incoming")
+        monkeypatch.setattr(doc_service, "UPLOAD_INDEX_PATH", tmp_path / "upload_index.json")
+        src = tmp_path / "cine.dcm"
+        write_synthetic_dicom(src, frames=4)
+        return src
+
+    def _post(self, src):
+        return TestClient(app).post(
+            "/analyze-case/stream",
+            files={"file": ("cine.dcm", src.read_bytes(), "application/dicom")},
+            data={"report_text": "LV dilated"},
+        )
+
+    def test_upload_sources_tokens_done(self, api_env, monkeypatch):
+        def stub(report_text, query_frames_folder=None, query_frame_paths=None, bypass_cache=False):
+            assert query_frame_paths
+            yield "sources", {"sources": []}
+            yield "token", {"text": f"ANSWER {report_text}"}
+            yield "done", {"answer": f"ANSWER {report_text}", "cached": False, "timings": {}}
+
+        monkeypatch.setattr(rag_service, "iter_multimodal_rag", stub)
+        events = _parse_sse(self._post(api_env).text)
+
+        assert [e for e, _ in events] == ["upload", "sources", "token", "done"]
+        assert len(events[0][1]["frames"]) > 0
+        assert events[-1][1]["answer"] == "ANSWER LV dilated"
+
+    def test_failure_reported_as_event(self, api_env, monkeypatch):
+        def stub(**kwargs):
+            yield "sources", {"sources": []}
+            raise RuntimeError("upstream 500")
+
+        monkeypatch.setattr(rag_service, "iter_multimodal_rag", stub)
+        events = _parse_sse(self._post(api_env).text)
+
+        assert [e for e, _ in events] == ["upload", "sources", "error"]
+        assert "upstream 500" in events[-1][1]["error"]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
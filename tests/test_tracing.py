@@ -0,0 +1,254 @@
+"""
+Unit tests for request tracing.
+Tests span nesting, context propagation across threads, tail sampling,
+log rotation, the X-Request-ID middleware and the trace viewer.
+"""
+import pytest
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__))))
+
+from scripts import tracing, trace_view
+from scripts.tracing import (
+    NOOP_SPAN,
+    TraceExporter,
+    bind,
+    current_request_id,
+    open_span,
+    span,
+    start_trace,
+    trace_files,
+    trace_to_dict,
+)
+from api.main import app
+
+
+@pytest.fixture
+def exporter(tmp_path, monkeypatch):
+    """Exporter su tmp_path che scrive tutte le tracce."""
+    exp = TraceExporter(path=str(tmp_path / "traces.jsonl"), slow_ms=0, sample_rate=0.0, seed=0)
+    monkeypatch.setattr(tracing, "_exporter", exp)
+    return exp
+
+
+def _read(exp):
+    exp.flush()
+    with open(exp.path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+class TestSpans:
+    """Test span trees and context propagation."""
+
+    def test_nesting_and_attrs(self, exporter):
+        with start_trace("req", request_id="r1") as root:
+            assert current_request_id() == "r1"
+            with span("search", collection="cases") as sp:
+                sp.set(hits=3)
+                with span("embed"):
+                    pass
+            with pytest.raises(ValueError):
+                with span("llm"):
+                    raise ValueError("boom")
+
+        assert current_request_id() is None
+        out = trace_to_dict(root)
+        assert out["request_id"] == "r1"
+        search, llm = out["children"]
+        assert search["attrs"] == {"collection": "cases", "hits": 3}
+        assert search["children"][0]["name"] == "embed"
+        assert llm["error"] == "ValueError: boom"
+        assert "thread" not in search
+
+    def test_noop_outside_trace(self):
+        with span("search") as sp:
+            sp.set(hits=1)
+        assert sp is NOOP_SPAN
+        assert open_span("llm") is NOOP_SPAN
+
+    def test_propagation_to_threads(self, exporter):
+        def work(name):
+            with span(name):
+                return current_request_id()
+
+        async def via_to_thread():
+            return await asyncio.to_thread(work, "to_thread")
+
+        with start_trace("req", request_id="r2") as root:
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                ids = list(pool.map(bind(work), ["a", "b"]))
+            ids.append(asyncio.run(via_to_thread()))
+
+        assert ids == ["r2", "r2", "r2"]
+        children = trace_to_dict(root)["children"]
+        assert sorted(c["name"] for c in children) == ["a", "b", "to_thread"]
+        assert all("thread" in c for c in children)
+
+    def test_open_span_unfinished_and_limit(self, exporter, monkeypatch):
+        monkeypatch.setattr(tracing, "TRACE_MAX_SPANS", 3)
+        with start_trace("req") as root:
+            pending = open_span("llm", stream=True)
+            for _ in range(5):
+                with span("batch"):
+                    pass
+
+        out = trace_to_dict(root)
+        assert out["children"][0]["unfinished"] is True
+        # la radice conta nel limite
+        assert len(out["children"]) == 2
+        assert out["dropped_spans"] == 4
+        pending.finish()
+
+
+class TestExporter:
+    """Test tail sampling and rotation."""
+
+    def test_tail_sampling(self, tmp_path, monkeypatch):
+        exp = TraceExporter(path=str(tmp_path / "t.jsonl"), slow_ms=10_000, sample_rate=0.0)
+        monkeypatch.setattr(tracing, "_exporter", exp)
+
+        with start_trace("fast"):
+            pass
+        with pytest.raises(RuntimeError):
+            with start_trace("failed"):
+                raise RuntimeError("x")
+        with start_trace("server error") as root:
+            root.set(status=503)
+
+        assert exp.offered == 3
+        assert [t["name"] for t in _read(exp)] == ["failed", "server error"]
+
+        exp.slow_ms = 0
+        with start_trace("slow"):
+            pass
+        assert _read(exp)[-1]["name"] == "slow"
+
+    def test_offer_does_not_wait_for_disk(self, tmp_path, monkeypatch):
+        exp = TraceExporter(path=str(tmp_path / "t.jsonl"), slow_ms=0)
+        original = exp.write
+        monkeypatch.setattr(exp, "write", lambda record: (time.sleep(0.2), original(record)))
+        monkeypatch.setattr(tracing, "_exporter", exp)
+
+        t0 = time.perf_counter()
+        for i in range(3):
+            with start_trace(f"req{i}"):
+                pass
+        elapsed = time.perf_counter() - t0
+
+        assert elapsed < 0.1, "Trace export must not block the caller (event loop)"
+        assert [t["name"] for t in _read(exp)] == ["req0", "req1", "req2"]
+
+    def test_full_queue_drops(self, tmp_path, monkeypatch):
+        exp = TraceExporter(path=str(tmp_path / "t.jsonl"), slow_ms=0, queue_size=1)
+        release = threading.Event()
+        original = exp.write
+        monkeypatch.setattr(exp, "write", lambda record: (release.wait(), original(record)))
+        monkeypatch.setattr(tracing, "_exporter", exp)
+
+        for i in range(5):
+            with start_trace(f"req{i}"):
+                pass
+        release.set()
+
+        # uno in scrittura, uno in coda, il resto scartato
+        assert len(_read(exp)) + exp.dropped == 5
+        assert exp.dropped >= 3
+        assert exp.stats()["dropped"] == exp.dropped
+
+    def test_offered_counted_across_threads(self, tmp_path):
+        exp = TraceExporter(path=str(tmp_path / "t.jsonl"), slow_ms=10_000, sample_rate=0.0)
+
+        def offer_many():
+            for i in range(2000):
+                root = tracing.Span("x", tracing._Trace(str(i)), 0, None, {})
+                root.finish()
+                exp.offer(root)
+
+        threads = [threading.Thread(target=offer_many) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert exp.offered == 16_000
+
+    def test_rotation(self, tmp_path):
+        path = str(tmp_path / "t.jsonl")
+        exp = TraceExporter(path=path, max_bytes=200, backups=2)
+        for i in range(10):
+            exp.write({"request_id": str(i), "pad": "x" * 80})
+
+        files = trace_files(path)
+        assert files == [f"{path}.2", f"{path}.1", path]
+        assert all(os.path.getsize(f) <= 200 for f in files)
+        ids = [t["request_id"] for t in trace_view.load_traces(path)]
+        assert ids == sorted(ids, key=int) and ids[-1] == "9"
+
+
+class TestMiddleware:
+    """Test X-Request-ID handling and HTTP traces."""
+
+    def test_request_id_echoed(self, exporter):
+        client = TestClient(app)
+        resp = client.get("/jobs/does-not-exist", headers={"X-Request-ID": "client-id-1"})
+
+        assert resp.headers["x-request-id"] == "client-id-1"
+        trace = _read(exporter)[-1]
+        assert trace["request_id"] == "client-id-1"
+        assert trace["attrs"]["status"] == 404
+        assert trace["attrs"]["route"] == "/jobs/{job_id}"
+
+    def test_request_id_generated(self, exporter):
+        client = TestClient(app)
+        resp = client.get("/jobs/does-not-exist", headers={"X-Request-ID": "bad id\twith spaces"})
+
+        request_id = resp.headers["x-request-id"]
+        assert request_id != "bad id\twith spaces" and len(request_id) == 32
+        assert _read(exporter)[-1]["request_id"] == request_id
+
+
+class TestTraceView:
+    """Test the flame-style rendering."""
+
+    TRACE = {
+        "request_id": "abc",
+        "name": "POST /chat",
+        "start_ms": 0.0,
+        "duration_ms": 100.0,
+        "children": [
+            {"name": "search", "start_ms": 10.0, "duration_ms": 40.0, "attrs": {"collection": "cases"}, "thread": "rag-search_0"},
+            {"name": "search", "start_ms": 20.0, "duration_ms": 40.0, "attrs": {"collection": "guidelines"}},
+            {"name": "llm", "start_ms": 70.0, "duration_ms": 25.0, "error": "TimeoutError: x"},
+        ],
+    }
+
+    def test_self_time_merges_parallel_children(self):
+        assert trace_view.self_ms(self.TRACE) == pytest.approx(100.0 - 50.0 - 25.0)
+
+    def test_render(self):
+        text = trace_view.render_trace(self.TRACE, width=20)
+        lines = text.splitlines()
+        assert lines[0].startswith("request abc  POST /chat  100.0 ms")
+        assert "|" + "#" * 20 + "|" in lines[2]
+        assert "|  ########" in lines[3] and "collection=cases @rag-search_0" in lines[3]
+        assert "ERROR TimeoutError: x" in lines[5]
+
+    def test_summary_and_selection(self):
+        other = {**self.TRACE, "request_id": "def", "duration_ms": 300.0}
+        assert trace_view.select_traces([self.TRACE, other], slowest=1) == [other]
+        assert trace_view.select_traces([self.TRACE, other], request_id="ab") == [self.TRACE]
+        rows = {r["span"]: r for r in trace_view.summarize([self.TRACE])}
+        assert rows["search"]["count"] == 2 and rows["search"]["total_ms"] == 80.0
+        assert rows["(request)"]["self_ms"] == pytest.approx(25.0)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
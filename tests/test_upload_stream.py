@@ -0,0 +1,292 @@
+"""
+Unit tests for streaming DICOM uploads.
+Tests chunked copy with on-the-fly hashing, the size limit, atomic placement
+and content-addressed deduplication with refcounted delete.
+"""
+import pytest
+import os
+import sys
+import io
+import time
+import asyncio
+import hashlib
+import threading
+import multiprocessing
+from pathlib import Path
+
+from fastapi import HTTPException, UploadFile
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__))))
+
+from api.main import app
+from api.services import doc_service
+from tests.conftest import write_synthetic_dicom
+
+
+class RecordingUpload(UploadFile):
+    """UploadFile che registra la dimensione di ogni read()."""
+
+    def __init__(self, data: bytes):
+        super().__init__(file=io.BytesIO(data), filename="x.dcm")
+        self.reads = []
+
+    async def read(self, size: int = -1) -> bytes:
+        self.reads.append(size)
+        return await super().read(size)
+
+
+@pytest.fixture
+def current_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(doc_service, "CURRENT_DICOM_DIR", tmp_path / "dicom")
+    monkeypatch.setattr(doc_service, "CURRENT_FRAMES_DIR", tmp_path / "frames")
+    monkeypatch.setattr(doc_service, "UPLOAD_STAGING_DIR", tmp_path / "incoming")
+    monkeypatch.setattr(doc_service, "UPLOAD_INDEX_PATH", tmp_path / "upload_index.json")
+    return tmp_path
+
+
+@pytest.fixture
+def cine_bytes(tmp_path):
+    src = tmp_path / "cine.dcm"
+    write_synthetic_dicom(src, frames=4)
+    return src.read_bytes()
+
+
+def _upload(data: bytes):
+    return TestClient(app).post("/upload-doc", files={"file": ("cine.dcm", data, "application/dicom")})
+
+
+class TestStreamUpload:
+    """Test stream_upload_to_file()."""
+
+    def test_chunked_copy_and_hash(self, tmp_path):
+        data = os.urandom(10_000)
+        upload = RecordingUpload(data)
+        dest = tmp_path / "a.dcm"
+
+        size, digest = asyncio.run(doc_service.stream_upload_to_file(upload, dest, chunk_size=4096))
+
+        assert size == len(data) and digest == hashlib.sha256(data).hexdigest()
+        assert dest.read_bytes() == data
+        # memoria costante: mai letture dell'intero file
+        assert set(upload.reads) == {4096}
+        assert list(tmp_path.iterdir()) == [dest]
+
+    def test_size_limit_leaves_no_file(self, tmp_path):
+        upload = RecordingUpload(b"x" * 5000)
+        dest = tmp_path / "a.dcm"
+
+        with pytest.raises(HTTPException) as exc:
+            asyncio.run(doc_service.stream_upload_to_file(upload, dest, max_bytes=4000, chunk_size=1024))
+
+        assert exc.value.status_code == 413
+        assert list(tmp_path.iterdir()) == []
+
+    def test_empty_upload(self, tmp_path):
+        dest = tmp_path / "a.dcm"
+        size, digest = asyncio.run(doc_service.stream_upload_to_file(RecordingUpload(b""), dest))
+        assert size == 0 and digest == hashlib.sha256(b"").hexdigest()
+        assert dest.exists()
+
+
+class TestUploadEndpoint:
+    """Test /upload-doc with streamed uploads."""
+
+    def test_upload_returns_hash_and_frames(self, current_dirs, cine_bytes):
+        resp = _upload(cine_bytes)
+
+        assert resp.status_code == 200, resp.text
+        body = resp.json()
+        assert body["size_bytes"] == len(cine_bytes)
+        assert body["sha256"] == hashlib.sha256(cine_bytes).hexdigest()
+        assert Path(body["dicom_path"]).read_bytes() == cine_bytes
+        assert len(body["frames"]) > 0
+
+    def test_upload_too_large(self, current_dirs, monkeypatch):
+        monkeypatch.setattr(doc_service, "MAX_UPLOAD_BYTES", 1000)
+
+        resp = TestClient(app).post("/upload-doc", files={"file": ("big.dcm", b"0" * 5000, "application/dicom")})
+
+        assert resp.status_code == 413
+        assert list((current_dirs / "dicom").iterdir()) == []
+        assert list((current_dirs / "incoming").iterdir()) == []
+
+
+class TestUploadDedup:
+    """Test content-addressed reuse of uploads and refcounted delete."""
+
+    def test_reupload_reuses_frames(self, current_dirs, cine_bytes, monkeypatch):
+        first = _upload(cine_bytes).json()
+        assert first["deduplicated"] is False
+        assert first["file_id"] == first["sha256"]
+        assert first["header"]["num_frames"] == 4
+
+        def no_extract(*args, **kwargs):
+            raise AssertionError("duplicate upload must not decode frames")
+
+        monkeypatch.setattr(doc_service, "extract_frames", no_extract)
+        second = _upload(cine_bytes).json()
+
+        assert second["deduplicated"] is True
+        assert second["file_id"] == first["file_id"]
+        assert second["frames"] == first["frames"]
+        assert second["refcount"] == 2
+        assert len(list((current_dirs / "dicom").glob("*.dcm"))) == 1
+        assert list((current_dirs / "incoming").iterdir()) == []
+
+    def test_delete_is_refcounted(self, current_dirs, cine_bytes):
+        file_id = _upload(cine_bytes).json()["file_id"]
+        _upload(cine_bytes)
+        dicom = current_dirs / "dicom" / f"{file_id}.dcm"
+
+        assert doc_service.delete_current_file(file_id)["refcount"] == 1
+        assert dicom.exists() and (current_dirs / "frames" / file_id).exists()
+
+        assert doc_service.delete_current_file(file_id)["refcount"] == 0
+        assert not dicom.exists() and not (current_dirs / "frames" / file_id).exists()
+        assert doc_service._load_upload_index() == {}
+
+    def test_missing_frames_are_extracted_again(self, current_dirs, cine_bytes):
+        first = _upload(cine_bytes).json()
+        os.remove(first["frames"][0])
+
+        second = _upload(cine_bytes).json()
+
+        assert second["deduplicated"] is False
+        assert os.path.exists(first["frames"][0])
+
+    def test_different_content_not_merged(self, current_dirs, cine_bytes, tmp_path):
+        other = tmp_path / "other.dcm"
+        write_synthetic_dicom(other, frames=4, seed=9)
+
+        a = _upload(cine_bytes).json()
+        b = _upload(other.read_bytes()).json()
+
+        assert a["file_id"] != b["file_id"] and not b["deduplicated"]
+
+
+class CountingPool:
+    """Pool di estrazione finto: lento, conta le estrazioni e scrive due frame."""
+
+    def __init__(self, delay=0.2):
+        self.delay = delay
+        self.calls = 0
+
+    def run(self, fn, dicom_path, out_dir, n, cancel_event=None):
+        self.calls += 1
+        time.sleep(self.delay)
+        frames = []
+        for i in range(2):
+            path = os.path.join(out_dir, f"frame_{i:03d}.png")
+            with open(path, "wb") as f:
+                f.write(b"png")
+            frames.append(path)
+        return frames
+
+
+def _saved(current_dirs, data: bytes):
+    sha = hashlib.sha256(data).hexdigest()
+    dicom = current_dirs / "dicom" / f"{sha}.dcm"
+    dicom.parent.mkdir(parents=True, exist_ok=True)
+    dicom.write_bytes(data)
+    return {
+        "file_id": sha, "sha256": sha, "dicom_path": str(dicom), "size_bytes": len(data),
+        "frames_dir": str(current_dirs / "frames" / sha), "deduplicated": False,
+    }
+
+
+def _bump_refcount(sha, times):
+    for _ in range(times):
+        assert doc_service._acquire_existing(sha) is not None
+
+
+class TestConcurrentUploads:
+    """Test single-flight extraction and cross-worker index updates."""
+
+    @pytest.fixture
+    def pool(self, monkeypatch):
+        pool = CountingPool()
+        monkeypatch.setattr(doc_service, "get_frame_extraction_pool", lambda: pool)
+        monkeypatch.setattr(doc_service, "UPLOAD_CLAIM_POLL_S", 0.02)
+        return pool
+
+    def test_same_content_extracted_once(self, current_dirs, cine_bytes, pool):
+        saved = _saved(current_dirs, cine_bytes)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(doc_service.extract_and_register_frames(dict(saved))))
+            for _ in range(3)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert pool.calls == 1
+        assert sorted(r["deduplicated"] for r in results) == [False, True, True]
+        assert len({tuple(r["frames"]) for r in results}) == 1
+        assert doc_service._load_upload_index()[saved["sha256"]]["refcount"] == 3
+        assert doc_service._inflight == {}
+
+    def test_waits_for_other_worker_claim(self, current_dirs, cine_bytes, pool):
+        saved = _saved(current_dirs, cine_bytes)
+        sha = saved["sha256"]
+        # claim scritto da un altro worker uvicorn (nessun Event in questo processo)
+        doc_service._save_upload_index({sha: {"refcount": 0, "extracting": {"token": "other", "pid": 0, "since": time.time()}}})
+
+        def other_worker_finishes():
+            time.sleep(0.2)
+            doc_service._register_upload(sha, {**saved, "frames": CountingPool(delay=0).run(None, None, _mkdir(saved), 2)})
+
+        threading.Thread(target=other_worker_finishes).start()
+        out = doc_service.extract_and_register_frames(saved)
+
+        assert pool.calls == 0
+        assert out["deduplicated"] is True and out["refcount"] == 2
+
+    def test_stale_claim_taken_over(self, current_dirs, cine_bytes, pool, monkeypatch):
+        saved = _saved(current_dirs, cine_bytes)
+        monkeypatch.setattr(doc_service, "UPLOAD_CLAIM_STALE_S", 1)
+        doc_service._save_upload_index({saved["sha256"]: {"refcount": 0, "extracting": {"token": "dead", "pid": 0, "since": time.time() - 5}}})
+
+        out = doc_service.extract_and_register_frames(saved)
+
+        assert pool.calls == 1 and out["deduplicated"] is False
+        assert "extracting" not in doc_service._load_upload_index()[saved["sha256"]]
+
+    def test_cancelled_extraction_releases_claim(self, current_dirs, cine_bytes, pool, monkeypatch):
+        saved = _saved(current_dirs, cine_bytes)
+
+        def cancelled(*args, **kwargs):
+            raise doc_service.FrameExtractionCancelled("cancelled")
+
+        monkeypatch.setattr(pool, "run", cancelled)
+        with pytest.raises(doc_service.FrameExtractionCancelled):
+            doc_service.extract_and_register_frames(saved)
+
+        assert doc_service._load_upload_index() == {}
+        assert doc_service._inflight == {}
+
+    @pytest.mark.skipif(doc_service.fcntl is None, reason="flock not available")
+    def test_refcount_updates_across_processes(self, current_dirs, cine_bytes, pool):
+        saved = _saved(current_dirs, cine_bytes)
+        doc_service.extract_and_register_frames(saved)
+
+        ctx = multiprocessing.get_context("fork")
+        workers = [ctx.Process(target=_bump_refcount, args=(saved["sha256"], 25)) for _ in range(4)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+
+        assert all(w.exitcode == 0 for w in workers)
+        assert doc_service._load_upload_index()[saved["sha256"]]["refcount"] == 1 + 100
+
+
+def _mkdir(saved):
+    os.makedirs(saved["frames_dir"], exist_ok=True)
+    return saved["frames_dir"]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])